@@ -1,100 +1,63 @@
 # app.py
 from flask import Flask, render_template, request, jsonify, send_from_directory, Response
 import os
+import sys
 import uuid
-import torch # For checking cuda availability for TTS
-import warnings
 import json # For SSE data
+import base64 # For inline audio in SSE events
 import time # For timing and unique filenames
-
-# Suppress future warnings for cleaner logs (optional)
-warnings.filterwarnings("ignore", category=FutureWarning)
-warnings.filterwarnings("ignore", category=UserWarning)
+from concurrent.futures import ThreadPoolExecutor
 
 # Import your custom modules
 import tts_module
 import llm_module
 import memory_module
 import stt_module # Using Whisper STT
+import speech_pipeline
+import audio_blob_store
+import audio_janitor
+import faq_knowledge_base
+import connection_warmup
+import tracing
 
 # Import Ana's conversation system
-import faq_knowledge_base
+import turn_planner
 import session_manager
-import conversation_flow
-from session_manager import ConversationState
 import conversation_logger as conv_log
 
-app = Flask(__name__, static_folder='static', static_url_path='/static')
+# Configuration and service startup shared with the ASGI server (asgi_app.py)
+import bootstrap
+from bootstrap import UPLOAD_FOLDER, STATIC_FOLDER, STREAM_CHUNK_SIZE, AUDIO_DISK_DEBUG, AUDIO_DELIVERY, USE_OPENAI
 
-# --- Configuration ---
-from dotenv import load_dotenv
-load_dotenv()
-
-DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "YOUR_DEEPSEEK_API_KEY_HERE")
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
-SUPABASE_URL = os.environ.get("SUPABASE_URL", "YOUR_SUPABASE_URL_HERE")
-# Ensure you are using the SERVICE KEY for Supabase from backend
-SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_KEY", os.environ.get("SUPABASE_API_KEY", "YOUR_SUPABASE_SERVICE_KEY_HERE"))
-
-# Google Cloud credentials setup
-if "GOOGLE_CREDENTIALS_JSON" in os.environ:
-    creds_path = "/tmp/google_credentials.json"
-    with open(creds_path, "w") as f:
-        f.write(os.environ["GOOGLE_CREDENTIALS_JSON"])
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = creds_path
-    print(f"✅ Set Google Cloud credentials from environment variable")
-elif os.environ.get("GOOGLE_CREDENTIALS_PATH"):
-    creds_path = os.environ["GOOGLE_CREDENTIALS_PATH"]
-    if os.path.exists(creds_path):
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = creds_path
-        print(f"✅ Set Google Cloud credentials: {creds_path}")
-    else:
-        print(f"⚠️  Google Cloud credentials not found at: {creds_path}")
-        print("   STT may not work properly without valid credentials.")
-
-# LLM Configuration - Set USE_OPENAI=True to use OpenAI instead of Deepseek
-USE_OPENAI = True # Set to False to use Deepseek by default
-
-UPLOAD_FOLDER = 'uploads'
-STATIC_FOLDER = 'static'
-
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(STATIC_FOLDER, exist_ok=True)
+app = Flask(__name__, static_folder='static', static_url_path='/static')
+log = conv_log.get_logger("app")
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['STATIC_FOLDER'] = STATIC_FOLDER
 
 # --- Module Initialization ---
-print("Starting module initialization...")
-try:
-    tts_module.initialize_tts()
-except Exception as e: print(f"ERROR initializing TTS: {e}")
-
-try:
-    if USE_OPENAI:
-        if OPENAI_API_KEY and OPENAI_API_KEY != "YOUR_OPENAI_API_KEY_HERE":
-            llm_module.initialize_llm(api_key=None, use_openai=True, openai_api_key=OPENAI_API_KEY)
-        else:
-            print("WARNING: OpenAI API key is a placeholder or missing. LLM will not function correctly if USE_OPENAI is True.")
-    else: # Use Deepseek
-        if DEEPSEEK_API_KEY and DEEPSEEK_API_KEY != "YOUR_DEEPSEEK_API_KEY_HERE":
-            llm_module.initialize_llm(api_key=DEEPSEEK_API_KEY, use_openai=False)
-        else:
-            print("WARNING: Deepseek API key is a placeholder or missing. LLM will not function correctly if USE_OPENAI is False.")
-except Exception as e: print(f"ERROR initializing LLM: {e}")
+bootstrap.initialize_services()
+bootstrap.start_background_tasks()
 
-try:
-    if SUPABASE_URL != "YOUR_SUPABASE_URL_HERE" and SUPABASE_KEY != "YOUR_SUPABASE_SERVICE_KEY_HERE":
-        memory_module.initialize_memory(url=SUPABASE_URL, key=SUPABASE_KEY)
-    else:
-        print("WARNING: Supabase URL/Key are placeholders. Memory will not function correctly.")
-except Exception as e: print(f"ERROR initializing Memory: {e}")
+# Loads each turn's context (session state, history) while STT is still running. One blocking
+# read per turn in progress: sized for every concurrent caller (threads start on demand)
+PREFETCH_MAX_WORKERS = int(os.environ.get("PREFETCH_MAX_WORKERS", "256"))
+_prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_MAX_WORKERS, thread_name_prefix="prefetch")
+
+def load_turn_context(session_id):
+    """Session state and recent history for a turn. Returns the history (oldest first)."""
+    session_manager.session_manager.get_session(session_id)
+    history = []
+    if memory_module.supabase_client: # Check if client is initialized
+        try:
+            history = memory_module.get_history(session_id, limit=3) # Limit history for speed
+        except Exception as e:
+            log.error(f"Error retrieving history: {e}")
+    return history
 
-try:
-    stt_module.initialize_stt(model_size="base")
-except Exception as e:
-    print(f"ERROR initializing STT: {e}. Make sure 'openai-whisper' and 'ffmpeg' (if on windows) are installed.")
-print("Module initialization phase completed.")
+def prefetch_turn_context(session_id, trace=None):
+    """Start load_turn_context in the background; build_turn_response waits for it"""
+    return _prefetch_executor.submit(tracing.bind(load_turn_context, trace), session_id)
 
 
 @app.route('/')
@@ -123,10 +86,88 @@ def download_session_debug(session_id):
     except Exception as e:
         return f"Error creating debug file: {e}", 500
 
+@app.route('/debug/tts-cache')
+def get_tts_cache_stats():
+    """TTS audio cache hit/miss counters"""
+    return jsonify(tts_module.get_cache_stats())
+
+@app.route('/debug/audio-janitor')
+def get_audio_janitor_stats():
+    """Generated audio retention: tracked files and bytes reclaimed"""
+    return jsonify({**audio_janitor.janitor.stats(), 'blob_store': audio_blob_store.blob_store.stats()})
+
+@app.route('/debug/persistence')
+def get_persistence_stats():
+    """Write-behind persistence queue depth and flush latency"""
+    return jsonify(memory_module.get_persistence_stats())
+
+@app.route('/debug/history-cache')
+def get_history_cache_stats():
+    """Conversation history cache hit/miss counters"""
+    return jsonify(memory_module.get_history_cache_stats())
+
+@app.route('/debug/llm-cache')
+def get_llm_cache_stats():
+    """LLM response cache hit rate and saved tokens"""
+    return jsonify(llm_module.get_llm_cache_stats())
+
+@app.route('/debug/sessions')
+def get_session_store_stats():
+    """Session store backend, size and compare-and-set conflicts"""
+    return jsonify(session_manager.session_manager.get_stats())
+
+@app.route('/debug/whisper-pool')
+def get_whisper_pool_stats():
+    """Whisper fallback pool: workers, queue time and batch sizes"""
+    return jsonify(stt_module.get_whisper_pool_stats())
+
+@app.route('/debug/logging')
+def get_log_stats():
+    """Log writer: queued, written and dropped records"""
+    return jsonify(conv_log.get_log_stats())
+
+@app.route('/metrics')
+def metrics():
+    """Stage latency histograms (p50/p95/p99) in the Prometheus text format"""
+    return Response(tracing.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/trace/<trace_id>')
+def get_trace(trace_id):
+    """Spans of a recent turn (trace_id comes with the end_of_stream event)"""
+    trace = tracing.get_trace(trace_id)
+    if trace is None:
+        return jsonify({'error': 'Trace not found or expired'}), 404
+    return jsonify(trace)
+
+@app.route('/ready')
+def readiness():
+    """Readiness probe: 200 once every service finished initializing, 503 while starting or if STT/TTS failed"""
+    report = bootstrap.get_readiness()
+    return jsonify(report), 200 if report['ready'] else 503
+
+@app.route('/debug/connections')
+def get_connection_stats():
+    """Connection setup time next to request time for STT, TTS and LLM"""
+    return jsonify(connection_warmup.monitor.stats())
+
+@app.route('/debug/faq')
+def get_faq_stats():
+    """FAQ hit vs LLM-fallback rates, keyword only vs hybrid (keyword + semantic)"""
+    return jsonify(faq_knowledge_base.get_faq_stats())
+
+def reject_turn(trace, status, error, **details):
+    """JSON error response for a turn rejected before its response stream; finishes the turn's trace with the error"""
+    if trace is not None:
+        trace.finish(error=error, status=status)
+    return jsonify({'error': error, **details}), status
+
 @app.route('/chat', methods=['POST'])
 def chat_endpoint():
     overall_start_time = time.time()
 
+    if not bootstrap.wait_until_ready():
+        return jsonify({'error': 'Services are still starting, try again shortly.'}), 503
+
     if 'audio_data' not in request.files:
         # This part will execute before streaming, so a normal JSON error is fine
         return jsonify({'error': 'No audio file part in the request'}), 400
@@ -135,11 +176,79 @@ def chat_endpoint():
         return jsonify({'error': 'No selected audio file'}), 400
 
     session_id = request.form.get('session_id', str(uuid.uuid4()))
-    unique_session_tag = f"{session_id}_{int(time.time())}" # For unique chunk filenames
+    trace = tracing.start_trace("chat", session_id, request.headers.get('X-Trace-Id'), start=overall_start_time)
+    stream_started = False  # From then on the response stream finishes the trace
+    try:
+        context_future = prefetch_turn_context(session_id, trace)  # Runs alongside STT
+        unique_session_tag = f"{session_id}_{int(time.time())}" # For unique chunk filenames
     
-    print(f"🔗 Session ID: {session_id} | Debug at: http://localhost:5000/debug/{session_id}")
-
-    # Save the uploaded file first with original format detection
+        log.info(f"🔗 Session ID: {session_id} | Debug at: http://localhost:5000/debug/{session_id}")
+
+        with tracing.span("upload", trace):
+            if AUDIO_DISK_DEBUG:
+                # Debug mode: keep a copy of the upload on disk
+                uploaded_audio_path = save_uploaded_audio(audio_file, unique_session_tag)
+                if uploaded_audio_path is None:
+                    return reject_turn(trace, 400, 'Audio file too small - please try recording again')
+                audio_janitor.janitor.track(session_id, uploaded_audio_path)  # Backstop if the turn dies before cleanup
+                audio_source, cleanup_paths = uploaded_audio_path, [uploaded_audio_path]
+                with open(uploaded_audio_path, 'rb') as f:
+                    header = f.read(4096)
+            else:
+                # Keep the upload in memory and hand STT a zero-copy view of it
+                file_read_start = time.time()
+                audio_bytes = audio_file.read()
+                log.info(f"⏱️ User audio received in memory ({time.time() - file_read_start:.3f}s)")
+                log.debug(f"📊 Audio size: {len(audio_bytes)} bytes")
+            
+                # Early validation
+                if len(audio_bytes) < 100:
+                    log.warning("⚠️  WARNING: User audio file is very small, possible recording issue")
+                    return reject_turn(trace, 400, 'Audio file too small - please try recording again')
+                audio_source, cleanup_paths = memoryview(audio_bytes), []
+                header = audio_source[:4096]
+    
+        # Detect audio format once - STT uses it to send a single correctly configured request
+        log.debug(f"📋 Audio header: {bytes(header[:8])}")
+        with tracing.span("format_detection", trace):
+            audio_format = stt_module.detect_audio_format(header)
+        log.debug(f"📱 Detected format: {audio_format}")
+
+        # Trim silence locally and drop recordings without speech before any STT request
+        with tracing.span("vad", trace) as vad_span:
+            speech = stt_module.detect_speech(audio_source, audio_format)
+            vad_span.attributes.update(has_speech=speech['has_speech'], speech_duration=speech['speech_duration'], duration=speech['duration'])
+        if speech['has_speech'] is not None:
+            conv_log.log_debug(session_id, f"VAD ({speech['backend']}): {speech['speech_duration']:.2f}s speech in {speech['duration']:.2f}s recording")
+        if speech['has_speech'] is False:
+            conv_log.log_error(session_id, "NO_SPEECH", f"No speech detected in {speech['duration']:.2f}s recording")
+            return reject_turn(trace, 400, 'No speech detected - please try recording again', suggestion='Please speak louder and try again')
+        audio_source, audio_format = speech['audio_source'], speech['audio_format']
+
+        if stt_module.stt_client is None:
+            return reject_turn(trace, 500, 'STT service not available.')
+    
+        stt_start_time = time.time()
+        with tracing.span("stt", trace, format=audio_format.get('format')):
+            user_text = stt_module.transcribe_audio(audio_source, language="es", audio_format=audio_format) # Force Spanish
+        log.info(f"⏱️ STT ({user_text}): {time.time() - stt_start_time:.3f}s")
+
+        if not user_text or "Error" in user_text:
+            conv_log.log_error(session_id, "STT_FAILURE", f"Transcription failed: {user_text}")
+            return reject_turn(trace, 500, 'Failed to transcribe audio', details=user_text, suggestion='Please speak louder and try again')
+
+        response = build_turn_response(session_id, user_text, overall_start_time, unique_session_tag, cleanup_paths=cleanup_paths,
+                                       context_future=context_future, trace=trace)
+        stream_started = True
+        return response
+    finally:
+        if trace is not None and not stream_started:
+            # Rejected turns are already finished with their error (reject_turn); this covers exceptions
+            failure = sys.exc_info()[1]
+            trace.finish(error=repr(failure) if failure is not None else 'no response stream')
+
+def save_uploaded_audio(audio_file, unique_session_tag):
+    """Debug mode only: save the upload to disk with the detected extension. Returns the path, or None if too small."""
     uploaded_audio_filename = f"user_audio_{unique_session_tag}"  # No extension yet
     uploaded_audio_path = os.path.join(app.config['UPLOAD_FOLDER'], uploaded_audio_filename)
     
@@ -148,69 +257,93 @@ def chat_endpoint():
     
     # Validate saved file
     file_size = os.path.getsize(uploaded_audio_path) if os.path.exists(uploaded_audio_path) else 0
-    print(f"⏱️ User audio saved: {uploaded_audio_path} ({time.time() - file_save_start:.3f}s)")
-    print(f"📊 Saved file size: {file_size} bytes")
+    log.info(f"⏱️ User audio saved: {uploaded_audio_path} ({time.time() - file_save_start:.3f}s)")
+    log.debug(f"📊 Saved file size: {file_size} bytes")
     
     # Early validation
     if file_size < 100:
-        print("⚠️  WARNING: User audio file is very small, possible recording issue")
-        return jsonify({'error': 'Audio file too small - please try recording again'}), 400
-    
-    # Detect and convert audio format for STT compatibility
-    def detect_and_convert_audio(input_path):
-        """Detect audio format and convert to WAV if needed for STT"""
+        log.warning("⚠️  WARNING: User audio file is very small, possible recording issue")
         try:
-            # Read first few bytes to detect format
-            with open(input_path, 'rb') as f:
-                header = f.read(16)
-            
-            print(f"📋 Audio header: {header[:8]}")
-            
-            # Detect format based on file headers
-            if header.startswith(b'\x1a\x45\xdf\xa3'):
-                print("📱 Detected format: WEBM")
-                return input_path + ".webm"  # Return with proper extension
-            elif header.startswith(b'RIFF'):
-                print("📱 Detected format: WAV")
-                return input_path + ".wav"
-            elif header.startswith(b'OggS'):
-                print("📱 Detected format: OGG")
-                return input_path + ".ogg"
-            elif header.startswith(b'fLaC'):
-                print("📱 Detected format: FLAC")
-                return input_path + ".flac"
-            else:
-                print(f"📱 Unknown format, assuming WEBM (header: {header[:8]})")
-                return input_path + ".webm"
-                
-        except Exception as e:
-            print(f"❌ Error detecting format: {e}")
-            return input_path + ".wav"  # Default fallback
+            os.remove(uploaded_audio_path)
+        except OSError:
+            pass
+        return None
     
-    # Detect format and rename file with proper extension
-    detected_audio_path = detect_and_convert_audio(uploaded_audio_path)
-    if detected_audio_path != uploaded_audio_path:
-        os.rename(uploaded_audio_path, detected_audio_path)
-        uploaded_audio_path = detected_audio_path
-        print(f"🔄 Renamed to: {uploaded_audio_path}")
-
-    if stt_module.stt_client is None:
+    # Rename file with proper extension
+    with open(uploaded_audio_path, 'rb') as f:
+        extension = stt_module.detect_audio_format(f.read(4096))['extension']
+    if extension:
+        os.rename(uploaded_audio_path, uploaded_audio_path + extension)
+        uploaded_audio_path += extension
+        log.debug(f"🔄 Renamed to: {uploaded_audio_path}")
+    return uploaded_audio_path
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream_endpoint():
+    """
+    Streaming upload mode: the request body is the raw recording sent with chunked
+    transfer encoding. Frames are forwarded to the streaming recognizer as they arrive,
+    then the turn continues exactly like /chat.
+    Session id comes from the 'session_id' query parameter or the X-Session-Id header.
+    """
+    overall_start_time = time.time()
+
+    if not bootstrap.wait_until_ready():
+        return jsonify({'error': 'Services are still starting, try again shortly.'}), 503
+
+    if stt_module.stt_client is None and stt_module.whisper_pool_client is None:
         return jsonify({'error': 'STT service not available.'}), 500
-    
-    stt_start_time = time.time()
-    user_text = stt_module.transcribe_audio(uploaded_audio_path, language="es") # Force Spanish
-    print(f"⏱️ STT ({user_text}): {time.time() - stt_start_time:.3f}s")
 
-    if not user_text or "Error" in user_text:
-        conv_log.log_error(session_id, "STT_FAILURE", f"Transcription failed: {user_text}")
-        return jsonify({'error': 'Failed to transcribe audio', 'details': user_text, 'suggestion': 'Please speak louder and try again'}), 500
+    session_id = request.args.get('session_id') or request.headers.get('X-Session-Id') or str(uuid.uuid4())
+    trace = tracing.start_trace("chat_stream", session_id, request.headers.get('X-Trace-Id'), start=overall_start_time)
+    stream_started = False  # From then on the response stream finishes the trace
+    try:
+        context_future = prefetch_turn_context(session_id, trace)  # Runs alongside the upload and STT
+        unique_session_tag = f"{session_id}_{int(time.time())}" # For unique chunk filenames
+        log.info(f"🔗 Session ID: {session_id} (streaming upload) | Debug at: http://localhost:5000/debug/{session_id}")
 
-    history = []
-    if memory_module.supabase_client: # Check if client is initialized
+        transcriber = stt_module.create_streaming_transcriber(language="es") # Force Spanish
         try:
-            history = memory_module.get_history(session_id, limit=3) # Limit history for speed
-        except Exception as e:
-            print(f"Error retrieving history: {e}")
+            with tracing.span("upload", trace, streaming=True):
+                while True:
+                    chunk = request.stream.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    transcriber.feed(chunk)
+
+            if transcriber.bytes_received < 100:
+                log.warning("⚠️  WARNING: Streamed audio is very small, possible recording issue")
+                return reject_turn(trace, 400, 'Audio file too small - please try recording again')
+
+            stt_start_time = time.time()
+            with tracing.span("stt", trace, streaming=True):
+                user_text = transcriber.finish()
+        finally:
+            transcriber.close()  # Client disconnects and early returns must not leave the recognizer stream open
+        log.info(f"⏱️ Streaming STT ({user_text}): {time.time() - stt_start_time:.3f}s after upload finished")
+
+        if not user_text or "Error" in user_text:
+            conv_log.log_error(session_id, "STT_FAILURE", f"Transcription failed: {user_text}")
+            return reject_turn(trace, 500, 'Failed to transcribe audio', details=user_text, suggestion='Please speak louder and try again')
+
+        response = build_turn_response(session_id, user_text, overall_start_time, unique_session_tag, context_future=context_future, trace=trace)
+        stream_started = True
+        return response
+    finally:
+        if trace is not None and not stream_started:
+            # Rejected turns are already finished with their error (reject_turn); this covers exceptions
+            failure = sys.exc_info()[1]
+            trace.finish(error=repr(failure) if failure is not None else 'no response stream')
+
+def build_turn_response(session_id, user_text, overall_start_time, unique_session_tag, cleanup_paths=(), context_future=None, trace=None):
+    """Run Ana's conversation flow for a transcribed turn and stream it to the client as SSE"""
+    turn_metrics = {'first_audio': None}  # Per-request latency, filled in while streaming
+
+    # Usually already loaded while STT was running
+    context_wait_start = time.time()
+    with tracing.span("context_wait", trace):
+        history = context_future.result() if context_future is not None else load_turn_context(session_id)
+    log.info(f"⏱️ Turn context ready (waited {time.time() - context_wait_start:.3f}s after STT)")
 
     # Now, define the generator for Server-Sent Events with Ana's conversation flow
     def event_stream():
@@ -221,286 +354,157 @@ def chat_endpoint():
         conv_log.log_conversation_start(session_id, user_text)
         
         try:
-            # Check if Ana needs to introduce herself for this session_id
-            first_interaction_in_session = not session_manager.session_manager.has_been_introduced(session_id)
-
-            if first_interaction_in_session:
-                intro_speech = "¡Hola! Soy Ana, tu asistente virtual de Club Cash In. ¿En qué puedo ayudarte hoy?"
-                conv_log.log_ana_response(session_id, "INTRODUCTION", intro_speech)
-                conv_log.log_debug(session_id, f"First interaction - introducing Ana. User said: '{user_text}'")
-                yield from generate_ana_response(intro_speech, session_id, unique_session_tag)
-                session_manager.session_manager.mark_as_introduced(session_id)
-                
-                # ALWAYS end turn after introduction to prevent double processing/audio
-                conv_log.log_debug(session_id, "Ending turn after introduction to prevent audio duplication")
-                conv_log.log_conversation_end(session_id, time.time() - overall_start_time, 1)
-                yield f"data: {json.dumps({'type': 'end_of_stream'})}\n\n"
-                return  # CRITICAL: Always stop after introduction
-
-            # --- Main Logic based on state (Ana has been introduced or first query is not a simple greeting) ---
-            current_state = session_manager.get_current_state(session_id)
-
-            if current_state == ConversationState.GENERAL_CHAT:
-                user_lower = user_text.lower().strip()
-                ana_response = None  # Default to no pre-canned response
-
-                # FIRST PRIORITY: Check for other contextual responses
-                if any(word in user_lower for word in ["gracias", "muchas gracias", "ok", "bueno", "bien", "entiendo", "claro"]):
-                    ana_response = "¡De nada! ¿Hay algo más en lo que te pueda ayudar hoy?"
-                    conv_log.log_ana_response(session_id, "THANKS_RESPONSE", ana_response)
-                    yield from generate_ana_response(ana_response, session_id, unique_session_tag)
-                elif any(user_lower == greet for greet in ["hola", "buenos días", "buenas tardes", "buenas noches"]):  # Simple greeting after intro
-                    ana_response = "¡Hola de nuevo! ¿En qué puedo asistirte?"
-                    conv_log.log_ana_response(session_id, "REPEAT_GREETING", ana_response)
-                    yield from generate_ana_response(ana_response, session_id, unique_session_tag)
-                
-                # SECOND PRIORITY: Try to match FAQ first (to catch information requests)
-                else:
-                    faq_match = faq_knowledge_base.find_faq_intent(user_text)
-                    if faq_match:
-                        print(f"🔍 FAQ Intent matched: {faq_match['intent_name']}")
-                        conv_log.log_faq_match(session_id, user_text, faq_match['intent_name'])
-                        
-                        faq_response_text = faq_knowledge_base.get_faq_response(faq_match)
-                        conv_log.log_ana_response(session_id, "FAQ_RESPONSE", faq_response_text)
-                        yield from generate_ana_response(faq_response_text, session_id, unique_session_tag)
-                        
-                        transition_question = faq_knowledge_base.get_transition_question()
-                        conv_log.log_state_change(session_id, "GENERAL_CHAT", "AWAITING_TRANSITION_RESPONSE")
-                        conv_log.log_transition_question(session_id)
-                        session_manager.update_state(session_id, ConversationState.AWAITING_TRANSITION_RESPONSE)
-                        yield from generate_ana_response(transition_question, session_id, unique_session_tag)
+            # 2. Speak whatever the turn planner decides, in order
+            plan = turn_planner.plan_turn(session_id, user_text, history, llm_available=llm_module.client is not None)
+            reply = None
+            while True:
+                try:
+                    action = plan.send(reply)
+                except StopIteration as stop:
+                    save_to_memory = stop.value
+                    break
+                reply = None
+                if action['type'] == 'say':
+                    yield from generate_ana_response(action['text'], session_id, unique_session_tag, action.get('segments'))
+                elif action['type'] == 'llm':
+                    llm_chunks = []
                     
-                    # THIRD PRIORITY: Check for explicit application requests (more specific patterns)
-                    elif any(phrase in user_lower for phrase in [
-                        "solicitar un préstamo", "aplicar para un préstamo", "pedir un préstamo",
-                        "iniciar solicitud", "empezar solicitud", "hacer una solicitud",
-                        "solicitud de préstamo", "aplicación de préstamo",
-                        "quiero un préstamo", "necesito un préstamo", "solicito un préstamo"
-                    ]):
-                        # Start application flow directly - no need for extra confirmation
-                        session_manager.session_manager.start_application_flow(session_id)
-                        ana_response = conversation_flow.conversation_flow.get_initial_question(ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION)
-                        conv_log.log_state_change(session_id, "GENERAL_CHAT", "STATE_ASK_ELIGIBILITY_PERMISSION")
-                        conv_log.log_ana_response(session_id, "APPLICATION_START", ana_response)
-                        session_manager.update_state(session_id, ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION)
-                        yield from generate_ana_response(ana_response, session_id, unique_session_tag)
-                
-                    # FOURTH PRIORITY: General chat / LLM fallback
-                    else:
-                        print(f"❌ No FAQ or application request found, providing contextual response for: '{user_text}'")
-                        conv_log.log_faq_no_match(session_id, user_text)
-                        
-                        # Fallback to LLM for unhandled general chat
-                        if llm_module.client is not None:
-                            ana_prompt = f"""Eres Ana, una asistente virtual amigable y profesional de una empresa de préstamos en Guatemala. Tu objetivo principal es ayudar con información de préstamos o guiar en el proceso de solicitud. Respondes en español de manera cálida y concisa. El usuario dice: "{user_text}" """
-                            llm_response_generator = llm_module.get_ai_response(ana_prompt, conversation_history=history)
-                            full_llm_response = ""
-                            for chunk in llm_response_generator:
-                                if chunk:
-                                    full_llm_response += chunk
-                            if full_llm_response.strip():
-                                conv_log.log_llm_fallback(session_id, user_text, full_llm_response)
-                                yield from generate_ana_response(full_llm_response, session_id, unique_session_tag)
-                            else:  # LLM gave empty response
-                                fallback_response = "Disculpa, no estoy segura de cómo responder a eso. ¿Podrías reformular tu pregunta? Puedo ayudarte con información sobre préstamos o iniciar una solicitud."
-                                conv_log.log_ana_response(session_id, "LLM_EMPTY_FALLBACK", fallback_response)
-                                yield from generate_ana_response(fallback_response, session_id, unique_session_tag)
-                        else:  # LLM not available
-                            fallback_response = "Disculpa, no pude entender tu pregunta. Puedo ayudarte con información sobre nuestros préstamos o iniciar una solicitud."
-                            conv_log.log_ana_response(session_id, "NO_LLM_FALLBACK", fallback_response)
-                            yield from generate_ana_response(fallback_response, session_id, unique_session_tag)
-
-            elif current_state == ConversationState.AWAITING_TRANSITION_RESPONSE:
-                # User is responding to "Do you want to start an application?"
-                conv_log.log_debug(session_id, f"Processing transition response: '{user_text}'")
-                
-                # FIRST: Try to process as transition response (affirmative/negative)
-                conv_log.log_debug(session_id, f"Attempting to process as transition response")
-                flow_result = conversation_flow.conversation_flow.process_user_input(session_id, user_text)
-                conv_log.log_debug(session_id, f"Flow result: {flow_result}")
-                
-                # If flow successfully processed the transition (user said yes/no), continue with flow
-                if flow_result['success'] or flow_result['next_state'] != ConversationState.AWAITING_TRANSITION_RESPONSE:
-                    conv_log.log_debug(session_id, f"Successfully processed as transition response")
+                    def collect_llm_chunks():
+                        for chunk in llm_module.get_ai_response(action['prompt'], conversation_history=action['history'],
+                                                                cache_text=action.get('cache_text')):
+                            if chunk:
+                                llm_chunks.append(chunk)
+                                yield chunk
                     
-                    if flow_result['success']:
-                        old_state = current_state.value
-                        new_state = flow_result['next_state']
-                        conv_log.log_state_change(session_id, old_state, new_state.value if hasattr(new_state, 'value') else str(new_state))
-                        session_manager.update_state(session_id, flow_result['next_state'])
-                        conv_log.log_ana_response(session_id, "TRANSITION_SUCCESS", flow_result['response'])
-                        yield from generate_ana_response(flow_result['response'], session_id, unique_session_tag)
-                    
-                        # If the next step involves Ana asking another question immediately:
-                        if flow_result['next_state'] not in [ConversationState.GENERAL_CHAT, ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT, ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY]:
-                            # This might be implicit if flow_result['response'] IS the next question
-                            conv_log.log_debug(session_id, f"Next state requires immediate question: {flow_result['next_state']}")
-                            pass
-                        elif flow_result['next_state'] == ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT:
-                            conv_log.log_debug(session_id, "Handling qualification result")
-                            qualification_result = conversation_flow.conversation_flow._handle_qualification_result(session_id)
-                            session_manager.update_state(session_id, qualification_result['next_state'])
-                            conv_log.log_ana_response(session_id, "QUALIFICATION_RESULT", qualification_result['response'])
-                            yield from generate_ana_response(qualification_result['response'], session_id, unique_session_tag)
-                            # Ask the next question automatically
-                            if qualification_result['next_state'] == ConversationState.STATE_ASK_FULL_NAME:
-                                next_question = conversation_flow.conversation_flow.get_initial_question(ConversationState.STATE_ASK_FULL_NAME)
-                                conv_log.log_ana_response(session_id, "AUTO_NEXT_QUESTION", next_question)
-                                yield from generate_ana_response(next_question, session_id, unique_session_tag)
-                        elif flow_result['next_state'] == ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY:
-                            conv_log.log_debug(session_id, "Providing application summary")
-                            summary_result = conversation_flow.conversation_flow._provide_application_summary(session_id)
-                            session_manager.update_state(session_id, summary_result['next_state'])  # Should go to GENERAL_CHAT
-                            conv_log.log_ana_response(session_id, "APPLICATION_SUMMARY", summary_result['response'])
-                            yield from generate_ana_response(summary_result['response'], session_id, unique_session_tag)
-                    else:
-                        # Failed to process as transition, still in AWAITING_TRANSITION_RESPONSE
-                        conv_log.log_debug(session_id, f"Failed to process as transition, trying validation error")
-                        session_manager.update_state(session_id, flow_result['next_state'])  # State might remain to re-ask
-                        conv_log.log_ana_response(session_id, "TRANSITION_VALIDATION_ERROR", flow_result['response'])
-                        yield from generate_ana_response(flow_result['response'], session_id, unique_session_tag)
-                        
-                else:
-                    # Could not process as transition response - maybe it's an FAQ question instead
-                    conv_log.log_debug(session_id, f"Could not process as transition, checking if it's an FAQ")
-                    faq_match_instead_of_transition = faq_knowledge_base.find_faq_intent(user_text)
-                    if faq_match_instead_of_transition:
-                        print(f"🔍 User asked FAQ ({faq_match_instead_of_transition['intent_name']}) instead of answering transition.")
-                        conv_log.log_faq_match(session_id, user_text, faq_match_instead_of_transition['intent_name'])
-                        
-                        faq_response_text = faq_knowledge_base.get_faq_response(faq_match_instead_of_transition)
-                        conv_log.log_ana_response(session_id, "FAQ_DURING_TRANSITION", faq_response_text)
-                        yield from generate_ana_response(faq_response_text, session_id, unique_session_tag)
-                        
-                        # Re-ask the transition question as the state is still AWAITING_TRANSITION_RESPONSE
-                        transition_question = faq_knowledge_base.get_transition_question()
-                        conv_log.log_ana_response(session_id, "RE_ASK_TRANSITION", transition_question)
-                        yield from generate_ana_response(transition_question, session_id, unique_session_tag)
-                    else:
-                        # Neither transition nor FAQ - provide clarification
-                        conv_log.log_debug(session_id, f"Neither transition nor FAQ - asking for clarification")
-                        clarification = "No entendí tu respuesta. ¿Te gustaría que te ayude a iniciar una solicitud de préstamo? Por favor responde 'sí' o 'no'."
-                        conv_log.log_ana_response(session_id, "TRANSITION_CLARIFICATION", clarification)
-                        yield from generate_ana_response(clarification, session_id, unique_session_tag)
-
-            else:  # User is in other application flow states (e.g., STATE_ASK_MINIMUM_AGE, etc.)
-                flow_result = conversation_flow.conversation_flow.process_user_input(session_id, user_text)
-                if flow_result['success']:
-                    session_manager.update_state(session_id, flow_result['next_state'])
-                    yield from generate_ana_response(flow_result['response'], session_id, unique_session_tag)
-                    
-                    # Handle special states that need additional processing
-                    if flow_result['next_state'] == ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT:
-                        conv_log.log_debug(session_id, "Handling qualification result in main flow")
-                        qualification_result = conversation_flow.conversation_flow._handle_qualification_result(session_id)
-                        session_manager.update_state(session_id, qualification_result['next_state'])
-                        conv_log.log_ana_response(session_id, "QUALIFICATION_RESULT", qualification_result['response'])
-                        yield from generate_ana_response(qualification_result['response'], session_id, unique_session_tag)
-                        # Ask the next question automatically
-                        if qualification_result['next_state'] == ConversationState.STATE_ASK_FULL_NAME:
-                            next_question = conversation_flow.conversation_flow.get_initial_question(ConversationState.STATE_ASK_FULL_NAME)
-                            conv_log.log_ana_response(session_id, "AUTO_NEXT_QUESTION", next_question)
-                            yield from generate_ana_response(next_question, session_id, unique_session_tag)
-                    elif flow_result['next_state'] == ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY:
-                        summary_result = conversation_flow.conversation_flow._provide_application_summary(session_id)
-                        session_manager.update_state(session_id, summary_result['next_state'])  # Should go to GENERAL_CHAT
-                        yield from generate_ana_response(summary_result['response'], session_id, unique_session_tag)
-                    # NOTE: Most states already include their next question in flow_result['response']
-                    # Only add automatic questions for states that explicitly need it (currently none)
-
-                else:  # flow_result not successful
-                    session_manager.update_state(session_id, flow_result['next_state'])
-                    yield from generate_ana_response(flow_result['response'], session_id, unique_session_tag)
-
-            # Save interaction to memory
-            if memory_module.supabase_client:
+                    yield from generate_ana_response_streaming(collect_llm_chunks(), session_id, unique_session_tag)
+                    reply = "".join(llm_chunks)
+
+            # Save interaction to memory (not for the introduction turn)
+            if save_to_memory and memory_module.supabase_client:
                 memory_module.save_interaction(session_id, user_text, "Ana response processed")
             
             # Log conversation end
             total_time = time.time() - overall_start_time
             conv_log.log_conversation_end(session_id, total_time, 1)
+            conv_log.log_turn_latency(session_id, turn_metrics['first_audio'], total_time)
             
-            yield f"data: {json.dumps({'type': 'end_of_stream'})}\n\n"
-            print(f"⏱️ === ANA RESPONSE COMPLETED IN: {total_time:.3f}s ===")
+            yield f"data: {json.dumps({'type': 'end_of_stream', 'trace_id': trace.trace_id if trace is not None else None})}\n\n"
+            log.info(f"⏱️ === ANA RESPONSE COMPLETED IN: {total_time:.3f}s ===")
 
         except Exception as e_stream:
-            print(f"❌ Error in Ana's conversation flow: {e_stream}")
+            log.error(f"❌ Error in Ana's conversation flow: {e_stream}")
             conv_log.log_error(session_id, "CONVERSATION_FLOW", str(e_stream))
             yield f"data: {json.dumps({'type': 'error', 'message': str(e_stream)})}\n\n"
         finally:
+            if trace is not None:
+                trace.finish(first_audio=turn_metrics['first_audio'])
             # Clean up uploaded user audio file
-            try:
-                if os.path.exists(uploaded_audio_path):
-                    os.remove(uploaded_audio_path)
-            except OSError as e_del:
-                print(f"Error deleting user audio file {uploaded_audio_path}: {e_del}")
-
-    def generate_ana_response(response_text, session_id, unique_session_tag):
-        """Generate Ana's TTS response and stream it to client"""
+            for uploaded_audio_path in cleanup_paths:
+                try:
+                    if os.path.exists(uploaded_audio_path):
+                        os.remove(uploaded_audio_path)
+                except OSError as e_del:
+                    log.error(f"Error deleting user audio file {uploaded_audio_path}: {e_del}")
+
+    def generate_ana_response(response_text, session_id, unique_session_tag, segments=None):
+        """Generate Ana's TTS response and stream it to client (segments: filled template, see speech_pipeline)"""
         if not response_text.strip():
             return
         
-        # Clean and normalize the text first
-        import re
-        import unicodedata
-        
-        # Normalize unicode characters (fix encoding issues)
-        clean_text = unicodedata.normalize('NFKC', response_text)
-        
-        # Remove extra whitespace and non-printable characters (but keep % symbol for interest rates)
-        clean_text = re.sub(r'\s+', ' ', clean_text.strip())
-        clean_text = re.sub(r'[^\w\s.!?¿¡,:;()\-áéíóúüñÁÉÍÓÚÜÑ%]', '', clean_text)
+        # Clean and normalize the text first (fix encoding issues, drop unreadable symbols)
+        clean_text = speech_pipeline.clean_response_text(response_text)
         
         conv_log.log_debug(session_id, f"Original text: '{response_text}'")
         conv_log.log_debug(session_id, f"Cleaned text: '{clean_text}'")
         
-        # Split response into sentences for chunked delivery - keeping punctuation with sentences
-        # Handle lists and percentages properly by looking for complete sentences
-        sentences = re.split(r'(?<=[.!?])\s+(?=[A-ZÁÉÍÓÚÜÑ¿¡])', clean_text)
-        sentences = [s.strip() for s in sentences if s.strip() and len(s) > 5]
+        # Split response into sentences for chunked delivery - keeping punctuation with sentences.
+        # Template sentences with user data keep their segments so only those parts are synthesized.
+        sentences = speech_pipeline.split_segments(segments) if segments else speech_pipeline.split_sentences(clean_text)
         
         conv_log.log_debug(session_id, f"Split into {len(sentences)} sentences: {sentences}")
         
-        for sentence in sentences:
-            if len(sentence) < 5:  # Skip very short fragments
-                conv_log.log_debug(session_id, f"Skipping short sentence: '{sentence}'")
-                continue
-                
-            tts_chunk_start_time = time.time()
-            # Use precise timestamp to ensure unique filenames across all calls
-            precise_timestamp = int(time.time() * 1000000)  # microseconds
-            ai_audio_chunk_filename = f"ana_chunk_{session_id}_{precise_timestamp}.wav"
+        yield from stream_ana_sentences(sentences, session_id)
+
+    def generate_ana_response_streaming(text_chunks, session_id, unique_session_tag):
+        """Stream Ana's TTS response while the text is still being generated (e.g. LLM tokens)"""
+        # Each sentence goes to TTS as soon as its boundary is seen in the stream
+        sentences = speech_pipeline.iter_sentences(text_chunks)
+        yield from stream_ana_sentences(sentences, session_id)
+
+    def stream_ana_sentences(sentences, session_id):
+        """Synthesize sentences concurrently and stream the audio chunks to client in order"""
+        if tts_module.client is None:
+            yield f"data: {json.dumps({'type': 'error', 'message': 'TTS service not initialized.'})}\n\n"
+            return
+        
+        # Use precise timestamp plus sentence index to ensure unique filenames across concurrent calls
+        batch_timestamp = int(time.time() * 1000000)  # microseconds
+        
+        def synthesize_sentence(index, tts_sentence):
+            """Synthesize one sentence and return the URL the client plays it from"""
+            with tracing.span("tts_sentence", index=index, chars=len(tts_sentence)):
+                return _synthesize_sentence(index, tts_sentence)
+
+        def _synthesize_sentence(index, tts_sentence):
+            if not AUDIO_DISK_DEBUG:
+                conv_log.log_debug(session_id, f"Generating TTS for: '{tts_sentence}' (in memory)")
+                audio_content = tts_module.synthesize_speech(tts_sentence, ultra_fast=True)
+                if AUDIO_DELIVERY == "inline":
+                    return f"data:{tts_module.AUDIO_MIME_TYPE};base64,{base64.b64encode(audio_content).decode('ascii')}"
+                blob_id = audio_blob_store.blob_store.put(audio_content, tts_module.AUDIO_MIME_TYPE, session_id)
+                return f"/audio/{blob_id}"
+            
+            ai_audio_chunk_filename = f"ana_chunk_{session_id}_{batch_timestamp}_{index}{tts_module.AUDIO_EXTENSION}"
             ai_audio_chunk_path = os.path.join(app.config['STATIC_FOLDER'], ai_audio_chunk_filename)
-
-            try:
-                if tts_module.client is None:
-                    yield f"data: {json.dumps({'type': 'error', 'message': 'TTS service not initialized.'})}\n\n"
-                else:
-                    # Final cleaning before TTS
-                    tts_sentence = sentence.strip()
-                    if not tts_sentence:
-                        conv_log.log_debug(session_id, f"Empty sentence after cleaning, skipping TTS")
-                        continue
-                    
-                    conv_log.log_debug(session_id, f"Generating TTS for: '{tts_sentence}' -> {ai_audio_chunk_filename}")
-                    tts_module.generate_speech(tts_sentence, ai_audio_chunk_path, ultra_fast=True)
-                    ai_audio_chunk_url = f"/static/{ai_audio_chunk_filename}"
-                    yield f"data: {json.dumps({'type': 'ai_audio_chunk', 'url': ai_audio_chunk_url, 'text_spoken': tts_sentence})}\n\n"
-                    print(f"🎵 Ana TTS: '{tts_sentence[:30]}...' ({time.time() - tts_chunk_start_time:.3f}s)")
-            except Exception as e_tts:
-                conv_log.log_error(session_id, "TTS_ERROR", f"Failed to generate TTS for '{sentence}': {e_tts}")
-                print(f"❌ Ana TTS error: {e_tts}")
+            conv_log.log_debug(session_id, f"Generating TTS for: '{tts_sentence}' -> {ai_audio_chunk_filename}")
+            # May return a shared file from the TTS audio cache instead of ai_audio_chunk_path
+            audio_path = tts_module.generate_speech(tts_sentence, ai_audio_chunk_path, ultra_fast=True)
+            if audio_path == ai_audio_chunk_path:
+                audio_janitor.janitor.track(session_id, audio_path)  # Cache files are managed by the TTS cache LRU
+            return "/static/" + os.path.relpath(audio_path, app.config['STATIC_FOLDER']).replace(os.sep, '/')
+        
+        # All sentences are synthesized concurrently; chunks are still emitted in order
+        for chunk in speech_pipeline.synthesize_in_order(sentences, synthesize_sentence):
+            e_tts = chunk['error']
+            if e_tts is not None:
+                conv_log.log_error(session_id, "TTS_ERROR", f"Failed to generate TTS for '{chunk['text']}': {e_tts}")
+                log.error(f"❌ Ana TTS error: {e_tts}")
                 yield f"data: {json.dumps({'type': 'error', 'message': f'TTS error: {e_tts}'})}\n\n"
-
-    return Response(event_stream(), mimetype='text/event-stream')
+                continue
+            
+            ai_audio_chunk_url = chunk['result']
+            if turn_metrics['first_audio'] is None:
+                turn_metrics['first_audio'] = time.time() - overall_start_time
+                tracing.record("first_audio", turn_metrics['first_audio'])
+                log.info(f"⏱️ Time to first audio: {turn_metrics['first_audio']:.3f}s")
+            yield f"data: {json.dumps({'type': 'ai_audio_chunk', 'url': ai_audio_chunk_url, 'mime_type': tts_module.AUDIO_MIME_TYPE, 'text_spoken': chunk['text']})}\n\n"
+            log.debug(f"🎵 Ana TTS: '{chunk['text'][:30]}...' ({chunk['elapsed']:.3f}s)")
+
+    return Response(tracing.stream(trace, event_stream()), mimetype='text/event-stream')
+
+# Route to serve in-memory TTS audio (default, no disk writes)
+@app.route('/audio/<blob_id>')
+def serve_audio_blob(blob_id):
+    blob = audio_blob_store.blob_store.get(blob_id)
+    if blob is None:
+        return jsonify({'error': 'Audio expired or not found'}), 404
+    data, mime_type = blob
+    return Response(data, mimetype=mime_type, headers={'Cache-Control': 'private, max-age=300'})
 
 # Route to serve static audio files (Flask static serving should handle this, but explicit can be useful)
 @app.route('/static/<path:filename>')
 def serve_static_audio(filename):
-    return send_from_directory(app.config['STATIC_FOLDER'], filename)
+    audio_janitor.janitor.mark_played(os.path.join(app.config['STATIC_FOLDER'], filename))
+    # Explicit type: slim images may lack the system MIME table, and browsers want "codecs=opus" for Ogg
+    return send_from_directory(app.config['STATIC_FOLDER'], filename, mimetype=tts_module.audio_mime_type(filename))
 
 if __name__ == '__main__':
+    import sys
+    if '--prewarm-tts' in sys.argv:
+        # python app.py --prewarm-tts : synthesize all static prompts into the TTS cache and exit
+        bootstrap.wait_until_ready(None)
+        tts_module.prewarm_cache(turn_planner.collect_static_prompts(), turn_planner.collect_speech_templates())
+        sys.exit(0)
     # ... (rest of your __main__ block)
     print("Starting Flask app for real-time conversation...")
     llm_provider_name = "OpenAI" if USE_OPENAI else "Deepseek"
@@ -0,0 +1,474 @@
+# asgi_app.py
+"""
+Asyncio serving mode for Ana: the same routes and SSE event schema as app.py, on Quart.
+STT, TTS, LLM and Supabase calls are awaited instead of holding a worker thread, so one
+process can keep hundreds of conversations in flight.
+
+Run with:  hypercorn asgi_app:app --bind 0.0.0.0:5000   (or: python asgi_app.py)
+"""
+
+from quart import Quart, render_template, request, jsonify, send_from_directory, send_file, Response
+import os
+import sys
+import uuid
+import json # For SSE data
+import base64 # For inline audio in SSE events
+import time # For timing
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import tts_module
+import llm_module
+import memory_module
+import stt_module
+import speech_pipeline
+import audio_blob_store
+import audio_janitor
+import faq_knowledge_base
+import connection_warmup
+import tracing
+
+# Import Ana's conversation system
+import turn_planner
+import session_manager
+import conversation_logger as conv_log
+
+# Configuration and service startup shared with the Flask server (app.py)
+import bootstrap
+from bootstrap import STATIC_FOLDER, AUDIO_DELIVERY, SUPABASE_URL, SUPABASE_KEY
+
+app = Quart(__name__, static_folder=None)
+log = conv_log.get_logger("asgi")
+app.config['STATIC_FOLDER'] = STATIC_FOLDER
+
+# --- Module Initialization ---
+# Sync clients back the TTS cache prewarm, Whisper fallback and streaming recognizer;
+# the asyncio clients are created after them, inside the server's event loop they bind to
+bootstrap.initialize_services()
+bootstrap.start_background_tasks()
+
+if bootstrap.AUDIO_DISK_DEBUG:
+    print("⚠️  AUDIO_DISK_DEBUG is not supported by the ASGI server - audio stays in memory")
+
+
+# Set once the sync startup finished and the asyncio clients exist (created in startup())
+async_services_ready = None
+
+# asyncio.to_thread pool: blocking work (session store, planner steps, VAD, streaming STT finish)
+# would otherwise queue on asyncio's default of min(32, CPUs + 4) threads
+ASGI_THREAD_POOL_WORKERS = int(os.environ.get("ASGI_THREAD_POOL_WORKERS", "64"))
+
+
+@app.before_serving
+async def startup():
+    """Start serving right away; the asyncio clients are created once the sync services are up"""
+    global async_services_ready
+    async_services_ready = asyncio.Event()
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASGI_THREAD_POOL_WORKERS, thread_name_prefix="asgi-io"))
+    app.add_background_task(create_async_clients)
+
+
+async def create_async_clients():
+    """Create the asyncio service clients inside the serving event loop"""
+    await asyncio.to_thread(bootstrap.wait_until_ready, None)
+    try:
+        if tts_module.client is not None:
+            tts_module.initialize_tts_async()
+    except Exception as e: print(f"ERROR initializing async TTS: {e}")
+
+    try:
+        if stt_module.stt_client is not None:
+            stt_module.initialize_stt_async()
+    except Exception as e: print(f"ERROR initializing async STT: {e}")
+
+    try:
+        if memory_module.supabase_client is not None:
+            await memory_module.initialize_memory_async(url=SUPABASE_URL, key=SUPABASE_KEY)
+    except Exception as e: print(f"ERROR initializing async Memory: {e}")
+    # llm_module creates its AsyncOpenAI client together with the sync one
+
+    try:
+        # Open the async channels now and keep them warm while idle
+        await connection_warmup.monitor.start_async()
+    except Exception as e: print(f"ERROR warming up async connections: {e}")
+    async_services_ready.set()
+    print("Async service clients ready.")
+
+
+async def wait_until_ready():
+    """Wait (bounded) for startup to finish. Returns False on timeout."""
+    try:
+        await asyncio.wait_for(async_services_ready.wait(), bootstrap.STARTUP_REQUEST_WAIT_SECONDS)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+@app.route('/debug/<session_id>')
+async def get_session_debug(session_id):
+    """Get debug logs for a specific session"""
+    try:
+        logs = await asyncio.to_thread(conv_log.get_session_logs, session_id)
+        return f"<pre>{logs}</pre>", 200, {'Content-Type': 'text/html; charset=utf-8'}
+    except Exception as e:
+        return f"Error retrieving logs: {e}", 500
+
+@app.route('/debug/<session_id>/download')
+async def download_session_debug(session_id):
+    """Download debug logs for a specific session as a file"""
+    try:
+        debug_file = await asyncio.to_thread(conv_log.create_debug_file, session_id)
+        if debug_file:
+            return await send_file(debug_file, as_attachment=True, attachment_filename=f"debug_{session_id}.log")
+        else:
+            return "Could not create debug file", 500
+    except Exception as e:
+        return f"Error creating debug file: {e}", 500
+
+@app.route('/debug/tts-cache')
+async def get_tts_cache_stats():
+    """TTS audio cache hit/miss counters"""
+    return jsonify(tts_module.get_cache_stats())
+
+@app.route('/debug/audio-janitor')
+async def get_audio_janitor_stats():
+    """Generated audio retention: tracked files and bytes reclaimed"""
+    return jsonify({**audio_janitor.janitor.stats(), 'blob_store': audio_blob_store.blob_store.stats()})
+
+@app.route('/debug/persistence')
+async def get_persistence_stats():
+    """Write-behind persistence queue depth and flush latency"""
+    return jsonify(memory_module.get_persistence_stats())
+
+@app.route('/debug/history-cache')
+async def get_history_cache_stats():
+    """Conversation history cache hit/miss counters"""
+    return jsonify(memory_module.get_history_cache_stats())
+
+@app.route('/debug/llm-cache')
+async def get_llm_cache_stats():
+    """LLM response cache hit rate and saved tokens"""
+    return jsonify(llm_module.get_llm_cache_stats())
+
+@app.route('/debug/sessions')
+async def get_session_store_stats():
+    """Session store backend, size and compare-and-set conflicts"""
+    return jsonify(await asyncio.to_thread(session_manager.session_manager.get_stats))
+
+@app.route('/debug/whisper-pool')
+async def get_whisper_pool_stats():
+    """Whisper fallback pool: workers, queue time and batch sizes"""
+    return jsonify(await asyncio.to_thread(stt_module.get_whisper_pool_stats))
+
+@app.route('/debug/logging')
+async def get_log_stats():
+    """Log writer: queued, written and dropped records"""
+    return jsonify(conv_log.get_log_stats())
+
+@app.route('/metrics')
+async def metrics():
+    """Stage latency histograms (p50/p95/p99) in the Prometheus text format"""
+    return Response(tracing.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/trace/<trace_id>')
+async def get_trace(trace_id):
+    """Spans of a recent turn (trace_id comes with the end_of_stream event)"""
+    trace = tracing.get_trace(trace_id)
+    if trace is None:
+        return jsonify({'error': 'Trace not found or expired'}), 404
+    return jsonify(trace)
+
+@app.route('/ready')
+async def readiness():
+    """Readiness probe: 200 once every service finished initializing, 503 while starting or if STT/TTS failed"""
+    report = bootstrap.get_readiness()
+    report['async_clients_ready'] = async_services_ready is not None and async_services_ready.is_set()
+    report['ready'] = report['ready'] and report['async_clients_ready']
+    return jsonify(report), 200 if report['ready'] else 503
+
+@app.route('/debug/connections')
+async def get_connection_stats():
+    """Connection setup time next to request time for STT, TTS and LLM"""
+    return jsonify(connection_warmup.monitor.stats())
+
+@app.route('/debug/faq')
+async def get_faq_stats():
+    """FAQ hit vs LLM-fallback rates, keyword only vs hybrid (keyword + semantic)"""
+    return jsonify(faq_knowledge_base.get_faq_stats())
+
+async def load_turn_context(session_id):
+    """Session state and recent history for a turn. Returns the history (oldest first)."""
+    # The session store (sqlite/redis) is blocking; planner steps that update it run in threads too (see advance_plan)
+    await asyncio.to_thread(session_manager.session_manager.get_session, session_id)
+    history = []
+    if memory_module.async_supabase_client: # Check if client is initialized
+        try:
+            history = await memory_module.get_history_async(session_id, limit=3) # Limit history for speed
+        except Exception as e:
+            log.error(f"Error retrieving history: {e}")
+    return history
+
+def reject_turn(trace, status, error, **details):
+    """JSON error response for a turn rejected before its response stream; finishes the turn's trace with the error"""
+    if trace is not None:
+        trace.finish(error=error, status=status)
+    return jsonify({'error': error, **details}), status
+
+@app.route('/chat', methods=['POST'])
+async def chat_endpoint():
+    overall_start_time = time.time()
+
+    if not await wait_until_ready():
+        return jsonify({'error': 'Services are still starting, try again shortly.'}), 503
+
+    files = await request.files
+    form = await request.form
+    if 'audio_data' not in files:
+        return jsonify({'error': 'No audio file part in the request'}), 400
+    audio_file = files['audio_data']
+    if audio_file.filename == '':
+        return jsonify({'error': 'No selected audio file'}), 400
+
+    session_id = form.get('session_id', str(uuid.uuid4()))
+    trace = tracing.start_trace("chat", session_id, request.headers.get('X-Trace-Id'), start=overall_start_time)
+    stream_started = False  # From then on the response stream finishes the trace
+    try:
+        tracing.attach(trace)  # This request's task, and the tasks it starts, run under the trace
+        context_task = asyncio.ensure_future(load_turn_context(session_id))  # Runs alongside STT
+        log.info(f"🔗 Session ID: {session_id} | Debug at: http://localhost:5000/debug/{session_id}")
+
+        # Keep the upload in memory and hand STT a zero-copy view of it
+        with tracing.span("upload"):
+            audio_bytes = audio_file.read()
+        log.debug(f"📊 Audio size: {len(audio_bytes)} bytes")
+        if len(audio_bytes) < 100:
+            log.warning("⚠️  WARNING: User audio file is very small, possible recording issue")
+            return reject_turn(trace, 400, 'Audio file too small - please try recording again')
+        audio_source = memoryview(audio_bytes)
+
+        # Detect audio format once - STT uses it to send a single correctly configured request
+        with tracing.span("format_detection"):
+            audio_format = stt_module.detect_audio_format(audio_source[:4096])
+        log.debug(f"📱 Detected format: {audio_format}")
+
+        # Trim silence locally and drop recordings without speech before any STT request (CPU and ffmpeg: worker thread)
+        with tracing.span("vad") as vad_span:
+            speech = await asyncio.to_thread(stt_module.detect_speech, audio_source, audio_format)
+            vad_span.attributes.update(has_speech=speech['has_speech'], speech_duration=speech['speech_duration'], duration=speech['duration'])
+        if speech['has_speech'] is not None:
+            conv_log.log_debug(session_id, f"VAD ({speech['backend']}): {speech['speech_duration']:.2f}s speech in {speech['duration']:.2f}s recording")
+        if speech['has_speech'] is False:
+            conv_log.log_error(session_id, "NO_SPEECH", f"No speech detected in {speech['duration']:.2f}s recording")
+            return reject_turn(trace, 400, 'No speech detected - please try recording again', suggestion='Please speak louder and try again')
+        audio_source, audio_format = speech['audio_source'], speech['audio_format']
+
+        if stt_module.stt_client is None and stt_module.async_stt_client is None:
+            return reject_turn(trace, 500, 'STT service not available.')
+
+        stt_start_time = time.time()
+        with tracing.span("stt", format=audio_format.get('format')):
+            user_text = await stt_module.transcribe_audio_async(audio_source, language="es", audio_format=audio_format) # Force Spanish
+        log.info(f"⏱️ STT ({user_text}): {time.time() - stt_start_time:.3f}s")
+
+        if not user_text or "Error" in user_text:
+            conv_log.log_error(session_id, "STT_FAILURE", f"Transcription failed: {user_text}")
+            return reject_turn(trace, 500, 'Failed to transcribe audio', details=user_text, suggestion='Please speak louder and try again')
+
+        response = await build_turn_response(session_id, user_text, overall_start_time, context_task, trace)
+        stream_started = True
+        return response
+    finally:
+        if trace is not None and not stream_started:
+            # Rejected turns are already finished with their error (reject_turn); this covers exceptions
+            failure = sys.exc_info()[1]
+            trace.finish(error=repr(failure) if failure is not None else 'no response stream')
+
+@app.route('/chat/stream', methods=['POST'])
+async def chat_stream_endpoint():
+    """Streaming upload mode (see app.py): the body is the raw recording, sent with chunked transfer encoding"""
+    overall_start_time = time.time()
+
+    if not await wait_until_ready():
+        return jsonify({'error': 'Services are still starting, try again shortly.'}), 503
+
+    if stt_module.stt_client is None and stt_module.whisper_pool_client is None:
+        return jsonify({'error': 'STT service not available.'}), 500
+
+    session_id = request.args.get('session_id') or request.headers.get('X-Session-Id') or str(uuid.uuid4())
+    trace = tracing.start_trace("chat_stream", session_id, request.headers.get('X-Trace-Id'), start=overall_start_time)
+    stream_started = False  # From then on the response stream finishes the trace
+    try:
+        tracing.attach(trace)
+        context_task = asyncio.ensure_future(load_turn_context(session_id))  # Runs alongside the upload and STT
+        log.info(f"🔗 Session ID: {session_id} (streaming upload) | Debug at: http://localhost:5000/debug/{session_id}")
+
+        # feed() only queues frames for the recognizer thread, so it is safe on the event loop
+        transcriber = stt_module.create_streaming_transcriber(language="es") # Force Spanish
+        try:
+            with tracing.span("upload", streaming=True):
+                async for chunk in request.body:
+                    if chunk:
+                        transcriber.feed(chunk)
+
+            if transcriber.bytes_received < 100:
+                log.warning("⚠️  WARNING: Streamed audio is very small, possible recording issue")
+                return reject_turn(trace, 400, 'Audio file too small - please try recording again')
+
+            stt_start_time = time.time()
+            with tracing.span("stt", streaming=True):
+                user_text = await asyncio.to_thread(transcriber.finish)
+        finally:
+            transcriber.close()  # Client disconnects, cancellation and early returns must not leave the recognizer stream open
+        log.info(f"⏱️ Streaming STT ({user_text}): {time.time() - stt_start_time:.3f}s after upload finished")
+
+        if not user_text or "Error" in user_text:
+            conv_log.log_error(session_id, "STT_FAILURE", f"Transcription failed: {user_text}")
+            return reject_turn(trace, 500, 'Failed to transcribe audio', details=user_text, suggestion='Please speak louder and try again')
+
+        response = await build_turn_response(session_id, user_text, overall_start_time, context_task, trace)
+        stream_started = True
+        return response
+    finally:
+        if trace is not None and not stream_started:
+            # Rejected turns are already finished with their error (reject_turn); this covers exceptions
+            failure = sys.exc_info()[1]
+            trace.finish(error=repr(failure) if failure is not None else 'no response stream')
+
+def advance_plan(plan, reply):
+    """Run one turn planner step. Returns (action, None), or (None, save_to_memory) once the plan is done."""
+    try:
+        return plan.send(reply), None
+    except StopIteration as stop:  # Can't be raised through asyncio.to_thread's future
+        return None, stop.value
+
+async def build_turn_response(session_id, user_text, overall_start_time, context_task, trace=None):
+    """Run Ana's conversation flow for a transcribed turn and stream it to the client as SSE"""
+    turn_metrics = {'first_audio': None}  # Per-request latency, filled in while streaming
+
+    with tracing.span("context_wait"):
+        history = await context_task  # Usually already loaded while STT was running
+
+    async def event_stream():
+        tracing.attach(trace)  # The body may be sent from another task than the request handler
+        # 1. Send transcribed user text to client
+        yield f"data: {json.dumps({'type': 'user_text_final', 'text': user_text, 'session_id': session_id})}\n\n"
+
+        # Log conversation start
+        conv_log.log_conversation_start(session_id, user_text)
+
+        try:
+            # 2. Speak whatever the turn planner decides, in order
+            plan = turn_planner.plan_turn(session_id, user_text, history, llm_available=llm_module.async_client is not None)
+            reply = None
+            while True:
+                # Planner steps block (FAQ embedding match, session store), so they run off the event loop
+                action, save_to_memory = await asyncio.to_thread(advance_plan, plan, reply)
+                if action is None:
+                    break
+                reply = None
+                if action['type'] == 'say':
+                    async for event in generate_ana_response(action['text'], action.get('segments')):
+                        yield event
+                elif action['type'] == 'llm':
+                    llm_chunks = []
+
+                    async def collect_llm_chunks():
+                        async for chunk in llm_module.get_ai_response_async(action['prompt'], conversation_history=action['history'],
+                                                                            cache_text=action.get('cache_text')):
+                            if chunk:
+                                llm_chunks.append(chunk)
+                                yield chunk
+
+                    # Speak each sentence as soon as the LLM finishes it
+                    async for event in stream_ana_sentences(speech_pipeline.iter_sentences_async(collect_llm_chunks())):
+                        yield event
+                    reply = "".join(llm_chunks)
+
+            # Save interaction to memory (not for the introduction turn)
+            if save_to_memory and memory_module.async_supabase_client:
+                await memory_module.save_interaction_async(session_id, user_text, "Ana response processed")
+
+            # Log conversation end
+            total_time = time.time() - overall_start_time
+            conv_log.log_conversation_end(session_id, total_time, 1)
+            conv_log.log_turn_latency(session_id, turn_metrics['first_audio'], total_time)
+
+            yield f"data: {json.dumps({'type': 'end_of_stream', 'trace_id': trace.trace_id if trace is not None else None})}\n\n"
+            log.info(f"⏱️ === ANA RESPONSE COMPLETED IN: {total_time:.3f}s ===")
+
+        except Exception as e_stream:
+            log.error(f"❌ Error in Ana's conversation flow: {e_stream}")
+            conv_log.log_error(session_id, "CONVERSATION_FLOW", str(e_stream))
+            yield f"data: {json.dumps({'type': 'error', 'message': str(e_stream)})}\n\n"
+        finally:
+            if trace is not None:
+                trace.finish(first_audio=turn_metrics['first_audio'])
+
+    async def generate_ana_response(response_text, segments=None):
+        """Generate Ana's TTS response and stream it to client (segments: filled template, see speech_pipeline)"""
+        if not response_text.strip():
+            return
+        clean_text = speech_pipeline.clean_response_text(response_text)
+        sentences = speech_pipeline.split_segments(segments) if segments else speech_pipeline.split_sentences(clean_text)
+        conv_log.log_debug(session_id, f"Split into {len(sentences)} sentences: {sentences}")
+        async for event in stream_ana_sentences(sentences):
+            yield event
+
+    async def stream_ana_sentences(sentences):
+        """Synthesize sentences concurrently and stream the audio chunks to client in order"""
+        if tts_module.async_client is None:
+            yield f"data: {json.dumps({'type': 'error', 'message': 'TTS service not initialized.'})}\n\n"
+            return
+
+        async def synthesize_sentence(index, tts_sentence):
+            """Synthesize one sentence and return the URL the client plays it from"""
+            conv_log.log_debug(session_id, f"Generating TTS for: '{tts_sentence}' (in memory)")
+            with tracing.span("tts_sentence", index=index, chars=len(tts_sentence)):
+                audio_content = await tts_module.synthesize_speech_async(tts_sentence, ultra_fast=True)
+            if AUDIO_DELIVERY == "inline":
+                return f"data:{tts_module.AUDIO_MIME_TYPE};base64,{base64.b64encode(audio_content).decode('ascii')}"
+            blob_id = audio_blob_store.blob_store.put(audio_content, tts_module.AUDIO_MIME_TYPE, session_id)
+            return f"/audio/{blob_id}"
+
+        async for chunk in speech_pipeline.synthesize_in_order_async(sentences, synthesize_sentence):
+            e_tts = chunk['error']
+            if e_tts is not None:
+                conv_log.log_error(session_id, "TTS_ERROR", f"Failed to generate TTS for '{chunk['text']}': {e_tts}")
+                log.error(f"❌ Ana TTS error: {e_tts}")
+                yield f"data: {json.dumps({'type': 'error', 'message': f'TTS error: {e_tts}'})}\n\n"
+                continue
+
+            if turn_metrics['first_audio'] is None:
+                turn_metrics['first_audio'] = time.time() - overall_start_time
+                tracing.record("first_audio", turn_metrics['first_audio'])
+                log.info(f"⏱️ Time to first audio: {turn_metrics['first_audio']:.3f}s")
+            yield f"data: {json.dumps({'type': 'ai_audio_chunk', 'url': chunk['result'], 'mime_type': tts_module.AUDIO_MIME_TYPE, 'text_spoken': chunk['text']})}\n\n"
+
+    response = Response(event_stream(), mimetype='text/event-stream')
+    response.timeout = None  # Long answers must not hit Quart's default response timeout
+    return response
+
+# Route to serve in-memory TTS audio
+@app.route('/audio/<blob_id>')
+async def serve_audio_blob(blob_id):
+    blob = audio_blob_store.blob_store.get(blob_id)
+    if blob is None:
+        return jsonify({'error': 'Audio expired or not found'}), 404
+    data, mime_type = blob
+    return Response(data, mimetype=mime_type, headers={'Cache-Control': 'private, max-age=300'})
+
+# Route to serve static audio files (TTS cache)
+@app.route('/static/<path:filename>')
+async def serve_static_audio(filename):
+    audio_janitor.janitor.mark_played(os.path.join(app.config['STATIC_FOLDER'], filename))
+    # Explicit type: slim images may lack the system MIME table, and browsers want "codecs=opus" for Ogg
+    return await send_from_directory(app.config['STATIC_FOLDER'], filename, mimetype=tts_module.audio_mime_type(filename))
+
+if __name__ == '__main__':
+    print("Starting Quart (ASGI) app for real-time conversation...")
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,85 @@
+# audio_blob_store.py
+"""
+In-process store for generated audio, served from memory instead of static/.
+Blobs expire after a TTL and the store is bounded in total size.
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+AUDIO_BLOB_TTL_SECONDS = int(os.environ.get("AUDIO_BLOB_TTL_SECONDS", "300"))
+AUDIO_BLOB_MAX_MB = int(os.environ.get("AUDIO_BLOB_MAX_MB", "256"))
+
+
+class AudioBlobStore:
+    """Thread-safe, expiring map of blob_id -> audio bytes"""
+
+    def __init__(self, ttl_seconds: int, max_bytes: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # blob_id -> (data, mime_type, expires_at, session_id); insertion order == expiry order
+        self._blobs: "OrderedDict[str, Tuple[bytes, str, float, Optional[str]]]" = OrderedDict()
+        self._total_bytes = 0
+        self.expired = 0
+
+    def put(self, data: bytes, mime_type: str = "audio/wav", session_id: Optional[str] = None) -> str:
+        """Store audio and return its blob id"""
+        blob_id = uuid.uuid4().hex
+        with self._lock:
+            self._purge_locked(time.time())
+            self._blobs[blob_id] = (data, mime_type, time.time() + self.ttl_seconds, session_id)
+            self._total_bytes += len(data)
+            # Over budget: drop the oldest blobs first
+            while self._total_bytes > self.max_bytes and len(self._blobs) > 1:
+                self._drop_locked(next(iter(self._blobs)))
+        return blob_id
+
+    def get(self, blob_id: str) -> Optional[Tuple[bytes, str]]:
+        """Return (data, mime_type) or None if missing/expired"""
+        with self._lock:
+            blob = self._blobs.get(blob_id)
+            if blob is None:
+                return None
+            if blob[2] < time.time():
+                self._drop_locked(blob_id)
+                self.expired += 1
+                return None
+            return blob[0], blob[1]
+
+    def purge_expired(self) -> int:
+        """Drop expired blobs, returns bytes reclaimed"""
+        with self._lock:
+            return self._purge_locked(time.time())
+
+    def _purge_locked(self, now: float) -> int:
+        reclaimed = 0
+        while self._blobs:
+            blob_id, blob = next(iter(self._blobs.items()))
+            if blob[2] >= now:
+                break
+            reclaimed += self._drop_locked(blob_id)
+            self.expired += 1
+        return reclaimed
+
+    def _drop_locked(self, blob_id: str) -> int:
+        data = self._blobs.pop(blob_id)[0]
+        self._total_bytes -= len(data)
+        return len(data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "blobs": len(self._blobs),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "expired": self.expired
+            }
+
+
+# Global blob store instance
+blob_store = AudioBlobStore(AUDIO_BLOB_TTL_SECONDS, AUDIO_BLOB_MAX_MB * 1024 * 1024)
@@ -0,0 +1,187 @@
+# audio_janitor.py
+"""
+Background retention for generated audio in static/ and uploads/
+Tracks files per session, deletes them after playback + TTL, when their
+session expires, or when the directories go over the disk quota.
+"""
+
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+AUDIO_PLAYED_TTL_SECONDS = int(os.environ.get("AUDIO_PLAYED_TTL_SECONDS", "60"))
+AUDIO_FILE_TTL_SECONDS = int(os.environ.get("AUDIO_FILE_TTL_SECONDS", "900"))
+AUDIO_DISK_QUOTA_MB = int(os.environ.get("AUDIO_DISK_QUOTA_MB", "500"))
+JANITOR_INTERVAL_SECONDS = int(os.environ.get("JANITOR_INTERVAL_SECONDS", "60"))
+
+
+class AudioJanitor:
+    """Deletes generated audio files that are no longer needed"""
+
+    def __init__(self, directories: List[str], played_ttl: int, file_ttl: int,
+                 quota_bytes: int, interval: int):
+        self.directories = directories
+        self.played_ttl = played_ttl
+        self.file_ttl = file_ttl
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._files: Dict[str, Dict[str, Any]] = {}  # path -> {'session_id', 'created', 'played'}
+        self._sessions: Dict[str, set] = {}  # session_id -> paths
+        self._extra_tasks: List[Callable[[], int]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.bytes_reclaimed = 0
+        self.files_deleted = 0
+        self.last_sweep: Optional[float] = None
+
+    def track(self, session_id: str, path: str) -> None:
+        """Register a generated file as belonging to a session"""
+        with self._lock:
+            self._files[os.path.abspath(path)] = {'session_id': session_id, 'created': time.time(), 'played': None}
+            self._sessions.setdefault(session_id, set()).add(os.path.abspath(path))
+
+    def mark_played(self, path: str) -> None:
+        """Record that the client fetched the file; it is deleted played_ttl seconds later"""
+        with self._lock:
+            entry = self._files.get(os.path.abspath(path))
+            if entry is not None and entry['played'] is None:
+                entry['played'] = time.time()
+
+    def release_session(self, session_id: str) -> int:
+        """Delete every file of a session (e.g. when the session expires). Returns bytes reclaimed."""
+        with self._lock:
+            paths = self._sessions.pop(session_id, set())
+            for path in paths:
+                self._files.pop(path, None)
+        reclaimed = sum(self._delete(path) for path in paths)
+        if reclaimed:
+            print(f"🧹 Released session {session_id}: {reclaimed} bytes reclaimed")
+        return reclaimed
+
+    def add_task(self, task: Callable[[], int]) -> None:
+        """Run an extra cleanup callable on every sweep (returns bytes reclaimed)"""
+        self._extra_tasks.append(task)
+
+    def _delete(self, path: str) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+        with self._lock:
+            self.bytes_reclaimed += size
+            self.files_deleted += 1
+        return size
+
+    def _forget(self, path: str) -> None:
+        with self._lock:
+            entry = self._files.pop(path, None)
+            if entry is not None:
+                paths = self._sessions.get(entry['session_id'])
+                if paths is not None:
+                    paths.discard(path)
+                    if not paths:
+                        del self._sessions[entry['session_id']]
+
+    def sweep(self) -> int:
+        """One retention pass. Returns bytes reclaimed."""
+        now = time.time()
+        reclaimed_before = self.bytes_reclaimed
+
+        # 1. Tracked files: played + TTL, or never played and older than the file TTL
+        with self._lock:
+            due = [path for path, entry in self._files.items()
+                   if (entry['played'] is not None and now - entry['played'] > self.played_ttl)
+                   or now - entry['created'] > self.file_ttl]
+        for path in due:
+            self._forget(path)
+            self._delete(path)
+
+        # 2. Untracked leftovers (older runs, generate_speech_chunked output) and the disk quota.
+        # Only top-level files are considered, so subdirectories such as the TTS cache are left alone.
+        files = []
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        files.append((stat.st_mtime, stat.st_size, os.path.abspath(entry.path)))
+                except OSError:
+                    continue
+
+        with self._lock:
+            tracked = set(self._files)
+        remaining = []
+        for mtime, size, path in files:
+            if path not in tracked and now - mtime > self.file_ttl:
+                self._delete(path)
+            else:
+                remaining.append((mtime, size, path))
+
+        total = sum(size for _, size, _ in remaining)
+        if total > self.quota_bytes:
+            for mtime, size, path in sorted(remaining):  # Oldest first
+                if total <= self.quota_bytes:
+                    break
+                self._forget(path)
+                self._delete(path)
+                total -= size
+
+        # 3. Extra cleanup hooks (expired sessions, in-memory blobs)
+        task_bytes = 0
+        for task in self._extra_tasks:
+            try:
+                task_bytes += task() or 0
+            except Exception as e:
+                print(f"❌ Janitor task error: {e}")
+        # Files released by session expiry listeners are counted via bytes_reclaimed
+        reclaimed = self.bytes_reclaimed - reclaimed_before + task_bytes
+
+        self.last_sweep = now
+        if reclaimed:
+            print(f"🧹 Janitor sweep reclaimed {reclaimed} bytes ({self.bytes_reclaimed} total)")
+        return reclaimed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"❌ Janitor sweep error: {e}")
+
+    def start(self) -> None:
+        """Start the background sweep thread (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audio-janitor", daemon=True)
+            self._thread.start()
+            print(f"🧹 Audio janitor started (every {self.interval}s, quota {self.quota_bytes // (1024 * 1024)} MB)")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tracked_files": len(self._files),
+                "tracked_sessions": len(self._sessions),
+                "bytes_reclaimed": self.bytes_reclaimed,
+                "files_deleted": self.files_deleted,
+                "last_sweep": self.last_sweep
+            }
+
+
+# Global janitor for pbx's generated audio directories
+janitor = AudioJanitor(
+    directories=['static', 'uploads'],
+    played_ttl=AUDIO_PLAYED_TTL_SECONDS,
+    file_ttl=AUDIO_FILE_TTL_SECONDS,
+    quota_bytes=AUDIO_DISK_QUOTA_MB * 1024 * 1024,
+    interval=JANITOR_INTERVAL_SECONDS
+)
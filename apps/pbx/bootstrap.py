@@ -0,0 +1,213 @@
+# bootstrap.py
+"""
+Shared configuration and service startup for the pbx servers
+(app.py on Flask, asgi_app.py on Quart).
+"""
+
+import os
+import time
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import tts_module
+import llm_module
+import memory_module
+import stt_module
+import faq_semantic
+import connection_warmup
+import faq_knowledge_base
+import audio_blob_store
+import audio_janitor
+import session_manager
+import turn_planner
+
+# Suppress future warnings for cleaner logs (optional)
+warnings.filterwarnings("ignore", category=FutureWarning)
+warnings.filterwarnings("ignore", category=UserWarning)
+
+# --- Configuration ---
+load_dotenv()
+
+DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "YOUR_DEEPSEEK_API_KEY_HERE")
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "YOUR_OPENAI_API_KEY_HERE")
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "YOUR_SUPABASE_URL_HERE")
+# Ensure you are using the SERVICE KEY for Supabase from backend
+SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_KEY", os.environ.get("SUPABASE_API_KEY", "YOUR_SUPABASE_SERVICE_KEY_HERE"))
+
+# Google Cloud credentials setup
+if "GOOGLE_CREDENTIALS_JSON" in os.environ:
+    creds_path = "/tmp/google_credentials.json"
+    with open(creds_path, "w") as f:
+        f.write(os.environ["GOOGLE_CREDENTIALS_JSON"])
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = creds_path
+    print(f"✅ Set Google Cloud credentials from environment variable")
+elif os.environ.get("GOOGLE_CREDENTIALS_PATH"):
+    creds_path = os.environ["GOOGLE_CREDENTIALS_PATH"]
+    if os.path.exists(creds_path):
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = creds_path
+        print(f"✅ Set Google Cloud credentials: {creds_path}")
+    else:
+        print(f"⚠️  Google Cloud credentials not found at: {creds_path}")
+        print("   STT may not work properly without valid credentials.")
+
+# LLM Configuration - Set USE_OPENAI=True to use OpenAI instead of Deepseek
+USE_OPENAI = True # Set to False to use Deepseek by default
+
+UPLOAD_FOLDER = 'uploads'
+STATIC_FOLDER = 'static'
+STREAM_CHUNK_SIZE = 4096  # Bytes read per frame in the /chat/stream upload mode
+
+# Audio stays in memory end to end unless disk writes are enabled for debugging
+AUDIO_DISK_DEBUG = os.environ.get("AUDIO_DISK_DEBUG", "false").lower() == "true"
+# How in-memory TTS audio reaches the client: "blob" (/audio/<id>) or "inline" (base64 data URL in the SSE event)
+AUDIO_DELIVERY = os.environ.get("AUDIO_DELIVERY", "blob").lower()
+
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(STATIC_FOLDER, exist_ok=True)
+
+# Pre-synthesize static prompts into the TTS cache in the background at startup
+TTS_CACHE_PREWARM = os.environ.get("TTS_CACHE_PREWARM", "false").lower() == "true"
+
+
+# Startup: independent services initialize in parallel; requests wait (and /ready reports 503) until done
+STARTUP_REQUEST_WAIT_SECONDS = float(os.environ.get("STARTUP_REQUEST_WAIT_SECONDS", "30"))
+REQUIRED_SERVICES = ("tts", "stt")  # Without these no turn can complete
+
+services_ready = threading.Event()
+startup_report = {"started_at": None, "ready_in": None, "services": {}}
+
+
+def _initialize_llm():
+    if USE_OPENAI:
+        if OPENAI_API_KEY and OPENAI_API_KEY != "YOUR_OPENAI_API_KEY_HERE":
+            llm_module.initialize_llm(api_key=None, use_openai=True, openai_api_key=OPENAI_API_KEY)
+            return True
+        print("WARNING: OpenAI API key is a placeholder or missing. LLM will not function correctly if USE_OPENAI is True.")
+    else: # Use Deepseek
+        if DEEPSEEK_API_KEY and DEEPSEEK_API_KEY != "YOUR_DEEPSEEK_API_KEY_HERE":
+            llm_module.initialize_llm(api_key=DEEPSEEK_API_KEY, use_openai=False)
+            return True
+        print("WARNING: Deepseek API key is a placeholder or missing. LLM will not function correctly if USE_OPENAI is False.")
+    return False
+
+
+def _initialize_memory():
+    if SUPABASE_URL != "YOUR_SUPABASE_URL_HERE" and SUPABASE_KEY != "YOUR_SUPABASE_SERVICE_KEY_HERE":
+        memory_module.initialize_memory(url=SUPABASE_URL, key=SUPABASE_KEY)
+        return True
+    print("WARNING: Supabase URL/Key are placeholders. Memory will not function correctly.")
+    return False
+
+
+def _initialize_stt():
+    try:
+        stt_module.initialize_stt(model_size="base")
+    except Exception:
+        print("   Make sure 'openai-whisper' and 'ffmpeg' (if on windows) are installed.")
+        raise
+
+
+def _initialize_semantic_faq():
+    return faq_semantic.initialize_semantic_faq(faq_knowledge_base.FAQ_DATABASE) is not None
+
+
+# Independent of each other: each only creates its own client
+STARTUP_STEPS = [
+    ("tts", tts_module.initialize_tts),
+    ("llm", _initialize_llm),
+    ("memory", _initialize_memory),
+    ("stt", _initialize_stt),
+    ("semantic_faq", _initialize_semantic_faq),
+]
+
+
+def _run_startup_step(name, step):
+    start = time.time()
+    status, error = "ready", None
+    try:
+        if step() is False:
+            status = "skipped"
+    except Exception as e:
+        status, error = "failed", str(e)
+        print(f"ERROR initializing {name}: {e}")
+    startup_report["services"][name] = {"status": status, "seconds": round(time.time() - start, 3), "error": error}
+    print(f"{'✅' if status == 'ready' else '⚠️ '} {name}: {status} in {time.time() - start:.2f}s")
+
+
+def _startup():
+    """Initialize every service in parallel, warm up connections, then start the post-readiness work"""
+    with ThreadPoolExecutor(max_workers=len(STARTUP_STEPS), thread_name_prefix="startup") as pool:
+        list(pool.map(lambda step: _run_startup_step(*step), STARTUP_STEPS))
+
+    # Open the STT/TTS/LLM connections now and keep them warm while idle
+    connection_warmup.monitor.start()
+
+    startup_report["ready_in"] = round(time.time() - startup_report["started_at"], 3)
+    services_ready.set()
+    print(f"Module initialization phase completed in {startup_report['ready_in']:.2f}s.")
+
+    # Deferred work that must not delay readiness
+    stt_module.load_whisper_backup_in_background()
+    if TTS_CACHE_PREWARM and tts_module.client is not None:
+        threading.Thread(target=tts_module.prewarm_cache, args=(turn_planner.collect_static_prompts(), turn_planner.collect_speech_templates()), name="tts-prewarm", daemon=True).start()
+
+
+def initialize_services(wait=False):
+    """
+    Start initializing the STT, TTS, LLM, memory and semantic FAQ services in parallel.
+
+    Args:
+        wait: Block until every service finished initializing.
+    """
+    if startup_report["started_at"] is None:
+        print("Starting module initialization...")
+        startup_report["started_at"] = time.time()
+        threading.Thread(target=_startup, name="startup", daemon=True).start()
+    if wait:
+        services_ready.wait()
+
+
+def wait_until_ready(timeout=STARTUP_REQUEST_WAIT_SECONDS):
+    """Block until startup finished. Returns False on timeout."""
+    return services_ready.wait(timeout)
+
+
+def get_readiness():
+    """Readiness for the /ready endpoint: startup finished and no required service failed"""
+    services = dict(startup_report["services"])
+    failed = [name for name in REQUIRED_SERVICES if services.get(name, {}).get("status") == "failed"]
+    return {
+        "ready": services_ready.is_set() and not failed,
+        "starting": not services_ready.is_set(),
+        "failed_required": failed,
+        "ready_in": startup_report["ready_in"],
+        "whisper_pool_connected": stt_module.whisper_pool_client is not None,
+        "services": services
+    }
+
+
+def _expire_sessions():
+    """Janitor task: expire idle sessions (their audio is released by the expiry listener)"""
+    session_manager.session_manager.cleanup_expired_sessions()
+    return 0
+
+
+def _purge_llm_cache():
+    """Janitor task: drop expired LLM answers (memory only, no bytes on disk)"""
+    if llm_module.response_cache is not None:
+        llm_module.response_cache.purge_expired()
+    return 0
+
+
+def start_background_tasks():
+    """Retention for generated audio (per-session files, expired sessions, in-memory blobs) and cached answers"""
+    audio_janitor.janitor.directories = [STATIC_FOLDER, UPLOAD_FOLDER]
+    session_manager.session_manager.add_expiry_listener(audio_janitor.janitor.release_session)
+    session_manager.session_manager.add_expiry_listener(memory_module.forget_history)
+    audio_janitor.janitor.add_task(_expire_sessions)
+    audio_janitor.janitor.add_task(audio_blob_store.blob_store.purge_expired)
+    audio_janitor.janitor.add_task(_purge_llm_cache)
+    audio_janitor.janitor.start()
@@ -0,0 +1,277 @@
+# connection_warmup.py
+"""
+Connection warm-up and keepalive for the STT/TTS (gRPC) and LLM (HTTP) clients.
+
+- gRPC channels are built with keepalive options and opened at startup; their connectivity
+  is watched so every (re)connect is timed as a connection setup.
+- The LLM HTTP client keeps pooled connections longer and traces TCP/TLS setup per request.
+- A background pinger touches every dependency on an interval so idle periods do not
+  leave the next caller paying the handshake.
+
+Setup times are reported next to request times per dependency (see monitor.stats()).
+"""
+
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import grpc
+import httpx
+
+CONNECTION_WARMUP_ENABLED = os.environ.get("CONNECTION_WARMUP_ENABLED", "true").lower() == "true"
+KEEPALIVE_PING_INTERVAL_SECONDS = float(os.environ.get("KEEPALIVE_PING_INTERVAL_SECONDS", "45"))
+WARMUP_TIMEOUT_SECONDS = float(os.environ.get("WARMUP_TIMEOUT_SECONDS", "10"))
+# HTTP/2 keepalive pings on gRPC channels (Google front ends reject pings more often than every ~30s)
+GRPC_KEEPALIVE_TIME_MS = int(os.environ.get("GRPC_KEEPALIVE_TIME_MS", "60000"))
+GRPC_KEEPALIVE_TIMEOUT_MS = int(os.environ.get("GRPC_KEEPALIVE_TIMEOUT_MS", "20000"))
+# How long idle HTTP connections stay in the pool (httpx default is 5s)
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY_SECONDS", "120"))
+
+
+def grpc_keepalive_options() -> List[Tuple[str, int]]:
+    """Channel options that keep an idle gRPC connection open"""
+    return [
+        ("grpc.keepalive_time_ms", GRPC_KEEPALIVE_TIME_MS),
+        ("grpc.keepalive_timeout_ms", GRPC_KEEPALIVE_TIMEOUT_MS),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        ("grpc.client_idle_timeout_ms", 24 * 60 * 60 * 1000),  # Don't drop to IDLE between calls
+    ]
+
+
+def grpc_transport(transport_cls, **kwargs):
+    """
+    Google API transport whose channel carries the keepalive options.
+
+    Args:
+        transport_cls: A generated *GrpcTransport or *GrpcAsyncIOTransport class.
+
+    Returns:
+        A transport instance to pass as the client's transport argument.
+    """
+    def create_channel(host, **channel_kwargs):
+        options = list(channel_kwargs.pop("options", None) or []) + grpc_keepalive_options()
+        return transport_cls.create_channel(host, options=options, **channel_kwargs)
+    return transport_cls(channel=create_channel, **kwargs)
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=1000, max_keepalive_connections=100, keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS)
+
+
+class _SetupTrace:
+    """httpcore trace callback: time from TCP connect to the first non-connection event (TCP + TLS)"""
+
+    def __init__(self, monitor: "ConnectionMonitor", name: str):
+        self.monitor = monitor
+        self.name = name
+        self.started = None
+
+    def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.started":
+            self.started = time.perf_counter()
+        elif self.started is not None and not event_name.startswith("connection."):
+            self.monitor.record_setup(self.name, time.perf_counter() - self.started)
+            self.started = None
+
+
+class ConnectionMonitor:
+    """Per-dependency connection setup, request and ping timings, plus the keepalive pinger"""
+
+    def __init__(self, interval: float = KEEPALIVE_PING_INTERVAL_SECONDS):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._pings: List[Tuple[str, Callable[[], Any]]] = []
+        self._async_pings: List[Tuple[str, Callable[[], Awaitable[Any]]]] = []
+        self._connecting_since: Dict[int, float] = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._async_tasks: List[asyncio.Task] = []
+
+    # --- Recording ---
+
+    def _entry(self, name: str) -> Dict[str, Any]:
+        entry = self._stats.get(name)
+        if entry is None:
+            entry = self._stats[name] = {
+                "state": None,
+                "setups": 0, "setup_total": 0.0, "setup_max": 0.0, "setup_last": None,
+                "requests": 0, "request_total": 0.0, "request_max": 0.0, "request_last": None,
+                "pings": 0, "ping_failures": 0, "ping_last": None, "last_error": None
+            }
+        return entry
+
+    def record_setup(self, name: str, seconds: float) -> None:
+        """A new connection (TCP/TLS/HTTP2 handshake) took `seconds`"""
+        with self._lock:
+            entry = self._entry(name)
+            entry["setups"] += 1
+            entry["setup_total"] += seconds
+            entry["setup_max"] = max(entry["setup_max"], seconds)
+            entry["setup_last"] = seconds
+        print(f"🔌 {name}: connection set up in {seconds:.3f}s")
+
+    def record_request(self, name: str, seconds: float) -> None:
+        """A request on an open connection took `seconds`"""
+        with self._lock:
+            entry = self._entry(name)
+            entry["requests"] += 1
+            entry["request_total"] += seconds
+            entry["request_max"] = max(entry["request_max"], seconds)
+            entry["request_last"] = seconds
+
+    def _record_ping(self, name: str, seconds: float, error: Exception = None) -> None:
+        with self._lock:
+            entry = self._entry(name)
+            entry["pings"] += 1
+            entry["ping_last"] = seconds
+            if error is not None:
+                entry["ping_failures"] += 1
+                entry["last_error"] = str(error)
+        if error is not None:
+            print(f"⚠️  {name}: keepalive ping failed after {seconds:.3f}s: {error}")
+
+    def _on_channel_state(self, name: str, channel_id: int, state: grpc.ChannelConnectivity) -> None:
+        """Time CONNECTING -> READY transitions as connection setups"""
+        now = time.perf_counter()
+        setup_time = None
+        with self._lock:
+            self._entry(name)["state"] = state.name
+            if state == grpc.ChannelConnectivity.CONNECTING:
+                self._connecting_since.setdefault(channel_id, now)
+            elif state == grpc.ChannelConnectivity.READY:
+                started = self._connecting_since.pop(channel_id, None)
+                setup_time = now - started if started is not None else None
+            else:  # IDLE, TRANSIENT_FAILURE, SHUTDOWN
+                self._connecting_since.pop(channel_id, None)
+        if setup_time is not None:
+            self.record_setup(name, setup_time)
+
+    # --- Registration ---
+
+    def watch_grpc_client(self, name: str, client) -> None:
+        """Track and keep warm the channel of a blocking Google API client"""
+        channel = client.transport.grpc_channel
+        channel.subscribe(lambda state: self._on_channel_state(name, id(channel), state), try_to_connect=False)
+        self._pings.append((name, lambda: grpc.channel_ready_future(channel).result(timeout=WARMUP_TIMEOUT_SECONDS)))
+
+    def watch_grpc_client_async(self, name: str, client) -> None:
+        """Track and keep warm the channel of an asyncio Google API client (call inside the event loop)"""
+        channel = client.transport.grpc_channel
+
+        async def watch_state():
+            state = channel.get_state(try_to_connect=False)
+            while True:
+                self._on_channel_state(name, id(channel), state)
+                await channel.wait_for_state_change(state)
+                state = channel.get_state(try_to_connect=False)
+
+        self._async_tasks.append(asyncio.get_running_loop().create_task(watch_state()))
+        self._async_pings.append((name, lambda: asyncio.wait_for(channel.channel_ready(), WARMUP_TIMEOUT_SECONDS)))
+
+    def http_client(self, name: str, **kwargs) -> httpx.Client:
+        """Blocking HTTP client with long-lived pooled connections and traced connection setup"""
+        def trace_setup(request):
+            request.extensions["trace"] = _SetupTrace(self, name)
+        return httpx.Client(limits=_http_limits(), event_hooks={"request": [trace_setup]}, follow_redirects=True, **kwargs)
+
+    def async_http_client(self, name: str, **kwargs) -> httpx.AsyncClient:
+        """asyncio version of http_client"""
+        async def trace_setup(request):
+            trace = _SetupTrace(self, name)
+
+            async def async_trace(event_name, info):
+                trace(event_name, info)
+            request.extensions["trace"] = async_trace
+        return httpx.AsyncClient(limits=_http_limits(), event_hooks={"request": [trace_setup]}, follow_redirects=True, **kwargs)
+
+    def register_ping(self, name: str, ping: Callable[[], Any]) -> None:
+        """Blocking callable that exercises the dependency's connection (raises on failure)"""
+        self._pings.append((name, ping))
+
+    def register_ping_async(self, name: str, ping: Callable[[], Awaitable[Any]]) -> None:
+        self._async_pings.append((name, ping))
+
+    # --- Warm-up and keepalive ---
+
+    def ping_all(self) -> None:
+        """Run every blocking ping once; the first run opens the connections (warm-up)"""
+        for name, ping in list(self._pings):
+            start = time.perf_counter()
+            try:
+                ping()
+                self._record_ping(name, time.perf_counter() - start)
+            except Exception as e:
+                self._record_ping(name, time.perf_counter() - start, e)
+
+    async def ping_all_async(self) -> None:
+        async def timed(name, ping):
+            start = time.perf_counter()
+            try:
+                await ping()
+                self._record_ping(name, time.perf_counter() - start)
+            except Exception as e:
+                self._record_ping(name, time.perf_counter() - start, e)
+        await asyncio.gather(*(timed(name, ping) for name, ping in list(self._async_pings)))
+
+    def start(self) -> None:
+        """Warm up now and keep pinging from a background thread"""
+        if not CONNECTION_WARMUP_ENABLED or not self._pings or (self._thread and self._thread.is_alive()):
+            return
+        start = time.time()
+        self.ping_all()
+        print(f"🔥 Connections warmed up in {time.time() - start:.2f}s ({', '.join(name for name, _ in self._pings)})")
+
+        def run():
+            while not self._stop.wait(self.interval):
+                self.ping_all()
+        self._thread = threading.Thread(target=run, name="connection-keepalive", daemon=True)
+        self._thread.start()
+
+    async def start_async(self) -> None:
+        """Warm up the asyncio clients now and keep pinging them from a task (call inside the event loop)"""
+        if not CONNECTION_WARMUP_ENABLED or not self._async_pings:
+            return
+        start = time.time()
+        await self.ping_all_async()
+        print(f"🔥 Async connections warmed up in {time.time() - start:.2f}s")
+
+        async def run():
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.ping_all_async()
+        self._async_tasks.append(asyncio.get_running_loop().create_task(run()))
+
+    def stop(self) -> None:
+        self._stop.set()
+        for task in self._async_tasks:
+            task.cancel()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Connection setup time next to request time, per dependency"""
+        with self._lock:
+            report = {}
+            for name, entry in self._stats.items():
+                report[name] = {
+                    "state": entry["state"],
+                    "connection_setups": entry["setups"],
+                    "setup_avg": entry["setup_total"] / entry["setups"] if entry["setups"] else None,
+                    "setup_max": entry["setup_max"],
+                    "setup_last": entry["setup_last"],
+                    "requests": entry["requests"],
+                    "request_avg": entry["request_total"] / entry["requests"] if entry["requests"] else None,
+                    "request_max": entry["request_max"],
+                    "request_last": entry["request_last"],
+                    "pings": entry["pings"],
+                    "ping_failures": entry["ping_failures"],
+                    "ping_last": entry["ping_last"],
+                    "last_error": entry["last_error"]
+                }
+            return report
+
+
+# Global monitor shared by the service modules
+monitor = ConnectionMonitor()
@@ -2,858 +2,540 @@
 """
 Conversation Flow Handler for Ana - AI Contact Center Agent
 Manages state-based conversation flow, validation, and responses
+
+Each application state is a row of FLOW_TABLE: the handler that runs the turn, the validator
+for the caller's answer and the state that follows. Validators and keyword sets are compiled
+once at import.
+
+Responses with user data (the application summary) are str.format templates filled through
+speech_pipeline.fill_template, so TTS can reuse the audio of their fixed parts.
 """
 
 import re
-from typing import Dict, Tuple, Optional, Any
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+import speech_pipeline
 from session_manager import (
-    ConversationState, session_manager, get_current_state, 
+    ConversationState, session_manager, get_current_state,
     update_state, get_retry_count
 )
 
+# --- Keyword sets (whole words / phrases, never substrings: "no" must not match "bueno") ---
+
+def _keyword_regex(words) -> "re.Pattern":
+    """One alternation over the keywords, longest first, anchored on word boundaries"""
+    alternatives = sorted(set(words), key=len, reverse=True)
+    return re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(word) for word in alternatives) + r')(?!\w)')
+
+AFFIRMATIVE_WORDS = [
+    'sí', 'si', 'yes', 'claro', 'correcto', 'exacto', 'afirmativo', 'ok', 'okey', 'okay', 'está bien',
+    'acepto', 'de acuerdo', 'empecemos', 'comencemos', 'vamos', 'dale', 'perfecto',
+    'genial', 'excelente', 'bueno', 'bien', 'seguro', 'por supuesto', 'desde luego',
+    'comenzar', 'empezar', 'iniciar', 'continuar', 'proceder'
+]
+NEGATIVE_WORDS = ['no', 'nop', 'nope', 'negativo', 'incorrecto', 'no acepto']
+# Checked in this order; unemployment first so "sin trabajo" is not read as "trabajo"
+EMPLOYMENT_KEYWORDS = [
+    ('unemployed', ['desempleado', 'desempleada', 'sin trabajo', 'sin empleo', 'desempleo']),
+    ('employed', ['empleado', 'empleada', 'trabajo', 'empleo', 'empresa']),
+    ('self_employed', ['independiente', 'propio', 'propia', 'cuenta propia', 'negocio propio']),
+    ('student', ['estudiante', 'estudio', 'universidad']),
+]
+EMAIL_DICTATION_WORDS = ['arroba', 'punto', 'gmail', 'hotmail', 'yahoo']
+
+_AFFIRMATIVE_RE = _keyword_regex(AFFIRMATIVE_WORDS)
+_NEGATIVE_RE = _keyword_regex(NEGATIVE_WORDS)
+_EMPLOYMENT_RES = [(status, _keyword_regex(words)) for status, words in EMPLOYMENT_KEYWORDS]
+_EMAIL_DICTATION_RE = _keyword_regex(EMAIL_DICTATION_WORDS)
+
+# --- Validators ---
+
+_AGE_RE = re.compile(r'(\d{1,2})')
+_INCOME_RE = re.compile(r'(\d{1,2},?\d{0,3})')
+_DPI_RE = re.compile(r'(\d{13})')
+_PHONE_RE = re.compile(r'(\d{4}[\-\s]?\d{4})')
+_DATE_RES = [
+    re.compile(r'(\d{1,2})\s+de\s+(\w+)\s+de\s+(\d{4})', re.IGNORECASE),
+    re.compile(r'(\d{1,2})[\/\-](\d{1,2})[\/\-](\d{4})'),
+    re.compile(r'(\d{1,2})\s+(\d{1,2})\s+(\d{4})'),
+]
+_EMAIL_RE = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+_VOICE_EMAIL_RES = [
+    # "nombre arroba domain punto com"
+    re.compile(r'(\w+(?:\s+\w+)*)\s+arroba\s+(\w+(?:\s+\w+)*)\s+punto\s+(\w+)'),
+    # "nombre @ domain . com" (partial transcription)
+    re.compile(r'(\w+(?:\s+\w+)*)\s*@\s*(\w+(?:\s+\w+)*)\s*\.\s*(\w+)'),
+    # "nombre en domain punto com"
+    re.compile(r'(\w+(?:\s+\w+)*)\s+en\s+(\w+(?:\s+\w+)*)\s+punto\s+(\w+)'),
+]
+EMAIL_EXTENSION_CORRECTIONS = {'con': 'com'}  # Common STT mistake
+_AMOUNT_WORDS_RE = re.compile(r'\b(quetzales|mil|millón|millones|q)\b')
+_AMOUNT_RES = [
+    re.compile(r'(\d{1,3}(?:[,\.]\d{3})*)'),  # 100,000 or 100.000 or 150.000
+    re.compile(r'(\d+)\s*mil'),                # 50 mil
+    re.compile(r'(\d+\.?\d*)\s*millón'),       # 1.2 millón
+    re.compile(r'(\d+)'),                      # Simple number like 150000
+]
+
+def is_affirmative(text: str) -> bool:
+    """Check if response is affirmative"""
+    return _AFFIRMATIVE_RE.search(text.lower()) is not None
+
+def is_negative(text: str) -> bool:
+    """Check if response is negative"""
+    return _NEGATIVE_RE.search(text.lower()) is not None
+
+def validate_age_response(text: str) -> Tuple[bool, Optional[int]]:
+    """Validate age response"""
+    if is_affirmative(text):
+        return True, None
+
+    # Try to extract specific age
+    age_match = _AGE_RE.search(text)
+    if age_match:
+        age = int(age_match.group(1))
+        if 18 <= age <= 100:
+            return True, age
+
+    return False, None
+
+def validate_income_response(text: str) -> Tuple[bool, Optional[float]]:
+    """Validate income response"""
+    if is_affirmative(text):
+        return True, None
+
+    # Try to extract specific amount
+    amount_match = _INCOME_RE.search(text.replace(',', ''))
+    if amount_match:
+        amount = float(amount_match.group(1).replace(',', ''))
+        if amount >= 3000:
+            return True, amount
+
+    return False, None
+
+def validate_full_name(text: str) -> Tuple[bool, Optional[str]]:
+    """Validate full name"""
+    name = text.strip()
+    if len(name) >= 5 and ' ' in name and all(c.isalpha() or c.isspace() for c in name):
+        return True, name
+    return False, None
+
+def validate_dpi(text: str) -> Tuple[bool, Optional[str]]:
+    """Validate DPI number"""
+    dpi_match = _DPI_RE.search(text.replace(' ', '').replace('-', ''))
+    if dpi_match:
+        return True, dpi_match.group(1)
+    return False, None
+
+def validate_date_of_birth(text: str) -> Tuple[bool, Optional[str]]:
+    """Validate date of birth (day/month/year patterns)"""
+    if any(pattern.search(text) for pattern in _DATE_RES):
+        return True, text.strip()
+    return False, None
+
+def validate_address(text: str) -> Tuple[bool, Optional[str]]:
+    """Validate address (basic length check)"""
+    address = text.strip()
+    return (True, address) if len(address) >= 10 else (False, None)
+
+def validate_phone(text: str) -> Tuple[bool, Optional[str]]:
+    """Validate phone number"""
+    phone_match = _PHONE_RE.search(text.replace(' ', '').replace('-', ''))
+    if phone_match:
+        return True, phone_match.group(1)
+    return False, None
+
+def validate_email(text: str) -> Tuple[bool, Optional[str]]:
+    """Validate email address, including voice transcriptions like "juan arroba gmail punto com" """
+    match = _EMAIL_RE.search(text)
+    if match:
+        return True, match.group(0)
+
+    text_lower = text.lower().strip()
+    for pattern in _VOICE_EMAIL_RES:
+        match = pattern.search(text_lower)
+        if match:
+            name_part, domain_part, extension = (group.replace(' ', '') for group in match.groups())
+            extension = EMAIL_EXTENSION_CORRECTIONS.get(extension, extension)
+            constructed_email = f"{name_part}@{domain_part}.{extension}"
+            if _EMAIL_RE.match(constructed_email):
+                return True, constructed_email
+
+    return False, None
+
+def validate_loan_purpose(text: str) -> Tuple[bool, Optional[str]]:
+    """Validate loan purpose (basic length check)"""
+    purpose = text.strip()
+    return (True, purpose) if len(purpose) >= 5 else (False, None)
+
+def extract_employment_status(text: str) -> Optional[str]:
+    """Extract employment status from text"""
+    text_lower = text.lower()
+    for status, pattern in _EMPLOYMENT_RES:
+        if pattern.search(text_lower):
+            return status
+    return None
+
+def validate_loan_amount(text: str) -> Tuple[bool, Optional[float]]:
+    """Validate loan amount"""
+    print(f"🔢 Validating loan amount: '{text}'")
+    text_lower = text.lower()
+
+    # Remove common words and clean the text
+    clean_text = _AMOUNT_WORDS_RE.sub('', text_lower)
+    print(f"🧹 Cleaned text: '{clean_text}'")
+
+    for i, pattern in enumerate(_AMOUNT_RES):
+        match = pattern.search(clean_text)
+        if match:
+            print(f"🎯 Pattern {i+1} matched: '{match.group(1)}'")
+            try:
+                if 'mil' in text_lower:
+                    amount = float(match.group(1).replace(',', '').replace('.', '')) * 1000
+                    print(f"💰 Interpreted as thousand: {amount}")
+                elif 'millón' in text_lower:
+                    amount = float(match.group(1).replace(',', '')) * 1000000
+                    print(f"💰 Interpreted as million: {amount}")
+                else:
+                    # Handle thousands separator (both comma and dot)
+                    number_str = match.group(1)
+                    print(f"🔍 Processing number string: '{number_str}'")
+                    # If it has 3 digits after separator, treat separator as thousands
+                    if '.' in number_str and len(number_str.split('.')[-1]) == 3:
+                        amount = float(number_str.replace('.', ''))
+                        print(f"💰 Interpreted as thousands (dot): {amount}")
+                    elif ',' in number_str:
+                        amount = float(number_str.replace(',', ''))
+                        print(f"💰 Interpreted as thousands (comma): {amount}")
+                    else:
+                        amount = float(number_str)
+                        print(f"💰 Interpreted as simple number: {amount}")
+
+                print(f"✅ Final amount: {amount}, valid range: {5000 <= amount <= 1200000}")
+                if 5000 <= amount <= 1200000:
+                    return True, amount
+            except Exception as e:
+                print(f"❌ Error parsing amount '{match.group(1)}': {e}")
+                continue
+
+    print(f"❌ No valid amount found in: '{text}'")
+    return False, None
+
+# --- Questions and the state table ---
+
+INITIAL_QUESTIONS = {
+    ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION:
+        "¡Excelente! Para comenzar con tu solicitud de préstamo, necesito hacerte unas preguntas rápidas para verificar tu elegibilidad. ¿Está bien que comencemos?",
+
+    ConversationState.STATE_ASK_MINIMUM_AGE:
+        "Perfecto, comencemos. Primera pregunta: ¿Tienes 18 años o más?",
+
+    ConversationState.STATE_ASK_RESIDENCY:
+        "Entendido. ¿Resides actualmente en Guatemala?",
+
+    ConversationState.STATE_ASK_MINIMUM_INCOME:
+        "Muy bien. ¿Tienes ingresos mensuales de al menos 3,000 quetzales?",
+
+    ConversationState.STATE_ASK_FULL_NAME:
+        "¿Cuál es tu nombre completo?",
+
+    ConversationState.STATE_ASK_DPI:
+        "Gracias. ¿Cuál es tu número de DPI?",
+
+    ConversationState.STATE_ASK_DOB:
+        "Perfecto. ¿Cuál es tu fecha de nacimiento? Por favor dímela en formato día, mes, año.",
+
+    ConversationState.STATE_ASK_ADDRESS:
+        "Muy bien. ¿Cuál es tu dirección completa de residencia?",
+
+    ConversationState.STATE_ASK_PHONE:
+        "Gracias. ¿Cuál es tu número de teléfono?",
+
+    ConversationState.STATE_ASK_EMAIL:
+        "Perfecto. ¿Cuál es tu dirección de correo electrónico?",
+
+    ConversationState.STATE_ASK_EMPLOYMENT_STATUS:
+        "Muy bien. ¿Cuál es tu situación laboral actual? ¿Estás empleado, eres trabajador independiente, estudiante, o desempleado?",
+
+    ConversationState.STATE_ASK_LOAN_AMOUNT:
+        "Perfecto. ¿Qué monto de préstamo necesitas? Recuerda que nuestros préstamos van desde 5,000 hasta 1,200,000 quetzales según el tipo.",
+
+    ConversationState.STATE_ASK_LOAN_PURPOSE:
+        "Entendido. ¿Para qué necesitas este préstamo? Por ejemplo: compra de vivienda, vehículo, gastos personales, negocio, etc.",
+
+    ConversationState.STATE_ASK_CONSENT_DISCLOSURES:
+        "Casi terminamos. Para procesar tu solicitud necesito tu consentimiento para verificar tu información crediticia y contactarte sobre tu aplicación. ¿Aceptas estos términos?"
+}
+
+APPLICATION_SUMMARY_TEMPLATE = """Excelente! Tu solicitud ha sido registrada exitosamente.
+
+Resumen de tu solicitud:
+Número de referencia: {app_data.application_id}
+Solicitante: {app_data.full_name}
+Monto solicitado: {app_data.loan_amount:,.0f} quetzales
+Propósito: {app_data.loan_purpose}
+
+Próximos pasos:
+Primero, nuestro equipo revisará tu solicitud en 24 a 48 horas.
+Segundo, te contactaremos al {app_data.phone} para confirmar detalles.
+Tercero, si es aprobada, coordinaremos la entrega de documentos.
+
+Gracias por confiar en nosotros! Hay algo más en lo que te pueda ayudar hoy?"""
+
+# Templates whose fixed parts are pre-synthesized (tts_module.prewarm_cache)
+SPEECH_TEMPLATES = [APPLICATION_SUMMARY_TEMPLATE]
+
+class FlowStep(NamedTuple):
+    """One row of the state table"""
+    handler: str  # ConversationFlowHandler method: handler(session_id, user_input, step)
+    validator: Optional[Callable[[str], Any]] = None  # Usually returns (is_valid, value)
+    next_state: Optional[ConversationState] = None
+    field: Optional[str] = None  # ApplicationData field that stores the validated value
+    retry_response: Optional[str] = None  # Re-ask after an invalid answer
+    give_up_response: Optional[str] = None  # After max_retries invalid answers
+
+FLOW_TABLE: Dict[ConversationState, FlowStep] = {
+    ConversationState.AWAITING_TRANSITION_RESPONSE: FlowStep(
+        '_handle_transition_response', is_affirmative, ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION),
+    ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION: FlowStep(
+        '_handle_eligibility_permission', is_affirmative, ConversationState.STATE_ASK_MINIMUM_AGE),
+    ConversationState.STATE_ASK_MINIMUM_AGE: FlowStep(
+        '_handle_age_validation', validate_age_response, ConversationState.STATE_ASK_RESIDENCY),
+    ConversationState.STATE_ASK_RESIDENCY: FlowStep(
+        '_handle_residency_validation', is_affirmative, ConversationState.STATE_ASK_MINIMUM_INCOME),
+    ConversationState.STATE_ASK_MINIMUM_INCOME: FlowStep(
+        '_handle_income_validation', validate_income_response, ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT),
+    ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT: FlowStep(
+        '_handle_qualification_result', None, ConversationState.STATE_ASK_FULL_NAME),
+    ConversationState.STATE_ASK_FULL_NAME: FlowStep(
+        '_collect_field', validate_full_name, ConversationState.STATE_ASK_DPI, 'full_name',
+        "Disculpa, necesito tu nombre completo. Por favor proporciona tu nombre y apellidos completos.",
+        "No puedo continuar sin tu nombre completo. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?"),
+    ConversationState.STATE_ASK_DPI: FlowStep(
+        '_collect_field', validate_dpi, ConversationState.STATE_ASK_DOB, 'dpi',
+        "Disculpa, necesito un número de DPI válido. Debe ser un número de 13 dígitos. ¿Podrías repetirlo?",
+        "No puedo continuar sin un DPI válido. Te invito a contactarnos nuevamente con tu DPI. ¿Hay algo más en lo que te pueda ayudar?"),
+    ConversationState.STATE_ASK_DOB: FlowStep(
+        '_collect_field', validate_date_of_birth, ConversationState.STATE_ASK_ADDRESS, 'date_of_birth',
+        "Disculpa, no entendí la fecha. Por favor dime tu fecha de nacimiento en formato día, mes, año. Por ejemplo: 15 de marzo de 1990.",
+        "No puedo continuar sin una fecha de nacimiento válida. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?"),
+    ConversationState.STATE_ASK_ADDRESS: FlowStep(
+        '_collect_field', validate_address, ConversationState.STATE_ASK_PHONE, 'address',
+        "Disculpa, necesito tu dirección completa. Por favor incluye zona, municipio o colonia.",
+        "No puedo continuar sin una dirección completa. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?"),
+    ConversationState.STATE_ASK_PHONE: FlowStep(
+        '_collect_field', validate_phone, ConversationState.STATE_ASK_EMAIL, 'phone',
+        "Disculpa, necesito un número de teléfono válido. Por ejemplo: 5555-1234 o 4455-6789.",
+        "No puedo continuar sin un número de teléfono válido. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?"),
+    ConversationState.STATE_ASK_EMAIL: FlowStep(
+        '_handle_email_validation', validate_email, ConversationState.STATE_ASK_EMPLOYMENT_STATUS, 'email',
+        "Disculpa, necesito un correo electrónico válido. Puedes decir: 'mi correo es nombre ARROBA gmail PUNTO com' o deletrearlo.",
+        "No puedo continuar sin un correo electrónico válido. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?"),
+    ConversationState.STATE_ASK_EMPLOYMENT_STATUS: FlowStep(
+        '_handle_employment_status_validation', extract_employment_status, ConversationState.STATE_ASK_EMPLOYMENT_DETAILS, 'employment_status',
+        "Disculpa, no entendí. ¿Estás empleado, eres trabajador independiente, estudiante, o desempleado?",
+        "No puedo continuar sin conocer tu situación laboral. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?"),
+    ConversationState.STATE_ASK_EMPLOYMENT_DETAILS: FlowStep(
+        '_handle_employment_details', None, ConversationState.STATE_ASK_LOAN_AMOUNT),
+    ConversationState.STATE_ASK_LOAN_AMOUNT: FlowStep(
+        '_collect_field', validate_loan_amount, ConversationState.STATE_ASK_LOAN_PURPOSE, 'loan_amount',
+        "Disculpa, no entendí el monto. Por favor indica una cantidad entre 5,000 y 1,200,000 quetzales. Por ejemplo: '50,000 quetzales' o '50 mil'.",
+        "No puedo continuar sin un monto válido. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?"),
+    ConversationState.STATE_ASK_LOAN_PURPOSE: FlowStep(
+        '_collect_field', validate_loan_purpose, ConversationState.STATE_ASK_CONSENT_DISCLOSURES, 'loan_purpose',
+        "Disculpa, necesito saber para qué necesitas el préstamo. Por ejemplo: compra de casa, auto, negocio, gastos personales, etc.",
+        "No puedo continuar sin conocer el propósito del préstamo. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?"),
+    ConversationState.STATE_ASK_CONSENT_DISCLOSURES: FlowStep(
+        '_handle_consent_validation', is_affirmative, ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY),
+    ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY: FlowStep(
+        '_provide_application_summary', None, ConversationState.GENERAL_CHAT),
+}
+
 class ConversationFlowHandler:
     """Handles conversation flow and state management"""
-    
+
     def __init__(self):
         self.max_retries = 2
-    
+        self._handlers = {state: (getattr(self, step.handler), step) for state, step in FLOW_TABLE.items()}
+
     def process_user_input(self, session_id: str, user_input: str) -> Dict[str, Any]:
         """
         Process user input based on current conversation state
-        
+
         Returns:
             Dict with keys: 'response', 'next_state', 'success', 'data_collected'
         """
-        current_state = get_current_state(session_id)
-        
-        # Handle different states
-        if current_state == ConversationState.AWAITING_TRANSITION_RESPONSE:
-            return self._handle_transition_response(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION:
-            return self._handle_eligibility_permission(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_MINIMUM_AGE:
-            return self._handle_age_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_RESIDENCY:
-            return self._handle_residency_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_MINIMUM_INCOME:
-            return self._handle_income_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT:
-            return self._handle_qualification_result(session_id)
-        elif current_state == ConversationState.STATE_ASK_FULL_NAME:
-            return self._handle_full_name_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_DPI:
-            return self._handle_dpi_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_DOB:
-            return self._handle_dob_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_ADDRESS:
-            return self._handle_address_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_PHONE:
-            return self._handle_phone_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_EMAIL:
-            return self._handle_email_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_EMPLOYMENT_STATUS:
-            return self._handle_employment_status_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_EMPLOYMENT_DETAILS:
-            return self._handle_employment_details(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_LOAN_AMOUNT:
-            return self._handle_loan_amount_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_LOAN_PURPOSE:
-            return self._handle_loan_purpose_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_ASK_CONSENT_DISCLOSURES:
-            return self._handle_consent_validation(session_id, user_input)
-        elif current_state == ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY:
-            return self._provide_application_summary(session_id)
-        else:
-            return {
-                'response': 'Lo siento, hay un error en el sistema. ¿Podrías repetir tu solicitud?',
-                'next_state': ConversationState.GENERAL_CHAT,
-                'success': False,
-                'data_collected': None
-            }
-    
+        entry = self._handlers.get(get_current_state(session_id))
+        if entry is None:
+            return self._result('Lo siento, hay un error en el sistema. ¿Podrías repetir tu solicitud?',
+                                ConversationState.GENERAL_CHAT, False)
+        handler, step = entry
+        return handler(session_id, user_input, step)
+
     def get_initial_question(self, state: ConversationState) -> str:
         """Get the initial question for a given state"""
-        questions = {
-            ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION: 
-                "¡Excelente! Para comenzar con tu solicitud de préstamo, necesito hacerte unas preguntas rápidas para verificar tu elegibilidad. ¿Está bien que comencemos?",
-            
-            ConversationState.STATE_ASK_MINIMUM_AGE:
-                "Perfecto, comencemos. Primera pregunta: ¿Tienes 18 años o más?",
-            
-            ConversationState.STATE_ASK_RESIDENCY:
-                "Entendido. ¿Resides actualmente en Guatemala?",
-            
-            ConversationState.STATE_ASK_MINIMUM_INCOME:
-                "Muy bien. ¿Tienes ingresos mensuales de al menos 3,000 quetzales?",
-            
-            ConversationState.STATE_ASK_FULL_NAME:
-                "¿Cuál es tu nombre completo?",
-            
-            ConversationState.STATE_ASK_DPI:
-                "Gracias. ¿Cuál es tu número de DPI?",
-            
-            ConversationState.STATE_ASK_DOB:
-                "Perfecto. ¿Cuál es tu fecha de nacimiento? Por favor dímela en formato día, mes, año.",
-            
-            ConversationState.STATE_ASK_ADDRESS:
-                "Muy bien. ¿Cuál es tu dirección completa de residencia?",
-            
-            ConversationState.STATE_ASK_PHONE:
-                "Gracias. ¿Cuál es tu número de teléfono?",
-            
-            ConversationState.STATE_ASK_EMAIL:
-                "Perfecto. ¿Cuál es tu dirección de correo electrónico?",
-            
-            ConversationState.STATE_ASK_EMPLOYMENT_STATUS:
-                "Muy bien. ¿Cuál es tu situación laboral actual? ¿Estás empleado, eres trabajador independiente, estudiante, o desempleado?",
-            
-            ConversationState.STATE_ASK_LOAN_AMOUNT:
-                "Perfecto. ¿Qué monto de préstamo necesitas? Recuerda que nuestros préstamos van desde 5,000 hasta 1,200,000 quetzales según el tipo.",
-            
-            ConversationState.STATE_ASK_LOAN_PURPOSE:
-                "Entendido. ¿Para qué necesitas este préstamo? Por ejemplo: compra de vivienda, vehículo, gastos personales, negocio, etc.",
-            
-            ConversationState.STATE_ASK_CONSENT_DISCLOSURES:
-                "Casi terminamos. Para procesar tu solicitud necesito tu consentimiento para verificar tu información crediticia y contactarte sobre tu aplicación. ¿Aceptas estos términos?"
+        return INITIAL_QUESTIONS.get(state, "¿En qué puedo ayudarte?")
+
+    @staticmethod
+    def _result(response: str, next_state: ConversationState, success: bool, data_collected: Optional[Dict[str, Any]] = None,
+                speech_segments: Optional[speech_pipeline.Segments] = None) -> Dict[str, Any]:
+        return {
+            'response': response,
+            'next_state': next_state,
+            'success': success,
+            'data_collected': data_collected,
+            'speech_segments': speech_segments  # Filled template the response was built from, if any
         }
-        
-        return questions.get(state, "¿En qué puedo ayudarte?")
-    
-    def _handle_transition_response(self, session_id: str, user_input: str) -> Dict[str, Any]:
+
+    def _retry_or_give_up(self, session_id: str, step: FlowStep, retry_response: Optional[str] = None) -> Dict[str, Any]:
+        """Invalid answer: re-ask in the same state, or leave the flow after max_retries"""
+        retry_count = session_manager.increment_retry_count(session_id)
+        if retry_count >= self.max_retries:
+            return self._result(step.give_up_response, ConversationState.GENERAL_CHAT, False)
+        return self._result(retry_response or step.retry_response, get_current_state(session_id), False)
+
+    def _collect_field(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
+        """Validate the answer, store it in step.field and ask the next question"""
+        is_valid, value = step.validator(user_input)
+        if not is_valid:
+            return self._retry_or_give_up(session_id, step)
+        session_manager.update_application_data(session_id, step.field, value)
+        return self._result(self.get_initial_question(step.next_state), step.next_state, True, {step.field: value})
+
+    def _handle_transition_response(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
         """Handle response to transition question after FAQ"""
-        if self._is_affirmative(user_input):
+        if step.validator(user_input):
             session_manager.start_application_flow(session_id)
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION),
-                'next_state': ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION,
-                'success': True,
-                'data_collected': None
-            }
-        elif self._is_negative(user_input):
-            return {
-                'response': "Entiendo. ¿Hay algo más en lo que te pueda ayudar hoy?",
-                'next_state': ConversationState.GENERAL_CHAT,
-                'success': True,
-                'data_collected': None
-            }
-        else:
-            # Neither clearly affirmative nor negative - could be another question
-            # Let the main logic handle this as a potential FAQ or other inquiry
-            return {
-                'response': "No entendí tu respuesta. ¿Te gustaría que te ayude a iniciar una solicitud de préstamo? Por favor responde 'sí' o 'no'.",
-                'next_state': ConversationState.AWAITING_TRANSITION_RESPONSE,
-                'success': False,
-                'data_collected': None
-            }
-    
-    def _handle_eligibility_permission(self, session_id: str, user_input: str) -> Dict[str, Any]:
+            return self._result(self.get_initial_question(step.next_state), step.next_state, True)
+        if is_negative(user_input):
+            return self._result("Entiendo. ¿Hay algo más en lo que te pueda ayudar hoy?", ConversationState.GENERAL_CHAT, True)
+        # Neither clearly affirmative nor negative - could be another question
+        return self._result("No entendí tu respuesta. ¿Te gustaría que te ayude a iniciar una solicitud de préstamo? Por favor responde 'sí' o 'no'.",
+                            ConversationState.AWAITING_TRANSITION_RESPONSE, False)
+
+    def _handle_eligibility_permission(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
         """Handle eligibility permission response"""
-        if self._is_affirmative(user_input):
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_MINIMUM_AGE),
-                'next_state': ConversationState.STATE_ASK_MINIMUM_AGE,
-                'success': True,
-                'data_collected': None
-            }
-        else:
-            return {
-                'response': "Entiendo. Si cambias de opinión, estaré aquí para ayudarte. ¿Hay algo más en lo que te pueda ayudar?",
-                'next_state': ConversationState.GENERAL_CHAT,
-                'success': True,
-                'data_collected': None
-            }
-    
-    def _handle_age_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
+        if step.validator(user_input):
+            return self._result(self.get_initial_question(step.next_state), step.next_state, True)
+        return self._result("Entiendo. Si cambias de opinión, estaré aquí para ayudarte. ¿Hay algo más en lo que te pueda ayudar?",
+                            ConversationState.GENERAL_CHAT, True)
+
+    def _handle_age_validation(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
         """Handle age validation"""
-        is_valid, age_data = self._validate_age_response(user_input)
-        
+        is_valid, age_data = step.validator(user_input)
+
         if is_valid:
             session_manager.update_application_data(session_id, 'is_minimum_age', True)
             if age_data:
                 session_manager.update_application_data(session_id, 'age', age_data)
-            
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_RESIDENCY),
-                'next_state': ConversationState.STATE_ASK_RESIDENCY,
-                'success': True,
-                'data_collected': {'age': age_data}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                session_manager.update_application_data(session_id, 'is_minimum_age', False)
-                return {
-                    'response': "Lo siento, pero nuestros préstamos requieren ser mayor de 18 años. Cuando cumplas la edad mínima, estaremos encantados de ayudarte. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, no entendí bien. ¿Podrías confirmar si tienes 18 años o más? Puedes responder 'sí' o 'no'.",
-                    'next_state': ConversationState.STATE_ASK_MINIMUM_AGE,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_residency_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
+            return self._result(self.get_initial_question(step.next_state), step.next_state, True, {'age': age_data})
+
+        retry_count = session_manager.increment_retry_count(session_id)
+        if retry_count >= self.max_retries:
+            session_manager.update_application_data(session_id, 'is_minimum_age', False)
+            return self._result("Lo siento, pero nuestros préstamos requieren ser mayor de 18 años. Cuando cumplas la edad mínima, estaremos encantados de ayudarte. ¿Hay algo más en lo que te pueda ayudar?",
+                                ConversationState.GENERAL_CHAT, False)
+        return self._result("Disculpa, no entendí bien. ¿Podrías confirmar si tienes 18 años o más? Puedes responder 'sí' o 'no'.",
+                            ConversationState.STATE_ASK_MINIMUM_AGE, False)
+
+    def _handle_residency_validation(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
         """Handle residency validation"""
-        if self._is_affirmative(user_input):
+        if step.validator(user_input):
             session_manager.update_application_data(session_id, 'is_guatemalan_resident', True)
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_MINIMUM_INCOME),
-                'next_state': ConversationState.STATE_ASK_MINIMUM_INCOME,
-                'success': True,
-                'data_collected': {'residency': True}
-            }
-        elif self._is_negative(user_input):
+            return self._result(self.get_initial_question(step.next_state), step.next_state, True, {'residency': True})
+        if is_negative(user_input):
             session_manager.update_application_data(session_id, 'is_guatemalan_resident', False)
-            return {
-                'response': "Lo siento, actualmente solo ofrecemos préstamos a residentes de Guatemala. ¿Hay algo más en lo que te pueda ayudar?",
-                'next_state': ConversationState.GENERAL_CHAT,
-                'success': False,
-                'data_collected': None
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin esta información. Te invito a contactarnos nuevamente cuando puedas proporcionar la información requerida. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, no entendí. ¿Resides actualmente en Guatemala? Por favor responde 'sí' o 'no'.",
-                    'next_state': ConversationState.STATE_ASK_RESIDENCY,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_income_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
+            return self._result("Lo siento, actualmente solo ofrecemos préstamos a residentes de Guatemala. ¿Hay algo más en lo que te pueda ayudar?",
+                                ConversationState.GENERAL_CHAT, False)
+
+        retry_count = session_manager.increment_retry_count(session_id)
+        if retry_count >= self.max_retries:
+            return self._result("No puedo continuar sin esta información. Te invito a contactarnos nuevamente cuando puedas proporcionar la información requerida. ¿Hay algo más en lo que te pueda ayudar?",
+                                ConversationState.GENERAL_CHAT, False)
+        return self._result("Disculpa, no entendí. ¿Resides actualmente en Guatemala? Por favor responde 'sí' o 'no'.",
+                            ConversationState.STATE_ASK_RESIDENCY, False)
+
+    def _handle_income_validation(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
         """Handle income validation"""
-        is_valid, income_data = self._validate_income_response(user_input)
-        
+        is_valid, income_data = step.validator(user_input)
+
         if is_valid:
             session_manager.update_application_data(session_id, 'has_minimum_income', True)
             if income_data:
                 session_manager.update_application_data(session_id, 'monthly_income', income_data)
-            
-            return {
-                'response': "Perfecto, cumples con los requisitos básicos.",
-                'next_state': ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT,
-                'success': True,
-                'data_collected': {'income': income_data}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                session_manager.update_application_data(session_id, 'has_minimum_income', False)
-                return {
-                    'response': "Entiendo. Lamentablemente, nuestros préstamos requieren ingresos mínimos de 3,000 quetzales mensuales. Te invitamos a aplicar nuevamente cuando tus ingresos aumenten. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, no entendí. ¿Tienes ingresos mensuales de al menos 3,000 quetzales? Puedes responder 'sí' o 'no'.",
-                    'next_state': ConversationState.STATE_ASK_MINIMUM_INCOME,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_qualification_result(self, session_id: str) -> Dict[str, Any]:
+            return self._result("Perfecto, cumples con los requisitos básicos.", step.next_state, True, {'income': income_data})
+
+        retry_count = session_manager.increment_retry_count(session_id)
+        if retry_count >= self.max_retries:
+            session_manager.update_application_data(session_id, 'has_minimum_income', False)
+            return self._result("Entiendo. Lamentablemente, nuestros préstamos requieren ingresos mínimos de 3,000 quetzales mensuales. Te invitamos a aplicar nuevamente cuando tus ingresos aumenten. ¿Hay algo más en lo que te pueda ayudar?",
+                                ConversationState.GENERAL_CHAT, False)
+        return self._result("Disculpa, no entendí. ¿Tienes ingresos mensuales de al menos 3,000 quetzales? Puedes responder 'sí' o 'no'.",
+                            ConversationState.STATE_ASK_MINIMUM_INCOME, False)
+
+    def _handle_qualification_result(self, session_id: str, user_input: Optional[str] = None, step: Optional[FlowStep] = None) -> Dict[str, Any]:
         """Handle qualification result and proceed to data collection"""
         if session_manager.is_qualified(session_id):
             session_manager.update_application_data(session_id, 'qualified', True)
-            return {
-                'response': "¡Excelente! Calificas para nuestros préstamos. Ahora necesito recopilar algunos datos personales.",
-                'next_state': ConversationState.STATE_ASK_FULL_NAME,
-                'success': True,
-                'data_collected': None
-            }
-        else:
-            return {
-                'response': "Lo siento, no cumples con los requisitos mínimos para nuestros préstamos en este momento. ¿Hay algo más en lo que te pueda ayudar?",
-                'next_state': ConversationState.GENERAL_CHAT,
-                'success': False,
-                'data_collected': None
-            }
-    
-    def _handle_full_name_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
-        """Handle full name validation"""
-        is_valid, name = self._validate_full_name(user_input)
-        
-        if is_valid:
-            session_manager.update_application_data(session_id, 'full_name', name)
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_DPI),
-                'next_state': ConversationState.STATE_ASK_DPI,
-                'success': True,
-                'data_collected': {'full_name': name}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin tu nombre completo. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, necesito tu nombre completo. Por favor proporciona tu nombre y apellidos completos.",
-                    'next_state': ConversationState.STATE_ASK_FULL_NAME,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_dpi_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
-        """Handle DPI validation"""
-        is_valid, dpi = self._validate_dpi(user_input)
-        
-        if is_valid:
-            session_manager.update_application_data(session_id, 'dpi', dpi)
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_DOB),
-                'next_state': ConversationState.STATE_ASK_DOB,
-                'success': True,
-                'data_collected': {'dpi': dpi}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin un DPI válido. Te invito a contactarnos nuevamente con tu DPI. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, necesito un número de DPI válido. Debe ser un número de 13 dígitos. ¿Podrías repetirlo?",
-                    'next_state': ConversationState.STATE_ASK_DPI,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_dob_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
-        """Handle date of birth validation"""
-        is_valid, dob = self._validate_date_of_birth(user_input)
-        
-        if is_valid:
-            session_manager.update_application_data(session_id, 'date_of_birth', dob)
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_ADDRESS),
-                'next_state': ConversationState.STATE_ASK_ADDRESS,
-                'success': True,
-                'data_collected': {'date_of_birth': dob}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin una fecha de nacimiento válida. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, no entendí la fecha. Por favor dime tu fecha de nacimiento en formato día, mes, año. Por ejemplo: 15 de marzo de 1990.",
-                    'next_state': ConversationState.STATE_ASK_DOB,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_address_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
-        """Handle address validation"""
-        if len(user_input.strip()) >= 10:  # Basic validation
-            session_manager.update_application_data(session_id, 'address', user_input.strip())
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_PHONE),
-                'next_state': ConversationState.STATE_ASK_PHONE,
-                'success': True,
-                'data_collected': {'address': user_input.strip()}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin una dirección completa. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, necesito tu dirección completa. Por favor incluye zona, municipio o colonia.",
-                    'next_state': ConversationState.STATE_ASK_ADDRESS,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_phone_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
-        """Handle phone validation"""
-        is_valid, phone = self._validate_phone(user_input)
-        
-        if is_valid:
-            session_manager.update_application_data(session_id, 'phone', phone)
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_EMAIL),
-                'next_state': ConversationState.STATE_ASK_EMAIL,
-                'success': True,
-                'data_collected': {'phone': phone}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin un número de teléfono válido. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, necesito un número de teléfono válido. Por ejemplo: 5555-1234 o 4455-6789.",
-                    'next_state': ConversationState.STATE_ASK_PHONE,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_email_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
+            return self._result("¡Excelente! Calificas para nuestros préstamos. Ahora necesito recopilar algunos datos personales.",
+                                ConversationState.STATE_ASK_FULL_NAME, True)
+        return self._result("Lo siento, no cumples con los requisitos mínimos para nuestros préstamos en este momento. ¿Hay algo más en lo que te pueda ayudar?",
+                            ConversationState.GENERAL_CHAT, False)
+
+    def _handle_email_validation(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
         """Handle email validation"""
-        is_valid, email = self._validate_email(user_input)
-        
+        is_valid, email = step.validator(user_input)
         if is_valid:
-            session_manager.update_application_data(session_id, 'email', email)
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_EMPLOYMENT_STATUS),
-                'next_state': ConversationState.STATE_ASK_EMPLOYMENT_STATUS,
-                'success': True,
-                'data_collected': {'email': email}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin un correo electrónico válido. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                # Check if it looks like a voice transcription attempt
-                if any(word in user_input.lower() for word in ['arroba', 'punto', 'gmail', 'hotmail', 'yahoo']):
-                    return {
-                        'response': "Entiendo que estás dictando tu correo. Intenta decirlo claramente: 'mi correo es juan ARROBA gmail PUNTO com'. O puedes deletrearlo letra por letra.",
-                        'next_state': ConversationState.STATE_ASK_EMAIL,
-                        'success': False,
-                        'data_collected': None
-                    }
-                else:
-                    return {
-                        'response': "Disculpa, necesito un correo electrónico válido. Puedes decir: 'mi correo es nombre ARROBA gmail PUNTO com' o deletrearlo.",
-                        'next_state': ConversationState.STATE_ASK_EMAIL,
-                        'success': False,
-                        'data_collected': None
-                    }
-    
-    def _handle_employment_status_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
+            session_manager.update_application_data(session_id, step.field, email)
+            return self._result(self.get_initial_question(step.next_state), step.next_state, True, {step.field: email})
+
+        # Check if it looks like a voice transcription attempt
+        if _EMAIL_DICTATION_RE.search(user_input.lower()):
+            return self._retry_or_give_up(session_id, step, "Entiendo que estás dictando tu correo. Intenta decirlo claramente: 'mi correo es juan ARROBA gmail PUNTO com'. O puedes deletrearlo letra por letra.")
+        return self._retry_or_give_up(session_id, step)
+
+    def _handle_employment_status_validation(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
         """Handle employment status validation"""
-        employment_status = self._extract_employment_status(user_input)
-        
-        if employment_status:
-            session_manager.update_application_data(session_id, 'employment_status', employment_status)
-            
-            if employment_status in ['employed', 'self_employed']:
-                return {
-                    'response': self._get_employment_details_question(employment_status),
-                    'next_state': ConversationState.STATE_ASK_EMPLOYMENT_DETAILS,
-                    'success': True,
-                    'data_collected': {'employment_status': employment_status}
-                }
-            else:  # unemployed or student
-                return {
-                    'response': "Entiendo. Para continuar necesitarías tener un empleo o ingresos regulares. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin conocer tu situación laboral. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, no entendí. ¿Estás empleado, eres trabajador independiente, estudiante, o desempleado?",
-                    'next_state': ConversationState.STATE_ASK_EMPLOYMENT_STATUS,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_employment_details(self, session_id: str, user_input: str) -> Dict[str, Any]:
+        employment_status = step.validator(user_input)
+        if not employment_status:
+            return self._retry_or_give_up(session_id, step)
+
+        session_manager.update_application_data(session_id, step.field, employment_status)
+        if employment_status in ['employed', 'self_employed']:
+            return self._result(self._get_employment_details_question(employment_status), step.next_state, True,
+                                {'employment_status': employment_status})
+        # unemployed or student
+        return self._result("Entiendo. Para continuar necesitarías tener un empleo o ingresos regulares. ¿Hay algo más en lo que te pueda ayudar?",
+                            ConversationState.GENERAL_CHAT, False)
+
+    def _handle_employment_details(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
         """Handle employment details collection"""
         app_data = session_manager.get_application_data(session_id)
-        
-        if app_data.employment_status == 'employed':
-            session_manager.update_application_data(session_id, 'company_name', user_input.strip())
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_LOAN_AMOUNT),
-                'next_state': ConversationState.STATE_ASK_LOAN_AMOUNT,
-                'success': True,
-                'data_collected': {'company_name': user_input.strip()}
-            }
-        else:  # self_employed
-            session_manager.update_application_data(session_id, 'business_type', user_input.strip())
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_LOAN_AMOUNT),
-                'next_state': ConversationState.STATE_ASK_LOAN_AMOUNT,
-                'success': True,
-                'data_collected': {'business_type': user_input.strip()}
-            }
-    
-    def _handle_loan_amount_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
-        """Handle loan amount validation"""
-        is_valid, amount = self._validate_loan_amount(user_input)
-        
-        if is_valid:
-            session_manager.update_application_data(session_id, 'loan_amount', amount)
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_LOAN_PURPOSE),
-                'next_state': ConversationState.STATE_ASK_LOAN_PURPOSE,
-                'success': True,
-                'data_collected': {'loan_amount': amount}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin un monto válido. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, no entendí el monto. Por favor indica una cantidad entre 5,000 y 1,200,000 quetzales. Por ejemplo: '50,000 quetzales' o '50 mil'.",
-                    'next_state': ConversationState.STATE_ASK_LOAN_AMOUNT,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_loan_purpose_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
-        """Handle loan purpose validation"""
-        if len(user_input.strip()) >= 5:
-            session_manager.update_application_data(session_id, 'loan_purpose', user_input.strip())
-            return {
-                'response': self.get_initial_question(ConversationState.STATE_ASK_CONSENT_DISCLOSURES),
-                'next_state': ConversationState.STATE_ASK_CONSENT_DISCLOSURES,
-                'success': True,
-                'data_collected': {'loan_purpose': user_input.strip()}
-            }
-        else:
-            retry_count = session_manager.increment_retry_count(session_id)
-            if retry_count >= self.max_retries:
-                return {
-                    'response': "No puedo continuar sin conocer el propósito del préstamo. Te invito a contactarnos nuevamente. ¿Hay algo más en lo que te pueda ayudar?",
-                    'next_state': ConversationState.GENERAL_CHAT,
-                    'success': False,
-                    'data_collected': None
-                }
-            else:
-                return {
-                    'response': "Disculpa, necesito saber para qué necesitas el préstamo. Por ejemplo: compra de casa, auto, negocio, gastos personales, etc.",
-                    'next_state': ConversationState.STATE_ASK_LOAN_PURPOSE,
-                    'success': False,
-                    'data_collected': None
-                }
-    
-    def _handle_consent_validation(self, session_id: str, user_input: str) -> Dict[str, Any]:
+        field = 'company_name' if app_data.employment_status == 'employed' else 'business_type'  # else self_employed
+        session_manager.update_application_data(session_id, field, user_input.strip())
+        return self._result(self.get_initial_question(step.next_state), step.next_state, True, {field: user_input.strip()})
+
+    def _handle_consent_validation(self, session_id: str, user_input: str, step: FlowStep) -> Dict[str, Any]:
         """Handle consent validation"""
-        if self._is_affirmative(user_input):
+        if step.validator(user_input):
             session_manager.update_application_data(session_id, 'consent_given', True)
-            return {
-                'response': "¡Perfecto! Procesando tu solicitud...",
-                'next_state': ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY,
-                'success': True,
-                'data_collected': {'consent': True}
-            }
-        else:
-            return {
-                'response': "Entiendo. Sin tu consentimiento no podemos procesar la solicitud. Si cambias de opinión, estaremos aquí para ayudarte. ¿Hay algo más en lo que te pueda ayudar?",
-                'next_state': ConversationState.GENERAL_CHAT,
-                'success': False,
-                'data_collected': None
-            }
-    
-    def _provide_application_summary(self, session_id: str) -> Dict[str, Any]:
+            return self._result("¡Perfecto! Procesando tu solicitud...", step.next_state, True, {'consent': True})
+        return self._result("Entiendo. Sin tu consentimiento no podemos procesar la solicitud. Si cambias de opinión, estaremos aquí para ayudarte. ¿Hay algo más en lo que te pueda ayudar?",
+                            ConversationState.GENERAL_CHAT, False)
+
+    def _provide_application_summary(self, session_id: str, user_input: Optional[str] = None, step: Optional[FlowStep] = None) -> Dict[str, Any]:
         """Provide application summary and next steps"""
         app_data = session_manager.get_application_data(session_id)
-        
-        summary = f"""Excelente! Tu solicitud ha sido registrada exitosamente.
-
-Resumen de tu solicitud:
-Número de referencia: {app_data.application_id}
-Solicitante: {app_data.full_name}
-Monto solicitado: {app_data.loan_amount:,.0f} quetzales
-Propósito: {app_data.loan_purpose}
-
-Próximos pasos:
-Primero, nuestro equipo revisará tu solicitud en 24 a 48 horas.
-Segundo, te contactaremos al {app_data.phone} para confirmar detalles.
-Tercero, si es aprobada, coordinaremos la entrega de documentos.
+        segments = speech_pipeline.fill_template(APPLICATION_SUMMARY_TEMPLATE, app_data=app_data)
+        return self._result(speech_pipeline.template_text(segments), ConversationState.GENERAL_CHAT, True,
+                            {'application_completed': True}, segments)
 
-Gracias por confiar en nosotros! Hay algo más en lo que te pueda ayudar hoy?"""
-        
-        return {
-            'response': summary,
-            'next_state': ConversationState.GENERAL_CHAT,
-            'success': True,
-            'data_collected': {'application_completed': True}
-        }
-    
-    # Validation helper methods
-    def _is_affirmative(self, text: str) -> bool:
-        """Check if response is affirmative"""
-        affirmative_words = [
-            'sí', 'si', 'yes', 'claro', 'correcto', 'exacto', 'afirmativo', 'ok', 'está bien', 
-            'acepto', 'de acuerdo', 'empecemos', 'comencemos', 'vamos', 'dale', 'perfecto',
-            'genial', 'excelente', 'bueno', 'bien', 'seguro', 'por supuesto', 'desde luego',
-            'comenzar', 'empezar', 'iniciar', 'continuar', 'proceder'
-        ]
-        text_lower = text.lower().strip()
-        return any(word in text_lower for word in affirmative_words)
-    
-    def _is_negative(self, text: str) -> bool:
-        """Check if response is negative"""
-        negative_words = ['no', 'nop', 'nope', 'negativo', 'incorrecto', 'no acepto']
-        text_lower = text.lower().strip()
-        return any(word in text_lower for word in negative_words)
-    
-    def _validate_age_response(self, text: str) -> Tuple[bool, Optional[int]]:
-        """Validate age response"""
-        if self._is_affirmative(text):
-            return True, None
-        
-        # Try to extract specific age
-        age_match = re.search(r'(\d{1,2})', text)
-        if age_match:
-            age = int(age_match.group(1))
-            if 18 <= age <= 100:
-                return True, age
-        
-        return False, None
-    
-    def _validate_income_response(self, text: str) -> Tuple[bool, Optional[float]]:
-        """Validate income response"""
-        if self._is_affirmative(text):
-            return True, None
-        
-        # Try to extract specific amount
-        amount_match = re.search(r'(\d{1,2},?\d{0,3})', text.replace(',', ''))
-        if amount_match:
-            try:
-                amount = float(amount_match.group(1).replace(',', ''))
-                if amount >= 3000:
-                    return True, amount
-            except:
-                pass
-        
-        return False, None
-    
-    def _validate_full_name(self, text: str) -> Tuple[bool, Optional[str]]:
-        """Validate full name"""
-        name = text.strip()
-        if len(name) >= 5 and ' ' in name and all(c.isalpha() or c.isspace() for c in name):
-            return True, name
-        return False, None
-    
-    def _validate_dpi(self, text: str) -> Tuple[bool, Optional[str]]:
-        """Validate DPI number"""
-        dpi_match = re.search(r'(\d{13})', text.replace(' ', '').replace('-', ''))
-        if dpi_match:
-            return True, dpi_match.group(1)
-        return False, None
-    
-    def _validate_date_of_birth(self, text: str) -> Tuple[bool, Optional[str]]:
-        """Validate date of birth"""
-        # Simple validation - look for day/month/year patterns
-        date_patterns = [
-            r'(\d{1,2})\s+de\s+(\w+)\s+de\s+(\d{4})',
-            r'(\d{1,2})[\/\-](\d{1,2})[\/\-](\d{4})',
-            r'(\d{1,2})\s+(\d{1,2})\s+(\d{4})'
-        ]
-        
-        for pattern in date_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                return True, text.strip()
-        
-        return False, None
-    
-    def _validate_phone(self, text: str) -> Tuple[bool, Optional[str]]:
-        """Validate phone number"""
-        phone_match = re.search(r'(\d{4}[\-\s]?\d{4})', text.replace(' ', '').replace('-', ''))
-        if phone_match:
-            return True, phone_match.group(1)
-        return False, None
-    
-    def _validate_email(self, text: str) -> Tuple[bool, Optional[str]]:
-        """Validate email address, including voice transcriptions"""
-        
-        # First try standard email pattern
-        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        match = re.search(email_pattern, text)
-        if match:
-            return True, match.group(0)
-        
-        # Handle voice transcriptions like "juan arroba gmail punto com"
-        text_lower = text.lower().strip()
-        
-        # Convert voice patterns to email format
-        voice_patterns = [
-            # Pattern: "nombre arroba domain punto com"
-            r'(\w+(?:\s+\w+)*)\s+arroba\s+(\w+(?:\s+\w+)*)\s+punto\s+(\w+)',
-            # Pattern: "nombre @ domain . com" (partial transcription)  
-            r'(\w+(?:\s+\w+)*)\s*@\s*(\w+(?:\s+\w+)*)\s*\.\s*(\w+)',
-            # Pattern: "nombre en domain punto com"
-            r'(\w+(?:\s+\w+)*)\s+en\s+(\w+(?:\s+\w+)*)\s+punto\s+(\w+)',
-        ]
-        
-        for pattern in voice_patterns:
-            match = re.search(pattern, text_lower)
-            if match:
-                # Extract parts and clean spaces
-                name_part = match.group(1).replace(' ', '')
-                domain_part = match.group(2).replace(' ', '')
-                extension = match.group(3).replace(' ', '')
-                
-                # Common domain corrections
-                domain_corrections = {
-                    'gmail': 'gmail',
-                    'g mail': 'gmail', 
-                    'hotmail': 'hotmail',
-                    'hot mail': 'hotmail',
-                    'yahoo': 'yahoo',
-                    'outlook': 'outlook',
-                    'out look': 'outlook'
-                }
-                
-                domain_clean = domain_corrections.get(domain_part, domain_part)
-                
-                # Extension corrections
-                extension_corrections = {
-                    'com': 'com',
-                    'con': 'com',  # Common STT mistake
-                    'es': 'es',
-                    'net': 'net',
-                    'org': 'org'
-                }
-                
-                extension_clean = extension_corrections.get(extension, extension)
-                
-                # Construct email
-                constructed_email = f"{name_part}@{domain_clean}.{extension_clean}"
-                
-                # Validate the constructed email
-                if re.match(email_pattern, constructed_email):
-                    return True, constructed_email
-        
-        # Try to extract any reasonable email-like pattern
-        # Look for patterns like "nombre domain extension"
-        words = text_lower.split()
-        if len(words) >= 3:
-            # Look for common email keywords
-            email_keywords = ['arroba', '@', 'punto', '.', 'en', 'gmail', 'hotmail', 'yahoo', 'outlook']
-            if any(keyword in text_lower for keyword in email_keywords):
-                # This looks like an email attempt, provide helpful feedback
-                return False, None
-        
-        return False, None
-    
-    def _extract_employment_status(self, text: str) -> Optional[str]:
-        """Extract employment status from text"""
-        text_lower = text.lower()
-        
-        if any(word in text_lower for word in ['empleado', 'trabajo', 'empleo', 'empresa']):
-            return 'employed'
-        elif any(word in text_lower for word in ['independiente', 'propio', 'cuenta propia', 'negocio propio']):
-            return 'self_employed'
-        elif any(word in text_lower for word in ['estudiante', 'estudio', 'universidad']):
-            return 'student'
-        elif any(word in text_lower for word in ['desempleado', 'sin trabajo', 'desempleo']):
-            return 'unemployed'
-        
-        return None
-    
     def _get_employment_details_question(self, employment_status: str) -> str:
         """Get employment details question based on status"""
         if employment_status == 'employed':
             return "Perfecto. ¿En qué empresa trabajas y cuánto tiempo llevas ahí?"
         else:  # self_employed
             return "Excelente. ¿A qué te dedicas? Describe brevemente tu negocio o actividad."
-    
-    def _validate_loan_amount(self, text: str) -> Tuple[bool, Optional[float]]:
-        """Validate loan amount"""
-        print(f"🔢 Validating loan amount: '{text}'")
-        
-        # Remove common words and clean the text
-        clean_text = re.sub(r'\b(quetzales|mil|millón|millones|q)\b', '', text.lower())
-        print(f"🧹 Cleaned text: '{clean_text}'")
-        
-        # Look for numbers - handle both comma and dot as thousands separator
-        amount_patterns = [
-            r'(\d{1,3}(?:[,\.]\d{3})*)',  # 100,000 or 100.000 or 150.000
-            r'(\d+)\s*mil',                # 50 mil
-            r'(\d+\.?\d*)\s*millón',       # 1.2 millón
-            r'(\d+)',                      # Simple number like 150000
-        ]
-        
-        for i, pattern in enumerate(amount_patterns):
-            match = re.search(pattern, clean_text)
-            if match:
-                print(f"🎯 Pattern {i+1} matched: '{match.group(1)}'")
-                try:
-                    if 'mil' in text.lower():
-                        amount = float(match.group(1).replace(',', '').replace('.', '')) * 1000
-                        print(f"💰 Interpreted as thousand: {amount}")
-                    elif 'millón' in text.lower():
-                        amount = float(match.group(1).replace(',', '')) * 1000000
-                        print(f"💰 Interpreted as million: {amount}")
-                    else:
-                        # Handle thousands separator (both comma and dot)
-                        number_str = match.group(1)
-                        print(f"🔍 Processing number string: '{number_str}'")
-                        # If it has 3 digits after separator, treat separator as thousands
-                        if '.' in number_str and len(number_str.split('.')[-1]) == 3:
-                            amount = float(number_str.replace('.', ''))
-                            print(f"💰 Interpreted as thousands (dot): {amount}")
-                        elif ',' in number_str:
-                            amount = float(number_str.replace(',', ''))
-                            print(f"💰 Interpreted as thousands (comma): {amount}")
-                        else:
-                            amount = float(number_str)
-                            print(f"💰 Interpreted as simple number: {amount}")
-                    
-                    print(f"✅ Final amount: {amount}, valid range: {5000 <= amount <= 1200000}")
-                    if 5000 <= amount <= 1200000:
-                        return True, amount
-                except Exception as e:
-                    print(f"❌ Error parsing amount '{match.group(1)}': {e}")
-                    continue
-        
-        print(f"❌ No valid amount found in: '{text}'")
-        return False, None
 
 # Global conversation flow handler
-conversation_flow = ConversationFlowHandler() 
\ No newline at end of file
+conversation_flow = ConversationFlowHandler()
@@ -1,137 +1,318 @@
-import logging
-import json
+# conversation_logger.py
+"""
+Conversation and service logging for Ana - AI Contact Center Agent
+
+Log calls only put the record on a queue; they never block (when the queue is full the record
+is dropped and counted). One writer thread per process drains the queue in batches and writes:
+- every record as a JSON line to logs/ana_events_<date>_<pid>.jsonl
+- for records with a session_id, (file, offset, length) in a SQLite index, so one session's
+  events are read back with an indexed query and a seek per event, whatever the log volume or date
+- console output: service logs (get_logger) from LOG_LEVEL, conversation events from WARNING
+"""
+
 import os
+import sys
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional
+from logging.handlers import QueueHandler
+from typing import Dict, Any, List, Optional
+
+LOG_DIR = os.environ.get("LOG_DIR", "logs")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_INDEX_PATH = os.environ.get("LOG_INDEX_PATH", os.path.join(LOG_DIR, "log_index.db"))
+LOG_BATCH_SIZE = 500
+CONVERSATION_CONSOLE_LEVEL = logging.WARNING
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Enqueue the record as is (formatted by the writer thread); drop it if the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter:
+    """Writer thread behind the queue: JSON lines, the per-session offset index and the console"""
+
+    def __init__(self, log_dir: str = LOG_DIR, index_path: str = LOG_INDEX_PATH):
+        self.log_dir = log_dir
+        self.index_path = index_path
+        os.makedirs(log_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        self.queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.handler = _NonBlockingQueueHandler(self.queue)
+        self.written = 0
+        self._file = None
+        self._file_day = None
+        self._local = threading.local()
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS events (session_id TEXT NOT NULL, file TEXT NOT NULL, "
+                           "offset INTEGER NOT NULL, length INTEGER NOT NULL, created REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS events_session ON events (session_id, created)")
+        connection.commit()
+
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.index_path, timeout=5.0)
+            connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _event_file(self, created: float):
+        """Today's JSON-lines file for this process (one file per process: offsets stay exact)"""
+        day = time.strftime("%Y%m%d", time.localtime(created))
+        if day != self._file_day:
+            if self._file is not None:
+                self._file.close()
+            path = os.path.join(self.log_dir, f"ana_events_{day}_{os.getpid()}.jsonl")
+            self._file = open(path, "ab")
+            self._file_day = day
+        return self._file
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                sys.stderr.write(f"❌ Log writer error: {e}\n")
+
+    def _write(self, batch: List[Any]) -> None:
+        rows, console, flushed = [], [], []
+        for item in batch:
+            if isinstance(item, threading.Event):
+                flushed.append(item)
+                continue
+            record = item
+            message = record.getMessage()
+            event = {
+                "time": datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S"),
+                "ts": record.created,
+                "level": record.levelname,
+                "logger": record.name,
+                "message": message
+            }
+            session_id = getattr(record, "session_id", None)
+            for key in ("session_id", "event", "data"):
+                value = getattr(record, key, None)
+                if value is not None:
+                    event[key] = value
+            if record.exc_info:
+                event["exception"] = logging.Formatter().formatException(record.exc_info)
+
+            line = (json.dumps(event, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+            event_file = self._event_file(record.created)
+            offset = event_file.tell()
+            event_file.write(line)
+            if session_id:
+                rows.append((session_id, event_file.name, offset, len(line), record.created))
+
+            if getattr(record, "event", None) is None:
+                if record.levelno >= logging.WARNING and record.exc_info:
+                    message += "\n" + event["exception"]
+                console.append(message)
+            elif record.levelno >= CONVERSATION_CONSOLE_LEVEL:
+                console.append(f"{event['time']} | {record.levelname} | {message}")
+
+        if self._file is not None:
+            self._file.flush()
+        if rows:
+            connection = self._connection()
+            connection.executemany("INSERT INTO events (session_id, file, offset, length, created) VALUES (?, ?, ?, ?, ?)", rows)
+            connection.commit()
+        if console:
+            sys.stdout.write("\n".join(console) + "\n")
+            sys.stdout.flush()
+        self.written += len(batch) - len(flushed)
+        for event in flushed:
+            event.set()
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """Wait until everything logged so far is written. False on timeout."""
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def read_session(self, session_id: str, since: float = 0.0) -> List[Dict[str, Any]]:
+        """A session's events, oldest first: one indexed query, one seek per event"""
+        rows = self._connection().execute(
+            "SELECT file, offset, length FROM events WHERE session_id = ? AND created >= ? ORDER BY created, rowid",
+            (session_id, since)).fetchall()
+        events, files = [], {}
+        try:
+            for path, offset, length in rows:
+                if path not in files:
+                    files[path] = open(path, "rb")
+                event_file = files[path]
+                event_file.seek(offset)
+                events.append(json.loads(event_file.read(length)))
+        finally:
+            for event_file in files.values():
+                event_file.close()
+        return events
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": self.queue.qsize(), "written": self.written, "dropped": self.handler.dropped,
+                "file": self._file.name if self._file is not None else None}
+
+
+# One writer per process behind every "pbx" logger
+log_writer = LogWriter()
+_root_logger = logging.getLogger("pbx")
+_root_logger.setLevel(LOG_LEVEL)
+_root_logger.addHandler(log_writer.handler)
+_root_logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Leveled, non-blocking logger for a service module (replaces print on hot paths)"""
+    return logging.getLogger(f"pbx.{name}")
+
 
 class ConversationLogger:
     """Logs conversation flow for debugging and analysis"""
-    
-    def __init__(self, log_dir: str = "logs"):
+
+    def __init__(self, log_dir: str = LOG_DIR):
         self.log_dir = log_dir
-        os.makedirs(log_dir, exist_ok=True)
-        
-        # Setup main conversation logger
-        self.logger = logging.getLogger('ana_conversations')
+        self.writer = log_writer
+
+        # Conversation events are always recorded; the console only shows warnings and errors
+        self.logger = logging.getLogger('pbx.conversations')
         self.logger.setLevel(logging.DEBUG)
-        
-        # Remove existing handlers to avoid duplicates
-        self.logger.handlers.clear()
-        
-        # File handler for all conversations
-        log_file = os.path.join(log_dir, f"ana_conversations_{datetime.now().strftime('%Y%m%d')}.log")
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
-        file_handler.setLevel(logging.DEBUG)
-        
-        # Console handler for debugging
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.WARNING)
-        
-        # Formatter
-        formatter = logging.Formatter(
-            '%(asctime)s | %(levelname)s | %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        file_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
-        
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
-        
-        self.logger.info("=== Ana Conversation Logger Initialized ===")
-    
+
+        self._log(logging.INFO, None, "LOGGER_INIT", "=== Ana Conversation Logger Initialized ===")
+
+    def _log(self, level: int, session_id: Optional[str], event: str, message: str, data: Any = None):
+        self.logger.log(level, message, extra={"session_id": session_id, "event": event, "data": data})
+
     def log_conversation_start(self, session_id: str, user_text: str):
         """Log start of conversation turn"""
-        self.logger.info(f"🎬 SESSION_START | {session_id} | USER: '{user_text}'")
-    
+        self._log(logging.INFO, session_id, "SESSION_START", f"🎬 SESSION_START | {session_id} | USER: '{user_text}'")
+
     def log_state_change(self, session_id: str, old_state: str, new_state: str):
         """Log conversation state changes"""
-        self.logger.info(f"🔄 STATE_CHANGE | {session_id} | {old_state} -> {new_state}")
-    
+        self._log(logging.INFO, session_id, "STATE_CHANGE", f"🔄 STATE_CHANGE | {session_id} | {old_state} -> {new_state}",
+                  {"old_state": old_state, "new_state": new_state})
+
     def log_faq_match(self, session_id: str, user_text: str, faq_intent: str, confidence: float = 0.0):
         """Log FAQ matching"""
-        self.logger.info(f"🔍 FAQ_MATCH | {session_id} | '{user_text}' -> {faq_intent} (confidence: {confidence})")
-    
+        self._log(logging.INFO, session_id, "FAQ_MATCH", f"🔍 FAQ_MATCH | {session_id} | '{user_text}' -> {faq_intent} (confidence: {confidence})",
+                  {"intent": faq_intent, "confidence": confidence})
+
     def log_faq_no_match(self, session_id: str, user_text: str):
         """Log when no FAQ matches"""
-        self.logger.info(f"❌ FAQ_NO_MATCH | {session_id} | '{user_text}'")
-    
+        self._log(logging.INFO, session_id, "FAQ_NO_MATCH", f"❌ FAQ_NO_MATCH | {session_id} | '{user_text}'")
+
     def log_ana_response(self, session_id: str, response_type: str, response_text: str):
         """Log Ana's responses"""
         # Truncate very long responses for readability
         display_text = response_text[:100] + "..." if len(response_text) > 100 else response_text
-        self.logger.info(f"🗣️ ANA_RESPONSE | {session_id} | {response_type} | '{display_text}'")
-    
+        self._log(logging.INFO, session_id, "ANA_RESPONSE", f"🗣️ ANA_RESPONSE | {session_id} | {response_type} | '{display_text}'",
+                  {"response_type": response_type})
+
     def log_transition_question(self, session_id: str):
         """Log when transition question is asked"""
-        self.logger.info(f"🔀 TRANSITION_QUESTION | {session_id} | Asked loan application transition")
-    
+        self._log(logging.INFO, session_id, "TRANSITION_QUESTION", f"🔀 TRANSITION_QUESTION | {session_id} | Asked loan application transition")
+
     def log_user_validation(self, session_id: str, field: str, value: str, is_valid: bool, retry_count: int = 0):
         """Log user input validation"""
         status = "VALID" if is_valid else "INVALID"
-        self.logger.info(f"✅ USER_VALIDATION | {session_id} | {field}: '{value}' -> {status} (retry: {retry_count})")
-    
+        self._log(logging.INFO, session_id, "USER_VALIDATION", f"✅ USER_VALIDATION | {session_id} | {field}: '{value}' -> {status} (retry: {retry_count})",
+                  {"field": field, "valid": is_valid, "retry_count": retry_count})
+
     def log_application_progress(self, session_id: str, step: str, data: Dict[str, Any]):
         """Log application flow progress"""
-        self.logger.info(f"📋 APP_PROGRESS | {session_id} | {step} | {json.dumps(data, ensure_ascii=False)}")
-    
+        self._log(logging.INFO, session_id, "APP_PROGRESS", f"📋 APP_PROGRESS | {session_id} | {step} | {json.dumps(data, ensure_ascii=False)}", data)
+
     def log_error(self, session_id: str, error_type: str, error_message: str):
         """Log errors"""
-        self.logger.error(f"❌ ERROR | {session_id} | {error_type} | {error_message}")
-    
+        self._log(logging.ERROR, session_id, "ERROR", f"❌ ERROR | {session_id} | {error_type} | {error_message}", {"error_type": error_type})
+
     def log_llm_fallback(self, session_id: str, user_text: str, llm_response: str):
         """Log when LLM is used as fallback"""
         llm_short = llm_response[:50] + "..." if len(llm_response) > 50 else llm_response
-        self.logger.info(f"🤖 LLM_FALLBACK | {session_id} | USER: '{user_text}' | LLM: '{llm_short}'")
-    
+        self._log(logging.INFO, session_id, "LLM_FALLBACK", f"🤖 LLM_FALLBACK | {session_id} | USER: '{user_text}' | LLM: '{llm_short}'")
+
     def log_session_summary(self, session_id: str, summary_data: Dict[str, Any]):
         """Log session summary"""
-        self.logger.info(f"📊 SESSION_SUMMARY | {session_id} | {json.dumps(summary_data, ensure_ascii=False)}")
-    
+        self._log(logging.INFO, session_id, "SESSION_SUMMARY", f"📊 SESSION_SUMMARY | {session_id} | {json.dumps(summary_data, ensure_ascii=False)}", summary_data)
+
     def log_conversation_end(self, session_id: str, total_time: float, interaction_count: int):
         """Log end of conversation turn"""
-        self.logger.info(f"🏁 SESSION_END | {session_id} | Time: {total_time:.2f}s | Interactions: {interaction_count}")
-    
+        self._log(logging.INFO, session_id, "SESSION_END", f"🏁 SESSION_END | {session_id} | Time: {total_time:.2f}s | Interactions: {interaction_count}",
+                  {"total_time": total_time, "interactions": interaction_count})
+
+    def log_turn_latency(self, session_id: str, time_to_first_audio: Optional[float], total_time: float):
+        """Log time-to-first-audio and total turn time for a request"""
+        first_audio = f"{time_to_first_audio:.3f}s" if time_to_first_audio is not None else "n/a"
+        self._log(logging.INFO, session_id, "TURN_LATENCY", f"⏱️ TURN_LATENCY | {session_id} | First audio: {first_audio} | Total: {total_time:.3f}s",
+                  {"first_audio": time_to_first_audio, "total_time": total_time})
+
     def log_debug(self, session_id: str, message: str, data: Optional[Dict[str, Any]] = None):
         """Log debugging information"""
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
         if data:
-            self.logger.debug(f"🐛 DEBUG | {session_id} | {message} | {json.dumps(data, ensure_ascii=False)}")
+            self._log(logging.DEBUG, session_id, "DEBUG", f"🐛 DEBUG | {session_id} | {message} | {json.dumps(data, ensure_ascii=False)}", data)
         else:
-            self.logger.debug(f"🐛 DEBUG | {session_id} | {message}")
-    
+            self._log(logging.DEBUG, session_id, "DEBUG", f"🐛 DEBUG | {session_id} | {message}")
+
     def get_session_logs(self, session_id: str, last_n_hours: int = 24) -> str:
-        """Extract logs for a specific session"""
+        """Extract logs for a specific session (indexed: cost grows with the session, not the log)"""
         try:
-            log_file = os.path.join(self.log_dir, f"ana_conversations_{datetime.now().strftime('%Y%m%d')}.log")
-            if not os.path.exists(log_file):
-                return f"No log file found for today: {log_file}"
-            
-            session_logs = []
-            with open(log_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if session_id in line:
-                        session_logs.append(line.strip())
-            
-            if session_logs:
-                return "\n".join(session_logs)
+            self.writer.flush()
+            events = self.writer.read_session(session_id, since=time.time() - last_n_hours * 3600)
+            if events:
+                return "\n".join(f"{event['time']} | {event['level']} | {event['message']}" for event in events)
             else:
                 return f"No logs found for session: {session_id}"
-                
+
         except Exception as e:
             return f"Error reading logs: {e}"
-    
+
     def create_conversation_debug_file(self, session_id: str) -> str:
         """Create a dedicated debug file for a specific session"""
         try:
             debug_file = os.path.join(self.log_dir, f"debug_session_{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
             session_logs = self.get_session_logs(session_id)
-            
+
             with open(debug_file, 'w', encoding='utf-8') as f:
                 f.write(f"=== DEBUG LOG FOR SESSION: {session_id} ===\n")
                 f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
                 f.write("=" * 60 + "\n\n")
                 f.write(session_logs)
-            
+
             return debug_file
         except Exception as e:
             self.log_error(session_id, "DEBUG_FILE_CREATION", str(e))
@@ -177,6 +358,9 @@ def log_session_summary(session_id: str, summary_data: Dict[str, Any]):
 def log_conversation_end(session_id: str, total_time: float, interaction_count: int):
     conversation_logger.log_conversation_end(session_id, total_time, interaction_count)
 
+def log_turn_latency(session_id: str, time_to_first_audio: Optional[float], total_time: float):
+    conversation_logger.log_turn_latency(session_id, time_to_first_audio, total_time)
+
 def get_session_logs(session_id: str) -> str:
     return conversation_logger.get_session_logs(session_id)
 
@@ -184,4 +368,7 @@ def create_debug_file(session_id: str) -> str:
     return conversation_logger.create_conversation_debug_file(session_id)
 
 def log_debug(session_id: str, message: str, data: Optional[Dict[str, Any]] = None):
-    conversation_logger.log_debug(session_id, message, data) 
\ No newline at end of file
+    conversation_logger.log_debug(session_id, message, data)
+
+def get_log_stats() -> Dict[str, Any]:
+    return log_writer.stats()
@@ -0,0 +1,231 @@
+# faq_benchmark.py
+"""
+Regression and throughput check for the compiled FAQ matcher (faq_knowledge_base.find_faq_intent)
+against the original per-phrase scan, kept here verbatim as the reference.
+
+Replays a corpus of caller transcripts and compares, for every utterance, the chosen intent
+and every intent score (exact float equality), then times both implementations.
+
+Usage:
+    python faq_benchmark.py                              # built-in corpus
+    python faq_benchmark.py --corpus transcripts.txt     # one transcript per line (or JSON lines with user_message)
+    python faq_benchmark.py --from-supabase --limit 5000 # user messages from conversation_history
+    python faq_benchmark.py --semantic                   # also FAQ-hit vs LLM-fallback rate, keyword vs hybrid
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+import faq_semantic
+from faq_knowledge_base import FAQ_DATABASE, find_faq_intent, normalize_faq_text, faq_matcher
+
+# Utterances that callers actually say outside the FAQ (greetings, application answers, small talk)
+NON_FAQ_UTTERANCES = [
+    "hola", "buenos días", "sí", "no", "gracias", "muchas gracias", "ok está bien",
+    "me llamo María Fernanda López", "tengo 34 años", "trabajo en una maquila", "soy comerciante",
+    "gano como cuatro mil quetzales al mes", "vivo en Mixco", "mi DPI es 2456 78901 0101",
+    "quiero aplicar", "quiero solicitar un préstamo", "cuéntame un chiste", "no entendí, repite por favor",
+    "¿con quién hablo?", "estoy manejando, llámeme más tarde", "aló, ¿me escucha?", "eh... este...", "",
+]
+
+# How callers wrap a question around a trigger phrase
+WRAPPERS = [
+    "{}", "¿{}?", "oiga, {}", "disculpe, ¿{}?", "mire, quisiera saber {}", "dime {} por favor",
+    "y {} porque necesito pagar la escuela", "buenas tardes, ¿{}? es que no sé",
+]
+
+# Paraphrases no trigger phrase covers word for word, with the intent a human would pick
+PARAPHRASES = [
+    ("¿qué clase de financiamiento manejan?", "faq_loan_types"),
+    ("¿prestan para negocio o solo personal?", "faq_loan_types"),
+    ("¿qué tan caro sale el préstamo en intereses?", "faq_interest_rates"),
+    ("¿cuánto me cobran de más al mes?", "faq_interest_rates"),
+    ("¿hasta cuánto dinero me pueden dar?", "faq_loan_amounts_max"),
+    ("¿cuál es lo más que prestan?", "faq_loan_amounts_max"),
+    ("¿me prestan aunque sea poquito, como quinientos?", "faq_loan_amounts_min"),
+    ("¿en cuántos días me depositan?", "faq_application_time"),
+    ("¿se tardan mucho en darme respuesta?", "faq_application_time"),
+    ("¿ustedes son legales o es estafa?", "faq_company_registration"),
+    ("¿cómo sé que son confiables?", "faq_company_registration"),
+    ("¿qué papeles tengo que llevar?", "faq_requirements"),
+    ("¿piden fiador o constancia de ingresos?", "faq_requirements"),
+    ("¿en cuánto tiempo lo tengo que devolver?", "faq_payment_terms"),
+    ("¿puedo pagar en cuotas quincenales?", "faq_payment_terms"),
+]
+
+
+def reference_scores(user_text):
+    """The original find_faq_intent scoring loop (prints removed), returning (best faq_data, scores)"""
+    if not user_text:
+        return None, {}
+    user_text_lower = user_text.lower()
+    clean_text = re.sub(r'[¿?¡!.,;:]', ' ', user_text_lower)
+    clean_text = re.sub(r'\b(me|puedes|podrías|quisiera|quiero|necesito|dime|explica|explícame|péntame|contame|háblame)\b', ' ', clean_text)
+    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+
+    best_match = None
+    highest_score = 0
+    scores = {}
+    for faq_key, faq_data in FAQ_DATABASE.items():
+        score = 0
+        for phrase in faq_data["trigger_phrases"]:
+            phrase_lower = phrase.lower()
+            if phrase_lower in clean_text:
+                score += 15
+            else:
+                phrase_words = phrase_lower.split()
+                matched_words = sum(1 for word in phrase_words if word in clean_text)
+                if matched_words > 0:
+                    score += (matched_words / len(phrase_words)) * 8
+        if score > 0:
+            scores[faq_key] = score
+        if score > highest_score and score >= 8:
+            highest_score = score
+            best_match = faq_data
+    return best_match, scores
+
+
+def compiled_scores(user_text):
+    if not user_text:
+        return None, {}
+    clean_text = normalize_faq_text(user_text)
+    return faq_matcher.match(clean_text)[0], faq_matcher.score(clean_text)
+
+
+def builtin_corpus():
+    corpus = list(NON_FAQ_UTTERANCES)
+    for faq_data in FAQ_DATABASE.values():
+        for phrase in faq_data["trigger_phrases"]:
+            corpus.extend(wrapper.format(phrase) for wrapper in WRAPPERS)
+            words = phrase.split()
+            corpus.append(" ".join(words[:max(1, len(words) // 2)]))  # Caller trails off mid-question
+    return corpus
+
+
+def load_corpus_file(path):
+    corpus = []
+    with open(path, encoding="utf-8") as corpus_file:
+        for line in corpus_file:
+            line = line.rstrip("\n")
+            if line.startswith("{"):
+                line = json.loads(line).get("user_message") or ""
+            corpus.append(line)
+    return corpus
+
+
+def load_supabase_corpus(limit):
+    from dotenv import load_dotenv
+    from supabase import create_client
+    load_dotenv()
+    url = os.environ["SUPABASE_URL"]
+    key = os.environ.get("SUPABASE_SERVICE_KEY", os.environ.get("SUPABASE_API_KEY"))
+    response = create_client(url, key).table("conversation_history").select("user_message").limit(limit).execute()
+    return [row["user_message"] or "" for row in response.data]
+
+
+def compare(corpus):
+    """Returns the utterances where intent choice or any score differs"""
+    mismatches = []
+    for user_text in corpus:
+        expected_match, expected_scores = reference_scores(user_text)
+        actual_match, actual_scores = compiled_scores(user_text)
+        if expected_match is not actual_match or expected_scores != actual_scores:
+            mismatches.append({
+                "text": user_text,
+                "expected": expected_match and expected_match["intent_name"],
+                "actual": actual_match and actual_match["intent_name"],
+                "expected_scores": expected_scores,
+                "actual_scores": actual_scores
+            })
+    return mismatches
+
+
+def throughput(match, corpus, min_seconds):
+    """Utterances per second, repeating the corpus for at least min_seconds"""
+    count = 0
+    start = time.perf_counter()
+    while True:
+        for user_text in corpus:
+            match(user_text)
+        count += len(corpus)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return count / elapsed
+
+
+def semantic_report(corpus):
+    """FAQ-hit vs LLM-fallback rate with keyword matching only (before) and hybrid matching (after)"""
+    if faq_semantic.initialize_semantic_faq(FAQ_DATABASE) is None:
+        print("⚠️  Semantic index unavailable, skipping the hybrid comparison")
+        return
+    for name, texts in (("corpus", corpus), ("paraphrases", [text for text, _ in PARAPHRASES])):
+        keyword_hits = hybrid_hits = 0
+        for user_text in texts:
+            if not user_text:
+                continue
+            clean_text = normalize_faq_text(user_text)
+            scores = faq_matcher.score(clean_text)
+            keyword_hits += faq_matcher.best(scores)[0] is not None
+            hybrid_hits += faq_matcher.best(scores, faq_semantic.semantic_index.similarities(user_text))[0] is not None
+        print(f"🧭 {name:11}: FAQ hit {keyword_hits / len(texts):6.1%} -> {hybrid_hits / len(texts):6.1%} | "
+              f"LLM fallback {1 - keyword_hits / len(texts):6.1%} -> {1 - hybrid_hits / len(texts):6.1%}")
+
+    correct = 0
+    for user_text, expected in PARAPHRASES:
+        scores = faq_matcher.score(normalize_faq_text(user_text))
+        match = faq_matcher.best(scores, faq_semantic.semantic_index.similarities(user_text))[0]
+        correct += match is not None and match["intent_name"] == expected
+    print(f"🧭 paraphrase intent accuracy (hybrid): {correct}/{len(PARAPHRASES)}, "
+          f"{faq_semantic.semantic_index.stats()['avg_latency'] * 1000:.1f}ms per embedding")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiled FAQ matcher vs the original scan: regression and throughput")
+    parser.add_argument("--corpus", help="Transcript file: one utterance per line, or JSON lines with user_message")
+    parser.add_argument("--from-supabase", action="store_true", help="Replay user messages from conversation_history")
+    parser.add_argument("--limit", type=int, default=5000, help="Rows to fetch with --from-supabase")
+    parser.add_argument("--semantic", action="store_true", help="Compare FAQ-hit/LLM-fallback rates, keyword vs hybrid")
+    parser.add_argument("--seconds", type=float, default=2.0, help="Minimum timing duration per implementation")
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = load_corpus_file(args.corpus)
+    elif args.from_supabase:
+        corpus = load_supabase_corpus(args.limit)
+    else:
+        corpus = builtin_corpus()
+
+    faq_hits = sum(1 for user_text in corpus if reference_scores(user_text)[0] is not None)
+    print(f"📚 {len(corpus)} utterances, {faq_hits} FAQ hits, {len(faq_matcher.phrases)} trigger phrases "
+          f"in {len(FAQ_DATABASE)} intents, {len(faq_matcher.automaton.goto)} automaton states")
+
+    mismatches = compare(corpus)
+    for mismatch in mismatches[:10]:
+        print(f"❌ '{mismatch['text']}': {mismatch['expected']} -> {mismatch['actual']}\n"
+              f"   expected {mismatch['expected_scores']}\n   actual   {mismatch['actual_scores']}")
+    print(f"{'✅' if not mismatches else '❌'} {len(corpus) - len(mismatches)}/{len(corpus)} identical intents and scores")
+
+    reference_rate = throughput(lambda text: reference_scores(text)[0], corpus, args.seconds)
+    compiled_rate = throughput(lambda text: text and faq_matcher.match(normalize_faq_text(text))[0], corpus, args.seconds)
+    print(f"⏱️  reference scan:   {reference_rate:10.0f} utterances/s ({1e6 / reference_rate:7.1f}µs each)")
+    print(f"⏱️  compiled matcher: {compiled_rate:10.0f} utterances/s ({1e6 / compiled_rate:7.1f}µs each)"
+          f"  x{compiled_rate / reference_rate:.1f}")
+
+    # find_faq_intent as the turn planner calls it, logging included
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        served_rate = throughput(find_faq_intent, corpus, args.seconds)
+    print(f"⏱️  find_faq_intent:  {served_rate:10.0f} utterances/s (with logging)")
+
+    if args.semantic:
+        semantic_report(corpus)
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
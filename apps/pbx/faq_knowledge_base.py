@@ -5,8 +5,15 @@ Contains structured FAQ data with intents, trigger phrases, and Spanish answers
 """
 
 import re
+import threading
 from typing import Dict, List, Tuple, Optional
 
+import faq_semantic
+import tracing
+import conversation_logger
+
+log = conversation_logger.get_logger("faq")
+
 # Company trust snippet to be used contextually
 COMPANY_TRUST_SNIPPET = """
 Somos una empresa con más de 7 años de experiencia en el sector financiero guatemalteco, 
@@ -244,9 +251,164 @@ Puedes pagar anticipadamente sin penalización.""",
     }
 }
 
+# Text normalization applied to every utterance before matching
+_PUNCTUATION_RE = re.compile(r'[¿?¡!.,;:]')
+_FILLER_WORDS_RE = re.compile(r'\b(me|puedes|podrías|quisiera|quiero|necesito|dime|explica|explícame|péntame|contame|háblame)\b')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+EXACT_PHRASE_SCORE = 15
+PARTIAL_PHRASE_SCORE = 8
+MIN_INTENT_SCORE = 8
+
+
+def normalize_faq_text(user_text: str) -> str:
+    """Lowercase, strip punctuation and filler words, collapse whitespace."""
+    clean_text = _PUNCTUATION_RE.sub(' ', user_text.lower())
+    clean_text = _FILLER_WORDS_RE.sub(' ', clean_text)
+    return _WHITESPACE_RE.sub(' ', clean_text).strip()
+
+
+class _AhoCorasick:
+    """Multi-pattern substring search: one pass over the text finds every pattern it contains."""
+
+    def __init__(self, patterns: List[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Tuple[int, ...]] = [()]
+
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next_state
+            self.output[state] += (pattern_id,)
+
+        # Breadth-first failure links; each state also reports the patterns of its failure chain
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def find(self, text: str) -> set:
+        """Ids of the patterns that occur anywhere in text."""
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        visited = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] and state not in visited:
+                visited.add(state)
+                found.update(output[state])
+        return found
+
+
+class FaqMatcher:
+    """
+    FAQ intent matcher compiled once from FAQ_DATABASE.
+
+    Scores are the same as the original per-phrase scan: +15 for every trigger phrase
+    contained in the cleaned text, otherwise (contained phrase words / phrase words) * 8.
+    Containment is substring based, so a single Aho-Corasick pass over the text finds
+    every phrase and phrase word present; an inverted index then limits scoring to the
+    phrases that were actually hit.
+    """
+
+    def __init__(self, database: Dict[str, Dict]):
+        self.intents: List[Tuple[str, Dict]] = list(database.items())
+        self.intents_by_key: Dict[str, Dict] = dict(database)
+        pattern_ids: Dict[str, int] = {}
+        self.phrases: List[Tuple[int, int, Tuple[int, ...]]] = []  # (intent index, phrase pattern, word patterns)
+        self.index: Dict[int, List[int]] = {}  # pattern -> phrases that contain it as phrase or word
+
+        for intent_index, (_, faq_data) in enumerate(self.intents):
+            for phrase in faq_data["trigger_phrases"]:
+                phrase_lower = phrase.lower()
+                phrase_id = pattern_ids.setdefault(phrase_lower, len(pattern_ids))
+                word_ids = tuple(pattern_ids.setdefault(word, len(pattern_ids)) for word in phrase_lower.split())
+                phrase_index = len(self.phrases)
+                self.phrases.append((intent_index, phrase_id, word_ids))
+                for pattern_id in {phrase_id, *word_ids}:
+                    self.index.setdefault(pattern_id, []).append(phrase_index)
+
+        self.automaton = _AhoCorasick(list(pattern_ids))
+
+    def score(self, clean_text: str) -> Dict[str, float]:
+        """
+        Score every intent against already normalized text.
+
+        Returns:
+            Dict[str, float]: Intent key -> score, only for intents with a positive score
+        """
+        found = self.automaton.find(clean_text)
+        hit_phrases = sorted({phrase_index for pattern_id in found for phrase_index in self.index[pattern_id]})
+
+        # Phrases are numbered in database order, so scores accumulate in the same order as the original scan
+        scores: Dict[int, float] = {}
+        for phrase_index in hit_phrases:
+            intent_index, phrase_id, word_ids = self.phrases[phrase_index]
+            if phrase_id in found:
+                scores[intent_index] = scores.get(intent_index, 0) + EXACT_PHRASE_SCORE
+            else:
+                matched_words = sum(1 for word_id in word_ids if word_id in found)
+                scores[intent_index] = scores.get(intent_index, 0) + (matched_words / len(word_ids)) * PARTIAL_PHRASE_SCORE
+        return {self.intents[intent_index][0]: score for intent_index, score in sorted(scores.items())}
+
+    def match(self, clean_text: str) -> Tuple[Optional[Dict], float]:
+        """Best intent for normalized text (first in database order on ties) and its score."""
+        return self.best(self.score(clean_text))
+
+    def best(self, scores: Dict[str, float], similarities: Optional[Dict[str, float]] = None) -> Tuple[Optional[Dict], float]:
+        """
+        Pick the intent from keyword scores, optionally combined with semantic similarities.
+
+        Without similarities an intent needs MIN_INTENT_SCORE keyword points. With them, an intent
+        also qualifies on similarity alone (FAQ_SEMANTIC_THRESHOLD) and qualifying intents are
+        ranked by keyword score + FAQ_SEMANTIC_WEIGHT * similarity.
+        """
+        best_match = None
+        highest_score = 0
+        for faq_key, faq_data in self.intents:
+            score = scores.get(faq_key, 0)
+            if similarities is not None:
+                similarity = similarities.get(faq_key, 0.0)
+                if score < MIN_INTENT_SCORE and similarity < faq_semantic.FAQ_SEMANTIC_THRESHOLD:
+                    continue
+                score += faq_semantic.FAQ_SEMANTIC_WEIGHT * max(similarity, 0.0)
+            elif score < MIN_INTENT_SCORE:
+                continue
+            if score > highest_score:
+                highest_score = score
+                best_match = faq_data
+        return best_match, highest_score
+
+
+faq_matcher = FaqMatcher(FAQ_DATABASE)
+
+
+# FAQ hit rate of keyword matching alone vs the hybrid (keyword + semantic) decision actually used.
+# A miss falls through to the LLM fallback (or a clarification while awaiting a transition answer).
+faq_stats = {"lookups": 0, "keyword_hits": 0, "hybrid_hits": 0, "semantic_rescues": 0, "semantic_changed": 0}
+_faq_stats_lock = threading.Lock()  # Updated from Flask request threads and the ASGI worker threads
+
+
 def find_faq_intent(user_text: str) -> Optional[Dict]:
     """
-    Find matching FAQ intent based on user input using improved keyword matching.
+    Find matching FAQ intent based on user input: compiled keyword matcher, combined with
+    embedding similarity when the semantic index is initialized.
     
     Args:
         user_text (str): User's transcribed text in Spanish
@@ -257,52 +419,49 @@ def find_faq_intent(user_text: str) -> Optional[Dict]:
     if not user_text:
         return None
     
-    user_text_lower = user_text.lower()
-    
-    # Remove common question words and punctuation for better matching
-    clean_text = re.sub(r'[¿?¡!.,;:]', ' ', user_text_lower)
-    clean_text = re.sub(r'\b(me|puedes|podrías|quisiera|quiero|necesito|dime|explica|explícame|péntame|contame|háblame)\b', ' ', clean_text)
-    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-    
-    print(f"🔍 Searching FAQ for: '{user_text}' -> cleaned: '{clean_text}'")
-    
-    best_match = None
-    highest_score = 0
-    
-    for faq_key, faq_data in FAQ_DATABASE.items():
-        score = 0
-        trigger_phrases = faq_data["trigger_phrases"]
-        
-        for phrase in trigger_phrases:
-            phrase_lower = phrase.lower()
-            
-            # Exact phrase match gets highest score
-            if phrase_lower in clean_text:
-                score += 15
-                print(f"  ✅ Exact match: '{phrase_lower}' in '{clean_text}' -> score: {score}")
-            else:
-                # Word-by-word matching for partial matches
-                phrase_words = phrase_lower.split()
-                matched_words = sum(1 for word in phrase_words if word in clean_text)
-                if matched_words > 0:
-                    partial_score = (matched_words / len(phrase_words)) * 8
-                    score += partial_score
-                    print(f"  🔸 Partial match: {matched_words}/{len(phrase_words)} words from '{phrase_lower}' -> +{partial_score:.1f}")
-        
-        if score > 0:
-            print(f"  📊 {faq_key}: {score:.1f} points")
-        
-        if score > highest_score and score >= 8:  # Lower threshold for better matching
-            highest_score = score
-            best_match = faq_data
+    with tracing.span("faq_match") as stage:
+        clean_text = normalize_faq_text(user_text)
+        keyword_scores = faq_matcher.score(clean_text)
+        keyword_match, keyword_score = faq_matcher.best(keyword_scores)
+        best_match, highest_score = keyword_match, keyword_score
+
+        if faq_semantic.semantic_index is not None:
+            try:
+                similarities = faq_semantic.semantic_index.similarities(user_text)
+                best_match, highest_score = faq_matcher.best(keyword_scores, similarities)
+            except Exception as e:
+                log.warning(f"⚠️  Semantic FAQ scoring failed, using keyword match: {e}")
+        stage.attributes["matched"] = best_match is not None
+
+    with _faq_stats_lock:
+        faq_stats["lookups"] += 1
+        faq_stats["keyword_hits"] += keyword_match is not None
+        faq_stats["hybrid_hits"] += best_match is not None
+        faq_stats["semantic_rescues"] += keyword_match is None and best_match is not None
+        faq_stats["semantic_changed"] += keyword_match is not None and best_match is not keyword_match
     
     if best_match:
-        print(f"🎯 Best match: {best_match['intent_name']} with score {highest_score:.1f}")
+        source = "keyword" if best_match is keyword_match else "semantic"
+        log.info(f"🎯 FAQ match for '{clean_text}': {best_match['intent_name']} with score {highest_score:.1f} ({source})")
     else:
-        print(f"❌ No FAQ match found for: '{user_text}'")
+        log.info(f"❌ No FAQ match found for: '{user_text}'")
     
     return best_match
 
+
+def get_faq_stats() -> Dict:
+    """FAQ hit vs LLM-fallback rates with keyword matching only (before) and with the hybrid matcher (after)"""
+    with _faq_stats_lock:
+        stats = dict(faq_stats, semantic_enabled=faq_semantic.semantic_index is not None)
+    lookups = stats["lookups"]
+    for kind in ("keyword", "hybrid"):
+        hit_rate = stats[f"{kind}_hits"] / lookups if lookups else None
+        stats[f"{kind}_faq_hit_rate"] = hit_rate
+        stats[f"{kind}_fallback_rate"] = 1 - hit_rate if lookups else None
+    if faq_semantic.semantic_index is not None:
+        stats["semantic_index"] = faq_semantic.semantic_index.stats()
+    return stats
+
 def get_faq_response(faq_data: Dict) -> str:
     """
     Generate complete FAQ response including company trust snippet if needed.
@@ -0,0 +1,160 @@
+# faq_semantic.py
+"""
+Semantic FAQ retrieval for Ana - AI Contact Center Agent
+Embeds every trigger phrase in the FAQ database with a small CPU sentence-embedding model,
+keeps the normalized matrix on disk, and scores an utterance against all phrases with one
+matrix-vector product. faq_knowledge_base combines these similarities with the keyword score.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import importlib.util
+from typing import Callable, Dict, List, Optional
+
+FAQ_SEMANTIC_ENABLED = os.environ.get("FAQ_SEMANTIC_ENABLED", "true").lower() == "true"
+# Multilingual MiniLM: ~120MB, a few milliseconds per utterance on CPU
+FAQ_EMBEDDING_MODEL = os.environ.get("FAQ_EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+FAQ_EMBEDDINGS_PATH = os.environ.get("FAQ_EMBEDDINGS_PATH", os.path.join("cache", "faq_embeddings.npy"))
+# Cosine similarity that accepts an intent on its own, and how much similarity weighs against keyword points
+FAQ_SEMANTIC_THRESHOLD = float(os.environ.get("FAQ_SEMANTIC_THRESHOLD", "0.65"))
+FAQ_SEMANTIC_WEIGHT = float(os.environ.get("FAQ_SEMANTIC_WEIGHT", "20"))
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Imported in initialize_semantic_faq(): it pulls in torch, which would slow down importing this module
+SENTENCE_TRANSFORMERS_AVAILABLE = importlib.util.find_spec("sentence_transformers") is not None
+
+# Global model and index, None until initialize_semantic_faq() succeeds (keyword matching only)
+embedding_model = None
+semantic_index = None
+
+
+def embed(texts: List[str]) -> Optional["np.ndarray"]:
+    """Unit-length embeddings of texts with the loaded model, or None if no model is loaded"""
+    if embedding_model is None:
+        return None
+    vectors = np.asarray(embedding_model.encode(texts, show_progress_bar=False), dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class SemanticFaqIndex:
+    """Trigger phrase embeddings for every intent, grouped by intent in database order"""
+
+    def __init__(self, database: Dict[str, Dict], encode: Callable[[List[str]], "np.ndarray"],
+                 model_name: str, path: str):
+        """
+        Args:
+            database: FAQ_DATABASE-shaped dict of intents with trigger_phrases.
+            encode: Callable mapping a list of texts to a 2D array of embeddings.
+            model_name: Identifies the encoder; a stored matrix from another model is rebuilt.
+            path: .npy file for the phrase matrix (a .json sidecar records what it was built from).
+        """
+        self.encode = encode
+        self.intent_keys: List[str] = []
+        phrases: List[str] = []
+        row_starts: List[int] = []
+        for faq_key, faq_data in database.items():
+            if not faq_data["trigger_phrases"]:
+                continue
+            self.intent_keys.append(faq_key)
+            row_starts.append(len(phrases))
+            phrases.extend(phrase.lower() for phrase in faq_data["trigger_phrases"])
+        self.row_starts = np.array(row_starts)
+        self.matrix = self._load_or_build(phrases, model_name, path)
+
+        self.queries = 0
+        self.total_latency = 0.0
+        self._lock = threading.Lock()
+
+    def _normalized(self, texts: List[str]) -> "np.ndarray":
+        vectors = np.asarray(self.encode(texts), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _load_or_build(self, phrases: List[str], model_name: str, path: str) -> "np.ndarray":
+        fingerprint = hashlib.sha256(json.dumps([model_name, phrases], ensure_ascii=False).encode('utf-8')).hexdigest()
+        meta_path = os.path.splitext(path)[0] + ".json"
+        try:
+            with open(meta_path, encoding="utf-8") as meta_file:
+                if json.load(meta_file).get("fingerprint") == fingerprint:
+                    matrix = np.load(path, mmap_mode="r")
+                    print(f"✅ Loaded {matrix.shape[0]} FAQ phrase embeddings from {path}")
+                    return matrix
+        except (OSError, ValueError):
+            pass
+
+        start = time.time()
+        matrix = self._normalized(phrases)
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            np.save(path, matrix)
+            with open(meta_path, "w", encoding="utf-8") as meta_file:
+                json.dump({"fingerprint": fingerprint, "model": model_name, "phrases": len(phrases)}, meta_file)
+        except OSError as e:
+            print(f"⚠️  Could not store FAQ embeddings at {path}: {e}")
+        print(f"✅ Embedded {len(phrases)} FAQ phrases with {model_name} in {time.time() - start:.2f}s")
+        return matrix
+
+    def similarities(self, text: str) -> Dict[str, float]:
+        """
+        Cosine similarity of text to each intent (its closest trigger phrase).
+
+        Returns:
+            Dict[str, float]: Intent key -> similarity in [-1, 1]
+        """
+        start = time.time()
+        query = self._normalized([text.lower()])[0]
+        per_phrase = self.matrix @ query
+        per_intent = np.maximum.reduceat(per_phrase, self.row_starts)
+        with self._lock:
+            self.queries += 1
+            self.total_latency += time.time() - start
+        return dict(zip(self.intent_keys, per_intent.tolist()))
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            queries, total_latency = self.queries, self.total_latency
+        return {
+            "phrases": int(self.matrix.shape[0]),
+            "intents": len(self.intent_keys),
+            "queries": queries,
+            "avg_latency": total_latency / queries if queries else None
+        }
+
+
+def initialize_semantic_faq(database: Dict[str, Dict], model_name: str = FAQ_EMBEDDING_MODEL,
+                            path: str = FAQ_EMBEDDINGS_PATH) -> Optional[SemanticFaqIndex]:
+    """
+    Load the embedding model and the phrase matrix (built and stored on first run).
+
+    Args:
+        database: The FAQ database to index.
+        model_name: sentence-transformers model name or local path.
+        path: Where the phrase matrix is stored.
+
+    Returns:
+        The index, or None when disabled or unavailable (FAQ matching stays keyword only).
+    """
+    global embedding_model, semantic_index
+    if not FAQ_SEMANTIC_ENABLED:
+        print("ℹ️  Semantic FAQ matching disabled (FAQ_SEMANTIC_ENABLED=false)")
+        return None
+    if not (NUMPY_AVAILABLE and SENTENCE_TRANSFORMERS_AVAILABLE):
+        print("⚠️  sentence-transformers not available, FAQ matching is keyword only. "
+              "Install with: pip install sentence-transformers")
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+        embedding_model = SentenceTransformer(model_name, device="cpu")
+        semantic_index = SemanticFaqIndex(database, embed, model_name, path)
+    except Exception as e:
+        print(f"❌ Error initializing semantic FAQ matching: {e}")
+        embedding_model = semantic_index = None
+    return semantic_index
@@ -0,0 +1,501 @@
+# flow_benchmark.py
+"""
+Correctness and CPU check for conversation_flow: the compiled validators and table dispatcher
+against the original validators, kept here verbatim as the reference.
+
+- Recorded utterances: every validator runs on the corpus; differences from the reference are
+  listed (the intended ones are word-boundary keyword matches, e.g. "no" inside "bueno").
+- Properties: seeded random inputs (dictated DPIs, phones, amounts, emails, keywords inside
+  longer words) must validate as expected.
+- Scripted calls run end to end through process_user_input on an in-memory session store.
+- CPU: per-utterance validator time and per-turn dispatch time (time.process_time).
+
+Usage:
+    python flow_benchmark.py
+    python flow_benchmark.py --cases 5000 --repeat 200
+"""
+
+import io
+import re
+import sys
+import time
+import random
+import argparse
+import contextlib
+from typing import Tuple, Optional
+
+import session_store
+import session_manager
+import conversation_flow
+from session_manager import ConversationState
+from conversation_flow import FLOW_TABLE, conversation_flow as flow
+
+# Answers callers give, by the question they answer
+RECORDED_UTTERANCES = {
+    "yes_no": [
+        "sí", "si claro", "sí, por favor", "ok", "okey", "está bien", "bueno pues sí", "dale", "de acuerdo",
+        "no", "no gracias", "nop", "no, ahorita no", "bueno, no sé", "tengo una pregunta", "sino después",
+        "mi nombre es Juan", "¿cuánto cobran?", "casi", "este... no estoy seguro", "afirmativo", "por supuesto que sí",
+        "no acepto", "ahora no puedo", "ninguna", "vamos a ver", "nomás quería preguntar", "sinceramente sí",
+    ],
+    "age": ["sí", "tengo 25 años", "25", "17", "no", "tengo diecinueve", "mayor de edad", "cumplí 18 el mes pasado", "99 años"],
+    "income": ["sí", "gano 5000", "como 2500 al mes", "4,500 quetzales", "no", "más o menos", "gano 12000 quetzales mensuales"],
+    "full_name": ["María Fernanda López", "Juan", "José Pérez 2", "Ana Lucía de León", "  Carlos   Méndez  "],
+    "dpi": ["2456 78901 0101", "2456-78901-0101", "mi dpi es 2456789010101", "123", "dos cuatro cinco seis"],
+    "dob": ["15 de marzo de 1990", "15/03/1990", "15-3-1990", "15 3 1990", "marzo del noventa", "1990"],
+    "address": ["zona 10, ciudad de Guatemala", "Mixco", "5a avenida 3-20 zona 1, Guatemala"],
+    "phone": ["5555-1234", "5555 1234", "mi número es 44556789", "123", "cinco cinco"],
+    "email": [
+        "juan@gmail.com", "juan arroba gmail punto com", "maria lopez arroba hotmail punto con",
+        "pedro en yahoo punto es", "mi correo es ana @ outlook . com", "no tengo correo", "arroba", "gmail",
+    ],
+    "employment": [
+        "soy empleado", "trabajo en una empresa", "tengo negocio propio", "soy independiente", "estudiante",
+        "estoy desempleado", "sin trabajo", "desempleada", "trabajo por cuenta propia", "ama de casa", "estudio y trabajo",
+    ],
+    "loan_amount": [
+        "50,000 quetzales", "50 mil", "150.000", "150000", "1 millón", "5000", "4000", "dos mil", "Q25,000", "1.200.000",
+    ],
+}
+
+# Scripted calls: (answers in order, expected final state, expected application fields)
+SCRIPTED_CALLS = [
+    (["sí", "sí", "tengo 30 años", "sí", "gano 8000", "", "María Fernanda López", "2456 78901 0101",
+      "15 de marzo de 1990", "5a avenida 3-20 zona 1, Guatemala", "5555-1234", "maria arroba gmail punto com",
+      "soy empleado", "Banco Industrial, 3 años", "50 mil", "compra de vehículo", "sí acepto", ""],
+     ConversationState.GENERAL_CHAT,
+     {"full_name": "María Fernanda López", "dpi": "2456789010101", "phone": "55551234", "email": "maria@gmail.com",
+      "employment_status": "employed", "loan_amount": 50000.0, "consent_given": True, "qualified": True}),
+    (["sí", "bueno", "17", "tengo 16"], ConversationState.GENERAL_CHAT, {"is_minimum_age": False}),
+    (["sí", "sí", "sí", "no"], ConversationState.GENERAL_CHAT, {"is_guatemalan_resident": False}),
+    (["sí", "sí", "sí", "sí", "sí", "", "Juan Pérez", "123", "2456789010101"], ConversationState.STATE_ASK_DOB,
+     {"dpi": "2456789010101"}),
+]
+
+
+class Reference:
+    """The original ConversationFlowHandler validators (verbatim)"""
+
+    def _is_affirmative(self, text: str) -> bool:
+        """Check if response is affirmative"""
+        affirmative_words = [
+            'sí', 'si', 'yes', 'claro', 'correcto', 'exacto', 'afirmativo', 'ok', 'está bien', 
+            'acepto', 'de acuerdo', 'empecemos', 'comencemos', 'vamos', 'dale', 'perfecto',
+            'genial', 'excelente', 'bueno', 'bien', 'seguro', 'por supuesto', 'desde luego',
+            'comenzar', 'empezar', 'iniciar', 'continuar', 'proceder'
+        ]
+        text_lower = text.lower().strip()
+        return any(word in text_lower for word in affirmative_words)
+    
+    def _is_negative(self, text: str) -> bool:
+        """Check if response is negative"""
+        negative_words = ['no', 'nop', 'nope', 'negativo', 'incorrecto', 'no acepto']
+        text_lower = text.lower().strip()
+        return any(word in text_lower for word in negative_words)
+    
+    def _validate_age_response(self, text: str) -> Tuple[bool, Optional[int]]:
+        """Validate age response"""
+        if self._is_affirmative(text):
+            return True, None
+        
+        # Try to extract specific age
+        age_match = re.search(r'(\d{1,2})', text)
+        if age_match:
+            age = int(age_match.group(1))
+            if 18 <= age <= 100:
+                return True, age
+        
+        return False, None
+    
+    def _validate_income_response(self, text: str) -> Tuple[bool, Optional[float]]:
+        """Validate income response"""
+        if self._is_affirmative(text):
+            return True, None
+        
+        # Try to extract specific amount
+        amount_match = re.search(r'(\d{1,2},?\d{0,3})', text.replace(',', ''))
+        if amount_match:
+            try:
+                amount = float(amount_match.group(1).replace(',', ''))
+                if amount >= 3000:
+                    return True, amount
+            except:
+                pass
+        
+        return False, None
+    
+    def _validate_full_name(self, text: str) -> Tuple[bool, Optional[str]]:
+        """Validate full name"""
+        name = text.strip()
+        if len(name) >= 5 and ' ' in name and all(c.isalpha() or c.isspace() for c in name):
+            return True, name
+        return False, None
+    
+    def _validate_dpi(self, text: str) -> Tuple[bool, Optional[str]]:
+        """Validate DPI number"""
+        dpi_match = re.search(r'(\d{13})', text.replace(' ', '').replace('-', ''))
+        if dpi_match:
+            return True, dpi_match.group(1)
+        return False, None
+    
+    def _validate_date_of_birth(self, text: str) -> Tuple[bool, Optional[str]]:
+        """Validate date of birth"""
+        # Simple validation - look for day/month/year patterns
+        date_patterns = [
+            r'(\d{1,2})\s+de\s+(\w+)\s+de\s+(\d{4})',
+            r'(\d{1,2})[\/\-](\d{1,2})[\/\-](\d{4})',
+            r'(\d{1,2})\s+(\d{1,2})\s+(\d{4})'
+        ]
+        
+        for pattern in date_patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                return True, text.strip()
+        
+        return False, None
+    
+    def _validate_phone(self, text: str) -> Tuple[bool, Optional[str]]:
+        """Validate phone number"""
+        phone_match = re.search(r'(\d{4}[\-\s]?\d{4})', text.replace(' ', '').replace('-', ''))
+        if phone_match:
+            return True, phone_match.group(1)
+        return False, None
+    
+    def _validate_email(self, text: str) -> Tuple[bool, Optional[str]]:
+        """Validate email address, including voice transcriptions"""
+        
+        # First try standard email pattern
+        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+        match = re.search(email_pattern, text)
+        if match:
+            return True, match.group(0)
+        
+        # Handle voice transcriptions like "juan arroba gmail punto com"
+        text_lower = text.lower().strip()
+        
+        # Convert voice patterns to email format
+        voice_patterns = [
+            # Pattern: "nombre arroba domain punto com"
+            r'(\w+(?:\s+\w+)*)\s+arroba\s+(\w+(?:\s+\w+)*)\s+punto\s+(\w+)',
+            # Pattern: "nombre @ domain . com" (partial transcription)  
+            r'(\w+(?:\s+\w+)*)\s*@\s*(\w+(?:\s+\w+)*)\s*\.\s*(\w+)',
+            # Pattern: "nombre en domain punto com"
+            r'(\w+(?:\s+\w+)*)\s+en\s+(\w+(?:\s+\w+)*)\s+punto\s+(\w+)',
+        ]
+        
+        for pattern in voice_patterns:
+            match = re.search(pattern, text_lower)
+            if match:
+                # Extract parts and clean spaces
+                name_part = match.group(1).replace(' ', '')
+                domain_part = match.group(2).replace(' ', '')
+                extension = match.group(3).replace(' ', '')
+                
+                # Common domain corrections
+                domain_corrections = {
+                    'gmail': 'gmail',
+                    'g mail': 'gmail', 
+                    'hotmail': 'hotmail',
+                    'hot mail': 'hotmail',
+                    'yahoo': 'yahoo',
+                    'outlook': 'outlook',
+                    'out look': 'outlook'
+                }
+                
+                domain_clean = domain_corrections.get(domain_part, domain_part)
+                
+                # Extension corrections
+                extension_corrections = {
+                    'com': 'com',
+                    'con': 'com',  # Common STT mistake
+                    'es': 'es',
+                    'net': 'net',
+                    'org': 'org'
+                }
+                
+                extension_clean = extension_corrections.get(extension, extension)
+                
+                # Construct email
+                constructed_email = f"{name_part}@{domain_clean}.{extension_clean}"
+                
+                # Validate the constructed email
+                if re.match(email_pattern, constructed_email):
+                    return True, constructed_email
+        
+        # Try to extract any reasonable email-like pattern
+        # Look for patterns like "nombre domain extension"
+        words = text_lower.split()
+        if len(words) >= 3:
+            # Look for common email keywords
+            email_keywords = ['arroba', '@', 'punto', '.', 'en', 'gmail', 'hotmail', 'yahoo', 'outlook']
+            if any(keyword in text_lower for keyword in email_keywords):
+                # This looks like an email attempt, provide helpful feedback
+                return False, None
+        
+        return False, None
+    
+    def _extract_employment_status(self, text: str) -> Optional[str]:
+        """Extract employment status from text"""
+        text_lower = text.lower()
+        
+        if any(word in text_lower for word in ['empleado', 'trabajo', 'empleo', 'empresa']):
+            return 'employed'
+        elif any(word in text_lower for word in ['independiente', 'propio', 'cuenta propia', 'negocio propio']):
+            return 'self_employed'
+        elif any(word in text_lower for word in ['estudiante', 'estudio', 'universidad']):
+            return 'student'
+        elif any(word in text_lower for word in ['desempleado', 'sin trabajo', 'desempleo']):
+            return 'unemployed'
+        
+        return None
+    
+    def _get_employment_details_question(self, employment_status: str) -> str:
+        """Get employment details question based on status"""
+        if employment_status == 'employed':
+            return "Perfecto. ¿En qué empresa trabajas y cuánto tiempo llevas ahí?"
+        else:  # self_employed
+            return "Excelente. ¿A qué te dedicas? Describe brevemente tu negocio o actividad."
+    
+    def _validate_loan_amount(self, text: str) -> Tuple[bool, Optional[float]]:
+        """Validate loan amount"""
+        print(f"🔢 Validating loan amount: '{text}'")
+        
+        # Remove common words and clean the text
+        clean_text = re.sub(r'\b(quetzales|mil|millón|millones|q)\b', '', text.lower())
+        print(f"🧹 Cleaned text: '{clean_text}'")
+        
+        # Look for numbers - handle both comma and dot as thousands separator
+        amount_patterns = [
+            r'(\d{1,3}(?:[,\.]\d{3})*)',  # 100,000 or 100.000 or 150.000
+            r'(\d+)\s*mil',                # 50 mil
+            r'(\d+\.?\d*)\s*millón',       # 1.2 millón
+            r'(\d+)',                      # Simple number like 150000
+        ]
+        
+        for i, pattern in enumerate(amount_patterns):
+            match = re.search(pattern, clean_text)
+            if match:
+                print(f"🎯 Pattern {i+1} matched: '{match.group(1)}'")
+                try:
+                    if 'mil' in text.lower():
+                        amount = float(match.group(1).replace(',', '').replace('.', '')) * 1000
+                        print(f"💰 Interpreted as thousand: {amount}")
+                    elif 'millón' in text.lower():
+                        amount = float(match.group(1).replace(',', '')) * 1000000
+                        print(f"💰 Interpreted as million: {amount}")
+                    else:
+                        # Handle thousands separator (both comma and dot)
+                        number_str = match.group(1)
+                        print(f"🔍 Processing number string: '{number_str}'")
+                        # If it has 3 digits after separator, treat separator as thousands
+                        if '.' in number_str and len(number_str.split('.')[-1]) == 3:
+                            amount = float(number_str.replace('.', ''))
+                            print(f"💰 Interpreted as thousands (dot): {amount}")
+                        elif ',' in number_str:
+                            amount = float(number_str.replace(',', ''))
+                            print(f"💰 Interpreted as thousands (comma): {amount}")
+                        else:
+                            amount = float(number_str)
+                            print(f"💰 Interpreted as simple number: {amount}")
+                    
+                    print(f"✅ Final amount: {amount}, valid range: {5000 <= amount <= 1200000}")
+                    if 5000 <= amount <= 1200000:
+                        return True, amount
+                except Exception as e:
+                    print(f"❌ Error parsing amount '{match.group(1)}': {e}")
+                    continue
+        
+        print(f"❌ No valid amount found in: '{text}'")
+        return False, None
+
+REFERENCE_VALIDATORS = {
+    "is_affirmative": Reference()._is_affirmative,
+    "is_negative": Reference()._is_negative,
+    "validate_age_response": Reference()._validate_age_response,
+    "validate_income_response": Reference()._validate_income_response,
+    "validate_full_name": Reference()._validate_full_name,
+    "validate_dpi": Reference()._validate_dpi,
+    "validate_date_of_birth": Reference()._validate_date_of_birth,
+    "validate_phone": Reference()._validate_phone,
+    "validate_email": Reference()._validate_email,
+    "extract_employment_status": Reference()._extract_employment_status,
+    "validate_loan_amount": Reference()._validate_loan_amount,
+}
+
+
+def all_utterances():
+    return [text for texts in RECORDED_UTTERANCES.values() for text in texts]
+
+
+def compare_with_reference():
+    """Run every validator on every recorded utterance. Returns (checks, differences)."""
+    checks, differences = 0, []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, reference in REFERENCE_VALIDATORS.items():
+            compiled = getattr(conversation_flow, name)
+            for text in all_utterances():
+                checks += 1
+                expected, actual = reference(text), compiled(text)
+                if expected != actual:
+                    differences.append((name, text, expected, actual))
+    return checks, differences
+
+
+def _spaced(digits: str, rng: random.Random) -> str:
+    """Digits as a caller dictates them: random groups joined by spaces or dashes"""
+    parts, i = [], 0
+    while i < len(digits):
+        size = rng.randint(1, 5)
+        parts.append(digits[i:i + size])
+        i += size
+    return rng.choice([" ", "-", ""]).join(parts)
+
+
+def check_properties(cases: int, seed: int = 7):
+    """Seeded random properties. Returns (checks, failures)."""
+    rng = random.Random(seed)
+    failures, checks = [], 0
+
+    def check(name, condition, example):
+        nonlocal checks
+        checks += 1
+        if not condition:
+            failures.append((name, example))
+
+    fillers = ["", "pues ", "mire, ", "eh... ", "claro que "]
+    containing_no = ["bueno", "nombre", "tengo", "ninguno", "noventa", "normal", "nosotros", "ahorita", "cono"]
+    containing_si = ["casi", "sino", "sigo", "necesito", "mismo", "visita", "asistente", "positivo"]
+    quiet = io.StringIO()
+    for _ in range(cases):
+        dpi = "".join(rng.choice("0123456789") for _ in range(13))
+        text = f"{rng.choice(fillers)}mi dpi es {_spaced(dpi, rng)}"
+        check("dictated DPI validates", conversation_flow.validate_dpi(text) == (True, dpi), text)
+
+        phone = "".join(rng.choice("0123456789") for _ in range(8))
+        text = f"{rng.choice(fillers)}{phone[:4]}{rng.choice(['-', ' ', ''])}{phone[4:]}"
+        check("dictated phone validates", conversation_flow.validate_phone(text) == (True, phone), text)
+
+        amount = rng.randint(5, 1200) * 1000
+        text = f"{amount:,} quetzales"
+        with contextlib.redirect_stdout(quiet):
+            result = conversation_flow.validate_loan_amount(text)
+        check("amount in range validates", result == (True, float(amount)), text)
+        small = rng.randint(1, 4999)
+        with contextlib.redirect_stdout(quiet):
+            result = conversation_flow.validate_loan_amount(f"{small} quetzales")
+        check("amount below range is rejected", result == (False, None), small)
+
+        name = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+        domain = rng.choice(["gmail", "hotmail", "yahoo", "outlook"])
+        text = f"{name} arroba {domain} punto {rng.choice(['com', 'con'])}"
+        check("dictated email validates", conversation_flow.validate_email(text) == (True, f"{name}@{domain}.com"), text)
+
+        words = rng.sample(containing_no, 2) + rng.sample(containing_si, 1)
+        rng.shuffle(words)
+        text = " ".join(words)
+        check("keywords never match inside words", not conversation_flow.is_negative(text), text)
+
+        word = rng.choice(conversation_flow.AFFIRMATIVE_WORDS)
+        text = f"{rng.choice(fillers)}{word}{rng.choice(['', ',', '.', '!'])} {rng.choice(['gracias', 'por favor', ''])}"
+        check("affirmative in a sentence is detected", conversation_flow.is_affirmative(text), text)
+        text = f"{rng.choice(fillers)}no{rng.choice(['', ',', '.'])} {rng.choice(['gracias', 'por ahora', ''])}"
+        check("negative in a sentence is detected", conversation_flow.is_negative(text), text)
+    return checks, failures
+
+
+def run_scripted_calls():
+    """Drive the dispatcher through whole calls on a fresh in-memory store. Returns failures."""
+    manager = session_manager.session_manager
+    original_store = manager.store
+    manager.store = session_store.MemorySessionStore()
+    failures = []
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for index, (answers, final_state, expected_fields) in enumerate(SCRIPTED_CALLS):
+                session_id = f"scripted-{index}"
+                manager.update_session_state(session_id, ConversationState.AWAITING_TRANSITION_RESPONSE)
+                for answer in answers:
+                    result = flow.process_user_input(session_id, answer)
+                    manager.update_session_state(session_id, result['next_state'])
+                    if result['next_state'] == ConversationState.GENERAL_CHAT:
+                        break
+                session = manager.get_session(session_id)
+                if session.current_state != final_state:
+                    failures.append((session_id, "final state", final_state, session.current_state))
+                for field, value in expected_fields.items():
+                    if getattr(session.application_data, field) != value:
+                        failures.append((session_id, field, value, getattr(session.application_data, field)))
+    finally:
+        manager.store = original_store
+    return failures
+
+
+def time_validators(repeat: int):
+    """Microseconds per utterance, reference vs compiled, over every validator"""
+    texts = all_utterances()
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for label, resolve in (("reference", REFERENCE_VALIDATORS.get), ("compiled", lambda name: getattr(conversation_flow, name))):
+            validators = [resolve(name) for name in REFERENCE_VALIDATORS]
+            re.purge()  # The reference compiled its patterns through the re module cache
+            start = time.process_time()
+            for _ in range(repeat):
+                for validator in validators:
+                    for text in texts:
+                        validator(text)
+            timings[label] = (time.process_time() - start) / (repeat * len(validators) * len(texts)) * 1e6
+    return timings
+
+
+def time_dispatch(repeat: int) -> float:
+    """Microseconds per process_user_input turn (session store included), over every table state"""
+    manager = session_manager.session_manager
+    original_store = manager.store
+    manager.store = session_store.MemorySessionStore()
+    turns = [(state, text) for state in FLOW_TABLE
+             if state not in (ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY,)
+             for text in RECORDED_UTTERANCES["yes_no"][:5]]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.process_time()
+            for _ in range(repeat):
+                for state, text in turns:
+                    manager.update_session_state("bench", state)
+                    flow.process_user_input("bench", text)
+            elapsed = time.process_time() - start
+    finally:
+        manager.store = original_store
+    return elapsed / (repeat * len(turns)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation flow validators: correctness and CPU per turn")
+    parser.add_argument("--cases", type=int, default=1000, help="Random cases per property")
+    parser.add_argument("--repeat", type=int, default=50, help="Timing repetitions")
+    args = parser.parse_args()
+
+    checks, differences = compare_with_reference()
+    print(f"🔁 Reference comparison: {checks} validator calls, {len(differences)} differences")
+    for name, text, expected, actual in differences:
+        print(f"   {name}({text!r}): reference {expected} -> now {actual}")
+
+    checks, failures = check_properties(args.cases)
+    print(f"🎲 Properties: {checks} checks, {len(failures)} failures")
+    for name, example in failures[:20]:
+        print(f"   ❌ {name}: {example!r}")
+
+    call_failures = run_scripted_calls()
+    print(f"📞 Scripted calls: {len(SCRIPTED_CALLS)} calls, {len(call_failures)} failures")
+    for failure in call_failures:
+        print(f"   ❌ {failure}")
+
+    timings = time_validators(args.repeat)
+    print(f"⏱️ Validators: reference {timings['reference']:.2f} µs/call, compiled {timings['compiled']:.2f} µs/call "
+          f"({timings['reference'] / timings['compiled']:.1f}x)")
+    print(f"⏱️ Dispatch: {time_dispatch(args.repeat):.1f} µs CPU per turn (process_user_input + session store)")
+
+    sys.exit(1 if failures or call_failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# llm_cache.py
+"""
+Response cache for the LLM general-chat fallback.
+Exact tier: keyed by hash(model, normalized messages) - the persona prompt, the user text and
+the recent history the model sees. Optional semantic tier: among entries with the same model,
+history and prompt template, reuse the answer to a near-duplicate user question.
+Entries are bounded by TTL and LRU; hits are replayed as a fake token stream.
+"""
+
+import re
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_WORD_RE = re.compile(r'\S+\s*')
+
+
+def normalize_prompt(text: str) -> str:
+    """Normalize text so trivially different prompts share one cache entry"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _hash(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def make_cache_keys(model: str, messages: List[Dict[str, str]], semantic_text: Optional[str] = None):
+    """
+    Build the exact key and the semantic bucket for a request.
+
+    Args:
+        model: Model name.
+        messages: Chat messages as sent to the model; the last one is the prompt.
+        semantic_text: The varying part of the prompt (the user's words) for the semantic tier.
+
+    Returns:
+        (exact_key, bucket): bucket is None when semantic_text is not part of the prompt.
+    """
+    context = [(message["role"], normalize_prompt(message["content"])) for message in messages[:-1]]
+    prompt = normalize_prompt(messages[-1]["content"])
+    exact_key = _hash([model, context, prompt])
+    bucket = None
+    if semantic_text:
+        varying = normalize_prompt(semantic_text)
+        if varying and varying in prompt:
+            bucket = _hash([model, context, prompt.replace(varying, "\x00")])
+    return exact_key, bucket
+
+
+def replay_stream(text: str) -> Iterator[str]:
+    """Yield a cached answer word by word, like the provider's token stream"""
+    for match in _WORD_RE.finditer(text):
+        yield match.group(0)
+
+
+class LLMResponseCache:
+    """In-memory LRU + TTL cache of complete LLM answers"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float,
+                 embed: Optional[Callable[[List[str]], Any]] = None, semantic_threshold: float = 0.93):
+        """
+        Args:
+            max_entries: LRU bound.
+            ttl_seconds: Entries older than this are never served.
+            embed: Callable returning unit-length embeddings (or None when no model is loaded);
+                enables the semantic tier.
+            semantic_threshold: Minimum cosine similarity between user questions for a semantic hit.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embed = embed
+        self.semantic_threshold = semantic_threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # key -> entry, least recent first
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_tokens = 0
+        self.saved_tokens_estimated = 0
+
+    def _embedding(self, text: Optional[str]):
+        if self.embed is None or not text:
+            return None
+        vectors = self.embed([normalize_prompt(text)])
+        return None if vectors is None else vectors[0]
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created"] > self.ttl_seconds
+
+    def get(self, model: str, messages: List[Dict[str, str]], semantic_text: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached answer.
+
+        Returns:
+            The entry dict ('text', 'tokens', 'tokens_estimated', 'tier') or None on a miss.
+        """
+        exact_key, bucket = make_cache_keys(model, messages, semantic_text)
+        with self._lock:
+            entry = self._entries.get(exact_key)
+            if entry is not None and self._expired(entry):
+                del self._entries[exact_key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(exact_key)
+                self.exact_hits += 1
+                return self._served(entry, "exact")
+            candidates = []
+            if bucket is not None and self.embed is not None:
+                candidates = [(key, entry) for key, entry in self._entries.items()
+                              if entry["bucket"] == bucket and entry["vector"] is not None]
+
+        if candidates:
+            vector = self._embedding(semantic_text)
+            if vector is not None:
+                similarities = [float(entry["vector"] @ vector) for _, entry in candidates]
+                best = max(range(len(candidates)), key=similarities.__getitem__)
+                key, entry = candidates[best]
+                if similarities[best] >= self.semantic_threshold and not self._expired(entry):
+                    with self._lock:
+                        if key in self._entries:
+                            self._entries.move_to_end(key)
+                        self.semantic_hits += 1
+                        return self._served(entry, "semantic", similarities[best])
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _served(self, entry: Dict[str, Any], tier: str, similarity: float = 1.0) -> Dict[str, Any]:
+        if entry["tokens_estimated"]:
+            self.saved_tokens_estimated += entry["tokens"]
+        else:
+            self.saved_tokens += entry["tokens"]
+        return dict(entry, tier=tier, similarity=similarity)
+
+    def put(self, model: str, messages: List[Dict[str, str]], text: str, tokens: Optional[int] = None,
+            semantic_text: Optional[str] = None) -> None:
+        """
+        Store a complete answer.
+
+        Args:
+            tokens: Prompt + completion tokens reported by the provider; estimated from length if None.
+        """
+        exact_key, bucket = make_cache_keys(model, messages, semantic_text)
+        tokens_estimated = tokens is None
+        if tokens_estimated:
+            # ~4 characters per token
+            tokens = (sum(len(message["content"]) for message in messages) + len(text)) // 4
+        entry = {
+            "text": text,
+            "tokens": tokens,
+            "tokens_estimated": tokens_estimated,
+            "created": time.time(),
+            "bucket": bucket,
+            "vector": self._embedding(semantic_text) if bucket is not None else None
+        }
+        with self._lock:
+            self._entries[exact_key] = entry
+            self._entries.move_to_end(exact_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def purge_expired(self) -> int:
+        """Drop expired entries. Returns how many were removed."""
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if self._expired(entry)]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters per tier and tokens not sent to the provider"""
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "semantic_tier": self.embed is not None,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "saved_tokens": self.saved_tokens,
+                "saved_tokens_estimated": self.saved_tokens_estimated
+            }
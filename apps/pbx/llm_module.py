@@ -1,11 +1,30 @@
 # llm_module.py
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import os
 import time
 import re
+import asyncio
+
+import llm_cache
+import faq_semantic
+import connection_warmup
+import conversation_logger
+import tracing
+
+log = conversation_logger.get_logger("llm")
 
 client = None
+async_client = None  # Used by the ASGI server (asgi_app.py)
 provider = None
 model_name = None
+response_cache = None
+
+# Cache of complete fallback answers; the semantic tier reuses the FAQ embedding model when it is loaded
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "2000"))
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_SEMANTIC = os.environ.get("LLM_CACHE_SEMANTIC", "false").lower() == "true"
+LLM_CACHE_SEMANTIC_THRESHOLD = float(os.environ.get("LLM_CACHE_SEMANTIC_THRESHOLD", "0.93"))
 
 def clean_text_for_tts(text):
     """
@@ -47,8 +66,15 @@ def clean_text_for_tts(text):
 
 def initialize_llm(api_key, use_openai=False, openai_api_key=None):
     """Initializes the LLM client (Deepseek or OpenAI)."""
-    global client, provider, model_name
+    global client, async_client, provider, model_name, response_cache
     
+    if LLM_CACHE_ENABLED and response_cache is None:
+        response_cache = llm_cache.LLMResponseCache(LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS,
+                                                    embed=faq_semantic.embed if LLM_CACHE_SEMANTIC else None,
+                                                    semantic_threshold=LLM_CACHE_SEMANTIC_THRESHOLD)
+        print(f"♻️ LLM response cache enabled (max {LLM_CACHE_MAX_ENTRIES} entries, TTL {LLM_CACHE_TTL_SECONDS:.0f}s"
+              f"{', semantic tier' if LLM_CACHE_SEMANTIC else ''})")
+
     if use_openai:
         if not openai_api_key or openai_api_key == "YOUR_OPENAI_API_KEY_HERE":
             # In a production app, you might raise an error or log a warning
@@ -59,8 +85,11 @@ def initialize_llm(api_key, use_openai=False, openai_api_key=None):
         
         client = OpenAI(
             api_key=openai_api_key,
-            timeout=30.0
+            timeout=30.0,
+            http_client=connection_warmup.monitor.http_client("llm")
         )
+        async_client = AsyncOpenAI(api_key=openai_api_key, timeout=30.0,
+                                   http_client=connection_warmup.monitor.async_http_client("llm"))
         provider = "openai"
         model_name = "gpt-4o-mini" # Or your preferred OpenAI model
         print("OpenAI LLM initialized (Model: gpt-4o-mini).")
@@ -72,25 +101,21 @@ def initialize_llm(api_key, use_openai=False, openai_api_key=None):
         client = OpenAI(
             api_key=api_key, 
             base_url="https://api.deepseek.com/v1",
-            timeout=30.0
+            timeout=30.0,
+            http_client=connection_warmup.monitor.http_client("llm")
         )
+        async_client = AsyncOpenAI(api_key=api_key, base_url="https://api.deepseek.com/v1", timeout=30.0,
+                                   http_client=connection_warmup.monitor.async_http_client("llm"))
         provider = "deepseek"
         model_name = "deepseek-chat" # Or "deepseek-coder"
         print(f"Deepseek LLM initialized (Model: {model_name}).")
 
-def get_ai_response(prompt, conversation_history=None):
-    """
-    Gets a streaming response from the configured AI provider.
-    Yields text chunks as they are received.
-    """
-    if client is None:
-        print("LLM client not available. Returning empty stream.")
-        # Depending on strictness, could raise Exception("LLM not initialized...")
-        yield "" # Return an empty generator if not initialized
-        return
+    # Keep the LLM connection pool warm; listing models is free and authenticated
+    connection_warmup.monitor.register_ping("llm", lambda: client.models.list())
+    connection_warmup.monitor.register_ping_async("llm", lambda: async_client.models.list())
 
-    api_start_time = time.time()
-    
+def _build_messages(prompt, conversation_history=None):
+    """System message + last turns of history + the prompt"""
     # System message to ensure clean text output for TTS
     system_message = {
         "role": "system", 
@@ -106,39 +131,166 @@ def get_ai_response(prompt, conversation_history=None):
             if entry.get("ai_message"):
                 messages.append({"role": "assistant", "content": entry["ai_message"]})
     messages.append({"role": "user", "content": prompt})
+    return messages
+
+def _completion_params(messages):
+    """Arguments for a streaming chat completion with the configured provider"""
+    if provider == "openai":
+        max_tokens = 300
+        temperature = 0.7
+    else:  # deepseek
+        max_tokens = 250 # Adjusted for potentially faster chunking
+        temperature = 0.7
+    return {
+        "model": model_name or "default-model",
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stream": True, # Enable streaming
+        "stream_options": {"include_usage": True},  # Final chunk reports token usage (for the cache stats)
+    }
+
+def _clean_stream_chunk(chunk):
+    """Text of one streamed completion chunk, cleaned for TTS ('' if none)"""
+    if not chunk.choices:  # Usage-only final chunk
+        return ""
+    if not (hasattr(chunk.choices[0], 'delta') and chunk.choices[0].delta and chunk.choices[0].delta.content):
+        return ""
+    content_chunk = chunk.choices[0].delta.content
+    # Clean any remaining markdown formatting for TTS compatibility
+    cleaned_chunk = clean_text_for_tts(content_chunk)
+    # Keep the spaces around the token - stripping them glues words together
+    # and hides the sentence boundaries the TTS segmenter looks for
+    if content_chunk[:1].isspace():
+        cleaned_chunk = " " + cleaned_chunk
+    if content_chunk[-1:].isspace() and cleaned_chunk.strip():
+        cleaned_chunk += " "
+    return cleaned_chunk
+
+def _usage_tokens(chunk):
+    """Total tokens if this stream chunk carries usage, else None"""
+    usage = getattr(chunk, 'usage', None)
+    return getattr(usage, 'total_tokens', None) if usage else None
+
+def _log_cache_hit(cached):
+    log.info(f"♻️ LLM cache hit ({cached['tier']}, similarity {cached['similarity']:.2f}): "
+          f"saved ~{cached['tokens']} tokens")
+
+def _cache_response(messages, chunks, tokens, cache_text):
+    """Store a complete, non-empty answer"""
+    text = "".join(chunks)
+    if response_cache is not None and text.strip():
+        response_cache.put(model_name or "default-model", messages, text, tokens=tokens, semantic_text=cache_text)
+
+def get_ai_response(prompt, conversation_history=None, cache_text=None):
+    """
+    Gets a streaming response from the configured AI provider.
+    Yields text chunks as they are received. Answers served from the response cache
+    are replayed word by word.
+
+    Args:
+        cache_text: The user's words within prompt; lets the cache match near-duplicate questions.
+    """
+    if client is None:
+        log.warning("LLM client not available. Returning empty stream.")
+        # Depending on strictness, could raise Exception("LLM not initialized...")
+        yield "" # Return an empty generator if not initialized
+        return
+
+    api_start_time = time.time()
+    stage = tracing.span("llm_completion", provider=provider)
+    messages = _build_messages(prompt, conversation_history)
+
+    if response_cache is not None:
+        cached = response_cache.get(model_name or "default-model", messages, semantic_text=cache_text)
+        if cached:
+            _log_cache_hit(cached)
+            stage.end(cache_hit=True)
+            yield from llm_cache.replay_stream(cached["text"])
+            return
     
     provider_name = provider or "LLM"
     current_model_name = model_name or "default-model"
-    print(f"🧠 Streaming request to {provider_name.upper()} (Model: {current_model_name}) with {len(messages)} messages...")
+    log.info(f"🧠 Streaming request to {provider_name.upper()} (Model: {current_model_name}) with {len(messages)} messages...")
 
     try:
-        if provider == "openai":
-            max_tokens = 300
-            temperature = 0.7
-        else:  # deepseek
-            max_tokens = 250 # Adjusted for potentially faster chunking
-            temperature = 0.7
-
-        response_stream = client.chat.completions.create(
-            model=current_model_name,
-            messages=messages,  # type: ignore
-            max_tokens=max_tokens,
-            temperature=temperature,
-            stream=True, # Enable streaming
-        )
+        response_stream = client.chat.completions.create(**_completion_params(messages))  # type: ignore
         
+        chunks, tokens = [], None
         for chunk in response_stream:
-            if hasattr(chunk.choices[0], 'delta') and chunk.choices[0].delta and chunk.choices[0].delta.content:
-                content_chunk = chunk.choices[0].delta.content
-                # Clean any remaining markdown formatting for TTS compatibility
-                cleaned_chunk = clean_text_for_tts(content_chunk)
-                if cleaned_chunk:  # Only yield non-empty chunks
-                    yield cleaned_chunk
+            tokens = _usage_tokens(chunk) or tokens
+            cleaned_chunk = _clean_stream_chunk(chunk)
+            if cleaned_chunk:  # Only yield non-empty chunks
+                if not chunks:  # Time to first token is the request time; connection setup is traced separately
+                    connection_warmup.monitor.record_request("llm", time.time() - api_start_time)
+                    tracing.record("llm_first_token", time.time() - api_start_time)
+                chunks.append(cleaned_chunk)
+                yield cleaned_chunk
         
         api_time = time.time() - api_start_time
-        print(f"🧠 {provider_name.upper()} stream finished in {api_time:.3f}s")
+        stage.end(cache_hit=False, tokens=tokens)
+        log.info(f"🧠 {provider_name.upper()} stream finished in {api_time:.3f}s")
+        _cache_response(messages, chunks, tokens, cache_text)
         
     except Exception as e:
         api_time = time.time() - api_start_time
-        print(f"🧠 {provider_name.upper()} API stream error after {api_time:.3f}s: {e}")
-        yield " Sorry, I encountered an error. " # Yield an error message within the stream
\ No newline at end of file
+        stage.end(cache_hit=False, error=str(e))
+        log.error(f"🧠 {provider_name.upper()} API stream error after {api_time:.3f}s: {e}")
+        yield " Sorry, I encountered an error. " # Yield an error message within the stream
+
+async def get_ai_response_async(prompt, conversation_history=None, cache_text=None):
+    """Async version of get_ai_response for the ASGI server. Async-yields text chunks."""
+    if async_client is None:
+        log.warning("LLM async client not available. Returning empty stream.")
+        yield ""
+        return
+
+    api_start_time = time.time()
+    stage = tracing.span("llm_completion", provider=provider)
+    messages = _build_messages(prompt, conversation_history)
+
+    if response_cache is not None:
+        model = model_name or "default-model"
+        if response_cache.embed:  # The semantic tier embeds the question on CPU - keep it off the event loop
+            cached = await asyncio.to_thread(response_cache.get, model, messages, cache_text)
+        else:
+            cached = response_cache.get(model, messages, cache_text)
+        if cached:
+            _log_cache_hit(cached)
+            stage.end(cache_hit=True)
+            for word in llm_cache.replay_stream(cached["text"]):
+                yield word
+            return
+
+    provider_name = provider or "LLM"
+    log.info(f"🧠 Streaming request to {provider_name.upper()} (Model: {model_name or 'default-model'}) with {len(messages)} messages (async)...")
+
+    try:
+        response_stream = await async_client.chat.completions.create(**_completion_params(messages))  # type: ignore
+        
+        chunks, tokens = [], None
+        async for chunk in response_stream:
+            tokens = _usage_tokens(chunk) or tokens
+            cleaned_chunk = _clean_stream_chunk(chunk)
+            if cleaned_chunk:  # Only yield non-empty chunks
+                if not chunks:  # Time to first token is the request time; connection setup is traced separately
+                    connection_warmup.monitor.record_request("llm", time.time() - api_start_time)
+                    tracing.record("llm_first_token", time.time() - api_start_time)
+                chunks.append(cleaned_chunk)
+                yield cleaned_chunk
+        
+        stage.end(cache_hit=False, tokens=tokens)
+        log.info(f"🧠 {provider_name.upper()} stream finished in {time.time() - api_start_time:.3f}s")
+        if response_cache is not None and response_cache.embed:
+            await asyncio.to_thread(_cache_response, messages, chunks, tokens, cache_text)
+        else:
+            _cache_response(messages, chunks, tokens, cache_text)
+        
+    except Exception as e:
+        stage.end(cache_hit=False, error=str(e))
+        log.error(f"🧠 {provider_name.upper()} API stream error after {time.time() - api_start_time:.3f}s: {e}")
+        yield " Sorry, I encountered an error. " # Yield an error message within the stream
+
+def get_llm_cache_stats():
+    """Response cache hit rate and saved tokens"""
+    return response_cache.stats() if response_cache is not None else {}
@@ -0,0 +1,340 @@
+# load_test.py
+"""
+Load test and latency benchmark for the pbx /chat pipeline: compares how many concurrent
+conversations the Flask server (app.py) and the ASGI server (asgi_app.py) sustain, with the
+cloud services replaced by local stand-ins (service_stubs.py), so it runs on a laptop with
+no network.
+
+Each simulated caller runs a full conversation: an introduction turn, then turns that go
+through STT -> history -> LLM fallback -> N x TTS, downloading every audio chunk. Turns
+upload recordings from --corpus (WAV/WEBM/OGG/FLAC, a transcript in name.txt next to a
+recording is what the stub STT "hears"), or a synthetic WAV without one.
+
+Reported per level: time to user text, time to first audio chunk and full turn latency
+(p50/p95/p99), turns per second and the error rate.
+
+Usage:
+    python load_test.py                              # both servers, default levels
+    python load_test.py --server asgi --levels 50,200,500
+    python load_test.py --flask-threads 32           # Flask capped like a gunicorn gthread worker
+    python load_test.py --corpus recordings/ --latency stt=lognormal:0.3,0.4 --error-rate tts=0.01 --json results.json
+    python load_test.py --stub-services llm,db       # real Google STT/TTS, stubbed LLM and Supabase
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+PBX_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LEVELS = "10,50,100,200,400"
+
+# --latency / --error-rate keys -> service_stubs settings
+LATENCY_SETTINGS = {"stt": "STUB_STT_LATENCY", "tts": "STUB_TTS_LATENCY", "llm": "STUB_LLM_FIRST_TOKEN",
+                    "llm_token": "STUB_LLM_TOKEN_INTERVAL", "db": "STUB_DB_LATENCY"}
+ERROR_RATE_SETTINGS = {"stt": "STUB_STT_ERROR_RATE", "tts": "STUB_TTS_ERROR_RATE", "llm": "STUB_LLM_ERROR_RATE"}
+CONTENT_TYPES = {".wav": "audio/wav", ".webm": "audio/webm", ".ogg": "audio/ogg", ".flac": "audio/flac"}
+
+
+# --- Server side (runs in a subprocess) ---
+
+def serve(server, port, flask_threads):
+    """Start one server with the service stubs installed"""
+    sys.path.insert(0, PBX_DIR)
+    import service_stubs
+
+    if server == "flask":
+        import app as flask_app
+        from werkzeug.serving import make_server
+        flask_app.bootstrap.wait_until_ready(None)  # Stubs replace the clients startup creates
+        service_stubs.install_sync_stubs()
+        http_server = make_server("127.0.0.1", port, flask_app.app, threaded=True)
+        if flask_threads:
+            # Bounded worker pool, like gunicorn --worker-class gthread --threads N
+            from concurrent.futures import ThreadPoolExecutor
+            pool = ThreadPoolExecutor(max_workers=flask_threads)
+            http_server.process_request = lambda request, client_address: pool.submit(
+                http_server.process_request_thread, request, client_address)
+        http_server.serve_forever()
+    else:
+        import asgi_app
+        from hypercorn.config import Config
+        from hypercorn.asyncio import serve as hypercorn_serve
+
+        async def install_stubs():
+            await asgi_app.async_services_ready.wait()  # Stubs replace the clients startup creates
+            service_stubs.install_async_stubs()
+
+        @asgi_app.app.before_serving
+        async def schedule_stubs():
+            asgi_app.app.add_background_task(install_stubs)
+
+        config = Config()
+        config.bind = [f"127.0.0.1:{port}"]
+        config.backlog = 2048
+        config.accesslog = None
+        asyncio.run(hypercorn_serve(asgi_app.app, config))
+
+
+def start_server(server, flask_threads, stub_env=None):
+    """Launch a server subprocess in a scratch directory and wait until it accepts requests"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    workdir = tempfile.mkdtemp(prefix=f"pbx_load_{server}_")
+    cmd = [sys.executable, os.path.abspath(__file__), "--serve", server, "--port", str(port)]
+    if flask_threads:
+        cmd += ["--flask-threads", str(flask_threads)]
+    env = {**os.environ, "TTS_CACHE_ENABLED": "false", "PYTHONPATH": PBX_DIR, **(stub_env or {})}
+    log = open(os.path.join(workdir, "server.log"), "w")
+    process = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{server} server exited, see {log.name}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process, f"http://127.0.0.1:{port}", log.name
+        except OSError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError(f"{server} server did not start, see {log.name}")
+
+
+# --- Client side ---
+
+def fake_recording(seconds=1.5):
+    """Without a corpus the stub STT ignores the audio, but the server still validates, sniffs and VAD-trims it"""
+    import service_stubs
+    return service_stubs.make_speech_wav(seconds, sample_rate=16000)
+
+
+def load_utterances(corpus_dir):
+    """
+    ((filename, bytes, content type), expected transcript or None) for every recording in the
+    corpus, or one synthetic WAV. The transcript comes from name.txt next to the recording.
+    """
+    if not corpus_dir:
+        return [(("turn.wav", fake_recording(), "audio/wav"), None)]
+    import service_stubs
+    utterances = []
+    for path in service_stubs.find_corpus_files(corpus_dir):
+        with open(path, "rb") as f:
+            upload = (os.path.basename(path), f.read(), CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream"))
+        transcript_path = os.path.splitext(path)[0] + ".txt"
+        expected = None
+        if os.path.exists(transcript_path):
+            with open(transcript_path, encoding="utf-8") as f:
+                expected = f.read().strip()
+        utterances.append((upload, expected))
+    if not utterances:
+        raise SystemExit(f"No recordings found in {corpus_dir}")
+    return utterances
+
+
+async def run_turn(client, base_url, session_id, utterance, timeout):
+    """One /chat turn: upload, read the SSE stream, download every audio chunk"""
+    upload, expected_transcript = utterance
+    start = time.time()
+    user_text = None
+    first_audio = None
+    chunks = 0
+    ended = False
+    async with client.stream("POST", f"{base_url}/chat", timeout=timeout,
+                             files={"audio_data": upload},
+                             data={"session_id": session_id}) as response:
+        if response.status_code != 200:
+            return {"ok": False, "error": f"HTTP {response.status_code}"}
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event["type"] == "user_text_final":
+                user_text = time.time() - start
+                # Corpus replay: the stub STT must have recognized this recording
+                if expected_transcript is not None and event.get("text") != expected_transcript:
+                    return {"ok": False, "error": "transcript mismatch (stub STT did not recognize the recording)"}
+            elif event["type"] == "ai_audio_chunk":
+                if first_audio is None:
+                    first_audio = time.time() - start
+                chunks += 1
+                if event["url"].startswith("/"):
+                    audio_response = await client.get(base_url + event["url"], timeout=timeout)
+                    if audio_response.status_code != 200:
+                        return {"ok": False, "error": f"audio HTTP {audio_response.status_code}"}
+            elif event["type"] == "error":
+                return {"ok": False, "error": event.get("message")}
+            elif event["type"] == "end_of_stream":
+                ended = True
+    if not ended:
+        return {"ok": False, "error": "stream ended without end_of_stream"}
+    return {"ok": True, "user_text": user_text, "first_audio": first_audio, "total": time.time() - start, "chunks": chunks}
+
+
+async def run_conversation(client, base_url, turns, utterances, rng, timeout):
+    session_id = f"load_{uuid.uuid4().hex[:12]}"
+    results = []
+    for _ in range(turns):
+        try:
+            result = await run_turn(client, base_url, session_id, rng.choice(utterances), timeout)
+        except Exception as e:
+            result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        results.append(result)
+        if not result["ok"]:
+            break
+    return results
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def run_level(base_url, concurrency, turns, timeout, utterances, seed=0):
+    """Start `concurrency` conversations at once and summarize their turns"""
+    import httpx
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits) as client:
+        start = time.time()
+        # Each caller picks its recordings from its own seeded generator: same corpus order every run
+        conversations = await asyncio.gather(*(run_conversation(client, base_url, turns, utterances,
+                                                                random.Random(seed * 100003 + caller), timeout)
+                                               for caller in range(concurrency)))
+        elapsed = time.time() - start
+
+    turn_results = [turn for conversation in conversations for turn in conversation]
+    ok = [turn for turn in turn_results if turn["ok"]]
+    completed = sum(1 for conversation in conversations
+                    if len(conversation) == turns and all(turn["ok"] for turn in conversation))
+    errors = {}
+    for turn in turn_results:
+        if not turn["ok"]:
+            errors[turn["error"]] = errors.get(turn["error"], 0) + 1
+    # Only LLM turns (after the introduction) are comparable across levels
+    llm_turns = [turn for conversation in conversations for turn in conversation[1:] if turn["ok"]]
+    stats = {
+        "concurrency": concurrency,
+        "success_rate": completed / concurrency,
+        "error_rate": (len(turn_results) - len(ok)) / len(turn_results) if turn_results else 0.0,
+        "turns": len(turn_results),
+        "turns_per_second": len(ok) / elapsed if elapsed else 0.0,
+        "errors": errors
+    }
+    for metric in ("user_text", "first_audio", "total"):
+        values = [turn[metric] for turn in llm_turns if turn[metric] is not None]
+        name = "turn" if metric == "total" else metric
+        for p in (50, 95, 99):
+            stats[f"{name}_p{p}"] = percentile(values, p)
+    return stats
+
+
+def print_level(server, stats):
+    print(f"  [{server:5}] {stats['concurrency']:5d} callers | ok {stats['success_rate'] * 100:5.1f}% | "
+          f"errors {stats['error_rate'] * 100:4.1f}% | {stats['turns_per_second']:6.1f} turns/s | "
+          f"user text p50 {stats['user_text_p50']:.2f}s p95 {stats['user_text_p95']:.2f}s | "
+          f"first audio p50 {stats['first_audio_p50']:.2f}s p95 {stats['first_audio_p95']:.2f}s | "
+          f"turn p50 {stats['turn_p50']:.2f}s p95 {stats['turn_p95']:.2f}s p99 {stats['turn_p99']:.2f}s")
+    for error, count in list(stats["errors"].items())[:3]:
+        print(f"          {count}x {error}")
+
+
+def capacity(levels, baseline_p95, slo_factor):
+    """Highest level with every conversation completed and p95 turn time within slo_factor x the baseline"""
+    best = 0
+    for stats in levels:
+        if stats["success_rate"] >= 1.0 and stats["turn_p95"] <= baseline_p95 * slo_factor:
+            best = stats["concurrency"]
+    return best
+
+
+def stub_settings(args):
+    """Environment for the server subprocess: stub latencies, error rates, services, corpus and seed"""
+    env = {"STUB_SEED": str(args.seed)}
+    for option, settings in ((args.latency, LATENCY_SETTINGS), (args.error_rate, ERROR_RATE_SETTINGS)):
+        for item in option:
+            service, _, value = item.partition("=")
+            if service not in settings or not value:
+                raise SystemExit(f"Expected SERVICE=VALUE with SERVICE in {', '.join(settings)}, got '{item}'")
+            if value.startswith("replay:"):
+                value = "replay:" + os.path.abspath(value[len("replay:"):])  # The server runs in a scratch directory
+            env[settings[service]] = value
+    if args.stub_services:
+        env["STUB_SERVICES"] = args.stub_services
+    if args.corpus:
+        env["STUB_CORPUS_DIR"] = os.path.abspath(args.corpus)
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session capacity: Flask vs ASGI pbx server (stubbed services)")
+    parser.add_argument("--server", choices=["flask", "asgi", "both"], default="both")
+    parser.add_argument("--levels", default=DEFAULT_LEVELS, help="Comma separated concurrent caller counts")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per conversation (first one is the introduction)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--slo-factor", type=float, default=2.0,
+                        help="A level counts as sustained while p95 turn time stays within this factor of the 1-caller baseline")
+    parser.add_argument("--flask-threads", type=int, default=0,
+                        help="Cap Flask at N worker threads (0 = thread per request, like app.py)")
+    parser.add_argument("--corpus", help="Directory of recorded utterances to replay (default: synthetic WAV)")
+    parser.add_argument("--latency", action="append", default=[], metavar="SERVICE=SPEC",
+                        help=f"Stub latency distribution, e.g. stt=lognormal:0.3,0.4 ({', '.join(LATENCY_SETTINGS)})")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="SERVICE=RATE",
+                        help=f"Share of failing stub calls, e.g. tts=0.01 ({', '.join(ERROR_RATE_SETTINGS)})")
+    parser.add_argument("--stub-services", help="Services to replace with stand-ins (default: stt,tts,llm,db)")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for stub latencies and recording choice")
+    parser.add_argument("--json", help="Write every level's results to this file")
+    parser.add_argument("--serve", choices=["flask", "asgi"], help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.flask_threads)
+        return
+
+    sys.path.insert(0, PBX_DIR)
+    levels = [int(level) for level in args.levels.split(",")]
+    servers = ["flask", "asgi"] if args.server == "both" else [args.server]
+    stub_env = stub_settings(args)
+    utterances = load_utterances(args.corpus)
+    print(f"🎙️ Replaying {len(utterances)} recording(s)" + (f" from {args.corpus}" if args.corpus else " (synthetic)"))
+    summary, report = {}, {"settings": stub_env, "servers": {}}
+    for server in servers:
+        process, base_url, log_path = start_server(server, args.flask_threads, stub_env)
+        print(f"🚀 {server} server at {base_url} (log: {log_path})")
+        try:
+            baseline = asyncio.run(run_level(base_url, 1, args.turns, args.timeout, utterances, args.seed))
+            print_level(server, baseline)
+            results = []
+            for level in levels:
+                stats = asyncio.run(run_level(base_url, level, args.turns, args.timeout, utterances, args.seed))
+                print_level(server, stats)
+                results.append(stats)
+            summary[server] = capacity(results, baseline["turn_p95"], args.slo_factor)
+            report["servers"][server] = {"baseline": baseline, "levels": results, "sustained": summary[server]}
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+    print("\n📊 Sustained concurrent conversations "
+          f"(100% completed, p95 turn <= {args.slo_factor:g}x single-caller baseline):")
+    for server, sustained in summary.items():
+        print(f"   {server:5}: {sustained}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,83 @@
 # memory_module.py
-from supabase import create_client, Client
+from supabase import create_client, Client, acreate_client, AsyncClient
+from collections import OrderedDict
 from typing import Optional
 import os
 import time
+import threading
+from datetime import datetime, timezone
+
+import write_behind
+import session_store
+import conversation_logger
+import tracing
+
+log = conversation_logger.get_logger("memory")
 
 supabase_client: Optional[Client] = None
+async_supabase_client: Optional[AsyncClient] = None  # Used by the ASGI server (asgi_app.py)
+persistence_queue: Optional[write_behind.WriteBehindQueue] = None  # Write-behind buffer for save_interaction
+
+# In-process write-through cache of recent history per session (oldest first).
+# save_interaction appends to it, so after the first read a session is served from memory.
+# Only used with the process-local session store: with a shared one (sqlite/redis behind several
+# workers) another worker may save later turns of the session and the cached copy goes stale.
+HISTORY_CACHE_ENABLED = session_store.SESSION_STORE == "memory"
+HISTORY_CACHE_DEPTH = 3  # get_history never returns more than 3 turns
+HISTORY_CACHE_MAX_SESSIONS = int(os.environ.get("HISTORY_CACHE_MAX_SESSIONS", "5000"))
+HISTORY_CACHE_TTL_SECONDS = int(os.environ.get("HISTORY_CACHE_TTL_SECONDS", "1800"))
+_history_cache = OrderedDict()  # session_id -> (loaded_at, [rows])
+_history_lock = threading.Lock()
+history_cache_hits = 0
+history_cache_misses = 0
+
+def _cached_history(session_id, limit):
+    """Recent history from the cache, or None on a miss"""
+    global history_cache_hits, history_cache_misses
+    if not HISTORY_CACHE_ENABLED:
+        return None
+    with _history_lock:
+        entry = _history_cache.get(session_id)
+        if entry is None or time.time() - entry[0] > HISTORY_CACHE_TTL_SECONDS:
+            history_cache_misses += 1
+            return None
+        _history_cache.move_to_end(session_id)
+        history_cache_hits += 1
+        return list(entry[1][-limit:])
+
+def _store_history(session_id, rows):
+    """Cache history just read from Supabase (oldest first)"""
+    if not HISTORY_CACHE_ENABLED:
+        return
+    with _history_lock:
+        _history_cache[session_id] = (time.time(), list(rows[-HISTORY_CACHE_DEPTH:]))
+        _history_cache.move_to_end(session_id)
+        while len(_history_cache) > HISTORY_CACHE_MAX_SESSIONS:
+            _history_cache.popitem(last=False)
+
+def _append_history(session_id, user_msg, ai_msg):
+    """Write-through: add a saved interaction to a cached session (uncached sessions are read fresh later)"""
+    with _history_lock:
+        entry = _history_cache.get(session_id)
+        if entry is not None:
+            rows = entry[1] + [{"user_message": user_msg, "ai_message": ai_msg}]
+            _history_cache[session_id] = (entry[0], rows[-HISTORY_CACHE_DEPTH:])
+
+def forget_history(session_id):
+    """Drop a session from the history cache (e.g. when the session expires)"""
+    with _history_lock:
+        _history_cache.pop(session_id, None)
+
+def get_history_cache_stats():
+    with _history_lock:
+        lookups = history_cache_hits + history_cache_misses
+        return {
+            "enabled": HISTORY_CACHE_ENABLED,
+            "sessions": len(_history_cache),
+            "hits": history_cache_hits,
+            "misses": history_cache_misses,
+            "hit_rate": round(history_cache_hits / lookups, 3) if lookups else 0.0
+        }
 
 def initialize_memory(url, key):
     """Initializes the Supabase client."""
@@ -13,44 +86,61 @@ def initialize_memory(url, key):
        not key or key == "YOUR_SUPABASE_SERVICE_KEY_HERE":
         raise ValueError("Supabase URL and Key are required and should not be placeholders.")
     supabase_client = create_client(url, key)
+    _start_persistence_queue()
     print("Supabase memory initialized.")
 
+def _insert_interactions(rows):
+    """Bulk insert used by the write-behind queue (raises on failure so it can retry)"""
+    supabase_client.table('conversation_history').insert(rows).execute()
+
+def _start_persistence_queue():
+    global persistence_queue
+    if persistence_queue is None:
+        persistence_queue = write_behind.WriteBehindQueue(_insert_interactions, write_behind.PERSIST_SPILL_PATH)
+        persistence_queue.start()
+
+def flush_pending(timeout=10.0):
+    """Block until queued interactions are written (tests, shutdown). Returns True if drained."""
+    return persistence_queue.flush(timeout) if persistence_queue is not None else True
+
+def get_persistence_stats():
+    """Write-behind queue depth and flush latency"""
+    return persistence_queue.stats() if persistence_queue is not None else {}
+
 def save_interaction(session_id, user_msg, ai_msg):
-    """Saves a user-AI interaction to Supabase."""
+    """
+    Saves a user-AI interaction. The row is queued and written to Supabase in the
+    background (batched), so this never waits on the database.
+    """
     if supabase_client is None:
         raise Exception("Memory not initialized. Call initialize_memory() first.")
     
-    db_start_time = time.time()
-    try:
-        # data, count = supabase_client.table('conversation_history').insert({ # Original V1 syntax
-        response = supabase_client.table('conversation_history').insert({ # V2 syntax
-            "session_id": session_id,
-            "user_message": user_msg,
-            "ai_message": ai_msg
-        }).execute()
-        
-        db_time = time.time() - db_start_time
-        print(f"💾 Database save completed in {db_time:.3f}s")
-        
-        # print(f"Interaction saved. Response: {response}") # For debugging
-        if hasattr(response, 'data') and response.data:
-            print("Interaction saved to Supabase.")
-            return response.data
-        return None # Fallback
-    except Exception as e:
-        db_time = time.time() - db_start_time
-        print(f"💾 Database save error after {db_time:.3f}s: {e}")
-        return None
+    _start_persistence_queue()
+    persistence_queue.put({
+        "session_id": session_id,
+        "user_message": user_msg,
+        "ai_message": ai_msg,
+        # Set now, not at flush time, so batched rows keep their conversation order
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    _append_history(session_id, user_msg, ai_msg)
 
 def get_history(session_id, limit=5):
     """Retrieves conversation history for a session from Supabase."""
     if supabase_client is None:
         raise Exception("Memory not initialized. Call initialize_memory() first.")
     
+    # Reduced limit for faster queries
+    actual_limit = min(limit, 3)  # Max 3 conversations for speed
+    stage = tracing.span("history_fetch")
+    cached = _cached_history(session_id, actual_limit)
+    if cached is not None:
+        stage.end(source="cache")
+        log.debug(f"💾 History cache hit ({len(cached)} conversation(s))")
+        return cached
+    
     db_start_time = time.time()
     try:
-        # Reduced limit for faster queries
-        actual_limit = min(limit, 3)  # Max 3 conversations for speed
         
         response = supabase_client.table('conversation_history') \
             .select("user_message, ai_message") \
@@ -60,17 +150,65 @@ def get_history(session_id, limit=5):
             .execute()
         
         db_time = time.time() - db_start_time
-        print(f"💾 Database query completed in {db_time:.3f}s")
+        stage.end(source="database")
+        log.info(f"💾 Database query completed in {db_time:.3f}s")
         
         if hasattr(response, 'data') and response.data is not None:
              # The history needs to be in chronological order (oldest first) for the LLM
             result = response.data[::-1]
-            print(f"💾 Retrieved {len(result)} conversation(s) from history")
+            log.debug(f"💾 Retrieved {len(result)} conversation(s) from history")
+            _store_history(session_id, result)
             return result
         return [] # Fallback
     except Exception as e:
         db_time = time.time() - db_start_time
-        print(f"💾 Database query error after {db_time:.3f}s: {e}")
+        stage.end(source="database", error=str(e))
+        log.error(f"💾 Database query error after {db_time:.3f}s: {e}")
+        return []
+
+async def initialize_memory_async(url, key):
+    """Initializes the asyncio Supabase client (call from the server's event loop)."""
+    global async_supabase_client
+    if not url or url == "YOUR_SUPABASE_URL_HERE" or \
+       not key or key == "YOUR_SUPABASE_SERVICE_KEY_HERE":
+        raise ValueError("Supabase URL and Key are required and should not be placeholders.")
+    async_supabase_client = await acreate_client(url, key)
+    print("Supabase async memory initialized.")
+
+async def save_interaction_async(session_id, user_msg, ai_msg):
+    """Async version of save_interaction - only enqueues, so it returns immediately."""
+    save_interaction(session_id, user_msg, ai_msg)
+
+async def get_history_async(session_id, limit=5):
+    """Async version of get_history (oldest first)."""
+    if async_supabase_client is None:
+        raise Exception("Async memory not initialized. Call initialize_memory_async() first.")
+    
+    actual_limit = min(limit, 3)
+    stage = tracing.span("history_fetch")
+    cached = _cached_history(session_id, actual_limit)
+    if cached is not None:
+        stage.end(source="cache")
+        return cached
+    
+    db_start_time = time.time()
+    try:
+        response = await async_supabase_client.table('conversation_history') \
+            .select("user_message, ai_message") \
+            .eq("session_id", session_id) \
+            .order("created_at", desc=True) \
+            .limit(actual_limit) \
+            .execute()
+        stage.end(source="database")
+        log.info(f"💾 Database query completed in {time.time() - db_start_time:.3f}s")
+        if hasattr(response, 'data') and response.data is not None:
+            result = response.data[::-1]
+            _store_history(session_id, result)
+            return result
+        return []
+    except Exception as e:
+        stage.end(source="database", error=str(e))
+        log.error(f"💾 Database query error after {time.time() - db_start_time:.3f}s: {e}")
         return []
 
 # Example self-test (optional)
@@ -86,6 +224,8 @@ if __name__ == "__main__":
             session_id = "test_session_002"
             save_interaction(session_id, "Hello AI, this is a test.", "Hello User! Test received.")
             save_interaction(session_id, "How is the weather in the cloud?", "It's always partly cloudy with a chance of data.")
+            flush_pending()
+            print("Persistence stats:", get_persistence_stats())
             history = get_history(session_id)
             print("Retrieved history:", history)
         except Exception as e:
@@ -0,0 +1,277 @@
+# service_stubs.py
+"""
+Local stand-ins for the cloud services (Google STT/TTS, OpenAI-compatible LLM, Supabase)
+with injectable latency, for load testing the pbx servers offline (see load_test.py).
+Both a blocking and an asyncio flavour of each client are provided.
+
+Latencies are distributions, sampled per call from a seeded generator:
+    0.3                     fixed (same as fixed:0.3)
+    uniform:0.2,0.4         uniform between two bounds
+    normal:0.3,0.05         mean, standard deviation (clipped at 0)
+    lognormal:0.3,0.5       median, sigma - long right tail like real APIs
+    exponential:0.3         mean
+    replay:latencies.txt    samples drawn from recorded values (one per line, seconds)
+
+STUB_SERVICES picks which services are replaced (e.g. "llm,db" keeps real Google STT/TTS).
+With STUB_CORPUS_DIR set, recordings that have a transcript next to them (name.txt) are
+recognized as that text; anything else is recognized as STUB_TRANSCRIPT.
+"""
+
+import os
+import math
+import time
+import random
+import struct
+import asyncio
+import hashlib
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import tts_module
+import stt_module
+import llm_module
+import memory_module
+
+# Simulated service latencies (distribution specs, see above)
+STUB_STT_LATENCY = os.environ.get("STUB_STT_LATENCY", "0.3")
+STUB_TTS_LATENCY = os.environ.get("STUB_TTS_LATENCY", "0.25")
+STUB_LLM_FIRST_TOKEN = os.environ.get("STUB_LLM_FIRST_TOKEN", "0.4")
+STUB_LLM_TOKEN_INTERVAL = os.environ.get("STUB_LLM_TOKEN_INTERVAL", "0.02")
+STUB_DB_LATENCY = os.environ.get("STUB_DB_LATENCY", "0.05")
+
+# Share of calls that fail, per service
+STUB_STT_ERROR_RATE = float(os.environ.get("STUB_STT_ERROR_RATE", "0"))
+STUB_TTS_ERROR_RATE = float(os.environ.get("STUB_TTS_ERROR_RATE", "0"))
+STUB_LLM_ERROR_RATE = float(os.environ.get("STUB_LLM_ERROR_RATE", "0"))
+
+STUB_SEED = int(os.environ.get("STUB_SEED", "1234"))
+STUB_SERVICES = {name.strip() for name in os.environ.get("STUB_SERVICES", "stt,tts,llm,db").split(",") if name.strip()}
+STUB_CORPUS_DIR = os.environ.get("STUB_CORPUS_DIR", "")
+CORPUS_EXTENSIONS = (".wav", ".webm", ".ogg", ".flac")
+
+# What the caller "says" - goes past the canned responses and FAQ to the LLM fallback
+STUB_TRANSCRIPT = os.environ.get("STUB_TRANSCRIPT", "cuéntame un chiste")
+STUB_LLM_RESPONSE = ("Claro, aquí va uno. ¿Por qué el libro de matemáticas estaba triste? "
+                     "Porque tenía demasiados problemas. ¿Te puedo ayudar con algún préstamo hoy?")
+
+TTS_SAMPLE_RATE = 22050
+TTS_SECONDS_PER_CHAR = 0.06  # Roughly matches Spanish speech rate
+
+_rng = random.Random(STUB_SEED)
+
+
+def latency_distribution(spec: str) -> Callable[[], float]:
+    """Sampler for a latency spec (see module docstring)"""
+    kind, _, args = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+    if kind == "replay":
+        with open(args, encoding="utf-8") as f:
+            samples = [float(line) for line in f if line.strip()]
+        return lambda: _rng.choice(samples)
+    values = [float(value) for value in args.split(",")]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: _rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, _rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: _rng.lognormvariate(mu, values[1])
+    if kind == "exponential":
+        return lambda: _rng.expovariate(1.0 / values[0])
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+stt_latency = latency_distribution(STUB_STT_LATENCY)
+tts_latency = latency_distribution(STUB_TTS_LATENCY)
+llm_first_token = latency_distribution(STUB_LLM_FIRST_TOKEN)
+llm_token_interval = latency_distribution(STUB_LLM_TOKEN_INTERVAL)
+db_latency = latency_distribution(STUB_DB_LATENCY)
+
+
+def _fail(service: str, rate: float) -> None:
+    if rate and _rng.random() < rate:
+        raise RuntimeError(f"Injected {service} stub failure")
+
+
+def find_corpus_files(corpus_dir: str) -> List[str]:
+    """Recordings under corpus_dir, sorted so every run replays them in the same order"""
+    paths = []
+    for root, _, names in os.walk(corpus_dir):
+        paths += [os.path.join(root, name) for name in names if name.lower().endswith(CORPUS_EXTENSIONS)]
+    return sorted(paths)
+
+
+def load_corpus_transcripts(corpus_dir: str) -> Dict[str, str]:
+    """
+    sha1 of each recording -> its transcript (from name.txt next to it). The server VAD-trims
+    uploads before STT, so the trimmed audio (deterministic) is keyed as well.
+    """
+    transcripts = {}
+    for path in find_corpus_files(corpus_dir):
+        transcript_path = os.path.splitext(path)[0] + ".txt"
+        if os.path.exists(transcript_path):
+            with open(path, "rb") as audio_file, open(transcript_path, encoding="utf-8") as text_file:
+                content, transcript = audio_file.read(), text_file.read().strip()
+            transcripts[hashlib.sha1(content).hexdigest()] = transcript
+            trimmed = stt_module.detect_speech(content)['audio_source']
+            transcripts[hashlib.sha1(bytes(trimmed)).hexdigest()] = transcript
+    return transcripts
+
+
+corpus_transcripts = load_corpus_transcripts(STUB_CORPUS_DIR) if STUB_CORPUS_DIR else {}
+
+
+def make_wav(duration_seconds, sample_rate=TTS_SAMPLE_RATE):
+    """Silent 16-bit mono WAV of the given duration"""
+    data_size = int(duration_seconds * sample_rate) * 2
+    header = b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE'
+    header += b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+    header += b'data' + struct.pack('<I', data_size)
+    return header + b'\x00' * data_size
+
+
+def make_speech_wav(speech_seconds, sample_rate=16000, silence_seconds=0.5):
+    """16-bit mono WAV with a voice-like tone between two silences, so VAD keeps (and trims) it"""
+    tone = [int(8000 * math.sin(2 * math.pi * 220 * i / sample_rate) * (0.6 + 0.4 * math.sin(2 * math.pi * 4 * i / sample_rate)))
+            for i in range(int(speech_seconds * sample_rate))]
+    silence = b'\x00\x00' * int(silence_seconds * sample_rate)
+    data = silence + struct.pack(f'<{len(tone)}h', *tone) + silence
+    header = b'RIFF' + struct.pack('<I', 36 + len(data)) + b'WAVE'
+    header += b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+    header += b'data' + struct.pack('<I', len(data))
+    return header + data
+
+
+def _recognize_response(audio):
+    transcript = STUB_TRANSCRIPT
+    if corpus_transcripts and audio is not None:
+        transcript = corpus_transcripts.get(hashlib.sha1(audio.content).hexdigest(), STUB_TRANSCRIPT)
+    alternative = SimpleNamespace(transcript=transcript, confidence=0.95)
+    return SimpleNamespace(results=[SimpleNamespace(alternatives=[alternative])])
+
+
+def _synthesize_response(input):
+    return SimpleNamespace(audio_content=make_wav(len(input.text) * TTS_SECONDS_PER_CHAR))
+
+
+def _completion_chunks():
+    for token in STUB_LLM_RESPONSE.split(" "):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token + " "))])
+
+
+# --- Blocking clients ---
+
+class StubSpeechClient:
+    def recognize(self, config=None, audio=None):
+        time.sleep(stt_latency())
+        _fail("STT", STUB_STT_ERROR_RATE)
+        return _recognize_response(audio)
+
+
+class StubTextToSpeechClient:
+    def synthesize_speech(self, input=None, voice=None, audio_config=None):
+        time.sleep(tts_latency())
+        _fail("TTS", STUB_TTS_ERROR_RATE)
+        return _synthesize_response(input)
+
+
+class StubCompletions:
+    def create(self, **params):
+        time.sleep(llm_first_token())
+        _fail("LLM", STUB_LLM_ERROR_RATE)
+        return self._stream()
+
+    def _stream(self):
+        for chunk in _completion_chunks():
+            yield chunk
+            time.sleep(llm_token_interval())
+
+
+class StubQuery:
+    """Supabase query builder: every builder method returns itself, execute() waits and returns no rows"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        time.sleep(db_latency())
+        return SimpleNamespace(data=[])
+
+
+class StubSupabaseClient:
+    def table(self, name):
+        return StubQuery()
+
+
+# --- Asyncio clients ---
+
+class AsyncStubSpeechClient:
+    async def recognize(self, config=None, audio=None):
+        await asyncio.sleep(stt_latency())
+        _fail("STT", STUB_STT_ERROR_RATE)
+        return _recognize_response(audio)
+
+
+class AsyncStubTextToSpeechClient:
+    async def synthesize_speech(self, input=None, voice=None, audio_config=None):
+        await asyncio.sleep(tts_latency())
+        _fail("TTS", STUB_TTS_ERROR_RATE)
+        return _synthesize_response(input)
+
+
+class AsyncStubCompletions:
+    async def create(self, **params):
+        await asyncio.sleep(llm_first_token())
+        _fail("LLM", STUB_LLM_ERROR_RATE)
+
+        async def stream():
+            for chunk in _completion_chunks():
+                yield chunk
+                await asyncio.sleep(llm_token_interval())
+        return stream()
+
+
+class AsyncStubQuery(StubQuery):
+    async def execute(self):
+        await asyncio.sleep(db_latency())
+        return SimpleNamespace(data=[])
+
+
+class AsyncStubSupabaseClient:
+    def table(self, name):
+        return AsyncStubQuery()
+
+
+def install_sync_stubs(services=None):
+    """Replace the blocking service clients (used by app.py); services defaults to STUB_SERVICES"""
+    services = STUB_SERVICES if services is None else services
+    if "stt" in services:
+        stt_module.stt_client = StubSpeechClient()
+        stt_module.use_google_cloud = True
+    if "tts" in services:
+        tts_module.client = StubTextToSpeechClient()
+        tts_module.audio_cache = tts_module.segment_cache = None  # Every turn must reach the (stub) TTS service
+    if "llm" in services:
+        llm_module.response_cache = None  # ...and the (stub) LLM
+        llm_module.client = SimpleNamespace(chat=SimpleNamespace(completions=StubCompletions()))
+        llm_module.provider, llm_module.model_name = "openai", "stub-model"
+    if "db" in services:
+        memory_module.supabase_client = StubSupabaseClient()
+    print(f"🧪 Blocking service stubs installed: {', '.join(sorted(services))} "
+          f"({len(corpus_transcripts)} corpus transcripts)")
+
+
+def install_async_stubs(services=None):
+    """Replace the asyncio service clients (used by asgi_app.py); call inside the event loop"""
+    services = STUB_SERVICES if services is None else services
+    install_sync_stubs(services)  # Sync clients still back the whisper/streaming fallbacks
+    if "stt" in services:
+        stt_module.async_stt_client = AsyncStubSpeechClient()
+    if "tts" in services:
+        tts_module.async_client = AsyncStubTextToSpeechClient()
+    if "llm" in services:
+        llm_module.async_client = SimpleNamespace(chat=SimpleNamespace(completions=AsyncStubCompletions()))
+    if "db" in services:
+        memory_module.async_supabase_client = AsyncStubSupabaseClient()
+    print("🧪 Async service stubs installed")
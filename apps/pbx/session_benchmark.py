@@ -0,0 +1,158 @@
+# session_benchmark.py
+"""
+Memory per live session: the previous dataclass layout (per-instance __dict__, untrimmed history)
+against the slotted records in session_manager and the encoded records in the memory session store.
+
+Sessions are a mix of general chat and callers part way through an application; each carries
+--history-entries conversation turns. Bytes are measured with tracemalloc.
+
+Usage:
+    python session_benchmark.py                       # 10k and 100k sessions
+    python session_benchmark.py --sessions 1000000 --history-entries 40
+"""
+
+import gc
+import time
+import random
+import argparse
+import tracemalloc
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import session_store
+from session_manager import ConversationState, SessionData, SESSION_HISTORY_MAX_ENTRIES, encode_session
+
+# Share of sessions in the middle of a loan application (the rest are general chat / FAQ)
+APPLICATION_SHARE = 0.3
+
+
+# Layout before slotted records, frozen for comparison
+@dataclass
+class LegacyApplicationData:
+    full_name: Optional[str] = None
+    dpi: Optional[str] = None
+    date_of_birth: Optional[str] = None
+    age: Optional[int] = None
+    address: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    is_minimum_age: Optional[bool] = None
+    is_guatemalan_resident: Optional[bool] = None
+    has_minimum_income: Optional[bool] = None
+    monthly_income: Optional[float] = None
+    employment_status: Optional[str] = None
+    company_name: Optional[str] = None
+    employment_time: Optional[str] = None
+    business_type: Optional[str] = None
+    loan_amount: Optional[float] = None
+    loan_purpose: Optional[str] = None
+    consent_given: Optional[bool] = None
+    wants_email_confirmation: Optional[bool] = None
+    application_id: Optional[str] = None
+    created_at: Optional[str] = None
+    qualified: Optional[bool] = None
+
+
+@dataclass
+class LegacySessionData:
+    session_id: str
+    current_state: ConversationState = ConversationState.GENERAL_CHAT
+    application_data: LegacyApplicationData = field(default_factory=LegacyApplicationData)
+    last_faq_response: Optional[str] = None
+    retry_count: int = 0
+    last_user_input: Optional[str] = None
+    conversation_history: List[Dict[str, Any]] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    last_activity: float = field(default_factory=time.time)
+    has_been_introduced: bool = False
+
+
+def _history_entry(index: int) -> Dict[str, Any]:
+    return {"role": "user" if index % 2 == 0 else "assistant", "content": f"mensaje {index} de la conversación"}
+
+
+def populate(session, rng: random.Random, history_entries: int, history: Callable[[], Any]) -> None:
+    """Fill a session like a live caller: introduced, a last input, history, maybe half an application"""
+    session.has_been_introduced = True
+    session.last_user_input = f"quiero saber sobre el préstamo {rng.randint(1, 10**6)}"
+    if history_entries:
+        session.conversation_history = history()
+        for index in range(history_entries):
+            session.conversation_history.append(_history_entry(index))
+    if rng.random() < APPLICATION_SHARE:
+        session.current_state = ConversationState.STATE_ASK_EMPLOYMENT_STATUS
+        application = session.application_data
+        application.application_id = f"APP_{rng.randint(10**9, 10**10)}_{rng.getrandbits(32):08x}"
+        application.created_at = "2025-01-01 10:00:00"
+        application.full_name = f"Cliente {rng.randint(1, 10**6)} Pérez"
+        application.dpi = str(rng.randint(10**12, 10**13 - 1))
+        application.age = rng.randint(18, 80)
+        application.is_minimum_age = application.is_guatemalan_resident = application.has_minimum_income = True
+        application.monthly_income = float(rng.randint(3000, 30000))
+        application.phone = f"5{rng.randint(1000000, 9999999)}"
+
+
+def measure(build: Callable[[int], Any], sessions: int) -> float:
+    """Bytes allocated per session while holding `sessions` of them"""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    held = build(sessions)
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del held
+    gc.collect()
+    return used / sessions
+
+
+def run(sessions: int, history_entries: int) -> Dict[str, float]:
+    def legacy(count):
+        rng = random.Random(7)
+        held = {}
+        for i in range(count):
+            session = LegacySessionData(session_id=f"call-{i}")
+            populate(session, rng, history_entries, list)
+            held[session.session_id] = session
+        return held
+
+    def slotted(count):
+        rng = random.Random(7)
+        held = {}
+        for i in range(count):
+            session = SessionData(session_id=f"call-{i}")
+            populate(session, rng, history_entries, lambda: deque(maxlen=SESSION_HISTORY_MAX_ENTRIES))
+            held[session.session_id] = session
+        return held
+
+    def stored(count):
+        rng = random.Random(7)
+        store = session_store.MemorySessionStore()
+        now = time.time()
+        for i in range(count):
+            session = SessionData(session_id=f"call-{i}")
+            populate(session, rng, history_entries, lambda: deque(maxlen=SESSION_HISTORY_MAX_ENTRIES))
+            store.compare_and_set(session.session_id, session_store.NEW_SESSION_VERSION, encode_session(session), now + 1800)
+        return store
+
+    return {"legacy": measure(legacy, sessions), "slotted": measure(slotted, sessions), "store": measure(stored, sessions)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per live session by record layout")
+    parser.add_argument("--sessions", default="10000,100000", help="Comma-separated session counts")
+    parser.add_argument("--history-entries", type=int, default=30, help="Conversation turns per session")
+    args = parser.parse_args()
+
+    print(f"📦 Bytes per session ({args.history_entries} history entries, ring buffer keeps {SESSION_HISTORY_MAX_ENTRIES}, "
+          f"{APPLICATION_SHARE:.0%} mid-application)")
+    for count in (int(value) for value in args.sessions.split(",")):
+        result = run(count, args.history_entries)
+        print(f"  {count:>8} sessions | legacy {result['legacy']:8.0f} B | slotted {result['slotted']:8.0f} B "
+              f"({result['legacy'] / result['slotted']:.1f}x) | memory store {result['store']:8.0f} B "
+              f"({result['legacy'] / result['store']:.1f}x) | sessions per GB: {2**30 / result['legacy']:,.0f} -> "
+              f"{2**30 / result['slotted']:,.0f} live / {2**30 / result['store']:,.0f} stored")
+
+
+if __name__ == "__main__":
+    main()
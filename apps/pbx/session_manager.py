@@ -4,12 +4,25 @@ Session Management System for Ana - AI Contact Center Agent
 Handles conversation states, application data, and flow control
 """
 
+import os
+import json
 import time
 import uuid
-from typing import Dict, Any, Optional, List
-from dataclasses import dataclass, field
+from collections import deque
+from typing import Deque, Dict, Any, Optional, List, Callable, TypeVar
+from dataclasses import dataclass, field, fields
 from enum import Enum
 
+import session_store
+
+SESSION_TIMEOUT_SECONDS = int(os.environ.get("SESSION_TIMEOUT_SECONDS", "1800"))  # 30 minutes
+# Attempts of a read-modify-write before giving up on a session another worker keeps changing
+SESSION_CAS_MAX_ATTEMPTS = 10
+# Conversation history entries kept per session (oldest dropped first)
+SESSION_HISTORY_MAX_ENTRIES = int(os.environ.get("SESSION_HISTORY_MAX_ENTRIES", "20"))
+
+T = TypeVar("T")
+
 class ConversationState(Enum):
     """Conversation states for the loan application flow"""
     # General states
@@ -51,7 +64,11 @@ class ConversationState(Enum):
     STATE_ASK_EMAIL_CONFIRMATION_PREFERENCE = "ask_email_confirmation_preference"
     STATE_END_APPLICATION_FLOW = "end_application_flow"
 
-@dataclass
+# Small int code per state for encoded sessions (definition order: add new states at the end)
+STATES_BY_CODE = list(ConversationState)
+STATE_CODES = {state: code for code, state in enumerate(STATES_BY_CODE)}
+
+@dataclass(slots=True)
 class ApplicationData:
     """Stores loan application data being collected"""
     # Personal Information
@@ -88,7 +105,7 @@ class ApplicationData:
     created_at: Optional[str] = None
     qualified: Optional[bool] = None
 
-@dataclass
+@dataclass(slots=True)
 class SessionData:
     """Stores session-specific data"""
     session_id: str
@@ -97,52 +114,128 @@ class SessionData:
     last_faq_response: Optional[str] = None
     retry_count: int = 0  # For validation retries
     last_user_input: Optional[str] = None
-    conversation_history: List[Dict[str, Any]] = field(default_factory=list)
+    conversation_history: Optional[Deque[Dict[str, Any]]] = None  # Ring buffer, created on the first entry
     created_at: float = field(default_factory=time.time)
     last_activity: float = field(default_factory=time.time)
     has_been_introduced: bool = False  # Track if Ana has been introduced
 
+# Encoded sessions: a JSON array with the state as its code and the application data as a dict of its non-empty fields
+SESSION_FORMAT_VERSION = 2
+_APPLICATION_FIELDS = [f.name for f in fields(ApplicationData)]
+
+def encode_session(session: SessionData) -> bytes:
+    """Compact bytes for a session store"""
+    application = {name: value for name in _APPLICATION_FIELDS
+                   if (value := getattr(session.application_data, name)) is not None}
+    history = list(session.conversation_history) if session.conversation_history else None
+    record = [SESSION_FORMAT_VERSION, session.session_id, STATE_CODES[session.current_state], application,
+              session.last_faq_response, session.retry_count, session.last_user_input, history,
+              session.created_at, session.last_activity, session.has_been_introduced]
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def decode_session(data: bytes) -> SessionData:
+    """Inverse of encode_session"""
+    (format_version, session_id, state, application, last_faq_response, retry_count, last_user_input,
+     conversation_history, created_at, last_activity, has_been_introduced) = json.loads(data)
+    if format_version != SESSION_FORMAT_VERSION:
+        raise ValueError(f"Unsupported session format {format_version}")
+    return SessionData(
+        session_id=session_id,
+        current_state=STATES_BY_CODE[state],
+        application_data=ApplicationData(**{name: value for name, value in application.items() if name in _APPLICATION_FIELDS}),
+        last_faq_response=last_faq_response,
+        retry_count=retry_count,
+        last_user_input=last_user_input,
+        conversation_history=deque(conversation_history, maxlen=SESSION_HISTORY_MAX_ENTRIES) if conversation_history else None,
+        created_at=created_at,
+        last_activity=last_activity,
+        has_been_introduced=has_been_introduced
+    )
+
 class SessionManager:
-    """Manages conversation sessions and state transitions"""
+    """Manages conversation sessions and state transitions on a pluggable session store"""
+    
+    def __init__(self, store=None):
+        self.store = store if store is not None else session_store.create_session_store()
+        self.session_timeout = SESSION_TIMEOUT_SECONDS
+        self.expiry_listeners: List[Callable[[str], None]] = []
+        self.cas_conflicts = 0
+    
+    def add_expiry_listener(self, callback: Callable[[str], None]) -> None:
+        """Register a callback(session_id) run when a session expires"""
+        self.expiry_listeners.append(callback)
     
-    def __init__(self):
-        self.sessions: Dict[str, SessionData] = {}
-        self.session_timeout = 1800  # 30 minutes
+    def _update(self, session_id: str, mutate: Callable[[SessionData], T]) -> T:
+        """
+        Apply mutate(session) atomically: read, change, compare-and-set on the version read,
+        and start over if another worker wrote the session in between.
+        Returns:
+            Whatever mutate returned.
+        """
+        for _ in range(SESSION_CAS_MAX_ATTEMPTS):
+            record = self.store.load(session_id)
+            if record is None:
+                version, session = session_store.NEW_SESSION_VERSION, SessionData(session_id=session_id)
+            else:
+                version, session = record[0], decode_session(record[1])
+            result = mutate(session)
+            session.last_activity = time.time()
+            if self.store.compare_and_set(session_id, version, encode_session(session), session.last_activity + self.session_timeout):
+                return result
+            self.cas_conflicts += 1
+        raise RuntimeError(f"Session {session_id} changed concurrently {SESSION_CAS_MAX_ATTEMPTS} times in a row")
     
     def get_session(self, session_id: str) -> SessionData:
-        """Get or create session data"""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = SessionData(session_id=session_id)
+        """Get or create session data. The result is a snapshot: change it through the methods below."""
+        record = self.store.load(session_id)
+        if record is None:
+            return self._update(session_id, lambda session: session)
         
         # Update last activity
-        self.sessions[session_id].last_activity = time.time()
-        return self.sessions[session_id]
+        now = time.time()
+        self.store.touch(session_id, now + self.session_timeout)
+        session = decode_session(record[1])
+        session.last_activity = now
+        return session
     
-    def update_session_state(self, session_id: str, new_state: ConversationState) -> None:
-        """Update session state"""
-        session = self.get_session(session_id)
-        session.current_state = new_state
-        session.last_activity = time.time()
-        
-        # Reset retry count when changing states
-        if new_state != session.current_state:
-            session.retry_count = 0
+    def update_session_state(self, session_id: str, new_state: ConversationState,
+                             expected_state: Optional[ConversationState] = None) -> bool:
+        """
+        Update session state.
+        Args:
+            expected_state: Only transition if the session is still in this state.
+        Returns:
+            bool: False if the session had left expected_state.
+        """
+        def transition(session: SessionData) -> bool:
+            if expected_state is not None and session.current_state != expected_state:
+                return False
+            session.current_state = new_state
+            return True
+        return self._update(session_id, transition)
     
     def increment_retry_count(self, session_id: str) -> int:
         """Increment retry count for validation failures"""
-        session = self.get_session(session_id)
-        session.retry_count += 1
-        return session.retry_count
+        def increment(session: SessionData) -> int:
+            session.retry_count += 1
+            return session.retry_count
+        return self._update(session_id, increment)
     
     def reset_retry_count(self, session_id: str) -> None:
         """Reset retry count"""
-        session = self.get_session(session_id)
-        session.retry_count = 0
+        self._update(session_id, lambda session: setattr(session, "retry_count", 0))
     
     def update_application_data(self, session_id: str, field: str, value: Any) -> None:
         """Update application data field"""
-        session = self.get_session(session_id)
-        setattr(session.application_data, field, value)
+        self._update(session_id, lambda session: setattr(session.application_data, field, value))
+    
+    def add_history_entry(self, session_id: str, entry: Dict[str, Any]) -> None:
+        """Append to the session's conversation history, dropping the oldest entry when full"""
+        def append(session: SessionData) -> None:
+            if session.conversation_history is None:
+                session.conversation_history = deque(maxlen=SESSION_HISTORY_MAX_ENTRIES)
+            session.conversation_history.append(entry)
+        self._update(session_id, append)
     
     def get_application_data(self, session_id: str) -> ApplicationData:
         """Get application data"""
@@ -151,17 +244,17 @@ class SessionManager:
     
     def start_application_flow(self, session_id: str) -> None:
         """Initialize application flow"""
-        session = self.get_session(session_id)
-        session.current_state = ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION
-        session.application_data = ApplicationData()
-        session.application_data.application_id = f"APP_{int(time.time())}_{uuid.uuid4().hex[:8]}"
-        session.application_data.created_at = time.strftime("%Y-%m-%d %H:%M:%S")
-        session.retry_count = 0
+        def start(session: SessionData) -> None:
+            session.current_state = ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION
+            session.application_data = ApplicationData()
+            session.application_data.application_id = f"APP_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+            session.application_data.created_at = time.strftime("%Y-%m-%d %H:%M:%S")
+            session.retry_count = 0
+        self._update(session_id, start)
     
     def mark_as_introduced(self, session_id: str) -> None:
         """Mark that Ana has been introduced to this user"""
-        session = self.get_session(session_id)
-        session.has_been_introduced = True
+        self._update(session_id, lambda session: setattr(session, "has_been_introduced", True))
     
     def has_been_introduced(self, session_id: str) -> bool:
         """Check if Ana has been introduced to this user"""
@@ -180,27 +273,31 @@ class SessionManager:
         
         return all(qual is True for qual in qualifications)
     
-    def cleanup_expired_sessions(self) -> None:
-        """Remove expired sessions"""
-        current_time = time.time()
-        expired_sessions = [
-            session_id for session_id, session_data in self.sessions.items()
-            if current_time - session_data.last_activity > self.session_timeout
-        ]
+    def cleanup_expired_sessions(self) -> List[str]:
+        """Remove expired sessions, notify expiry listeners and return the expired ids"""
+        expired_sessions = self.store.pop_expired(time.time())
         
         for session_id in expired_sessions:
-            del self.sessions[session_id]
+            for callback in self.expiry_listeners:
+                try:
+                    callback(session_id)
+                except Exception as e:
+                    print(f"❌ Session expiry listener error for {session_id}: {e}")
+        
+        return expired_sessions
     
     def get_session_summary(self, session_id: str) -> Dict[str, Any]:
         """Get session summary for debugging"""
-        if session_id not in self.sessions:
+        record = self.store.load(session_id)
+        if record is None:
             return {"error": "Session not found"}
         
-        session = self.sessions[session_id]
+        session = decode_session(record[1])
         return {
             "session_id": session_id,
             "current_state": session.current_state.value,
             "retry_count": session.retry_count,
+            "version": record[0],
             "application_data": {
                 "application_id": session.application_data.application_id,
                 "full_name": session.application_data.full_name,
@@ -209,6 +306,10 @@ class SessionManager:
             },
             "last_activity": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(session.last_activity))
         }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Session store backend, size and compare-and-set conflicts"""
+        return dict(self.store.stats(), cas_conflicts=self.cas_conflicts, timeout_seconds=self.session_timeout)
 
 # Global session manager instance
 session_manager = SessionManager()
@@ -0,0 +1,284 @@
+# session_store.py
+"""
+Session storage backends for session_manager.
+Every backend stores an encoded session (bytes) with a version and an expiry time:
+- load() returns (version, data)
+- compare_and_set() writes only if the version is unchanged, so concurrent turns (threads,
+  Gunicorn workers, nodes) never overwrite each other's changes
+- pop_expired() removes and returns expired ids in O(log n) per session (min-heap in memory,
+  an expires_at index in SQLite, a sorted set in Redis)
+
+Backends: "memory" (one process), "sqlite" (processes on one node), "redis" (any number of nodes;
+SESSION_REDIS_URL=fakeredis:// gives an in-process stand-in for local runs).
+"""
+
+import os
+import heapq
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory").lower()
+SESSION_SQLITE_PATH = os.environ.get("SESSION_SQLITE_PATH", os.path.join("cache", "sessions.db"))
+SESSION_REDIS_URL = os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/0")
+SESSION_REDIS_PREFIX = os.environ.get("SESSION_REDIS_PREFIX", "pbx:")
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+try:
+    import fakeredis
+    FAKEREDIS_AVAILABLE = True
+except ImportError:
+    FAKEREDIS_AVAILABLE = False
+
+# Version of a session that does not exist yet: compare_and_set(id, 0, ...) creates it
+NEW_SESSION_VERSION = 0
+
+
+class MemorySessionStore:
+    """Process-local store with a min-heap of expiry times"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records: Dict[str, List[Any]] = {}  # session_id -> [version, data, expires_at]
+        self._expiry_heap: List[Tuple[float, str]] = []  # (expires_at, session_id); stale entries are skipped
+
+    def load(self, session_id: str) -> Optional[Tuple[int, bytes]]:
+        with self._lock:
+            record = self._records.get(session_id)
+            return (record[0], record[1]) if record is not None else None
+
+    def compare_and_set(self, session_id: str, expected_version: int, data: bytes, expires_at: float) -> bool:
+        """Store data as version expected_version + 1 if the stored version is still expected_version"""
+        with self._lock:
+            record = self._records.get(session_id)
+            if (record[0] if record is not None else NEW_SESSION_VERSION) != expected_version:
+                return False
+            self._records[session_id] = [expected_version + 1, data, expires_at]
+            self._push_expiry(session_id, expires_at)
+            return True
+
+    def touch(self, session_id: str, expires_at: float) -> None:
+        """Push back the expiry of an existing session"""
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is not None:
+                record[2] = expires_at
+                self._push_expiry(session_id, expires_at)
+
+    def _push_expiry(self, session_id: str, expires_at: float) -> None:
+        heapq.heappush(self._expiry_heap, (expires_at, session_id))
+        if len(self._expiry_heap) > 2 * len(self._records) + 1024:
+            # Mostly superseded entries: rebuild from the live records
+            self._expiry_heap = [(record[2], sid) for sid, record in self._records.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._records.pop(session_id, None)
+
+    def pop_expired(self, now: float, limit: int = 1000) -> List[str]:
+        """Remove and return up to limit sessions whose expiry is <= now"""
+        expired = []
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now and len(expired) < limit:
+                expires_at, session_id = heapq.heappop(self._expiry_heap)
+                record = self._records.get(session_id)
+                if record is not None and record[2] == expires_at:
+                    del self._records[session_id]
+                    expired.append(session_id)
+        return expired
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.name, "sessions": len(self._records), "expiry_heap": len(self._expiry_heap),
+                    "bytes": sum(len(record[1]) for record in self._records.values())}
+
+
+class SQLiteSessionStore:
+    """Node-local store shared by every process that opens the same file (WAL mode)"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SESSION_SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+                           "expires_at REAL NOT NULL, data BLOB NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit: every statement below is atomic on its own
+            connection = self._local.connection = sqlite3.connect(self.path, isolation_level=None, timeout=5.0)
+            connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def load(self, session_id: str) -> Optional[Tuple[int, bytes]]:
+        row = self._connection().execute("SELECT version, data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return (row[0], bytes(row[1])) if row is not None else None
+
+    def compare_and_set(self, session_id: str, expected_version: int, data: bytes, expires_at: float) -> bool:
+        if expected_version == NEW_SESSION_VERSION:
+            cursor = self._connection().execute(
+                "INSERT OR IGNORE INTO sessions (session_id, version, expires_at, data) VALUES (?, ?, ?, ?)",
+                (session_id, expected_version + 1, expires_at, data))
+        else:
+            cursor = self._connection().execute(
+                "UPDATE sessions SET version = ?, expires_at = ?, data = ? WHERE session_id = ? AND version = ?",
+                (expected_version + 1, expires_at, data, session_id, expected_version))
+        return cursor.rowcount == 1
+
+    def touch(self, session_id: str, expires_at: float) -> None:
+        self._connection().execute("UPDATE sessions SET expires_at = ? WHERE session_id = ?", (expires_at, session_id))
+
+    def delete(self, session_id: str) -> None:
+        self._connection().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def pop_expired(self, now: float, limit: int = 1000) -> List[str]:
+        # One statement, so two processes never both report the same expiry
+        rows = self._connection().execute(
+            "DELETE FROM sessions WHERE session_id IN "
+            "(SELECT session_id FROM sessions WHERE expires_at <= ? ORDER BY expires_at LIMIT ?) RETURNING session_id",
+            (now, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        sessions, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions").fetchone()
+        return {"backend": self.name, "path": self.path, "sessions": sessions, "bytes": size}
+
+
+class RedisSessionStore:
+    """Store on a Redis-protocol server: a hash per session plus one expiry sorted set"""
+
+    name = "redis"
+
+    def __init__(self, client, prefix: str = SESSION_REDIS_PREFIX):
+        self.client = client
+        self.prefix = prefix
+        self.expiry_key = f"{prefix}session-expiry"
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}session:{session_id}"
+
+    def load(self, session_id: str) -> Optional[Tuple[int, bytes]]:
+        version, data = self.client.hmget(self._key(session_id), "v", "d")
+        return (int(version), data) if version is not None else None
+
+    def compare_and_set(self, session_id: str, expected_version: int, data: bytes, expires_at: float) -> bool:
+        key = self._key(session_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                version = pipe.hget(key, "v")
+                if (int(version) if version is not None else NEW_SESSION_VERSION) != expected_version:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.hset(key, mapping={"v": expected_version + 1, "d": data, "e": expires_at})
+                pipe.zadd(self.expiry_key, {session_id: expires_at})
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def touch(self, session_id: str, expires_at: float) -> None:
+        key = self._key(session_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if not pipe.exists(key):
+                    pipe.unwatch()
+                    return
+                pipe.multi()
+                pipe.hset(key, "e", expires_at)  # Also invalidates a concurrent pop_expired of this session
+                pipe.zadd(self.expiry_key, {session_id: expires_at})
+                pipe.execute()
+            except redis.WatchError:
+                pass  # Deleted or rewritten meanwhile; a rewrite sets its own expiry
+
+    def delete(self, session_id: str) -> None:
+        with self.client.pipeline() as pipe:
+            pipe.delete(self._key(session_id))
+            pipe.zrem(self.expiry_key, session_id)
+            pipe.execute()
+
+    def pop_expired(self, now: float, limit: int = 1000) -> List[str]:
+        expired = []
+        for member in self.client.zrangebyscore(self.expiry_key, "-inf", now, start=0, num=limit):
+            session_id = member.decode("utf-8") if isinstance(member, bytes) else member
+            key = self._key(session_id)
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    expires_at = pipe.hget(key, "e")
+                    if expires_at is not None and float(expires_at) > now:
+                        pipe.unwatch()  # Touched since the range query
+                        continue
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.zrem(self.expiry_key, session_id)
+                    _, removed = pipe.execute()
+                except redis.WatchError:
+                    continue
+            if removed:  # Another worker may have expired it first
+                expired.append(session_id)
+        return expired
+
+    def count(self) -> int:
+        return self.client.zcard(self.expiry_key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "sessions": self.count()}
+
+
+def create_session_store(backend: str = SESSION_STORE):
+    """
+    Build the configured session store.
+
+    Args:
+        backend: "memory", "sqlite" or "redis".
+
+    Returns:
+        A store; falls back to memory when the backend is unavailable.
+    """
+    try:
+        if backend == "sqlite":
+            store = SQLiteSessionStore(SESSION_SQLITE_PATH)
+            print(f"✅ Sessions stored in SQLite at {SESSION_SQLITE_PATH}")
+            return store
+        if backend == "redis":
+            if SESSION_REDIS_URL.startswith("fakeredis://"):
+                if not FAKEREDIS_AVAILABLE:
+                    raise ImportError("fakeredis not installed (pip install fakeredis)")
+                client = fakeredis.FakeRedis()
+            else:
+                if not REDIS_AVAILABLE:
+                    raise ImportError("redis not installed (pip install redis)")
+                client = redis.Redis.from_url(SESSION_REDIS_URL)
+                client.ping()
+            print(f"✅ Sessions stored in Redis at {SESSION_REDIS_URL}")
+            return RedisSessionStore(client)
+        if backend != "memory":
+            print(f"⚠️  Unknown SESSION_STORE '{backend}'")
+    except Exception as e:
+        print(f"❌ Session store '{backend}' unavailable: {e}")
+        print("   Falling back to in-memory sessions (not shared between workers)")
+    return MemorySessionStore()
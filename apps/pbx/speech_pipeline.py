@@ -0,0 +1,358 @@
+# speech_pipeline.py
+"""
+Speech Pipeline for Ana - AI Contact Center Agent
+Text cleanup, sentence splitting and bounded-concurrency TTS synthesis
+that hands results back strictly in sentence order.
+
+Template responses (fixed text with a few variable parts, e.g. the application summary) are
+filled with fill_template() and split with split_segments(): sentences with variable parts come
+back as SplicedSentence, which tts_module synthesizes per segment so only the variable parts
+reach the TTS service.
+"""
+
+import os
+import re
+import string
+import asyncio
+import time
+import queue
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import tracing
+
+# Max concurrent TTS requests per turn (each response gets its own budget, so callers do not queue behind each other)
+TTS_MAX_WORKERS = int(os.environ.get("TTS_MAX_WORKERS", "4"))
+# Threads shared by all turns of a process; size for expected callers x TTS_MAX_WORKERS (threads start on demand)
+TTS_POOL_WORKERS = int(os.environ.get("TTS_POOL_WORKERS", "256"))
+# Process-wide cap for the ASGI server, where requests are coroutines instead of threads
+TTS_MAX_CONCURRENCY_ASYNC = int(os.environ.get("TTS_MAX_CONCURRENCY_ASYNC", "256"))
+
+# Sentence boundary: punctuation, whitespace, then an uppercase letter or opening ¿/¡
+SENTENCE_BOUNDARY_RE = re.compile(r'(?<=[.!?])\s+(?=[A-ZÁÉÍÓÚÜÑ¿¡])')
+_WHITESPACE_RE = re.compile(r'\s+')
+# Keep % symbol for interest rates
+_UNSUPPORTED_CHARS_RE = re.compile(r'[^\w\s.!?¿¡,:;()\-áéíóúüñÁÉÍÓÚÜÑ%]')
+MIN_SENTENCE_LENGTH = 5
+
+_executor = ThreadPoolExecutor(max_workers=TTS_POOL_WORKERS, thread_name_prefix="tts")
+_async_semaphore = None
+_END_OF_INPUT = object()
+
+
+def clean_response_text(text: str) -> str:
+    """Normalize unicode and strip characters the TTS voice should not read"""
+    clean_text = unicodedata.normalize('NFKC', text)
+    clean_text = _WHITESPACE_RE.sub(' ', clean_text.strip())
+    return _UNSUPPORTED_CHARS_RE.sub('', clean_text)
+
+
+def _clean_fragment(text: str) -> str:
+    """clean_response_text for a piece of a longer text (edges are not stripped)"""
+    return _UNSUPPORTED_CHARS_RE.sub('', _WHITESPACE_RE.sub(' ', unicodedata.normalize('NFKC', text)))
+
+
+def split_sentences(clean_text: str) -> List[str]:
+    """Split cleaned text into sentences, keeping punctuation with each sentence"""
+    sentences = SENTENCE_BOUNDARY_RE.split(clean_text)
+    return [s.strip() for s in sentences if s.strip() and len(s) > MIN_SENTENCE_LENGTH]
+
+
+class SentenceSplitter:
+    """
+    Incremental version of split_sentences for streamed text (e.g. LLM tokens).
+
+    feed() returns each sentence as soon as the boundary after it has been seen, using
+    the same boundary rule as split_sentences; flush() returns the trailing text.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        if not chunk:
+            return []
+        chunk = _clean_fragment(chunk)
+        buffer = _WHITESPACE_RE.sub(' ', self.buffer + chunk)
+
+        sentences = []
+        start = 0
+        for boundary in SENTENCE_BOUNDARY_RE.finditer(buffer):
+            sentence = buffer[start:boundary.start()].strip()
+            if sentence and len(sentence) > MIN_SENTENCE_LENGTH:
+                sentences.append(sentence)
+            start = boundary.end()
+        self.buffer = buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        sentences = split_sentences(self.buffer.strip())
+        self.buffer = ""
+        return sentences
+
+
+# --- Template responses ---
+
+Segments = List[Tuple[str, bool]]  # (text, is_variable)
+
+
+class SplicedSentence(str):
+    """A sentence with variable parts; .segments lists its (text, is_variable) parts in order"""
+
+    segments: Segments
+
+    def __new__(cls, text: str, segments: Segments):
+        sentence = super().__new__(cls, text)
+        sentence.segments = segments
+        return sentence
+
+
+def fill_template(template: str, **values) -> Segments:
+    """
+    Fill a str.format template and keep track of which parts came from values.
+    "Monto: {amount:,.0f} quetzales" -> [("Monto: ", False), ("50,000", True), (" quetzales", False)]
+    """
+    formatter = string.Formatter()
+    segments = []
+    for literal, field, spec, conversion in formatter.parse(template):
+        if literal:
+            segments.append((literal, False))
+        if field is not None:
+            value = formatter.convert_field(formatter.get_field(field, (), values)[0], conversion)
+            segments.append((formatter.format_field(value, spec or ""), True))
+    return segments
+
+
+def template_text(segments: Segments) -> str:
+    """The full text of filled template segments"""
+    return "".join(text for text, _ in segments)
+
+
+def probe_template(template: str) -> Segments:
+    """Fill a template with placeholder values, to find its fixed segments without real data (prewarming)"""
+    segments = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        if literal:
+            segments.append((literal, False))
+        if field is not None:
+            segments.append(("x", True))
+    return segments
+
+
+def _sentence_segments(text: str, start: int, end: int, variable_spans: List[Tuple[int, int]]) -> Optional[Segments]:
+    """Segments of text[start:end], or None when no variable part falls inside it"""
+    segments = []
+    position = start
+    for span_start, span_end in variable_spans:
+        span_start, span_end = max(span_start, start), min(span_end, end)
+        if span_start >= span_end:
+            continue
+        segments.append((text[position:span_start], False))
+        segments.append((text[span_start:span_end], True))
+        position = span_end
+    if not segments:
+        return None
+    segments.append((text[position:end], False))
+    return [(part.strip(), is_variable) for part, is_variable in segments if part.strip()]
+
+
+def split_segments(segments: Segments) -> List[str]:
+    """
+    split_sentences for filled template segments. Sentences without variable parts are
+    plain strings (cached like any other sentence); the rest are SplicedSentence.
+    """
+    text = ""
+    variable_spans = []
+    for part, is_variable in segments:
+        part = _clean_fragment(part)
+        if text.endswith(" ") and part.startswith(" "):
+            part = part[1:]
+        if is_variable:
+            variable_spans.append((len(text), len(text) + len(part)))
+        text += part
+
+    sentences = []
+    start = 0
+    boundaries = [(match.start(), match.end()) for match in SENTENCE_BOUNDARY_RE.finditer(text)]
+    for end, next_start in boundaries + [(len(text), len(text))]:
+        sentence = text[start:end].strip()
+        if sentence and len(sentence) > MIN_SENTENCE_LENGTH:
+            sentence_segments = _sentence_segments(text, start, end, variable_spans)
+            sentences.append(SplicedSentence(sentence, sentence_segments) if sentence_segments else sentence)
+        start = next_start
+    return sentences
+
+
+def iter_sentences(text_chunks: Iterable[str]) -> Iterator[str]:
+    """Yield sentences from streamed text as soon as each one is complete"""
+    splitter = SentenceSplitter()
+    for chunk in text_chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.flush()
+
+
+async def iter_sentences_async(text_chunks: AsyncIterable[str]) -> AsyncIterator[str]:
+    """Async version of iter_sentences (e.g. for an async LLM stream)"""
+    splitter = SentenceSplitter()
+    async for chunk in text_chunks:
+        for sentence in splitter.feed(chunk):
+            yield sentence
+    for sentence in splitter.flush():
+        yield sentence
+
+
+def synthesize_in_order(sentences: Iterable[str],
+                        synthesize: Callable[[int, str], Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Submit every sentence to the TTS worker pool as soon as it is available and
+    yield the results strictly in sentence order. At most TTS_MAX_WORKERS sentences
+    of this call are in flight at once. If the consumer stops early (e.g. the client
+    disconnected), no further sentences are read or submitted and queued ones are cancelled.
+
+    Args:
+        sentences: Sentences to synthesize, consumed in a background thread so slow
+                   producers (e.g. a streaming LLM) do not hold back finished audio.
+        synthesize: Callable(index, sentence) run on a worker thread.
+
+    Yields:
+        Dict with keys: 'index', 'text', 'result', 'error', 'elapsed'
+    """
+    submitted: "queue.Queue" = queue.Queue()
+    synthesize = tracing.bind(synthesize)  # Worker threads keep the caller's trace
+    in_flight = threading.BoundedSemaphore(TTS_MAX_WORKERS)  # This turn's share of the pool
+    stopped = threading.Event()  # Set when the consumer is done, also on early exit
+
+    def submit(index, sentence):
+        in_flight.acquire()  # Cancelled futures release it too, so a stop never leaves this blocked
+        if stopped.is_set():
+            in_flight.release()
+            return
+        submitted_at = time.time()
+        future = _executor.submit(synthesize, index, sentence)
+        future.add_done_callback(lambda _: in_flight.release())
+        submitted.put((index, sentence, submitted_at, future))
+        if stopped.is_set():
+            future.cancel()  # Consumer stopped while this was being submitted
+
+    def produce():
+        try:
+            for index, sentence in enumerate(sentences):
+                if stopped.is_set():
+                    break
+                submit(index, sentence)
+        except Exception as e:
+            submitted.put(e)
+        finally:
+            if stopped.is_set() and hasattr(sentences, "close"):
+                sentences.close()  # Stop the source too (e.g. the LLM stream of a caller who hung up)
+        submitted.put(_END_OF_INPUT)
+
+    threading.Thread(target=tracing.bind(produce), name="tts-producer", daemon=True).start()
+
+    try:
+        while True:
+            item = submitted.get()
+            if item is _END_OF_INPUT:
+                return
+            if isinstance(item, Exception):
+                raise item
+
+            index, sentence, submitted_at, future = item
+            try:
+                result, error = future.result(), None
+            except Exception as e:
+                result, error = None, e
+            yield {
+                'index': index,
+                'text': sentence,
+                'result': result,
+                'error': error,
+                'elapsed': time.time() - submitted_at
+            }
+    finally:
+        stopped.set()
+        while True:
+            try:
+                item = submitted.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple):
+                item[3].cancel()
+
+
+async def synthesize_in_order_async(sentences: Union[List[str], AsyncIterable[str]],
+                                    synthesize: Callable[[int, str], Awaitable[Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Async version of synthesize_in_order: every sentence becomes a task as soon as it
+    is available (at most TTS_MAX_WORKERS per call and TTS_MAX_CONCURRENCY_ASYNC per process
+    in flight) and results
+    are yielded strictly in sentence order. Unfinished tasks are cancelled if the
+    consumer stops early (e.g. the client disconnected).
+
+    Args:
+        sentences: List of sentences, or an async iterable consumed in a background task.
+        synthesize: Coroutine function (index, sentence).
+
+    Yields:
+        Dict with keys: 'index', 'text', 'result', 'error', 'elapsed'
+    """
+    global _async_semaphore
+    if _async_semaphore is None:
+        _async_semaphore = asyncio.Semaphore(TTS_MAX_CONCURRENCY_ASYNC)
+    semaphore = _async_semaphore
+    in_flight = asyncio.Semaphore(TTS_MAX_WORKERS)  # This turn's share
+    submitted: "asyncio.Queue" = asyncio.Queue()
+    tasks = []
+
+    async def run(index, sentence):
+        async with in_flight, semaphore:
+            return await synthesize(index, sentence)
+
+    def submit(index, sentence):
+        task = asyncio.ensure_future(run(index, sentence))
+        tasks.append(task)
+        submitted.put_nowait((index, sentence, time.time(), task))
+
+    if isinstance(sentences, (list, tuple)):
+        for index, sentence in enumerate(sentences):
+            submit(index, sentence)
+        submitted.put_nowait(_END_OF_INPUT)
+    else:
+        async def produce():
+            try:
+                index = 0
+                async for sentence in sentences:
+                    submit(index, sentence)
+                    index += 1
+            except Exception as e:
+                submitted.put_nowait(e)
+            submitted.put_nowait(_END_OF_INPUT)
+
+        tasks.append(asyncio.ensure_future(produce()))
+
+    try:
+        while True:
+            item = await submitted.get()
+            if item is _END_OF_INPUT:
+                return
+            if isinstance(item, Exception):
+                raise item
+
+            index, sentence, submitted_at, task = item
+            try:
+                result, error = await task, None
+            except Exception as e:
+                result, error = None, e
+            yield {
+                'index': index,
+                'text': sentence,
+                'result': result,
+                'error': error,
+                'elapsed': time.time() - submitted_at
+            }
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -1,34 +1,89 @@
 # stt_module.py
 import os
 import io
+import sys
+import math
+import array
+import wave
+import asyncio
+import time
+import queue
+import shutil
+import struct
+import operator
+import threading
+import subprocess
+import importlib.util
+
+import connection_warmup
+import whisper_pool
+import conversation_logger
+import tracing
+
+log = conversation_logger.get_logger("stt")
 
 # Global variables
 stt_client = None
-whisper_model = None
+async_stt_client = None  # Used by the ASGI server (asgi_app.py)
+whisper_pool_client = None  # Connection to the node's Whisper worker pool
 use_google_cloud = False
 
+# Streaming recognition backend: "google", "whisper" (local stand-in for offline testing) or "auto"
+STT_STREAMING_BACKEND = os.environ.get("STT_STREAMING_BACKEND", "auto").lower()
+
 # Try to import Google Cloud Speech
 try:
     from google.cloud import speech
+    from google.cloud.speech_v1.services.speech.transports import SpeechGrpcTransport, SpeechGrpcAsyncIOTransport
     from google.api_core import exceptions as google_exceptions
     GOOGLE_CLOUD_AVAILABLE = True
 except ImportError:
     GOOGLE_CLOUD_AVAILABLE = False
     print("⚠️  Google Cloud Speech not available, will use Whisper fallback")
 
-# Try to import Whisper as fallback
-try:
-    import whisper
-    WHISPER_AVAILABLE = True
-except ImportError:
-    WHISPER_AVAILABLE = False
+# Whisper runs in the node's worker pool (whisper_pool.py); this process only needs the package to start it
+WHISPER_AVAILABLE = importlib.util.find_spec("whisper") is not None
+if not WHISPER_AVAILABLE:
     print("⚠️  Whisper not available, install with: pip install openai-whisper")
 
+# When Google STT works, the Whisper backup pool starts in the "background" after startup or "lazy" on the first fallback
+WHISPER_BACKUP_LOAD = os.environ.get("WHISPER_BACKUP_LOAD", "background").lower()
+# How long a Whisper-only setup waits at startup for the first pool worker to load its model
+WHISPER_POOL_READY_TIMEOUT_SECONDS = float(os.environ.get("WHISPER_POOL_READY_TIMEOUT_SECONDS", "120"))
+whisper_model_size = "base"
+_whisper_lock = threading.Lock()
+_whisper_load_failed = False
+
+def get_whisper_pool():
+    """The node's Whisper worker pool, connected (and started if needed) on first use. None if unreachable."""
+    global whisper_pool_client, _whisper_load_failed
+    if whisper_pool_client is not None or _whisper_load_failed:
+        return whisper_pool_client
+    with _whisper_lock:
+        if whisper_pool_client is None and not _whisper_load_failed:
+            whisper_pool_client = whisper_pool.connect_or_start(whisper_model_size, autostart=WHISPER_AVAILABLE)
+            _whisper_load_failed = whisper_pool_client is None
+    return whisper_pool_client
+
+def load_whisper_backup_in_background():
+    """Connect to (or start) the Whisper pool off the request path (no-op when lazy or already connected)"""
+    if WHISPER_BACKUP_LOAD == "background" and whisper_pool_client is None:
+        threading.Thread(target=get_whisper_pool, name="whisper-pool-connect", daemon=True).start()
+
+def get_whisper_pool_stats():
+    """Queue time, batch size and worker state of the Whisper pool, or None if not connected"""
+    if whisper_pool_client is None:
+        return None
+    try:
+        return whisper_pool_client.stats()
+    except Exception as e:
+        return {"error": str(e)}
+
 def initialize_stt(model_size="base"):
     """
     Initializes STT service with Google Cloud first, Whisper as fallback.
     """
-    global stt_client, whisper_model, use_google_cloud
+    global stt_client, use_google_cloud, whisper_model_size
     
     # Try Google Cloud first
     if GOOGLE_CLOUD_AVAILABLE:
@@ -42,7 +97,8 @@ def initialize_stt(model_size="base"):
                 print("   Falling back to Whisper...")
                 raise Exception("No valid credentials")
             
-            stt_client = speech.SpeechClient()
+            stt_client = speech.SpeechClient(transport=connection_warmup.grpc_transport(SpeechGrpcTransport))
+            connection_warmup.monitor.watch_grpc_client("stt", stt_client)
             
             # Test the connection with a quick call
             config = speech.RecognitionConfig(
@@ -51,45 +107,295 @@ def initialize_stt(model_size="base"):
             )
             
             use_google_cloud = True
+            whisper_model_size = model_size
             print("✅ Google Cloud Speech-to-Text initialized successfully!")
-            
-            # Also load Whisper as backup (don't return yet)
-            if WHISPER_AVAILABLE:
-                try:
-                    print(f"🔄 Also loading Whisper ({model_size}) as backup...")
-                    whisper_model = whisper.load_model(model_size)
-                    print(f"✅ Whisper backup model ({model_size}) loaded successfully!")
-                except Exception as e:
-                    print(f"⚠️  Could not load Whisper backup: {e}")
-            
+            print(f"💤 Whisper backup pool ({model_size}) will connect {'after startup' if WHISPER_BACKUP_LOAD == 'background' else 'on first fallback'}")
             return
             
         except Exception as e:
             print(f"❌ Google Cloud Speech failed: {e}")
             print("🔄 Falling back to Whisper...")
     
-    # Fallback to Whisper
-    if WHISPER_AVAILABLE:
-        try:
-            print(f"🔄 Loading Whisper STT model ({model_size})...")
-            whisper_model = whisper.load_model(model_size)
-            use_google_cloud = False
-            print(f"✅ Whisper STT model ({model_size}) loaded successfully!")
-            return
-        except Exception as e:
-            print(f"❌ Error loading Whisper: {e}")
+    # Fallback to Whisper as the primary recognizer - needed now
+    whisper_model_size = model_size
+    pool = get_whisper_pool()
+    if pool is not None and pool.wait_ready(WHISPER_POOL_READY_TIMEOUT_SECONDS):
+        use_google_cloud = False
+        print("✅ Whisper worker pool ready as the primary recognizer")
+        return
     
     # Both failed
     raise Exception("❌ No STT service available! Install either google-cloud-speech OR openai-whisper")
 
 
-def transcribe_audio(audio_file_path, language=None):
+def _normalize_language(language):
+    """Map short language codes to the Spanish variant used for recognition"""
+    if not language or language == "es":
+        return "es-MX"
+    return language
+
+# Sample rate used when audio has to be transcoded locally before recognition
+TRANSCODE_SAMPLE_RATE = 16000
+
+def _parse_wav_header(content):
+    """Parse the RIFF/WAVE fmt chunk. Returns dict with sample_rate, channels, bits_per_sample, pcm."""
+    info = {}
+    offset = 12  # Skip 'RIFF' <size> 'WAVE'
+    while offset + 8 <= len(content):
+        chunk_id = content[offset:offset + 4]
+        chunk_size = struct.unpack('<I', content[offset + 4:offset + 8])[0]
+        if chunk_id == b'fmt ' and offset + 24 <= len(content):
+            audio_format, channels, sample_rate = struct.unpack('<HHI', content[offset + 8:offset + 16])
+            bits_per_sample = struct.unpack('<H', content[offset + 22:offset + 24])[0]
+            if audio_format == 0xFFFE and chunk_size >= 40 and offset + 34 <= len(content):
+                # WAVE_FORMAT_EXTENSIBLE: real format is the first 2 bytes of the sub-format GUID
+                audio_format = struct.unpack('<H', content[offset + 32:offset + 34])[0]
+            info.update({
+                'sample_rate': sample_rate,
+                'channels': channels,
+                'bits_per_sample': bits_per_sample,
+                'pcm': audio_format == 1
+            })
+            break
+        offset += 8 + chunk_size + (chunk_size % 2)  # Chunks are word aligned
+    return info
+
+def detect_audio_format(header):
     """
-    Transcribes audio from a file path using Google Cloud Speech-to-Text.
+    Detect the audio container from the first bytes of a recording.
     Args:
-        audio_file_path (str): Path to the audio file
+        header (bytes): Beginning of the file (a few KB is enough to reach the WAV fmt chunk).
+    Returns:
+        dict: {'format': 'webm'|'wav'|'ogg'|'flac'|'unknown', 'extension': str, ...}
+              WAV adds sample_rate/channels/bits_per_sample/pcm, OGG adds codec.
+    """
+    header = bytes(header)
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        return {'format': 'webm', 'extension': '.webm'}
+    if header.startswith(b'RIFF') and header[8:12] == b'WAVE':
+        return {'format': 'wav', 'extension': '.wav', **_parse_wav_header(header)}
+    if header.startswith(b'OggS'):
+        # First Ogg page carries the codec identification packet
+        codec = 'opus' if b'OpusHead' in header[:64] else 'vorbis' if b'vorbis' in header[:64] else 'unknown'
+        return {'format': 'ogg', 'extension': '.ogg', 'codec': codec}
+    if header.startswith(b'fLaC'):
+        return {'format': 'flac', 'extension': '.flac'}
+    return {'format': 'unknown', 'extension': ''}
+
+def transcode_to_linear16(content, sample_rate=TRANSCODE_SAMPLE_RATE):
+    """Transcode any ffmpeg-readable audio to raw mono 16-bit PCM, entirely through pipes."""
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"],
+        input=bytes(content), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30
+    )
+    if result.returncode != 0 or not result.stdout:
+        raise Exception(f"ffmpeg transcoding failed: {result.stderr.decode('utf-8', 'ignore').strip()}")
+    return result.stdout
+
+# --- Voice activity detection (runs before any recognition request) ---
+
+# Trim leading/trailing silence and reject recordings without speech before they reach STT
+VAD_ENABLED = os.environ.get("VAD_ENABLED", "true").lower() == "true"
+# "energy" (frame RMS against an adaptive noise floor), "webrtc" (pip install webrtcvad) or "auto"
+VAD_BACKEND = os.environ.get("VAD_BACKEND", "auto").lower()
+VAD_FRAME_MS = 30
+VAD_MIN_SPEECH_MS = int(os.environ.get("VAD_MIN_SPEECH_MS", "200"))  # Less speech than this counts as empty
+VAD_PADDING_MS = int(os.environ.get("VAD_PADDING_MS", "250"))  # Kept around the speech when trimming
+VAD_ENERGY_FLOOR_DB = float(os.environ.get("VAD_ENERGY_FLOOR_DB", "-50"))  # dBFS below which a frame is never speech
+VAD_SNR_DB = float(os.environ.get("VAD_SNR_DB", "12"))  # Speech must be this far above the noise floor
+VAD_WEBRTC_AGGRESSIVENESS = int(os.environ.get("VAD_WEBRTC_AGGRESSIVENESS", "2"))  # 0 (lenient) - 3 (strict)
+WEBRTC_SAMPLE_RATES = (8000, 16000, 32000, 48000)
+
+try:
+    import webrtcvad
+    WEBRTC_VAD_AVAILABLE = True
+except ImportError:
+    WEBRTC_VAD_AVAILABLE = False
+
+def _decode_pcm(content, audio_format):
+    """
+    16-bit mono PCM of a recording for VAD: WAV is read as is, anything else is decoded with ffmpeg.
+    Returns (pcm bytes, sample_rate), or (None, None) when the audio cannot be decoded here.
+    """
+    if (audio_format.get('format') == 'wav' and audio_format.get('pcm')
+            and audio_format.get('bits_per_sample') == 16 and audio_format.get('channels') == 1):
+        offset = _wav_data_offset(content)
+        if offset is not None:
+            data_size = struct.unpack('<I', bytes(content[offset - 4:offset]))[0]
+            if data_size == 0:
+                data_size = len(content) - offset  # Streamed recorders leave the size unset
+            return bytes(content[offset:offset + data_size]), audio_format['sample_rate']
+    if shutil.which("ffmpeg") is None:
+        return None, None
+    with tracing.span("stt_transcode", format=audio_format.get('format')):
+        return transcode_to_linear16(content), TRANSCODE_SAMPLE_RATE
+
+def _energy_speech_frames(pcm, sample_rate):
+    """Speech flag per VAD_FRAME_MS frame: RMS level above an adaptive noise floor"""
+    samples = array.array('h')
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder == 'big':
+        samples.byteswap()  # WAV is little endian
+    frame_length = sample_rate * VAD_FRAME_MS // 1000
+    levels = []
+    for start in range(0, len(samples) - frame_length + 1, frame_length):
+        frame = samples[start:start + frame_length]
+        rms = math.sqrt(sum(map(operator.mul, frame, frame)) / frame_length)
+        levels.append(20 * math.log10(max(rms, 1.0) / 32768))
+    if not levels:
+        return []
+    ordered = sorted(levels)
+    noise_floor = ordered[len(ordered) // 10]
+    # Relative to the loudest frame too, so a clip that is speech throughout is not cut into
+    threshold = max(VAD_ENERGY_FLOOR_DB, min(noise_floor + VAD_SNR_DB, ordered[-1] - VAD_SNR_DB))
+    return [level >= threshold for level in levels]
+
+def _webrtc_speech_frames(pcm, sample_rate):
+    vad = webrtcvad.Vad(VAD_WEBRTC_AGGRESSIVENESS)
+    frame_bytes = sample_rate * VAD_FRAME_MS // 1000 * 2
+    return [vad.is_speech(pcm[start:start + frame_bytes], sample_rate)
+            for start in range(0, len(pcm) - frame_bytes + 1, frame_bytes)]
+
+def _pcm_to_wav(pcm, sample_rate):
+    output = io.BytesIO()
+    with wave.open(output, "wb") as clip:
+        clip.setnchannels(1)
+        clip.setsampwidth(2)
+        clip.setframerate(sample_rate)
+        clip.writeframes(pcm)
+    return output.getvalue()
+
+def detect_speech(audio_source, audio_format=None):
+    """
+    Voice activity detection and silence trimming, before any recognition request.
+    Args:
+        audio_source (str | bytes | memoryview): Path to the recording or the recording itself.
+        audio_format (dict, optional): Result of detect_audio_format().
+    Returns:
+        dict: 'has_speech' (None when VAD did not run), 'speech_duration' and 'duration' in seconds,
+              'backend', and the 'audio_source'/'audio_format' to transcribe - a trimmed 16-bit WAV
+              when silence was cut, the original recording otherwise.
+    """
+    result = {'has_speech': None, 'speech_duration': None, 'duration': None, 'backend': None,
+              'audio_source': audio_source, 'audio_format': audio_format}
+    if not VAD_ENABLED:
+        return result
+    try:
+        if isinstance(audio_source, str):
+            with open(audio_source, "rb") as audio_file:
+                content = audio_file.read()
+        else:
+            content = memoryview(audio_source)
+        if audio_format is None:
+            audio_format = result['audio_format'] = detect_audio_format(content[:4096])
+        pcm, sample_rate = _decode_pcm(content, audio_format)
+        if pcm is None:
+            log.debug(f"🔇 VAD skipped: cannot decode {audio_format.get('format')} audio without ffmpeg")
+            return result
+        
+        use_webrtc = (VAD_BACKEND in ("webrtc", "auto") and WEBRTC_VAD_AVAILABLE and sample_rate in WEBRTC_SAMPLE_RATES)
+        speech_frames = _webrtc_speech_frames(pcm, sample_rate) if use_webrtc else _energy_speech_frames(pcm, sample_rate)
+        speech_indexes = [index for index, is_speech in enumerate(speech_frames) if is_speech]
+        result.update({
+            'backend': "webrtc" if use_webrtc else "energy",
+            'duration': len(pcm) / (2 * sample_rate),
+            'speech_duration': len(speech_indexes) * VAD_FRAME_MS / 1000,
+        })
+        result['has_speech'] = result['speech_duration'] * 1000 >= VAD_MIN_SPEECH_MS
+        if not result['has_speech']:
+            return result
+        
+        # Keep first to last speech frame plus padding
+        frame_bytes = sample_rate * VAD_FRAME_MS // 1000 * 2
+        padding_bytes = sample_rate * VAD_PADDING_MS // 1000 * 2
+        start = max(0, speech_indexes[0] * frame_bytes - padding_bytes)
+        end = min(len(pcm), (speech_indexes[-1] + 1) * frame_bytes + padding_bytes)
+        trimmed = len(pcm) - (end - start)
+        # Compressed uploads turn into (larger) WAV when trimmed, only worth it for a real cut
+        if trimmed and (audio_format.get('format') == 'wav' or trimmed >= padding_bytes):
+            result['audio_source'] = _pcm_to_wav(pcm[start:end], sample_rate)
+            result['audio_format'] = detect_audio_format(result['audio_source'][:4096])
+    except Exception as e:
+        log.warning(f"⚠️ VAD failed, transcribing the untrimmed recording: {e}")
+    return result
+
+def _whisper_transcribe(pool, content, language="es"):
+    """Decode audio to 16 kHz PCM here (ffmpeg pipes) and transcribe it in the Whisper pool"""
+    with tracing.span("stt_attempt", backend="whisper"):
+        pcm = transcode_to_linear16(content, sample_rate=whisper_pool.SAMPLE_RATE)
+        return pool.transcribe(pcm, language).strip()
+
+def _build_recognition_request(content, audio_format):
+    """
+    Choose the single RecognitionConfig encoding for the detected format.
+    Formats Google cannot read directly are transcoded to LINEAR16 first.
+    Returns:
+        tuple: (encoding params dict, audio content to send)
+    """
+    encodings = speech.RecognitionConfig.AudioEncoding
+    container = audio_format.get('format')
+    
+    if container == 'webm':
+        return {"encoding": encodings.WEBM_OPUS}, content
+    if container == 'ogg' and audio_format.get('codec') == 'opus':
+        return {"encoding": encodings.OGG_OPUS, "sample_rate_hertz": 48000}, content  # Opus always decodes at 48 kHz
+    if container == 'flac':
+        return {"encoding": encodings.FLAC}, content
+    if container == 'wav' and audio_format.get('pcm') and audio_format.get('bits_per_sample') == 16:
+        params = {"encoding": encodings.LINEAR16}
+        if audio_format.get('sample_rate'):
+            params["sample_rate_hertz"] = audio_format['sample_rate']
+        if audio_format.get('channels'):
+            params["audio_channel_count"] = audio_format['channels']
+        return params, content
+    
+    # Unknown container, non-16-bit WAV or Ogg Vorbis: transcode locally
+    log.debug(f"🔄 Transcoding {container} audio to {TRANSCODE_SAMPLE_RATE} Hz LINEAR16...")
+    with tracing.span("stt_transcode", format=container):
+        pcm = transcode_to_linear16(content)
+    return {"encoding": encodings.LINEAR16, "sample_rate_hertz": TRANSCODE_SAMPLE_RATE}, pcm
+
+def _base_recognition_config(language):
+    """Recognition config without encoding (set from the detected format)"""
+    return {
+        "language_code": language,
+        "alternative_language_codes": ["es-MX", "es-ES"],  # Fallback Spanish variants
+        "enable_automatic_punctuation": True,
+        "model": "latest_long",  # Best model for accuracy
+        "use_enhanced": True,  # Enhanced model for better accuracy
+    }
+
+def _whisper_fallback(content, audio_file_path=None):
+    """Transcribe with the node's Whisper pool. Returns the text, or None if unavailable/empty."""
+    log.info("🔄 Falling back to Whisper for transcription...")
+    pool = get_whisper_pool()
+    if pool is None:
+        return None
+    try:
+        if audio_file_path is not None:
+            with open(audio_file_path, 'rb') as audio_file:
+                content = audio_file.read()
+        whisper_transcript = _whisper_transcribe(pool, content)
+        
+        if whisper_transcript:
+            log.info(f"✅ Whisper transcription successful: '{whisper_transcript}'")
+            return whisper_transcript
+        log.error("❌ Whisper returned empty transcription")
+    except Exception as whisper_error:
+        log.error(f"❌ Whisper fallback failed: {whisper_error}")
+    return None
+
+def transcribe_audio(audio_source, language=None, audio_format=None):
+    """
+    Transcribes audio using Google Cloud Speech-to-Text.
+    Args:
+        audio_source (str | bytes | memoryview): Path to the audio file, or the audio
+                                                 itself already in memory (no disk I/O)
         language (str, optional): Language code (e.g., "es" for Spanish, "en" for English). 
                                  Default is "es-MX" for Spanish (Mexico).
+        audio_format (dict, optional): Result of detect_audio_format() if the caller already
+                                       sniffed the header. Detected from the content otherwise.
     Returns:
         str: The transcribed text.
     """
@@ -98,136 +404,351 @@ def transcribe_audio(audio_file_path, language=None):
         raise Exception("STT client not initialized. Call initialize_stt() first.")
     
     try:
-        if not os.path.exists(audio_file_path):
+        audio_file_path = audio_source if isinstance(audio_source, str) else None
+        if audio_file_path is not None and not os.path.exists(audio_file_path):
             return "Error: Audio file not found for transcription."
         
         # Default to Spanish (Guatemala) if no language specified
-        if not language:
-            language = "es-MX"
-        elif language == "es":
-            language = "es-MX"  # More specific Spanish variant for Mexico
+        language = _normalize_language(language)
         
-        print(f"🎤 Transcribing audio: {audio_file_path} (language: {language})")
+        log.info(f"🎤 Transcribing audio: {audio_file_path or 'in-memory buffer'} (language: {language})")
         
-        # Read the audio file
-        with io.open(audio_file_path, "rb") as audio_file:
-            content = audio_file.read()
+        if audio_file_path is not None:
+            # Read the audio file
+            with io.open(audio_file_path, "rb") as audio_file:
+                content = audio_file.read()
+        else:
+            content = memoryview(audio_source)
         
         # Debug: Check file size and basic info
         file_size = len(content)
-        print(f"📊 Audio file size: {file_size} bytes")
+        log.debug(f"📊 Audio file size: {file_size} bytes")
         
         if file_size < 100:  # Very small file
-            print("⚠️  WARNING: Audio file is very small, might be empty or corrupted")
+            log.warning("⚠️  WARNING: Audio file is very small, might be empty or corrupted")
             return "Error: Audio file too small or empty"
         
-        # Check for basic audio file headers
-        if content[:4] == b'RIFF':
-            print("📋 Audio format: WAV/RIFF detected")
-        elif content[:4] == b'OggS':
-            print("📋 Audio format: OGG detected")
-        elif content[:4] == b'fLaC':
-            print("📋 Audio format: FLAC detected")
-        else:
-            print(f"📋 Audio format: Unknown (first 4 bytes: {content[:4]})")
-            print("⚠️  Might be an unsupported format")
-        
-        # Configure the audio settings
-        audio = speech.RecognitionAudio(content=content)
-        
-        # Base config without encoding (will be set in loop)
-        base_config = {
-            "language_code": language,
-            "alternative_language_codes": ["es-MX", "es-ES"],  # Fallback Spanish variants
-            "enable_automatic_punctuation": True,
-            "model": "latest_long",  # Best model for accuracy
-            "use_enhanced": True,  # Enhanced model for better accuracy
-        }
-        
-        # Try different encodings and sample rates
-        configs_to_try = [
-            # Common web audio formats
-            {"encoding": speech.RecognitionConfig.AudioEncoding.WEBM_OPUS},
-            {"encoding": speech.RecognitionConfig.AudioEncoding.OGG_OPUS},
-            # Linear PCM with common sample rates
-            {"encoding": speech.RecognitionConfig.AudioEncoding.LINEAR16, "sample_rate_hertz": 48000},
-            {"encoding": speech.RecognitionConfig.AudioEncoding.LINEAR16, "sample_rate_hertz": 44100},
-            {"encoding": speech.RecognitionConfig.AudioEncoding.LINEAR16, "sample_rate_hertz": 16000},
-            {"encoding": speech.RecognitionConfig.AudioEncoding.LINEAR16},  # Auto-detect
-            # FLAC format
-            {"encoding": speech.RecognitionConfig.AudioEncoding.FLAC},
-        ]
+        if audio_format is None:
+            audio_format = detect_audio_format(content[:4096])
+        log.debug(f"📋 Audio format: {audio_format}")
         
+        # Base config without encoding (set from the detected format)
+        base_config = _base_recognition_config(language)
+        
+        # Exactly one correctly configured request
         transcript = ""
-        for config_attempt in configs_to_try:
-            try:
-                # Create config for this encoding attempt
-                config_params = {**base_config, **config_attempt}
-                config = speech.RecognitionConfig(**config_params)
-                
-                encoding_name = config_attempt["encoding"].name
-                sample_rate = config_attempt.get("sample_rate_hertz", "auto")
-                print(f"🔄 Trying encoding: {encoding_name} (sample rate: {sample_rate})")
-                
+        try:
+            encoding_params, recognition_content = _build_recognition_request(content, audio_format)
+            config = speech.RecognitionConfig(**base_config, **encoding_params)
+            audio = speech.RecognitionAudio(content=bytes(recognition_content))
+            
+            encoding_name = encoding_params["encoding"].name
+            sample_rate = encoding_params.get("sample_rate_hertz", "auto")
+            log.debug(f"🔄 Recognizing with encoding: {encoding_name} (sample rate: {sample_rate})")
+            
+            request_start = time.time()
+            with tracing.span("stt_attempt", backend="google", encoding=encoding_name):
                 response = stt_client.recognize(config=config, audio=audio)
+            connection_warmup.monitor.record_request("stt", time.time() - request_start)
+            
+            if response.results:
+                # Get the most confident transcription
+                transcript = response.results[0].alternatives[0].transcript
+                confidence = response.results[0].alternatives[0].confidence
+                log.debug(f"✅ Transcription successful with {encoding_name}")
+                log.debug(f"🎯 Confidence: {confidence:.2f}")
+            else:
+                log.warning(f"⚠️  No results with {encoding_name}")
+                log.debug(f"   Response metadata: {response}")
                 
-                if response.results:
-                    # Get the most confident transcription
-                    transcript = response.results[0].alternatives[0].transcript
-                    confidence = response.results[0].alternatives[0].confidence
-                    print(f"✅ Transcription successful with {encoding_name}")
-                    print(f"🎯 Confidence: {confidence:.2f}")
-                    break
-                else:
-                    print(f"⚠️  No results with {encoding_name}")
-                    print(f"   Response metadata: {response}")
-                    if hasattr(response, 'results'):
-                        print(f"   Results count: {len(response.results)}")
-                    
-            except google_exceptions.InvalidArgument as e:
-                print(f"❌ {encoding_name} failed: {e}")
-                continue
-            except Exception as e:
-                print(f"❌ Unexpected error with {encoding_name}: {e}")
-                continue
+        except google_exceptions.InvalidArgument as e:
+            log.error(f"❌ Google Cloud rejected {audio_format.get('format')} audio: {e}")
+        except Exception as e:
+            log.error(f"❌ Unexpected error during Google Cloud recognition: {e}")
         
         if not transcript:
-            print(f"❌ Google Cloud failed with all {len(configs_to_try)} configurations")
+            log.error(f"❌ Google Cloud returned no transcription for {audio_format.get('format')} audio")
             
             # Fallback to Whisper if available
-            if WHISPER_AVAILABLE and whisper_model is not None:
-                print("🔄 Falling back to Whisper for transcription...")
-                try:
-                    # Whisper can handle most audio formats directly
-                    result = whisper_model.transcribe(audio_file_path, language="es")
-                    # Handle different return types from whisper
-                    if isinstance(result, dict) and "text" in result:
-                        text_value = result["text"]
-                        whisper_transcript = text_value.strip() if isinstance(text_value, str) else str(text_value).strip()
-                    else:
-                        whisper_transcript = str(result).strip()
-                    
-                    if whisper_transcript:
-                        print(f"✅ Whisper transcription successful: '{whisper_transcript}'")
-                        return whisper_transcript
-                    else:
-                        print("❌ Whisper returned empty transcription")
-                except Exception as whisper_error:
-                    print(f"❌ Whisper fallback failed: {whisper_error}")
+            whisper_transcript = _whisper_fallback(content, audio_file_path)
+            if whisper_transcript:
+                return whisper_transcript
             
             # Both Google Cloud and Whisper failed
-            error_msg = f"Error: Could not transcribe audio with any service. File size: {file_size} bytes, tried Google Cloud ({len(configs_to_try)} configs) and Whisper."
-            print(f"❌ {error_msg}")
+            error_msg = f"Error: Could not transcribe audio with any service. File size: {file_size} bytes, tried Google Cloud ({audio_format.get('format')}) and Whisper."
+            log.error(f"❌ {error_msg}")
+            return error_msg
+        
+        log.info(f"📝 Transcribed: '{transcript}'")
+        return transcript.strip()
+        
+    except Exception as e:
+        log.error(f"❌ Error during Google Cloud Speech transcription: {e}")
+        return "Error during transcription."
+
+
+def initialize_stt_async():
+    """Creates the asyncio STT client. Must run inside the server's event loop (gRPC aio binds to it)."""
+    global async_stt_client
+    if use_google_cloud:
+        async_stt_client = speech.SpeechAsyncClient(transport=connection_warmup.grpc_transport(SpeechGrpcAsyncIOTransport))
+        connection_warmup.monitor.watch_grpc_client_async("stt", async_stt_client)
+        print("✅ Google Cloud STT async client ready")
+
+async def transcribe_audio_async(audio_source, language=None, audio_format=None):
+    """
+    Async version of transcribe_audio for the ASGI server (in-memory audio only).
+    Blocking work - ffmpeg transcoding and the Whisper fallback - runs in a worker thread.
+    Returns:
+        str: The transcribed text (or an "Error..." message, like transcribe_audio).
+    """
+    if async_stt_client is None:
+        # No async Google client (e.g. Whisper-only setup): run the sync path off the event loop
+        return await asyncio.to_thread(transcribe_audio, audio_source, language, audio_format)
+    
+    try:
+        language = _normalize_language(language)
+        content = memoryview(audio_source)
+        file_size = len(content)
+        log.info(f"🎤 Transcribing audio: in-memory buffer (language: {language}, async)")
+        
+        if file_size < 100:  # Very small file
+            log.warning("⚠️  WARNING: Audio file is very small, might be empty or corrupted")
+            return "Error: Audio file too small or empty"
+        
+        if audio_format is None:
+            audio_format = detect_audio_format(content[:4096])
+        
+        transcript = ""
+        try:
+            # May transcode through ffmpeg, so keep it off the event loop
+            encoding_params, recognition_content = await asyncio.to_thread(_build_recognition_request, content, audio_format)
+            config = speech.RecognitionConfig(**_base_recognition_config(language), **encoding_params)
+            audio = speech.RecognitionAudio(content=bytes(recognition_content))
+            
+            request_start = time.time()
+            with tracing.span("stt_attempt", backend="google", encoding=encoding_params["encoding"].name):
+                response = await async_stt_client.recognize(config=config, audio=audio)
+            connection_warmup.monitor.record_request("stt", time.time() - request_start)
+            if response.results:
+                transcript = response.results[0].alternatives[0].transcript
+                log.debug(f"✅ Transcription successful with {encoding_params['encoding'].name}")
+        except google_exceptions.InvalidArgument as e:
+            log.error(f"❌ Google Cloud rejected {audio_format.get('format')} audio: {e}")
+        except Exception as e:
+            log.error(f"❌ Unexpected error during Google Cloud recognition: {e}")
+        
+        if not transcript:
+            whisper_transcript = await asyncio.to_thread(_whisper_fallback, content)
+            if whisper_transcript:
+                return whisper_transcript
+            error_msg = f"Error: Could not transcribe audio with any service. File size: {file_size} bytes, tried Google Cloud ({audio_format.get('format')}) and Whisper."
+            log.error(f"❌ {error_msg}")
             return error_msg
         
-        print(f"📝 Transcribed: '{transcript}'")
+        log.info(f"📝 Transcribed: '{transcript}'")
         return transcript.strip()
         
     except Exception as e:
-        print(f"❌ Error during Google Cloud Speech transcription: {e}")
+        log.error(f"❌ Error during Google Cloud Speech transcription: {e}")
         return "Error during transcription."
 
 
+def _wav_data_offset(content):
+    """Byte offset of the PCM samples in a WAV file (after the 'data' chunk header), or None."""
+    offset = 12
+    while offset + 8 <= len(content):
+        chunk_id = content[offset:offset + 4]
+        chunk_size = struct.unpack('<I', content[offset + 4:offset + 8])[0]
+        if chunk_id == b'data':
+            return offset + 8
+        offset += 8 + chunk_size + (chunk_size % 2)
+    return None
+
+class GoogleStreamingTranscriber:
+    """
+    Forwards audio frames to Google streaming recognition as they arrive.
+    The recognizer works while the upload is still in progress, so the final
+    transcript is ready shortly after the last frame instead of after upload + recognize.
+    """
+    
+    def __init__(self, language=None):
+        self.language = _normalize_language(language)
+        self.audio_format = None
+        self.bytes_received = 0
+        self._header = b""
+        self._frames = queue.Queue()
+        self._buffered = []  # Used instead of streaming when the format needs local transcoding
+        self._thread = None
+        self._closed = False  # End-of-audio sentinel queued
+        self._final_segments = []
+        self._error = None
+        self._started_at = time.time()
+    
+    def feed(self, chunk):
+        """Add an audio frame (bytes) from the upload"""
+        if not chunk:
+            return
+        self.bytes_received += len(chunk)
+        
+        if self.audio_format is None:
+            # Wait until the header is long enough to identify the container
+            self._header += chunk
+            if len(self._header) < 64:
+                return
+            self._start(self._header)
+        elif self._thread is not None:
+            self._frames.put(bytes(chunk))
+        else:
+            self._buffered.append(bytes(chunk))
+    
+    def _start(self, first_bytes):
+        self.audio_format = detect_audio_format(first_bytes[:4096])
+        log.debug(f"🎙️ Streaming STT format: {self.audio_format}")
+        
+        encodings = speech.RecognitionConfig.AudioEncoding
+        container = self.audio_format['format']
+        params = None
+        if container == 'webm':
+            params = {"encoding": encodings.WEBM_OPUS}
+        elif container == 'ogg' and self.audio_format.get('codec') == 'opus':
+            params = {"encoding": encodings.OGG_OPUS, "sample_rate_hertz": 48000}
+        elif container == 'flac':
+            params = {"encoding": encodings.FLAC}
+        elif container == 'wav' and self.audio_format.get('pcm') and self.audio_format.get('bits_per_sample') == 16:
+            data_offset = _wav_data_offset(first_bytes)
+            if data_offset is not None:
+                params = {
+                    "encoding": encodings.LINEAR16,
+                    "sample_rate_hertz": self.audio_format['sample_rate'],
+                    "audio_channel_count": self.audio_format['channels']
+                }
+                first_bytes = first_bytes[data_offset:]  # Streaming LINEAR16 expects raw samples
+        
+        if params is None:
+            # Not streamable as-is: buffer and transcode at the end
+            log.warning(f"⚠️  {container} audio cannot be streamed, buffering for single-shot recognition")
+            self._buffered.append(first_bytes)
+            return
+        
+        config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                language_code=self.language,
+                alternative_language_codes=["es-MX", "es-ES"],
+                enable_automatic_punctuation=True,
+                model="latest_long",
+                use_enhanced=True,
+                **params
+            ),
+            interim_results=False
+        )
+        self._frames.put(first_bytes)
+        self._thread = threading.Thread(target=self._run, args=(config,), name="stt-stream", daemon=True)
+        self._thread.start()
+    
+    def _requests(self):
+        while True:
+            frame = self._frames.get()
+            if frame is None:
+                return
+            yield speech.StreamingRecognizeRequest(audio_content=frame)
+    
+    def _run(self, config):
+        try:
+            for response in stt_client.streaming_recognize(config=config, requests=self._requests()):
+                for result in response.results:
+                    if result.is_final and result.alternatives:
+                        self._final_segments.append(result.alternatives[0].transcript.strip())
+        except Exception as e:
+            self._error = e
+            log.error(f"❌ Google streaming recognition error: {e}")
+    
+    def finish(self, timeout=15.0):
+        """
+        Signal end of audio and return the final transcript.
+        Returns:
+            str: The transcribed text, or an "Error: ..." message like transcribe_audio.
+        """
+        if self.audio_format is None and self._header:
+            self._start(self._header)
+        
+        if self._thread is None:
+            # Buffered (non-streamable) audio: single correctly configured request
+            content = b"".join(self._buffered)
+            return transcribe_audio(content, language=self.language, audio_format=self.audio_format)
+        
+        self.close()
+        self._thread.join(timeout)
+        transcript = " ".join(segment for segment in self._final_segments if segment)
+        log.info(f"⏱️ Streaming STT finalized {time.time() - self._started_at:.3f}s after first frame ({self.bytes_received} bytes)")
+        
+        if transcript:
+            log.info(f"📝 Transcribed (streaming): '{transcript}'")
+            return transcript
+        if self._error is not None:
+            return f"Error: Streaming recognition failed: {self._error}"
+        return "Error: Could not transcribe audio (no speech recognized)."
+    
+    def close(self):
+        """
+        End the request stream so the recognizer thread and its gRPC stream exit. Handlers call
+        this in a finally block: uploads that abort before finish() would otherwise leak both.
+        Safe to call more than once and after finish().
+        """
+        if self._thread is not None and not self._closed:
+            self._closed = True
+            self._frames.put(None)
+
+class WhisperStreamingTranscriber:
+    """
+    Local stand-in for streaming recognition, for offline testing.
+    Buffers the frames in memory and runs Whisper once the upload ends.
+    """
+    
+    def __init__(self, language=None):
+        self.language = _normalize_language(language)
+        self.audio_format = None
+        self.bytes_received = 0
+        self._chunks = []
+    
+    def feed(self, chunk):
+        """Add an audio frame (bytes) from the upload"""
+        if chunk:
+            self.bytes_received += len(chunk)
+            self._chunks.append(bytes(chunk))
+    
+    def finish(self, timeout=None):
+        """Signal end of audio and return the transcript (or an "Error: ..." message)."""
+        pool = get_whisper_pool()
+        if pool is None:
+            return "Error: Whisper pool not available for local streaming recognition."
+        content = b"".join(self._chunks)
+        self.audio_format = detect_audio_format(content[:4096])
+        try:
+            text = _whisper_transcribe(pool, content, self.language.split("-")[0])
+        except Exception as e:
+            return f"Error: Whisper transcription failed: {e}"
+        return text or "Error: Whisper returned empty transcription"
+    
+    def close(self):
+        """Drop the buffered frames (nothing runs in the background until finish())"""
+        self._chunks = []
+
+def create_streaming_transcriber(language=None):
+    """
+    Create a transcriber that accepts audio frames as they are uploaded.
+    Uses Google streaming recognition, or the local Whisper stand-in when
+    STT_STREAMING_BACKEND=whisper or Google Cloud is not available.
+    """
+    backend = STT_STREAMING_BACKEND
+    if backend == "auto":
+        backend = "google" if use_google_cloud and stt_client is not None else "whisper"
+    log.info(f"🎙️ Streaming STT backend: {backend}")
+    if backend == "google":
+        return GoogleStreamingTranscriber(language)
+    return WhisperStreamingTranscriber(language)
+
+
 # Example self-test (optional)
 if __name__ == "__main__":
     try:
@@ -0,0 +1,273 @@
+# tracing.py
+"""
+Per-turn latency tracing for Ana.
+
+Each /chat turn opens a trace; stages open spans inside it:
+
+    trace = tracing.start_trace("chat", session_id)
+    with tracing.span("stt", trace):
+        ...
+
+The open span is kept in a context variable, so service modules (stt, llm, tts, memory, FAQ)
+open child spans without a trace being passed in. Executor work keeps the trace with
+tracing.bind(fn), response generators with tracing.stream(trace, generator).
+
+Every finished span also feeds a per-stage latency histogram, traced or not; render_metrics()
+exposes them in the Prometheus text format (/metrics) with p50/p95/p99 over the most recent
+TRACE_QUANTILE_WINDOW samples.
+
+Finished traces are logged under their session (see /debug/<session_id>) and kept in memory
+for /debug/trace/<trace_id>.
+"""
+
+import os
+import re
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import conversation_logger
+
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "true").lower() == "true"
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "1000"))
+TRACE_QUANTILE_WINDOW = int(os.environ.get("TRACE_QUANTILE_WINDOW", "2048"))
+
+# Histogram buckets (seconds) - from FAQ matching to whole turns
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+log = conversation_logger.get_logger("tracing")
+
+# Accepted client trace ids (X-Trace-Id); a random suffix keeps them unique per turn
+CLIENT_TRACE_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+# (trace, span) the current code runs under
+_current: contextvars.ContextVar = contextvars.ContextVar("pbx_trace", default=(None, None))
+
+
+class StageHistogram:
+    """Cumulative bucket counts plus a window of recent samples for quantiles"""
+
+    __slots__ = ("counts", "total", "count", "recent")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # Last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=TRACE_QUANTILE_WINDOW)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def quantiles(self) -> Dict[float, float]:
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+
+_histograms: Dict[str, StageHistogram] = {}
+_histograms_lock = threading.Lock()
+_recent_traces: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_traces_lock = threading.Lock()
+
+
+def observe(stage: str, seconds: float) -> None:
+    """Add one latency sample to a stage histogram"""
+    with _histograms_lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = StageHistogram()
+        histogram.observe(seconds)
+
+
+class Span:
+    """One timed stage; use as a context manager or call end()"""
+
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start", "duration", "attributes", "_previous")
+
+    def __init__(self, name: str, trace: Optional["Trace"], parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.duration: Optional[float] = None
+        self.attributes = attributes
+        self._previous = None
+
+    def end(self, **attributes) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.time() - self.start
+        self.attributes.update(attributes)
+        observe(self.name, self.duration)
+        if self.trace is not None:
+            self.trace.add(self)
+
+    def __enter__(self) -> "Span":
+        self._previous = _current.get()
+        _current.set((self.trace, self))
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current.set(self._previous)
+        if exc is not None:
+            self.attributes["error"] = str(exc)
+        self.end()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "span_id": self.span_id, "parent_id": self.parent_id,
+                "offset": round(self.start - self.trace.root.start, 4) if self.trace is not None else 0.0,
+                "duration": round(self.duration, 4) if self.duration is not None else None,
+                "attributes": self.attributes}
+
+
+class Trace:
+    """Spans of one turn, rooted at a span named after the endpoint"""
+
+    def __init__(self, name: str, session_id: Optional[str] = None, trace_id: Optional[str] = None,
+                 start: Optional[float] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.session_id = session_id
+        self.spans: List[Span] = []
+        self.finished = False
+        self._lock = threading.Lock()
+        self.root = Span(name, self, None, {})
+        if start is not None:
+            self.root.start = start
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self, **attributes) -> Optional[Dict[str, Any]]:
+        """End the root span, keep the trace for /debug/trace and log it under its session (None if already finished)"""
+        with self._lock:
+            if self.finished:
+                return None
+            self.finished = True
+        self.root.end(**attributes)
+        with self._lock:
+            stages = sorted((span for span in self.spans if span is not self.root), key=lambda span: span.start)
+            spans = [self.root.to_dict()] + [span.to_dict() for span in stages]
+        record = {"trace_id": self.trace_id, "session_id": self.session_id, "name": self.root.name,
+                  "duration": spans[0]["duration"], "spans": spans}
+        with _traces_lock:
+            _recent_traces[self.trace_id] = record
+            while len(_recent_traces) > TRACE_BUFFER_SIZE:
+                _recent_traces.popitem(last=False)
+        summary = ", ".join(f"{span['name']} {span['duration']:.3f}s" for span in spans[1:])
+        log.info(f"🧭 TRACE | {self.session_id} | {self.trace_id} | {self.root.name} {self.root.duration:.3f}s | {summary}",
+                 extra={"session_id": self.session_id, "event": "TRACE", "data": record})
+        return record
+
+
+def start_trace(name: str, session_id: Optional[str] = None, trace_id: Optional[str] = None,
+                start: Optional[float] = None) -> Optional[Trace]:
+    """
+    Open a trace for one turn (None when tracing is disabled); start backdates it to the request arrival.
+    trace_id comes from the client: invalid ids are ignored and valid ones get a random suffix, so a
+    client can't overwrite another turn's trace in the buffer. The final id is in end_of_stream.
+    """
+    if not TRACING_ENABLED:
+        return None
+    if trace_id is not None:
+        trace_id = f"{trace_id}-{uuid.uuid4().hex[:8]}" if CLIENT_TRACE_ID_PATTERN.fullmatch(trace_id) else None
+    return Trace(name, session_id, trace_id, start)
+
+
+def span(name: str, trace: Optional[Trace] = None, **attributes) -> Span:
+    """
+    Start a span under the current one, or under the root of an explicitly given trace.
+    Recorded in the stage histogram even outside a trace.
+    """
+    current_trace, parent = _current.get()
+    if trace is not None and trace is not current_trace:
+        current_trace, parent = trace, trace.root
+    return Span(name, current_trace, parent, attributes)
+
+
+def record(name: str, seconds: float, trace: Optional[Trace] = None, **attributes) -> None:
+    """Record a stage that ended just now after `seconds` (e.g. time to first token)"""
+    stage = span(name, trace, **attributes)
+    stage.start = time.time() - seconds
+    stage.end()
+
+
+def attach(trace: Optional[Trace]) -> None:
+    """Make trace current for the rest of this asyncio task (tasks own their context)"""
+    _current.set((trace, trace.root if trace is not None else None))
+
+
+def _context_for(trace: Optional[Trace]) -> contextvars.Context:
+    context = contextvars.copy_context()
+    if trace is not None:
+        context.run(attach, trace)
+    return context
+
+
+def bind(fn: Callable, trace: Optional[Trace] = None) -> Callable:
+    """Wrap fn to run on another thread (executors) under the caller's trace, or under trace"""
+    context = _context_for(trace)
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def stream(trace: Optional[Trace], iterator: Iterator) -> Iterator:
+    """
+    Iterate a response generator under trace. Every step runs in the trace's own context,
+    so spans stay nested across yields and nothing leaks into the server thread.
+    """
+    context = _context_for(trace)
+    while True:
+        try:
+            item = context.run(next, iterator)
+        except StopIteration:
+            return
+        yield item
+
+
+def current_trace_id() -> Optional[str]:
+    trace, _ = _current.get()
+    return trace.trace_id if trace is not None else None
+
+
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+    with _traces_lock:
+        return _recent_traces.get(trace_id)
+
+
+def render_metrics() -> str:
+    """Stage latency histograms and quantiles in the Prometheus text exposition format"""
+    with _histograms_lock:
+        snapshot = {stage: (list(h.counts), h.total, h.count, h.quantiles()) for stage, h in sorted(_histograms.items())}
+
+    lines = ["# HELP pbx_stage_duration_seconds Latency of each turn stage.",
+             "# TYPE pbx_stage_duration_seconds histogram"]
+    for stage, (counts, total, count, _) in snapshot.items():
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'pbx_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'pbx_stage_duration_seconds_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'pbx_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+
+    lines += [f"# HELP pbx_stage_latency_seconds Stage latency quantiles over the last {TRACE_QUANTILE_WINDOW} samples.",
+              "# TYPE pbx_stage_latency_seconds summary"]
+    for stage, (_, total, count, quantiles) in snapshot.items():
+        for q, value in quantiles.items():
+            lines.append(f'pbx_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'pbx_stage_latency_seconds_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'pbx_stage_latency_seconds_count{{stage="{stage}"}} {count}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,137 @@
+# tts_cache.py
+"""
+Content-addressed TTS audio cache for Ana - AI Contact Center Agent
+Stores synthesized audio on disk keyed by hash(normalized text, voice, audio config)
+with a size-bounded LRU eviction policy.
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different strings share one cache entry"""
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def make_cache_key(text: str, voice_name: str, audio_config: Dict[str, Any]) -> str:
+    """Build the cache key for a synthesis request"""
+    payload = json.dumps({
+        "text": normalize_text(text),
+        "voice": voice_name,
+        "audio_config": audio_config
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """Persistent, size-bounded LRU cache of synthesized audio files"""
+
+    def __init__(self, cache_dir: str, max_bytes: int, extension: str = ".wav"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size in bytes, oldest first
+        self._total_bytes = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{self.extension}")
+
+    def _load_index(self) -> None:
+        """Rebuild the LRU order from disk (mtime is refreshed on every hit)"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.extension):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name[:-len(self.extension)], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+        if self._entries:
+            print(f"♻️ TTS cache loaded: {len(self._entries)} entries, {self._total_bytes / 1024 / 1024:.1f} MB")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached audio path for key, or None on a miss"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            path = self._path_for(key)
+            if not os.path.exists(path):
+                # File removed behind our back - forget it
+                self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        try:
+            os.utime(path, None)  # Persist recency for the next startup
+        except OSError:
+            pass
+        return path
+
+    def put(self, key: str, audio_content: bytes) -> str:
+        """Store audio for key and return its path"""
+        path = self._path_for(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as out:
+            out.write(audio_content)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = len(audio_content)
+            self._total_bytes += len(audio_content)
+            self._evict()
+        return path
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the cache fits (keeps the newest entry)"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path_for(key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
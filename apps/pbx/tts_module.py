@@ -1,17 +1,98 @@
 # tts_module.py
 from google.cloud import texttospeech
+from google.cloud.texttospeech_v1.services.text_to_speech.transports import TextToSpeechGrpcTransport, TextToSpeechGrpcAsyncIOTransport
+import io
 import os
 import time
+import wave
+import shutil
+import asyncio
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import tts_cache
+import tracing
+import speech_pipeline
+import connection_warmup
+import conversation_logger
+
+log = conversation_logger.get_logger("tts")
 
 client = None
+async_client = None  # Used by the ASGI server (asgi_app.py)
 google_voice = None
+audio_cache = None
+segment_cache = None  # LINEAR16 audio of fixed template segments, for splicing
+
+# Audio cache configuration (cached files are served from /static, keep the directory under it)
+TTS_CACHE_ENABLED = os.environ.get("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join("static", "tts_cache"))
+TTS_CACHE_MAX_MB = int(os.environ.get("TTS_CACHE_MAX_MB", "200"))  # Whole directory, segment cache included
+TTS_SEGMENT_CACHE_MAX_MB = int(os.environ.get("TTS_SEGMENT_CACHE_MAX_MB", "20"))  # Share of it for template segments
+
+# Voice used for ultra_fast synthesis (every live turn uses it)
+FAST_VOICE_NAME = "es-US-Chirp-HD-F"
+
+# Output codec for every synthesized chunk: MP3 (default, plays everywhere including Safari/iOS < 17),
+# OGG_OPUS (about half the size of MP3, only for clients known to play Ogg) or LINEAR16 (uncompressed WAV)
+AUDIO_FORMATS = {
+    "OGG_OPUS": {"mime_type": "audio/ogg; codecs=opus", "extension": ".ogg", "sample_rate_hertz": 24000,  # Opus only takes 8/12/16/24/48 kHz
+                 "ffmpeg_args": ["-c:a", "libopus", "-b:a", "32k", "-f", "ogg"]},
+    "MP3": {"mime_type": "audio/mpeg", "extension": ".mp3", "sample_rate_hertz": 22050,
+            "ffmpeg_args": ["-c:a", "libmp3lame", "-b:a", "64k", "-f", "mp3"]},
+    "LINEAR16": {"mime_type": "audio/wav", "extension": ".wav", "sample_rate_hertz": 22050, "ffmpeg_args": None},
+}
+TTS_AUDIO_ENCODING = os.environ.get("TTS_AUDIO_ENCODING", "MP3").upper()
+if TTS_AUDIO_ENCODING not in AUDIO_FORMATS:
+    print(f"⚠️  Unknown TTS_AUDIO_ENCODING '{TTS_AUDIO_ENCODING}', using LINEAR16")
+    TTS_AUDIO_ENCODING = "LINEAR16"
+AUDIO_MIME_TYPE = AUDIO_FORMATS[TTS_AUDIO_ENCODING]["mime_type"]
+AUDIO_EXTENSION = AUDIO_FORMATS[TTS_AUDIO_ENCODING]["extension"]
+
+# Audio output settings - also part of the cache key
+AUDIO_CONFIG_PARAMS = {
+    "audio_encoding": TTS_AUDIO_ENCODING,
+    "sample_rate_hertz": AUDIO_FORMATS[TTS_AUDIO_ENCODING]["sample_rate_hertz"],
+    "speaking_rate": 1.0,        # Normal speed
+    "pitch": 0.0,                # Normal pitch
+    "effects_profile_id": ["small-bluetooth-speaker-class-device"]  # Optimized for small Bluetooth speakers
+}
+
+# Template responses (speech_pipeline.SplicedSentence): fixed segments are synthesized once as PCM,
+# only the variable parts are synthesized per turn, and the PCM is spliced into one chunk
+TTS_SPLICE_ENABLED = os.environ.get("TTS_SPLICE_ENABLED", "true").lower() == "true"
+TTS_SPLICE_GAP_MS = int(os.environ.get("TTS_SPLICE_GAP_MS", "60"))  # Pause between spliced segments
+SEGMENT_CONFIG_PARAMS = {**AUDIO_CONFIG_PARAMS, "audio_encoding": "LINEAR16",
+                         "sample_rate_hertz": AUDIO_FORMATS[TTS_AUDIO_ENCODING]["sample_rate_hertz"]}
+# Encoding spliced PCM to OGG_OPUS/MP3 needs ffmpeg
+SPLICE_AVAILABLE = TTS_SPLICE_ENABLED and (AUDIO_FORMATS[TTS_AUDIO_ENCODING]["ffmpeg_args"] is None or shutil.which("ffmpeg") is not None)
+_segment_executor = ThreadPoolExecutor(max_workers=speech_pipeline.TTS_POOL_WORKERS, thread_name_prefix="tts-segment")
 
 def initialize_tts():
     """Initializes the Google Cloud Text-to-Speech client."""
-    global client, google_voice
+    global client, google_voice, audio_cache, segment_cache
     
     print("🚀 Initializing Google Cloud Text-to-Speech...")
     
+    # Both caches live under TTS_CACHE_DIR and split TTS_CACHE_MAX_MB between them
+    segment_cache_mb = min(TTS_SEGMENT_CACHE_MAX_MB, TTS_CACHE_MAX_MB // 2) if SPLICE_AVAILABLE else 0
+    audio_cache_mb = TTS_CACHE_MAX_MB - segment_cache_mb
+    if TTS_CACHE_ENABLED and audio_cache is None:
+        try:
+            audio_cache = tts_cache.TTSCache(TTS_CACHE_DIR, audio_cache_mb * 1024 * 1024, extension=AUDIO_EXTENSION)
+            print(f"♻️ TTS audio cache enabled: {TTS_CACHE_DIR} (max {audio_cache_mb} MB, {TTS_AUDIO_ENCODING})")
+        except Exception as e:
+            print(f"⚠️  Could not enable TTS audio cache: {e}")
+    
+    if TTS_SPLICE_ENABLED and not SPLICE_AVAILABLE:
+        print(f"⚠️  ffmpeg not found, template responses are synthesized whole ({TTS_AUDIO_ENCODING} encoding needs it for splicing)")
+    elif SPLICE_AVAILABLE and TTS_CACHE_ENABLED and segment_cache is None:
+        try:
+            segment_cache = tts_cache.TTSCache(os.path.join(TTS_CACHE_DIR, "segments"), segment_cache_mb * 1024 * 1024, extension=".wav")
+            print(f"✂️ Template splicing enabled (segment cache: {segment_cache.cache_dir}, max {segment_cache_mb} MB)")
+        except Exception as e:
+            print(f"⚠️  Could not enable TTS segment cache: {e}")
+    
     try:
         # Check if Google Cloud credentials are set up (should be done by app.py)
         if not os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"):
@@ -20,7 +101,8 @@ def initialize_tts():
         # Initialize the client using Application Default Credentials
         # This will use the credentials set up by app.py via environment variables
         start_time = time.time()
-        client = texttospeech.TextToSpeechClient()
+        client = texttospeech.TextToSpeechClient(transport=connection_warmup.grpc_transport(TextToSpeechGrpcTransport))
+        connection_warmup.monitor.watch_grpc_client("tts", client)
         
         # Set up voice configuration - using high-quality Spanish voice
         google_voice = texttospeech.VoiceSelectionParams(
@@ -68,98 +150,386 @@ def initialize_tts():
         print("   - Make sure app.py credentials setup ran before TTS initialization")
         raise
 
-def generate_speech(text, output_filename="output.wav", speaker_wav=None, speed_mode=True, ultra_fast=False):
+def _select_voice(ultra_fast):
+    """Choose voice quality based on ultra_fast mode"""
+    if ultra_fast:
+        # Use Chirp HD voice for faster synthesis (still high quality)
+        log.debug("⚡ Using Chirp HD voice for ultra-fast mode")
+        return texttospeech.VoiceSelectionParams(
+            language_code="es-US",
+            name=FAST_VOICE_NAME,  # Chirp HD voice (faster than Chirp3-HD)
+            ssml_gender=texttospeech.SsmlVoiceGender.FEMALE
+        )
+    # Use Neural voice for high quality
+    log.debug("🎵 Using Neural voice for high quality")
+    return google_voice
+
+def _synthesis_audio_config():
+    """Audio output config (TTS_AUDIO_ENCODING) with Bluetooth speaker optimization"""
+    return texttospeech.AudioConfig(
+        **{**AUDIO_CONFIG_PARAMS, "audio_encoding": texttospeech.AudioEncoding[TTS_AUDIO_ENCODING]}
+    )
+
+def audio_mime_type(path):
+    """MIME type of a synthesized audio file, from its extension (None if it is not one of ours)"""
+    extension = os.path.splitext(path)[1].lower()
+    for audio_format in AUDIO_FORMATS.values():
+        if audio_format["extension"] == extension:
+            return audio_format["mime_type"]
+    return None
+
+def _log_synthesis(audio_content, synthesis_time):
+    connection_warmup.monitor.record_request("tts", synthesis_time)
+    log.info(f"⏱️ Synthesis time: {synthesis_time:.3f}s")
+    if TTS_AUDIO_ENCODING == "LINEAR16":
+        # Estimate audio duration (16-bit mono PCM)
+        audio_duration = len(audio_content) / (AUDIO_CONFIG_PARAMS["sample_rate_hertz"] * 2)
+        log.debug(f"✅ Speech generated successfully! ({len(audio_content)} bytes, {audio_duration:.1f}s audio)")
+        log.debug(f"🚀 Speed: {audio_duration/max(synthesis_time, 1e-6):.1f}x realtime (synthesis only)")
+    else:
+        log.debug(f"✅ Speech generated successfully! ({len(audio_content)} bytes {TTS_AUDIO_ENCODING})")
+
+def _log_synthesis_error(e):
+    log.error(f"❌ Error in speech generation: {e}")
+    if "quota" in str(e).lower():
+        log.warning("💡 Quota exceeded - try using ultra_fast=True or check Google Cloud billing")
+    elif "permission" in str(e).lower():
+        log.warning("💡 Permission denied - check Google Cloud TTS API is enabled")
+    elif "network" in str(e).lower():
+        log.warning("💡 Network error - check internet connection")
+
+def _request_synthesis(text, voice):
+    """Call Google Cloud TTS and return the raw audio bytes"""
+    try:
+        # Generate speech
+        log.debug("🎵 Synthesizing audio with Google Cloud...")
+        synthesis_start = time.time()
+        
+        response = client.synthesize_speech(
+            input=texttospeech.SynthesisInput(text=text),
+            voice=voice,
+            audio_config=_synthesis_audio_config()
+        )
+        
+        _log_synthesis(response.audio_content, time.time() - synthesis_start)
+        return response.audio_content
+        
+    except Exception as e:
+        _log_synthesis_error(e)
+        raise
+
+def _cache_lookup(text, voice):
+    """Returns (cache_key, cached_path); both None when the audio cache is disabled"""
+    if audio_cache is None:
+        return None, None
+    cache_key = tts_cache.make_cache_key(text, voice.name, AUDIO_CONFIG_PARAMS)
+    return cache_key, audio_cache.get(cache_key)
+
+def synthesize_speech(text, ultra_fast=False):
+    """
+    Generates speech from text and returns the audio in memory (no output file).
+    Args:
+        text (str): The text to synthesize.
+        ultra_fast (bool): If True, uses the faster Chirp HD voice.
+    Returns:
+        bytes: Audio content in TTS_AUDIO_ENCODING (AUDIO_MIME_TYPE).
+    """
+    if client is None:
+        raise Exception("Google Cloud TTS not initialized. Call initialize_tts() first.")
+
+    log.info(f"🗣️ Generating speech: '{text[:50]}{'...' if len(text) > 50 else ''}'")
+    start_time = time.time()
+    voice = _select_voice(ultra_fast)
+    if isinstance(text, speech_pipeline.SplicedSentence):
+        return synthesize_spliced(text, voice)
+    
+    # Serve repeated prompts straight from the audio cache
+    cache_key, cached_path = _cache_lookup(text, voice)
+    if cached_path:
+        with open(cached_path, "rb") as cached:
+            audio_content = cached.read()
+        log.info(f"♻️ TTS cache hit: {cached_path} ({time.time() - start_time:.3f}s)")
+        return audio_content
+    
+    audio_content = _request_synthesis(text, voice)
+    if cache_key is not None:
+        audio_cache.put(cache_key, audio_content)
+    log.info(f"⏱️ Total time: {time.time() - start_time:.3f}s")
+    return audio_content
+
+def initialize_tts_async():
+    """Creates the asyncio TTS client. Must run inside the server's event loop (gRPC aio binds to it)."""
+    global async_client
+    async_client = texttospeech.TextToSpeechAsyncClient(transport=connection_warmup.grpc_transport(TextToSpeechGrpcAsyncIOTransport))
+    connection_warmup.monitor.watch_grpc_client_async("tts", async_client)
+    print("✅ Google Cloud TTS async client ready")
+
+async def synthesize_speech_async(text, ultra_fast=False):
+    """
+    Async version of synthesize_speech for the ASGI server.
+    Returns:
+        bytes: Audio content in TTS_AUDIO_ENCODING (AUDIO_MIME_TYPE).
+    """
+    if async_client is None:
+        raise Exception("Google Cloud TTS async client not initialized. Call initialize_tts_async() first.")
+
+    log.info(f"🗣️ Generating speech: '{text[:50]}{'...' if len(text) > 50 else ''}'")
+    start_time = time.time()
+    voice = _select_voice(ultra_fast)
+    if isinstance(text, speech_pipeline.SplicedSentence):
+        return await synthesize_spliced_async(text, voice)
+    
+    # Cache lookups and writes are small local file operations, done inline
+    cache_key, cached_path = _cache_lookup(text, voice)
+    if cached_path:
+        with open(cached_path, "rb") as cached:
+            audio_content = cached.read()
+        log.info(f"♻️ TTS cache hit: {cached_path} ({time.time() - start_time:.3f}s)")
+        return audio_content
+    
+    try:
+        response = await async_client.synthesize_speech(
+            input=texttospeech.SynthesisInput(text=text),
+            voice=voice,
+            audio_config=_synthesis_audio_config()
+        )
+    except Exception as e:
+        _log_synthesis_error(e)
+        raise
+    audio_content = response.audio_content
+    _log_synthesis(audio_content, time.time() - start_time)
+    
+    if cache_key is not None:
+        audio_cache.put(cache_key, audio_content)
+    return audio_content
+
+def generate_speech(text, output_filename="output" + AUDIO_EXTENSION, speaker_wav=None, speed_mode=True, ultra_fast=False):
     """
     Generates speech from text using Google Cloud Text-to-Speech.
     Args:
         text (str): The text to synthesize.
-        output_filename (str): The path to save the output WAV file.
+        output_filename (str): The path to save the output audio file (use AUDIO_EXTENSION).
         speaker_wav (str, optional): Ignored in Google TTS.
         speed_mode (bool): Ignored (Google TTS is always optimized).
         ultra_fast (bool): If True, uses Standard voice for faster synthesis.
     Returns:
-        str: Path to the saved audio file.
+        str: Path to the saved audio file. When the audio cache is enabled this is
+             the cached file and output_filename is not written.
     """
     if client is None:
         raise Exception("Google Cloud TTS not initialized. Call initialize_tts() first.")
 
-    print(f"🗣️ Generating speech: '{text[:50]}{'...' if len(text) > 50 else ''}'")
+    log.info(f"🗣️ Generating speech: '{text[:50]}{'...' if len(text) > 50 else ''}'")
+    start_time = time.time()
+    voice = _select_voice(ultra_fast)
     
-    try:
-        start_time = time.time()
-        
+    # Serve repeated prompts straight from the audio cache (spliced sentences carry user data, never cached)
+    cache_key, cached_path = (None, None) if isinstance(text, speech_pipeline.SplicedSentence) else _cache_lookup(text, voice)
+    if cached_path:
+        log.info(f"♻️ TTS cache hit: {cached_path} ({time.time() - start_time:.3f}s)")
+        return cached_path
+    
+    if isinstance(text, speech_pipeline.SplicedSentence):
+        audio_content = synthesize_spliced(text, voice)
+    else:
+        audio_content = _request_synthesis(text, voice)
+    
+    # Save the audio to file (into the cache when enabled)
+    log.debug("💾 Saving audio file...")
+    if cache_key is not None:
+        output_filename = audio_cache.put(cache_key, audio_content)
+    else:
         # Ensure the directory exists
         output_dir = os.path.dirname(output_filename)
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir, exist_ok=True)
-            print(f"📁 Created directory: {output_dir}")
-        
-        # Choose voice quality based on ultra_fast mode
-        if ultra_fast:
-            # Use Chirp HD voice for faster synthesis (still high quality)
-            voice = texttospeech.VoiceSelectionParams(
-                language_code="es-US",
-                name="es-US-Chirp-HD-F",  # Chirp HD voice (faster than Chirp3-HD)
-                ssml_gender=texttospeech.SsmlVoiceGender.FEMALE
+            log.debug(f"📁 Created directory: {output_dir}")
+        with open(output_filename, "wb") as out:
+            out.write(audio_content)
+    
+    log.debug(f"🎵 Saved: {output_filename} ({len(audio_content)} bytes)")
+    log.info(f"⏱️ Total time: {time.time() - start_time:.3f}s")
+    return output_filename
+
+def splice_pcm(wav_parts, gap_ms=TTS_SPLICE_GAP_MS):
+    """Join 16-bit mono WAV clips (same sample rate) into one WAV, with gap_ms of silence between them"""
+    sample_rate = None
+    frames = []
+    for part in wav_parts:
+        with wave.open(io.BytesIO(part), "rb") as clip:
+            if clip.getsampwidth() != 2 or clip.getnchannels() != 1:
+                raise ValueError("Only 16-bit mono PCM can be spliced")
+            if sample_rate is None:
+                sample_rate = clip.getframerate()
+            elif clip.getframerate() != sample_rate:
+                raise ValueError(f"Sample rate mismatch: {clip.getframerate()} != {sample_rate}")
+            frames.append(clip.readframes(clip.getnframes()))
+    
+    output = io.BytesIO()
+    with wave.open(output, "wb") as spliced:
+        spliced.setnchannels(1)
+        spliced.setsampwidth(2)
+        spliced.setframerate(sample_rate)
+        spliced.writeframes((b"\x00\x00" * int(sample_rate * gap_ms / 1000)).join(frames))
+    return output.getvalue()
+
+def encode_audio(wav_content):
+    """Encode a WAV clip to TTS_AUDIO_ENCODING (ffmpeg pipes; LINEAR16 is returned as is)"""
+    ffmpeg_args = AUDIO_FORMATS[TTS_AUDIO_ENCODING]["ffmpeg_args"]
+    if not ffmpeg_args:
+        return wav_content
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-ac", "1",
+         "-ar", str(AUDIO_FORMATS[TTS_AUDIO_ENCODING]["sample_rate_hertz"]), *ffmpeg_args, "pipe:1"],
+        input=wav_content, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30
+    )
+    if result.returncode != 0 or not result.stdout:
+        raise Exception(f"ffmpeg encoding failed: {result.stderr.decode('utf-8', 'ignore').strip()}")
+    return result.stdout
+
+def _segment_audio_config():
+    return texttospeech.AudioConfig(
+        **{**SEGMENT_CONFIG_PARAMS, "audio_encoding": texttospeech.AudioEncoding.LINEAR16}
+    )
+
+def _segment_cache_lookup(text, voice, is_variable):
+    """Returns (cache_key, cached_audio); variable segments (user data) are never cached"""
+    if is_variable or segment_cache is None:
+        return None, None
+    cache_key = tts_cache.make_cache_key(text, voice.name, SEGMENT_CONFIG_PARAMS)
+    cached_path = segment_cache.get(cache_key)
+    if cached_path is None:
+        return cache_key, None
+    with open(cached_path, "rb") as cached:
+        return cache_key, cached.read()
+
+def _synthesize_segment(text, voice, is_variable):
+    """LINEAR16 audio of one template segment, fixed segments from the segment cache. Returns (audio, synthesized)."""
+    with tracing.span("tts_segment", variable=is_variable, chars=len(text)) as segment_span:
+        cache_key, audio_content = _segment_cache_lookup(text, voice, is_variable)
+        segment_span.attributes["cached"] = audio_content is not None
+        if audio_content is None:
+            audio_content = client.synthesize_speech(
+                input=texttospeech.SynthesisInput(text=text), voice=voice, audio_config=_segment_audio_config()
+            ).audio_content
+            if cache_key is not None:
+                segment_cache.put(cache_key, audio_content)
+        return audio_content, not segment_span.attributes["cached"]
+
+async def _synthesize_segment_async(text, voice, is_variable):
+    with tracing.span("tts_segment", variable=is_variable, chars=len(text)) as segment_span:
+        cache_key, audio_content = _segment_cache_lookup(text, voice, is_variable)
+        segment_span.attributes["cached"] = audio_content is not None
+        if audio_content is None:
+            response = await async_client.synthesize_speech(
+                input=texttospeech.SynthesisInput(text=text), voice=voice, audio_config=_segment_audio_config()
             )
-            print("⚡ Using Chirp HD voice for ultra-fast mode")
-        else:
-            # Use Neural voice for high quality
-            voice = google_voice
-            print("🎵 Using Neural voice for high quality")
-        
-        # Prepare the text input
-        text_input = texttospeech.SynthesisInput(text=text)
-        
-        # Configure audio output with Bluetooth speaker optimization
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.LINEAR16,
-            sample_rate_hertz=22050,  # Good quality, reasonable file size
-            speaking_rate=1.0,        # Normal speed
-            pitch=0.0,                # Normal pitch
-            effects_profile_id=["small-bluetooth-speaker-class-device"]  # Optimized for small Bluetooth speakers
-        )
-        
-        # Generate speech
-        print("🎵 Synthesizing audio with Google Cloud...")
-        synthesis_start = time.time()
-        
-        response = client.synthesize_speech(
-            input=text_input,
-            voice=voice,
-            audio_config=audio_config
+            audio_content = response.audio_content
+            if cache_key is not None:
+                segment_cache.put(cache_key, audio_content)
+        return audio_content, not segment_span.attributes["cached"]
+
+def _splice_enabled():
+    """Splicing only pays off with the segment cache; without it every fixed segment would be synthesized each turn"""
+    return SPLICE_AVAILABLE and segment_cache is not None
+
+def _splice(sentence, parts, start_time):
+    """Splice and encode (audio, synthesized) segment results"""
+    audio_content = encode_audio(splice_pcm([audio for audio, _ in parts]))
+    synthesized = sum(1 for _, was_synthesized in parts if was_synthesized)
+    log.info(f"✂️ Spliced {len(parts)} segments ({synthesized} synthesized) in {time.time() - start_time:.3f}s")
+    return audio_content
+
+def synthesize_spliced(sentence, voice):
+    """
+    Audio for a speech_pipeline.SplicedSentence: segments are synthesized concurrently (fixed ones
+    come from the segment cache) and spliced. Falls back to synthesizing the whole sentence.
+    """
+    if not _splice_enabled():
+        return _request_synthesis(str(sentence), voice)
+    start_time = time.time()
+    try:
+        synthesize = tracing.bind(_synthesize_segment)
+        futures = [_segment_executor.submit(synthesize, text, voice, is_variable) for text, is_variable in sentence.segments]
+        return _splice(sentence, [future.result() for future in futures], start_time)
+    except Exception as e:
+        log.warning(f"⚠️ Splicing failed, synthesizing the whole sentence: {e}")
+        return _request_synthesis(str(sentence), voice)
+
+async def synthesize_spliced_async(sentence, voice):
+    """Async version of synthesize_spliced (ffmpeg encoding runs in a worker thread)"""
+    if _splice_enabled():
+        start_time = time.time()
+        try:
+            parts = await asyncio.gather(*(_synthesize_segment_async(text, voice, is_variable) for text, is_variable in sentence.segments))
+            return await asyncio.to_thread(_splice, sentence, parts, start_time)
+        except Exception as e:
+            log.warning(f"⚠️ Splicing failed, synthesizing the whole sentence: {e}")
+    try:
+        response = await async_client.synthesize_speech(
+            input=texttospeech.SynthesisInput(text=str(sentence)), voice=voice, audio_config=_synthesis_audio_config()
         )
-        
-        synthesis_time = time.time() - synthesis_start
-        
-        # Save the audio to file
-        print("💾 Saving audio file...")
-        with open(output_filename, "wb") as out:
-            out.write(response.audio_content)
-        
-        total_time = time.time() - start_time
-        file_size = os.path.getsize(output_filename)
-        
-        # Estimate audio duration (22050 Hz, 16-bit, mono)
-        audio_duration = len(response.audio_content) / (22050 * 2)  # bytes / (sample_rate * bytes_per_sample)
-        
-        print(f"✅ Speech generated successfully!")
-        print(f"🎵 Saved: {output_filename} ({file_size} bytes, {audio_duration:.1f}s audio)")
-        print(f"⏱️ Synthesis time: {synthesis_time:.3f}s")
-        print(f"⏱️ Total time: {total_time:.3f}s")
-        print(f"🚀 Speed: {audio_duration/synthesis_time:.1f}x realtime (synthesis only)")
-        
-        return output_filename
-        
     except Exception as e:
-        print(f"❌ Error in speech generation: {e}")
-        if "quota" in str(e).lower():
-            print("💡 Quota exceeded - try using ultra_fast=True or check Google Cloud billing")
-        elif "permission" in str(e).lower():
-            print("💡 Permission denied - check Google Cloud TTS API is enabled")
-        elif "network" in str(e).lower():
-            print("💡 Network error - check internet connection")
+        _log_synthesis_error(e)
         raise
+    return response.audio_content
+
+def prewarm_cache(texts, templates=()):
+    """
+    Synthesize static prompts ahead of time so scripted turns are served from the cache.
+    Texts are split exactly like live responses so the cached sentences match.
+    Args:
+        texts (list): Prompt texts to pre-synthesize.
+        templates (list): speech_pipeline.fill_template templates; their fixed sentences go to the
+                          audio cache and the fixed parts of sentences with variables to the segment cache.
+    Returns:
+        dict: Cache statistics after pre-warming.
+    """
+    if client is None:
+        raise Exception("Google Cloud TTS not initialized. Call initialize_tts() first.")
+    if audio_cache is None:
+        print("⚠️ TTS audio cache disabled, nothing to pre-warm.")
+        return {}
+    
+    sentences = []
+    segments = []
+    for text in texts:
+        sentences.extend(speech_pipeline.split_sentences(speech_pipeline.clean_response_text(text)))
+    for template in templates:
+        for sentence in speech_pipeline.split_segments(speech_pipeline.probe_template(template)):
+            if isinstance(sentence, speech_pipeline.SplicedSentence):
+                segments.extend(text for text, is_variable in sentence.segments if not is_variable)
+            else:
+                sentences.append(sentence)
+    sentences = list(dict.fromkeys(sentences))  # Unique, keep order
+    segments = list(dict.fromkeys(segments)) if segment_cache is not None else []
+    
+    print(f"🔥 Pre-warming TTS cache with {len(sentences)} sentences and {len(segments)} template segments...")
+    start_time = time.time()
+    failed = 0
+    for chunk in speech_pipeline.synthesize_in_order(sentences, lambda index, sentence: synthesize_speech(sentence, ultra_fast=True)):
+        if chunk['error'] is not None:
+            failed += 1
+            print(f"❌ Pre-warm failed for '{chunk['text'][:30]}...': {chunk['error']}")
+    
+    fast_voice = _select_voice(True)  # Live turns synthesize with ultra_fast=True
+    for chunk in speech_pipeline.synthesize_in_order(segments, lambda index, segment: _synthesize_segment(segment, fast_voice, False)):
+        if chunk['error'] is not None:
+            failed += 1
+            print(f"❌ Pre-warm failed for segment '{chunk['text'][:30]}...': {chunk['error']}")
+    
+    stats = audio_cache.stats()
+    print(f"✅ TTS cache pre-warmed in {time.time() - start_time:.1f}s ({failed} failed): {stats}")
+    return stats
+
+def get_cache_stats():
+    """Return audio cache hit/miss counters (empty dict when the cache is disabled)."""
+    if audio_cache is None:
+        return {}
+    stats = audio_cache.stats()
+    if segment_cache is not None:
+        stats["segments"] = segment_cache.stats()
+    return stats
 
 def generate_speech_chunked(text, output_dir="static", session_id="default", speaker_wav=None):
     """
@@ -175,26 +545,26 @@ def generate_speech_chunked(text, output_dir="static", session_id="default", spe
     
     if len(sentences) <= 1:
         # Single sentence, no need to chunk
-        output_file = os.path.join(output_dir, f"speech_{session_id}.wav")
+        output_file = os.path.join(output_dir, f"speech_{session_id}{AUDIO_EXTENSION}")
         return [generate_speech(text, output_file, ultra_fast=True)]
     
-    print(f"📝 Generating {len(sentences)} chunks with Google Cloud TTS...")
+    log.info(f"📝 Generating {len(sentences)} chunks with Google Cloud TTS...")
     audio_files = []
     
     for i, sentence in enumerate(sentences):
         if len(sentence) < 3:  # Skip very short fragments
             continue
             
-        chunk_filename = f"chunk_{session_id}_{i:03d}.wav"
+        chunk_filename = f"chunk_{session_id}_{i:03d}{AUDIO_EXTENSION}"
         chunk_path = os.path.join(output_dir, chunk_filename)
         
         try:
             generate_speech(sentence, chunk_path, ultra_fast=True)
             audio_files.append(chunk_path)
         except Exception as e:
-            print(f"❌ Error generating chunk {i}: {e}")
+            log.error(f"❌ Error generating chunk {i}: {e}")
     
-    print(f"✅ Generated {len(audio_files)} audio chunks with Google Cloud TTS")
+    log.info(f"✅ Generated {len(audio_files)} audio chunks with Google Cloud TTS")
     return audio_files
 
 def list_available_voices():
@@ -0,0 +1,253 @@
+# turn_planner.py
+"""
+Turn Planner for Ana - AI Contact Center Agent
+Decides what Ana says for one transcribed user turn (introduction, canned responses,
+FAQ answers, application flow, LLM fallback). Shared by the Flask and ASGI servers,
+which only differ in how the speech is synthesized and streamed.
+"""
+
+from typing import Any, Dict, Generator, List, Optional, Tuple
+
+import faq_knowledge_base
+import session_manager
+import conversation_flow
+from session_manager import ConversationState
+import conversation_logger as conv_log
+
+log = conv_log.get_logger("turn_planner")
+
+# --- Ana's fixed responses (also pre-synthesized into the TTS cache) ---
+INTRO_SPEECH = "¡Hola! Soy Ana, tu asistente virtual de Club Cash In. ¿En qué puedo ayudarte hoy?"
+THANKS_RESPONSE = "¡De nada! ¿Hay algo más en lo que te pueda ayudar hoy?"
+REPEAT_GREETING_RESPONSE = "¡Hola de nuevo! ¿En qué puedo asistirte?"
+LLM_EMPTY_FALLBACK_RESPONSE = "Disculpa, no estoy segura de cómo responder a eso. ¿Podrías reformular tu pregunta? Puedo ayudarte con información sobre préstamos o iniciar una solicitud."
+NO_LLM_FALLBACK_RESPONSE = "Disculpa, no pude entender tu pregunta. Puedo ayudarte con información sobre nuestros préstamos o iniciar una solicitud."
+TRANSITION_CLARIFICATION_RESPONSE = "No entendí tu respuesta. ¿Te gustaría que te ayude a iniciar una solicitud de préstamo? Por favor responde 'sí' o 'no'."
+
+THANKS_WORDS = ["gracias", "muchas gracias", "ok", "bueno", "bien", "entiendo", "claro"]
+GREETINGS = ["hola", "buenos días", "buenas tardes", "buenas noches"]
+APPLICATION_REQUEST_PHRASES = [
+    "solicitar un préstamo", "aplicar para un préstamo", "pedir un préstamo",
+    "iniciar solicitud", "empezar solicitud", "hacer una solicitud",
+    "solicitud de préstamo", "aplicación de préstamo",
+    "quiero un préstamo", "necesito un préstamo", "solicito un préstamo"
+]
+
+
+def collect_static_prompts() -> List[str]:
+    """All scripted prompts Ana can say: fixed responses, FAQ answers and flow questions"""
+    prompts = [
+        INTRO_SPEECH, THANKS_RESPONSE, REPEAT_GREETING_RESPONSE,
+        LLM_EMPTY_FALLBACK_RESPONSE, NO_LLM_FALLBACK_RESPONSE, TRANSITION_CLARIFICATION_RESPONSE,
+        faq_knowledge_base.get_transition_question()
+    ]
+    prompts.extend(faq_knowledge_base.get_faq_response(faq_data) for faq_data in faq_knowledge_base.FAQ_DATABASE.values())
+    prompts.extend(conversation_flow.conversation_flow.get_initial_question(state) for state in ConversationState)
+    return prompts
+
+
+def collect_speech_templates() -> List[str]:
+    """Scripted responses with user data; their fixed parts are pre-synthesized for splicing"""
+    return list(conversation_flow.SPEECH_TEMPLATES)
+
+
+def say(text: str, segments: Optional[List[Tuple[str, bool]]] = None) -> Dict[str, Any]:
+    """Action: synthesize and stream a fixed text (segments: the filled template it came from, if any)"""
+    return {'type': 'say', 'text': text, 'segments': segments}
+
+
+def build_llm_prompt(user_text: str) -> str:
+    """Prompt for the LLM fallback"""
+    return f"""Eres Ana, una asistente virtual amigable y profesional de una empresa de préstamos en Guatemala. Tu objetivo principal es ayudar con información de préstamos o guiar en el proceso de solicitud. Respondes en español de manera cálida y concisa. El usuario dice: "{user_text}" """
+
+
+def plan_turn(session_id: str, user_text: str, history: Optional[List[Dict[str, Any]]] = None,
+              llm_available: bool = True) -> Generator[Dict[str, Any], Optional[str], bool]:
+    """
+    Run Ana's conversation flow for one user turn.
+
+    Yields actions for the server to perform, in order:
+        {'type': 'say', 'text': ..., 'segments': ...}  - synthesize and stream the text; segments
+            (may be None) is the filled template it came from, for speech_pipeline.split_segments
+        {'type': 'llm', 'prompt': ..., 'history': ..., 'cache_text': ...}  - stream an LLM answer;
+            the server must send() back the full generated text (may be empty). cache_text is
+            the user's part of the prompt, for the response cache.
+
+    Returns (StopIteration.value):
+        bool: True if the interaction should be saved to memory (False for the introduction turn)
+    """
+    # Check if Ana needs to introduce herself for this session_id
+    first_interaction_in_session = not session_manager.session_manager.has_been_introduced(session_id)
+
+    if first_interaction_in_session:
+        intro_speech = INTRO_SPEECH
+        conv_log.log_ana_response(session_id, "INTRODUCTION", intro_speech)
+        conv_log.log_debug(session_id, f"First interaction - introducing Ana. User said: '{user_text}'")
+        yield say(intro_speech)
+        session_manager.session_manager.mark_as_introduced(session_id)
+
+        # ALWAYS end turn after introduction to prevent double processing/audio
+        conv_log.log_debug(session_id, "Ending turn after introduction to prevent audio duplication")
+        return False  # CRITICAL: Always stop after introduction
+
+    # --- Main Logic based on state (Ana has been introduced or first query is not a simple greeting) ---
+    current_state = session_manager.get_current_state(session_id)
+
+    if current_state == ConversationState.GENERAL_CHAT:
+        user_lower = user_text.lower().strip()
+
+        # FIRST PRIORITY: Check for other contextual responses
+        if any(word in user_lower for word in THANKS_WORDS):
+            conv_log.log_ana_response(session_id, "THANKS_RESPONSE", THANKS_RESPONSE)
+            yield say(THANKS_RESPONSE)
+        elif any(user_lower == greet for greet in GREETINGS):  # Simple greeting after intro
+            conv_log.log_ana_response(session_id, "REPEAT_GREETING", REPEAT_GREETING_RESPONSE)
+            yield say(REPEAT_GREETING_RESPONSE)
+
+        # SECOND PRIORITY: Try to match FAQ first (to catch information requests)
+        else:
+            faq_match = faq_knowledge_base.find_faq_intent(user_text)
+            if faq_match:
+                log.info(f"🔍 FAQ Intent matched: {faq_match['intent_name']}")
+                conv_log.log_faq_match(session_id, user_text, faq_match['intent_name'])
+
+                faq_response_text = faq_knowledge_base.get_faq_response(faq_match)
+                conv_log.log_ana_response(session_id, "FAQ_RESPONSE", faq_response_text)
+                yield say(faq_response_text)
+
+                transition_question = faq_knowledge_base.get_transition_question()
+                conv_log.log_state_change(session_id, "GENERAL_CHAT", "AWAITING_TRANSITION_RESPONSE")
+                conv_log.log_transition_question(session_id)
+                session_manager.update_state(session_id, ConversationState.AWAITING_TRANSITION_RESPONSE)
+                yield say(transition_question)
+
+            # THIRD PRIORITY: Check for explicit application requests (more specific patterns)
+            elif any(phrase in user_lower for phrase in APPLICATION_REQUEST_PHRASES):
+                # Start application flow directly - no need for extra confirmation
+                session_manager.session_manager.start_application_flow(session_id)
+                ana_response = conversation_flow.conversation_flow.get_initial_question(ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION)
+                conv_log.log_state_change(session_id, "GENERAL_CHAT", "STATE_ASK_ELIGIBILITY_PERMISSION")
+                conv_log.log_ana_response(session_id, "APPLICATION_START", ana_response)
+                session_manager.update_state(session_id, ConversationState.STATE_ASK_ELIGIBILITY_PERMISSION)
+                yield say(ana_response)
+
+            # FOURTH PRIORITY: General chat / LLM fallback
+            else:
+                log.info(f"❌ No FAQ or application request found, providing contextual response for: '{user_text}'")
+                conv_log.log_faq_no_match(session_id, user_text)
+
+                # Fallback to LLM for unhandled general chat
+                if llm_available:
+                    # Speak each sentence as soon as the LLM finishes it instead of waiting for the full completion
+                    full_llm_response = yield {'type': 'llm', 'prompt': build_llm_prompt(user_text),
+                                               'history': history, 'cache_text': user_text}
+                    if full_llm_response and full_llm_response.strip():
+                        conv_log.log_llm_fallback(session_id, user_text, full_llm_response)
+                    else:  # LLM gave empty response
+                        conv_log.log_ana_response(session_id, "LLM_EMPTY_FALLBACK", LLM_EMPTY_FALLBACK_RESPONSE)
+                        yield say(LLM_EMPTY_FALLBACK_RESPONSE)
+                else:  # LLM not available
+                    conv_log.log_ana_response(session_id, "NO_LLM_FALLBACK", NO_LLM_FALLBACK_RESPONSE)
+                    yield say(NO_LLM_FALLBACK_RESPONSE)
+
+    elif current_state == ConversationState.AWAITING_TRANSITION_RESPONSE:
+        # User is responding to "Do you want to start an application?"
+        conv_log.log_debug(session_id, f"Processing transition response: '{user_text}'")
+
+        # FIRST: Try to process as transition response (affirmative/negative)
+        conv_log.log_debug(session_id, f"Attempting to process as transition response")
+        flow_result = conversation_flow.conversation_flow.process_user_input(session_id, user_text)
+        conv_log.log_debug(session_id, f"Flow result: {flow_result}")
+
+        # If flow successfully processed the transition (user said yes/no), continue with flow
+        if flow_result['success'] or flow_result['next_state'] != ConversationState.AWAITING_TRANSITION_RESPONSE:
+            conv_log.log_debug(session_id, f"Successfully processed as transition response")
+
+            if flow_result['success']:
+                old_state = current_state.value
+                new_state = flow_result['next_state']
+                conv_log.log_state_change(session_id, old_state, new_state.value if hasattr(new_state, 'value') else str(new_state))
+                session_manager.update_state(session_id, flow_result['next_state'])
+                conv_log.log_ana_response(session_id, "TRANSITION_SUCCESS", flow_result['response'])
+                yield say(flow_result['response'])
+
+                # If the next step involves Ana asking another question immediately:
+                if flow_result['next_state'] not in [ConversationState.GENERAL_CHAT, ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT, ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY]:
+                    # This might be implicit if flow_result['response'] IS the next question
+                    conv_log.log_debug(session_id, f"Next state requires immediate question: {flow_result['next_state']}")
+                elif flow_result['next_state'] == ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT:
+                    conv_log.log_debug(session_id, "Handling qualification result")
+                    yield from _qualification_result(session_id)
+                elif flow_result['next_state'] == ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY:
+                    conv_log.log_debug(session_id, "Providing application summary")
+                    yield from _application_summary(session_id, log_response=True)
+            else:
+                # Failed to process as transition, still in AWAITING_TRANSITION_RESPONSE
+                conv_log.log_debug(session_id, f"Failed to process as transition, trying validation error")
+                session_manager.update_state(session_id, flow_result['next_state'])  # State might remain to re-ask
+                conv_log.log_ana_response(session_id, "TRANSITION_VALIDATION_ERROR", flow_result['response'])
+                yield say(flow_result['response'])
+
+        else:
+            # Could not process as transition response - maybe it's an FAQ question instead
+            conv_log.log_debug(session_id, f"Could not process as transition, checking if it's an FAQ")
+            faq_match_instead_of_transition = faq_knowledge_base.find_faq_intent(user_text)
+            if faq_match_instead_of_transition:
+                log.info(f"🔍 User asked FAQ ({faq_match_instead_of_transition['intent_name']}) instead of answering transition.")
+                conv_log.log_faq_match(session_id, user_text, faq_match_instead_of_transition['intent_name'])
+
+                faq_response_text = faq_knowledge_base.get_faq_response(faq_match_instead_of_transition)
+                conv_log.log_ana_response(session_id, "FAQ_DURING_TRANSITION", faq_response_text)
+                yield say(faq_response_text)
+
+                # Re-ask the transition question as the state is still AWAITING_TRANSITION_RESPONSE
+                transition_question = faq_knowledge_base.get_transition_question()
+                conv_log.log_ana_response(session_id, "RE_ASK_TRANSITION", transition_question)
+                yield say(transition_question)
+            else:
+                # Neither transition nor FAQ - provide clarification
+                conv_log.log_debug(session_id, f"Neither transition nor FAQ - asking for clarification")
+                conv_log.log_ana_response(session_id, "TRANSITION_CLARIFICATION", TRANSITION_CLARIFICATION_RESPONSE)
+                yield say(TRANSITION_CLARIFICATION_RESPONSE)
+
+    else:  # User is in other application flow states (e.g., STATE_ASK_MINIMUM_AGE, etc.)
+        flow_result = conversation_flow.conversation_flow.process_user_input(session_id, user_text)
+        if flow_result['success']:
+            session_manager.update_state(session_id, flow_result['next_state'])
+            yield say(flow_result['response'])
+
+            # Handle special states that need additional processing
+            if flow_result['next_state'] == ConversationState.STATE_HANDLE_INITIAL_QUALIFICATION_RESULT:
+                conv_log.log_debug(session_id, "Handling qualification result in main flow")
+                yield from _qualification_result(session_id)
+            elif flow_result['next_state'] == ConversationState.STATE_PROVIDE_APPLICATION_SUMMARY:
+                yield from _application_summary(session_id, log_response=False)
+            # NOTE: Most states already include their next question in flow_result['response']
+            # Only add automatic questions for states that explicitly need it (currently none)
+
+        else:  # flow_result not successful
+            session_manager.update_state(session_id, flow_result['next_state'])
+            yield say(flow_result['response'])
+
+    return True
+
+
+def _qualification_result(session_id: str) -> Generator[Dict[str, Any], Optional[str], None]:
+    """Announce the eligibility result and ask the next question automatically"""
+    qualification_result = conversation_flow.conversation_flow._handle_qualification_result(session_id)
+    session_manager.update_state(session_id, qualification_result['next_state'])
+    conv_log.log_ana_response(session_id, "QUALIFICATION_RESULT", qualification_result['response'])
+    yield say(qualification_result['response'])
+    if qualification_result['next_state'] == ConversationState.STATE_ASK_FULL_NAME:
+        next_question = conversation_flow.conversation_flow.get_initial_question(ConversationState.STATE_ASK_FULL_NAME)
+        conv_log.log_ana_response(session_id, "AUTO_NEXT_QUESTION", next_question)
+        yield say(next_question)
+
+
+def _application_summary(session_id: str, log_response: bool) -> Generator[Dict[str, Any], Optional[str], None]:
+    """Read back the application summary (moves the session back to GENERAL_CHAT)"""
+    summary_result = conversation_flow.conversation_flow._provide_application_summary(session_id)
+    session_manager.update_state(session_id, summary_result['next_state'])  # Should go to GENERAL_CHAT
+    if log_response:
+        conv_log.log_ana_response(session_id, "APPLICATION_SUMMARY", summary_result['response'])
+    yield say(summary_result['response'], summary_result['speech_segments'])
@@ -0,0 +1,449 @@
+# whisper_pool.py
+"""
+Shared Whisper fallback STT for a node.
+
+One pool process owns N worker processes, each holding one Whisper model. Web processes
+(Flask threads, gunicorn workers, the ASGI server) send 16 kHz PCM to it over a local socket
+and block only their own request thread. Requests wait in a single queue; a worker takes up to
+WHISPER_BATCH_SIZE of them at once and decodes clips that fit Whisper's 30 s window as one
+batch. The CPU budget (WHISPER_POOL_CPU_THREADS) is split across the workers.
+
+The first web process that needs the fallback starts the pool (WHISPER_POOL_AUTOSTART); the
+others connect to the same address, so model memory is paid once per node.
+
+The manager protocol unpickles what it receives, so only the node's own processes may connect:
+by default the pool listens on a Unix socket in an owner-only directory and authenticates with a
+random per-node key file (mode 0600). A TCP address needs an explicit WHISPER_POOL_AUTHKEY.
+
+Usage:
+    python whisper_pool.py                                  # serve on WHISPER_POOL_ADDRESS
+    python whisper_pool.py --workers 2 --cpu-threads 4 --model small
+"""
+
+import os
+import sys
+import time
+import queue
+import fcntl
+import socket
+import secrets
+import argparse
+import itertools
+import threading
+import subprocess
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.managers import BaseManager
+from typing import Any, Dict, List, Optional
+
+WHISPER_POOL_RUNTIME_DIR = os.environ.get("WHISPER_POOL_RUNTIME_DIR") or os.path.join(os.path.expanduser("~"), ".pbx")
+WHISPER_POOL_ADDRESS = os.environ.get("WHISPER_POOL_ADDRESS") or os.path.join(WHISPER_POOL_RUNTIME_DIR, "whisper_pool.sock")  # Unix socket path or host:port
+WHISPER_POOL_AUTHKEY = os.environ.get("WHISPER_POOL_AUTHKEY", "")  # Empty: generated per-node key file
+WHISPER_POOL_AUTHKEY_FILE = os.environ.get("WHISPER_POOL_AUTHKEY_FILE") or os.path.join(WHISPER_POOL_RUNTIME_DIR, "whisper_pool.key")
+WHISPER_POOL_AUTOSTART = os.environ.get("WHISPER_POOL_AUTOSTART", "true").lower() == "true"
+WHISPER_POOL_WORKERS = int(os.environ.get("WHISPER_POOL_WORKERS", "1"))
+WHISPER_POOL_CPU_THREADS = int(os.environ.get("WHISPER_POOL_CPU_THREADS", str(max(1, (os.cpu_count() or 2) // 2))))
+WHISPER_BATCH_SIZE = int(os.environ.get("WHISPER_BATCH_SIZE", "4"))
+WHISPER_BATCH_WAIT_MS = float(os.environ.get("WHISPER_BATCH_WAIT_MS", "50"))
+WHISPER_POOL_TIMEOUT_SECONDS = float(os.environ.get("WHISPER_POOL_TIMEOUT_SECONDS", "60"))
+WHISPER_POOL_LOG = os.environ.get("WHISPER_POOL_LOG", os.path.join("logs", "whisper_pool.log"))
+
+SAMPLE_RATE = 16000  # PCM sent to the pool: 16-bit mono at this rate
+MAX_BATCH_SECONDS = 30  # Whisper's window; longer clips are transcribed on their own
+_WELL_KNOWN_AUTHKEYS = ("", "pbx-whisper")  # Former built-in default: never accepted on TCP
+
+_authkey: Optional[bytes] = None
+
+
+def _parse_address(address: str):
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address  # Unix socket path
+
+
+def _tcp_key_error(address: str) -> Optional[str]:
+    """Why the pool must not listen on address with the configured key (None if it may)"""
+    if isinstance(_parse_address(address), tuple) and WHISPER_POOL_AUTHKEY in _WELL_KNOWN_AUTHKEYS:
+        return (f"Whisper pool address {address} is TCP: set WHISPER_POOL_AUTHKEY to a random secret "
+                f"(or use a unix socket path)")
+    return None
+
+
+def _get_authkey() -> bytes:
+    """WHISPER_POOL_AUTHKEY, or this node's key file, created with a random key (mode 0600) on first use"""
+    global _authkey
+    if _authkey is not None:
+        return _authkey
+    if WHISPER_POOL_AUTHKEY:
+        _authkey = WHISPER_POOL_AUTHKEY.encode()
+        return _authkey
+
+    path = WHISPER_POOL_AUTHKEY_FILE
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", mode=0o700, exist_ok=True)
+        # Write a complete file under a temporary name, then link it in: concurrent starters all read one key
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as key_file:
+            key_file.write(secrets.token_hex(32))
+        try:
+            os.link(temporary_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary_path)
+    if os.stat(path).st_mode & 0o077:
+        print(f"⚠️  Whisper pool key file {path} is readable by other users, chmod 600 it")
+    with open(path) as key_file:
+        _authkey = key_file.read().strip().encode()
+    return _authkey
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Remove a socket file left behind by a pool that died"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.remove(path)  # Nobody listening; get_server() below fails if another pool is
+    finally:
+        probe.close()
+
+
+# --- Worker process ---
+
+def _transcribe_batch(model, whisper, torch, np, jobs):
+    """Returns one text per job. Short clips of one language share a single batched decode."""
+    texts: Dict[int, str] = {}
+    short: Dict[str, List] = {}
+    for job in jobs:
+        job_id, _, pcm, language = job
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        if len(audio) <= MAX_BATCH_SECONDS * SAMPLE_RATE:
+            short.setdefault(language, []).append((job_id, audio))
+        else:
+            texts[job_id] = model.transcribe(audio, language=language, fp16=False)["text"]
+
+    for language, clips in short.items():
+        mels = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), model.dims.n_mels) for _, audio in clips])
+        results = whisper.decode(model, mels.to(model.device), whisper.DecodingOptions(language=language, fp16=False))
+        for (job_id, _), result in zip(clips, results):
+            texts[job_id] = result.text
+    return [texts[job[0]].strip() for job in jobs]
+
+
+def _worker_main(worker_id, model_size, cpu_threads, jobs, results, batch_size, batch_wait):
+    """Load one model, then decode batches from the shared job queue until a None sentinel"""
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[variable] = str(cpu_threads)
+    import numpy as np
+    import torch
+    import whisper
+    torch.set_num_threads(cpu_threads)
+
+    load_start = time.time()
+    try:
+        model = whisper.load_model(model_size, device="cpu")
+    except Exception as e:
+        results.put(("failed", worker_id, str(e), None))
+        return
+    results.put(("ready", worker_id, time.time() - load_start, None))
+
+    stopping = False
+    while not stopping:
+        job = jobs.get()
+        if job is None:
+            break
+        batch = [job]
+        deadline = time.time() + batch_wait
+        while len(batch) < batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                job = jobs.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                stopping = True
+                break
+            batch.append(job)
+
+        started = time.time()
+        try:
+            texts, error = _transcribe_batch(model, whisper, torch, np, batch), None
+        except Exception as e:
+            texts, error = [None] * len(batch), str(e)
+        processing_time = time.time() - started
+        for (job_id, enqueued_at, _, _), text in zip(batch, texts):
+            results.put(("done", job_id, text, {"error": error, "queue_time": started - enqueued_at,
+                                                "processing_time": processing_time, "batch_size": len(batch),
+                                                "worker": worker_id}))
+
+
+# --- Pool process ---
+
+class WhisperPool:
+    """Worker processes fed from one job queue; transcribe() blocks the calling thread only"""
+
+    def __init__(self, model_size: str = "base", workers: int = WHISPER_POOL_WORKERS,
+                 cpu_threads: int = WHISPER_POOL_CPU_THREADS, batch_size: int = WHISPER_BATCH_SIZE,
+                 batch_wait_ms: float = WHISPER_BATCH_WAIT_MS):
+        self.model_size = model_size
+        self.workers = max(1, workers)
+        self.threads_per_worker = max(1, cpu_threads // self.workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000
+
+        context = multiprocessing.get_context("spawn")
+        self._jobs = context.Queue()
+        self._results = context.Queue()
+        self._processes = [context.Process(target=_worker_main, name=f"whisper-worker-{i}", daemon=True,
+                                           args=(i, model_size, self.threads_per_worker, self._jobs, self._results,
+                                                 self.batch_size, self.batch_wait))
+                           for i in range(self.workers)]
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+        self.workers_ready = 0
+        self.workers_failed = 0
+        self.load_times: List[float] = []
+        self.completed = 0
+        self.failed = 0
+        self._queue_times: deque = deque(maxlen=1000)
+        self._processing_times: deque = deque(maxlen=1000)
+        self._batch_sizes: deque = deque(maxlen=1000)
+
+    def start(self) -> None:
+        for process in self._processes:
+            process.start()
+        threading.Thread(target=self._collect_results, name="whisper-results", daemon=True).start()
+        print(f"🎙️ Whisper pool: {self.workers} worker(s) x {self.threads_per_worker} CPU thread(s), "
+              f"model {self.model_size}, batches of up to {self.batch_size}")
+
+    def _collect_results(self) -> None:
+        while True:
+            kind, key, value, metrics = self._results.get()
+            if kind == "ready":
+                with self._lock:
+                    self.workers_ready += 1
+                    self.load_times.append(value)
+                print(f"✅ Whisper worker {key} loaded its model in {value:.1f}s")
+                continue
+            if kind == "failed":
+                with self._lock:
+                    self.workers_failed += 1
+                print(f"❌ Whisper worker {key} could not load the model: {value}")
+                continue
+            with self._lock:
+                future = self._pending.pop(key, None)
+                if metrics["error"] is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self._queue_times.append(metrics["queue_time"])
+                self._processing_times.append(metrics["processing_time"])
+                self._batch_sizes.append(metrics["batch_size"])
+            if future is not None:
+                if metrics["error"] is None:
+                    future.set_result(value)
+                else:
+                    future.set_exception(RuntimeError(metrics["error"]))
+
+    def transcribe(self, pcm: bytes, language: str = "es", timeout: float = WHISPER_POOL_TIMEOUT_SECONDS) -> str:
+        """Transcribe 16 kHz 16-bit mono PCM. Raises on worker error or timeout."""
+        if self.workers_failed == self.workers:
+            raise RuntimeError("No Whisper worker could load the model")
+        future: Future = Future()
+        with self._lock:
+            job_id = next(self._ids)
+            self._pending[job_id] = future
+        self._jobs.put((job_id, time.time(), bytes(pcm), language))
+        try:
+            return future.result(timeout)
+        finally:
+            with self._lock:
+                self._pending.pop(job_id, None)
+
+    def stop(self) -> None:
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes:
+            process.join(10)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue time (enqueue -> batch start), processing time and batch size"""
+        def summary(values):
+            if not values:
+                return {"avg": None, "p50": None, "p95": None, "max": None}
+            ordered = sorted(values)
+            return {"avg": sum(ordered) / len(ordered), "p50": ordered[len(ordered) // 2],
+                    "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], "max": ordered[-1]}
+
+        with self._lock:
+            return {
+                "model": self.model_size,
+                "workers": self.workers,
+                "workers_ready": self.workers_ready,
+                "workers_failed": self.workers_failed,
+                "threads_per_worker": self.threads_per_worker,
+                "max_batch_size": self.batch_size,
+                "in_flight": len(self._pending),
+                "completed": self.completed,
+                "failed": self.failed,
+                "model_load_seconds": list(self.load_times),
+                "queue_time": summary(self._queue_times),
+                "processing_time": summary(self._processing_times),
+                "avg_batch_size": sum(self._batch_sizes) / len(self._batch_sizes) if self._batch_sizes else None
+            }
+
+
+class _PoolManager(BaseManager):
+    pass
+
+
+class _PoolClientManager(BaseManager):
+    pass
+
+
+_PoolClientManager.register("pool")
+
+
+def serve(address: str, model_size: str, workers: int, cpu_threads: int, batch_size: int, batch_wait_ms: float) -> None:
+    """Claim the address, start the workers and serve requests until killed"""
+    key_error = _tcp_key_error(address)
+    if key_error:
+        raise SystemExit(f"❌ {key_error}")
+    pool = WhisperPool(model_size, workers, cpu_threads, batch_size, batch_wait_ms)
+    _PoolManager.register("pool", callable=lambda: pool, exposed=("transcribe", "stats"))
+    parsed_address = _parse_address(address)
+    if isinstance(parsed_address, tuple):
+        server = _PoolManager(address=parsed_address, authkey=_get_authkey()).get_server()  # Fails if taken
+    else:
+        os.makedirs(os.path.dirname(address) or ".", mode=0o700, exist_ok=True)  # Owner only
+        # Serialize starters on this node while a stale socket is replaced
+        with open(f"{address}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            _remove_stale_socket(address)
+            server = _PoolManager(address=parsed_address, authkey=_get_authkey()).get_server()  # Fails if taken
+            os.chmod(address, 0o600)
+    pool.start()
+    print(f"🎙️ Whisper pool listening on {address}")
+    try:
+        server.serve_forever()
+    finally:
+        pool.stop()
+
+
+# --- Client (web processes) ---
+
+class WhisperPoolClient:
+    """Connection to the node's pool process; safe to share between threads"""
+
+    def __init__(self, address: str = WHISPER_POOL_ADDRESS):
+        self.address = address
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def connect(self, timeout: float = 0.0) -> bool:
+        """Connect, retrying until timeout. Returns False if the pool is not reachable."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                manager = _PoolClientManager(address=_parse_address(self.address), authkey=_get_authkey())
+                manager.connect()
+                with self._lock:
+                    self._pool = manager.pool()
+                return True
+            except multiprocessing.AuthenticationError:
+                print(f"❌ Whisper pool at {self.address} rejected our key (WHISPER_POOL_AUTHKEY / WHISPER_POOL_AUTHKEY_FILE)")
+                return False
+            except (OSError, EOFError):
+                if time.time() >= deadline:
+                    return False
+                time.sleep(0.2)
+
+    def _call(self, method: str, *args):
+        if self._pool is None and not self.connect():
+            raise ConnectionError(f"Whisper pool not reachable at {self.address}")
+        try:
+            return getattr(self._pool, method)(*args)
+        except (OSError, EOFError):
+            # Pool restarted - reconnect once
+            if not self.connect(timeout=5.0):
+                raise
+            return getattr(self._pool, method)(*args)
+
+    def transcribe(self, pcm: bytes, language: str = "es", timeout: float = WHISPER_POOL_TIMEOUT_SECONDS) -> str:
+        return self._call("transcribe", pcm, language, timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._call("stats")
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Wait until at least one worker has loaded its model. False on timeout or if every worker failed."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            stats = self.stats()
+            if stats["workers_ready"] > 0:
+                return True
+            if stats["workers_failed"] == stats["workers"]:
+                return False
+            time.sleep(0.5)
+        return False
+
+
+def connect_or_start(model_size: str = "base", autostart: bool = True,
+                     start_timeout: float = 30.0) -> Optional[WhisperPoolClient]:
+    """
+    Connect to the node's pool, starting it first if nobody has.
+
+    Args:
+        model_size: Whisper model for a pool started here (an already running pool keeps its own).
+        autostart: Start the pool if it is not running (also requires WHISPER_POOL_AUTOSTART).
+
+    Returns:
+        A connected client, or None if the pool is neither reachable nor startable.
+    """
+    client = WhisperPoolClient()
+    if client.connect():
+        return client
+    if not (autostart and WHISPER_POOL_AUTOSTART):
+        print(f"⚠️  Whisper pool not reachable at {WHISPER_POOL_ADDRESS} and not started from here")
+        return None
+    key_error = _tcp_key_error(WHISPER_POOL_ADDRESS)
+    if key_error:
+        print(f"❌ Not starting the Whisper pool: {key_error}")
+        return None
+
+    print(f"🚀 Starting Whisper pool at {WHISPER_POOL_ADDRESS} (log: {WHISPER_POOL_LOG})")
+    os.makedirs(os.path.dirname(WHISPER_POOL_LOG) or ".", exist_ok=True)
+    with open(WHISPER_POOL_LOG, "a") as log:
+        # Own session: the pool outlives the web worker that happened to start it
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--model", model_size],
+                         stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    if client.connect(timeout=start_timeout):
+        return client
+    print(f"❌ Whisper pool did not come up at {WHISPER_POOL_ADDRESS}, see {WHISPER_POOL_LOG}")
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared Whisper fallback STT worker pool")
+    parser.add_argument("--address", default=WHISPER_POOL_ADDRESS)
+    parser.add_argument("--model", default=os.environ.get("WHISPER_MODEL_SIZE", "base"))
+    parser.add_argument("--workers", type=int, default=WHISPER_POOL_WORKERS)
+    parser.add_argument("--cpu-threads", type=int, default=WHISPER_POOL_CPU_THREADS, help="Total CPU threads shared by all workers")
+    parser.add_argument("--batch-size", type=int, default=WHISPER_BATCH_SIZE)
+    parser.add_argument("--batch-wait-ms", type=float, default=WHISPER_BATCH_WAIT_MS)
+    args = parser.parse_args()
+    serve(args.address, args.model, args.workers, args.cpu_threads, args.batch_size, args.batch_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# write_behind.py
+"""
+Write-behind queue for conversation persistence.
+Callers enqueue rows without waiting; a background thread flushes them as bulk
+inserts on a size or time trigger, retries with exponential backoff, and spills
+to a local append-only JSON-lines file when the database is unreachable. Spilled
+rows are replayed once writes succeed again.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+PERSIST_BATCH_SIZE = int(os.environ.get("PERSIST_BATCH_SIZE", "50"))
+PERSIST_FLUSH_INTERVAL_SECONDS = float(os.environ.get("PERSIST_FLUSH_INTERVAL_SECONDS", "1.0"))
+PERSIST_MAX_RETRIES = int(os.environ.get("PERSIST_MAX_RETRIES", "3"))
+PERSIST_RETRY_BACKOFF_SECONDS = float(os.environ.get("PERSIST_RETRY_BACKOFF_SECONDS", "0.5"))
+PERSIST_QUEUE_MAX = int(os.environ.get("PERSIST_QUEUE_MAX", "10000"))
+PERSIST_SPILL_PATH = os.environ.get("PERSIST_SPILL_PATH", os.path.join("logs", "pending_interactions.jsonl"))
+PERSIST_REPLAY_INTERVAL_SECONDS = float(os.environ.get("PERSIST_REPLAY_INTERVAL_SECONDS", "30"))
+
+
+class WriteBehindQueue:
+    """Buffers rows in memory and writes them in batches from a background thread"""
+
+    def __init__(self, write_batch: Callable[[List[Dict[str, Any]]], None], spill_path: str,
+                 batch_size: int = PERSIST_BATCH_SIZE, flush_interval: float = PERSIST_FLUSH_INTERVAL_SECONDS,
+                 max_retries: int = PERSIST_MAX_RETRIES, backoff: float = PERSIST_RETRY_BACKOFF_SECONDS,
+                 max_queue: int = PERSIST_QUEUE_MAX, replay_interval: float = PERSIST_REPLAY_INTERVAL_SECONDS):
+        """
+        Args:
+            write_batch: Callable that inserts a list of rows, raising on failure.
+            spill_path: Append-only JSON-lines file for rows that could not be written.
+        """
+        self.write_batch = write_batch
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_queue = max_queue
+        self.replay_interval = replay_interval
+
+        self._rows: deque = deque()  # (enqueued_at, row)
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._flush_requested = False
+        self._in_flight = 0
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._last_replay_attempt = 0.0
+
+        # Metrics
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failed_attempts = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.quarantined = 0  # Unreadable spill lines (e.g. torn by a crash mid-write)
+        self.last_flush_latency: Optional[float] = None
+        self.max_flush_latency = 0.0
+        self._total_flush_latency = 0.0
+
+    def put(self, row: Dict[str, Any]) -> None:
+        """Enqueue a row. Never blocks on the database; spills directly if the queue is full."""
+        with self._cond:
+            overflow = len(self._rows) >= self.max_queue
+            if not overflow:
+                self._rows.append((time.time(), row))
+                self.enqueued += 1
+                if len(self._rows) >= self.batch_size:
+                    self._cond.notify()
+        if overflow:
+            print(f"⚠️  Persistence queue full ({self.max_queue} rows) - spilling to {self.spill_path}")
+            self._spill([row])
+
+    def start(self) -> None:
+        """Start the flusher thread (idempotent) and drain the queue at interpreter exit"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="persistence-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Flush what is left and stop the flusher thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Write everything queued so far. Returns True if the queue drained within timeout."""
+        deadline = time.time() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify()
+            while self._rows or self._in_flight:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                # Size trigger, time trigger (oldest row waited flush_interval), explicit flush or shutdown
+                while len(self._rows) < self.batch_size and not (self._flush_requested or self._stopping):
+                    if self._rows:
+                        remaining = self._rows[0][0] + self.flush_interval - time.time()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait(self.flush_interval)
+                        if not self._rows:
+                            break  # Idle tick: check for spilled rows to replay
+                batch = [self._rows.popleft()[1] for _ in range(min(self.batch_size, len(self._rows)))]
+                self._in_flight = len(batch)
+                if not self._rows:
+                    self._flush_requested = False
+                stopping = self._stopping and not self._rows
+
+            if batch:
+                if not self._write_with_retry(batch):
+                    self._spill(batch)
+                elif self._has_spill():
+                    self._replay_spill()
+            elif self._has_spill() and time.time() - self._last_replay_attempt > self.replay_interval:
+                self._replay_spill()
+
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+            if stopping:
+                return
+
+    def _write_with_retry(self, batch: List[Dict[str, Any]]) -> bool:
+        """Bulk insert with exponential backoff. Returns False if every attempt failed."""
+        for attempt in range(self.max_retries + 1):
+            start = time.time()
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                self.failed_attempts += 1
+                if attempt == self.max_retries:
+                    print(f"💾 Bulk insert of {len(batch)} rows failed after {attempt + 1} attempts: {e}")
+                    return False
+                delay = self.backoff * (2 ** attempt)
+                print(f"💾 Bulk insert failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            latency = time.time() - start
+            self.written += len(batch)
+            self.batches += 1
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self._total_flush_latency += latency
+            print(f"💾 Flushed {len(batch)} interaction(s) in {latency:.3f}s")
+            return True
+        return False
+
+    def _spill(self, rows: List[Dict[str, Any]]) -> bool:
+        """Append rows to the local spill file for later replay. Returns False if they could not be written."""
+        try:
+            with self._spill_lock:
+                os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                # A crash mid-write leaves a torn last line; start on a fresh one so only that line is lost
+                torn = False
+                if os.path.exists(self.spill_path) and os.path.getsize(self.spill_path) > 0:
+                    with open(self.spill_path, "rb") as existing:
+                        existing.seek(-1, os.SEEK_END)
+                        torn = existing.read(1) != b"\n"
+                with open(self.spill_path, "a", encoding="utf-8") as spill:
+                    if torn:
+                        spill.write("\n")
+                    for row in rows:
+                        spill.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self.spilled += len(rows)
+            print(f"💾 Spilled {len(rows)} interaction(s) to {self.spill_path}")
+            return True
+        except OSError as e:
+            print(f"❌ Could not spill {len(rows)} interaction(s): {e}")
+            return False
+
+    def _has_spill(self) -> bool:
+        return os.path.exists(self.spill_path) or os.path.exists(f"{self.spill_path}.replay")
+
+    def _replay_spill(self) -> None:
+        """Write spilled rows back in batches; whatever still fails is spilled again"""
+        self._last_replay_attempt = time.time()
+        replay_path = f"{self.spill_path}.replay"
+        with self._spill_lock:
+            if not os.path.exists(replay_path):
+                try:
+                    os.replace(self.spill_path, replay_path)  # New spills go to a fresh file meanwhile
+                except OSError:
+                    return
+        rows, bad_lines = [], []
+        try:
+            with open(replay_path, encoding="utf-8", errors="replace") as spilled:
+                for line in spilled:
+                    if not line.strip():
+                        continue
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        bad_lines.append(line if line.endswith("\n") else line + "\n")
+        except OSError as e:
+            print(f"❌ Could not read spilled interactions: {e}")
+            return
+        unsaved_lines = bad_lines if bad_lines and not self._quarantine(bad_lines) else []
+
+        pending = rows  # Neither written nor spilled again yet
+        try:
+            print(f"💾 Replaying {len(rows)} spilled interaction(s)")
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                if not self._write_with_retry(batch):
+                    if self._spill(rows[start:]):
+                        pending = []
+                    break
+                self.replayed += len(batch)
+                pending = rows[start + len(batch):]
+        finally:
+            self._finish_replay(replay_path, [json.dumps(row, ensure_ascii=False) + "\n" for row in pending] + unsaved_lines)
+
+    def _finish_replay(self, replay_path: str, leftover_lines: List[str]) -> None:
+        """
+        Remove the replay file once every row is written, spilled again or quarantined. Otherwise it
+        keeps only the leftover lines for the next replay (or stays whole if even that fails).
+        """
+        try:
+            if not leftover_lines:
+                os.remove(replay_path)
+                return
+            with open(f"{replay_path}.tmp", "w", encoding="utf-8") as replay:
+                replay.writelines(leftover_lines)
+            os.replace(f"{replay_path}.tmp", replay_path)
+            print(f"⚠️ {len(leftover_lines)} spilled line(s) kept in {replay_path} for the next replay")
+        except OSError as e:
+            print(f"❌ Could not update {replay_path}, keeping it for the next replay: {e}")
+
+    def _quarantine(self, lines: List[str]) -> bool:
+        """
+        Keep unreadable spill lines next to the spill file for inspection instead of blocking replay.
+        Returns False if they could not be written there.
+        """
+        quarantine_path = f"{self.spill_path}.corrupt"
+        try:
+            with open(quarantine_path, "a", encoding="utf-8") as quarantine:
+                quarantine.writelines(lines)
+        except OSError as e:
+            print(f"❌ Could not quarantine spilled lines: {e}")
+            return False
+        self.quarantined += len(lines)
+        print(f"⚠️ {len(lines)} unreadable spilled line(s) moved to {quarantine_path}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            depth = len(self._rows) + self._in_flight
+        return {
+            "queue_depth": depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "failed_attempts": self.failed_attempts,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "quarantined": self.quarantined,
+            "spill_pending": self._has_spill(),
+            "last_flush_latency": self.last_flush_latency,
+            "avg_flush_latency": self._total_flush_latency / self.batches if self.batches else None,
+            "max_flush_latency": self.max_flush_latency
+        }